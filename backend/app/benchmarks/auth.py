@@ -0,0 +1,187 @@
+"""
+
+Throughput of the auth hot path: verifying the token of every protected request, and logging in.
+
+Tokens are verified by re-decoding them on every request (the cache holds nothing) and through the
+token cache. Logins run against a simulated database with a fixed round-trip time, with the user
+and community fetched in two queries or in one JOIN. Run from backend/app:
+	
+	python -m benchmarks.auth --requests 50000 --users 500
+	python -m benchmarks.auth --logins 2000 --db-latency 0.002
+
+"""
+
+import argparse
+import asyncio
+import os
+import random
+import time
+
+
+os.environ.setdefault("JWT_SECRET_KEY", "benchmark")
+os.environ.setdefault("JWT_ALGORITHM", "HS256")
+
+from fastapi.concurrency import run_in_threadpool
+
+from utils import auth
+from utils.security import verify_password
+
+
+class SimulatedDatabase:
+	
+	"""
+	
+	Database stand-in answering the login queries after a fixed round-trip time.
+	
+	"""
+	
+	def __init__(self, latency: float, hashed_password: str):
+		
+		self.latency = latency
+		self.queries = 0
+		self.user = {
+			"id": 1,
+			"hashed_password": hashed_password,
+			"community_code": "HOA-000-000-000",
+			"is_admin": False,
+			}
+	
+	
+	async def _round_trip(self):
+		
+		self.queries += 1
+		
+		await asyncio.sleep(self.latency)
+	
+	
+	async def get_user_by_email(self, email: str):
+		
+		await self._round_trip()
+		
+		return self.user
+	
+	
+	async def get_community_by_code(self, code: str):
+		
+		await self._round_trip()
+		
+		return {"code": code, "name": "Benchmark HOA"}
+	
+	
+	async def get_user_with_community(self, email: str):
+		
+		await self._round_trip()
+		
+		return {**self.user, "community_name": "Benchmark HOA"}
+
+
+async def verify_all(tokens: list[str], requests: int, cache: auth.TokenCache) -> float:
+	
+	"""
+	
+	Verify random tokens of the given set, returning verifications per second.
+	
+	"""
+	
+	auth.token_cache = cache
+	rng = random.Random(0)
+	
+	started = time.perf_counter()
+	
+	for _ in range(requests):
+		await auth.verify_token(rng.choice(tokens))
+	
+	return requests / (time.perf_counter() - started)
+
+
+async def separate_queries_login(db: SimulatedDatabase, email: str, password: str):
+	
+	"""
+	
+	Login as it was: fetch the user, check the password on the event loop, then fetch the community.
+	
+	"""
+	
+	user = await db.get_user_by_email(email)
+	
+	if not verify_password(password, user["hashed_password"]):
+		raise RuntimeError("Invalid password")
+	
+	community = await db.get_community_by_code(user["community_code"])
+	
+	return auth.create_access_token({"sub": email, "community_name": community["name"]})
+
+
+async def joined_login(db: SimulatedDatabase, email: str, password: str):
+	
+	"""
+	
+	Login as in routes/auth.py: fetch the user with their community, check the password in a thread.
+	
+	"""
+	
+	user = await db.get_user_with_community(email)
+	
+	if not await run_in_threadpool(verify_password, password, user["hashed_password"]):
+		raise RuntimeError("Invalid password")
+	
+	return auth.create_access_token({"sub": email, "community_name": user["community_name"]})
+
+
+async def login_all(login, db: SimulatedDatabase, password: str, logins: int, concurrency: int) -> float:
+	
+	"""
+	
+	Run logins from concurrent clients, returning logins per second.
+	
+	"""
+	
+	semaphore = asyncio.Semaphore(concurrency)
+	
+	async def one(index: int):
+		
+		async with semaphore:
+			await login(db, f"resident{index}@example.com", password)
+	
+	started = time.perf_counter()
+	
+	await asyncio.gather(*(one(index) for index in range(logins)))
+	
+	return logins / (time.perf_counter() - started)
+
+
+def main():
+	
+	parser = argparse.ArgumentParser(description = "Throughput of token verification and login.")
+	parser.add_argument("--requests", type = int, default = 50_000, help = "Token verifications per run")
+	parser.add_argument("--users", type = int, default = 500, help = "Distinct tokens in use")
+	parser.add_argument("--logins", type = int, default = 2000)
+	parser.add_argument("--concurrency", type = int, default = 32)
+	parser.add_argument("--db-latency", type = float, default = 0.002, help = "Simulated database round trip in seconds")
+	parser.add_argument("--bcrypt-rounds", type = int, default = 4, help = "Cost of the simulated password hashes")
+	args = parser.parse_args()
+	
+	import bcrypt
+	
+	tokens = [auth.create_access_token({"sub": f"resident{index}@example.com"}) for index in range(args.users)]
+	
+	uncached = asyncio.run(verify_all(tokens, args.requests, auth.TokenCache(max_size = 0)))
+	cached = asyncio.run(verify_all(tokens, args.requests, auth.TokenCache()))
+	
+	print(f"verify, decode every request {uncached:>10,.0f} /s")
+	print(f"verify, token cache          {cached:>10,.0f} /s  ({cached / uncached:.1f}x, {args.users} users)")
+	
+	password = "correct horse"
+	hashed_password = bcrypt.hashpw(password.encode("utf-8"), bcrypt.gensalt(args.bcrypt_rounds)).decode("utf-8")
+	
+	for name, login in (("two queries", separate_queries_login), ("one JOIN", joined_login)):
+		
+		db = SimulatedDatabase(args.db_latency, hashed_password)
+		
+		rate = asyncio.run(login_all(login, db, password, args.logins, args.concurrency))
+		
+		print(f"login, {name:<22} {rate:>10,.0f} /s  ({db.queries / args.logins:.0f} round trips/login)")
+
+
+if __name__ == "__main__":
+	main()
@@ -0,0 +1,158 @@
+"""
+
+Load test of query coalescing: a burst of residents asking the same few questions after a notice.
+
+The embedding API, database and LLM are simulated with fixed latencies, and the number of calls
+that reach each of them is counted with and without single-flight coalescing. Run from backend/app:
+	
+	python -m benchmarks.coalescing --residents 200 --questions 3 --window 2
+
+"""
+
+import argparse
+import asyncio
+import os
+import random
+import time
+
+from services.rag import RAG
+from utils.metrics import Metrics
+from utils.singleflight import SingleFlight
+
+
+# Ways residents phrase the same question
+PHRASINGS = ["{}", "{}?", "  {}?", "{}!", "{} ?"]
+
+
+class SimulatedEmbedder:
+	
+	"""
+	
+	Embedding service stand-in with a fixed latency.
+	
+	"""
+	
+	def __init__(self, latency: float):
+		
+		self.latency = latency
+		self.requests = 0
+	
+	
+	async def get_query_embedding(self, text: str, priority: str = "interactive", hoa_code: str | None = None) -> list[float]:
+		
+		self.requests += 1
+		
+		await asyncio.sleep(self.latency)
+		
+		return [0.0] * 8
+
+
+class SimulatedDatabase:
+	
+	"""
+	
+	Database stand-in with a fixed latency.
+	
+	"""
+	
+	def __init__(self, latency: float):
+		
+		self.latency = latency
+		self.queries = 0
+	
+	
+	async def get_relevant_chunks_with_context(self, query_embedding, hoa_code, top_k = 3):
+		
+		self.queries += 1
+		
+		await asyncio.sleep(self.latency)
+		
+		return [{"document_type": "bylaws", "page_number": 1, "content": "Dues are paid monthly."}]
+
+
+class SimulatedRAG(RAG):
+	
+	"""
+	
+	RAG with a simulated LLM.
+	
+	"""
+	
+	def __init__(self, db, embedder, llm_latency: float, coalescer = None):
+		
+		super().__init__(db, embedder, coalescer = coalescer)
+		
+		self.llm_latency = llm_latency
+		self.completions = 0
+	
+	
+	async def generate_answer(self, prompt: str, priority: str = "interactive", hoa_code: str | None = None) -> str:
+		
+		self.completions += 1
+		
+		await asyncio.sleep(self.llm_latency)
+		
+		return "Dues are paid monthly. Source: [bylaws] Page 1"
+
+
+async def run(residents: int, questions: int, window: float, embed_latency: float, db_latency: float, llm_latency: float):
+	
+	"""
+	
+	Replay the same burst of questions with and without coalescing.
+	
+	"""
+	
+	os.environ.setdefault("OPENAI_API_KEY", "simulated")
+	
+	rng = random.Random(42)
+	burst = [
+		(
+			rng.uniform(0, window),
+			rng.choice(PHRASINGS).format(f"when are dues for question {rng.randrange(questions)} due"),
+			)
+		for _ in range(residents)
+		]
+	
+	for mode in ("independent", "coalesced"):
+		
+		metrics = Metrics()
+		coalescer = SingleFlight("answer_query", metrics) if mode == "coalesced" else None
+		rag = SimulatedRAG(SimulatedDatabase(db_latency), SimulatedEmbedder(embed_latency), llm_latency, coalescer)
+		
+		async def ask(delay: float, query: str) -> float:
+			
+			await asyncio.sleep(delay)
+			
+			start = time.perf_counter()
+			await rag.answer_query(query, "HOA-000-000-000")
+			
+			return time.perf_counter() - start
+		
+		latencies = sorted(await asyncio.gather(*(ask(delay, query) for delay, query in burst)))
+		
+		print(
+				f"{mode:>11}: {rag.embedder.requests:4d} embeddings, {rag.db.queries:4d} searches, "
+				f"{rag.completions:4d} completions, p50 {latencies[len(latencies) // 2]:.2f}s"
+				)
+		
+		if coalescer:
+			
+			for series in metrics.snapshot()["counters"]["singleflight_calls_total"]:
+				print(f"{'':>13}{series['labels']['role']}: {series['value']}")
+
+
+if __name__ == "__main__":
+	
+	parser = argparse.ArgumentParser(description = "Load test of query coalescing.")
+	parser.add_argument("--residents", type = int, default = 200)
+	parser.add_argument("--questions", type = int, default = 3, help = "Distinct questions in the burst")
+	parser.add_argument("--window", type = float, default = 2.0, help = "Seconds over which the questions arrive")
+	parser.add_argument("--embed-latency", type = float, default = 0.15)
+	parser.add_argument("--db-latency", type = float, default = 0.05)
+	parser.add_argument("--llm-latency", type = float, default = 1.5)
+	args = parser.parse_args()
+	
+	asyncio.run(
+			run(args.residents, args.questions, args.window, args.embed_latency, args.db_latency, args.llm_latency)
+			)
@@ -0,0 +1,112 @@
+"""
+
+Cold start of the API: time to import the app, and time from launching uvicorn to the first
+served request (which needs the database and OpenAI settings of a real deployment).
+
+Each measurement runs in a fresh interpreter. Run from backend/app:
+	
+	python -m benchmarks.cold_start --runs 5
+	python -m benchmarks.cold_start --runs 5 --serve --warmup
+
+"""
+
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import time
+import urllib.request
+
+
+def time_import(module: str) -> float:
+	
+	"""
+	
+	Time importing a module in a fresh interpreter.
+	
+	"""
+	
+	output = subprocess.run(
+			[
+				sys.executable,
+				"-c",
+				f"import time; start = time.perf_counter(); import {module}; print(time.perf_counter() - start)",
+				],
+			capture_output = True,
+			text = True,
+			check = True,
+			)
+	
+	return float(output.stdout.strip().splitlines()[-1])
+
+
+def time_first_request(port: int, warmup: bool, timeout: float = 120.0) -> float:
+	
+	"""
+	
+	Time from launching uvicorn until GET / is answered.
+	
+	"""
+	
+	environment = dict(os.environ, WARMUP = "true" if warmup else "false")
+	start = time.perf_counter()
+	
+	server = subprocess.Popen(
+			[sys.executable, "-m", "uvicorn", "main:app", "--port", str(port)],
+			env = environment,
+			stdout = subprocess.DEVNULL,
+			stderr = subprocess.DEVNULL,
+			)
+	
+	try:
+		
+		while time.perf_counter() - start < timeout:
+			
+			if server.poll() is not None:
+				raise RuntimeError("The server exited during startup (check the database and OpenAI settings).")
+			
+			try:
+				
+				with urllib.request.urlopen(f"http://127.0.0.1:{port}/", timeout = 1):
+					return time.perf_counter() - start
+			
+			except OSError:
+				time.sleep(0.02)
+		
+		raise TimeoutError(f"The server did not answer within {timeout:.0f}s.")
+	
+	finally:
+		
+		server.terminate()
+		server.wait()
+
+
+def main():
+	
+	parser = argparse.ArgumentParser(description = "Cold start of the API.")
+	parser.add_argument("--runs", type = int, default = 5)
+	parser.add_argument("--serve", action = "store_true", help = "Also time the first served request")
+	parser.add_argument("--warmup", action = "store_true", help = "Start the server with WARMUP=true")
+	parser.add_argument("--port", type = int, default = 8765)
+	args = parser.parse_args()
+	
+	for module in ("routes.query", "main"):
+		
+		try:
+			
+			timings = [time_import(module) for _ in range(args.runs)]
+			print(f"import {module:<13} median {statistics.median(timings):.3f}s")
+		
+		except subprocess.CalledProcessError as e:
+			
+			print(f"import {module:<13} failed: {e.stderr.strip().splitlines()[-1]}")
+	
+	if args.serve:
+		
+		timings = [time_first_request(args.port, args.warmup) for _ in range(args.runs)]
+		print(f"first request (warm-up {'on' if args.warmup else 'off'}) median {statistics.median(timings):.3f}s")
+
+
+if __name__ == "__main__":
+	main()
@@ -0,0 +1,165 @@
+"""
+
+Load test of hedged requests against a provider with a long latency tail.
+
+The embedding API and LLM are simulated: most calls are fast, but a small share of them stall
+(a slow replica, a retried connection). The same questions are answered with and without hedging,
+and the latency percentiles and hedge rate are compared. Run from backend/app:
+	
+	python -m benchmarks.hedging --questions 2000 --slow-rate 0.05
+
+"""
+
+import argparse
+import asyncio
+import os
+import random
+import time
+
+from benchmarks.coalescing import SimulatedDatabase
+from services.rag import RAG
+from utils.metrics import Metrics
+from utils.resilience import Hedger, StagePolicy
+
+
+class TailLatency:
+	
+	"""
+	
+	Latency of a provider that is usually fast and sometimes stalls.
+	
+	"""
+	
+	def __init__(self, rng: random.Random, typical: float, slow: float, slow_rate: float):
+		
+		self.rng = rng
+		self.typical = typical
+		self.slow = slow
+		self.slow_rate = slow_rate
+		self.calls = 0
+	
+	
+	async def wait(self):
+		
+		self.calls += 1
+		
+		stalled = self.rng.random() < self.slow_rate
+		
+		await asyncio.sleep(self.rng.uniform(0.8, 1.2) * (self.slow if stalled else self.typical))
+
+
+class SimulatedEmbedder:
+	
+	"""
+	
+	Embedding service stand-in with a long latency tail.
+	
+	"""
+	
+	def __init__(self, latency: TailLatency):
+		
+		self.latency = latency
+	
+	
+	async def get_query_embedding(self, text: str, priority: str = "interactive", hoa_code: str | None = None) -> list[float]:
+		
+		await self.latency.wait()
+		
+		return [0.0] * 8
+
+
+class SimulatedRAG(RAG):
+	
+	"""
+	
+	RAG with a simulated LLM with a long latency tail.
+	
+	"""
+	
+	def __init__(self, db, embedder, latency: TailLatency, policy = None):
+		
+		super().__init__(db, embedder, policy = policy)
+		
+		self.latency = latency
+	
+	
+	async def generate_answer(self, prompt: str, priority: str = "interactive", hoa_code: str | None = None) -> str:
+		
+		await self.latency.wait()
+		
+		return "Dues are paid monthly. Source: [bylaws] Page 1"
+
+
+def percentile(ordered: list[float], fraction: float) -> float:
+	
+	return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+async def run(questions: int, concurrency: int, slow_rate: float, percentile_threshold: float):
+	
+	"""
+	
+	Answer the same questions with and without hedging.
+	
+	"""
+	
+	os.environ.setdefault("OPENAI_API_KEY", "simulated")
+	
+	for mode in ("unhedged", "hedged"):
+		
+		rng = random.Random(42)
+		metrics = Metrics()
+		
+		embed_latency = TailLatency(rng, 0.1, 2.0, slow_rate)
+		llm_latency = TailLatency(rng, 0.8, 8.0, slow_rate)
+		
+		hedgers = None
+		
+		if mode == "hedged":
+			
+			hedgers = {
+				"embedding": Hedger("embedding", percentile = percentile_threshold, metrics = metrics),
+				"completion": Hedger("completion", percentile = percentile_threshold, metrics = metrics),
+				}
+		
+		rag = SimulatedRAG(
+				SimulatedDatabase(0.02),
+				SimulatedEmbedder(embed_latency),
+				llm_latency,
+				StagePolicy(deadline = 30, hedgers = hedgers, metrics = metrics),
+				)
+		
+		semaphore = asyncio.Semaphore(concurrency)
+		
+		async def ask(index: int) -> float:
+			
+			async with semaphore:
+				
+				start = time.perf_counter()
+				await rag.answer_query(f"when are dues due {index}", "HOA-000-000-000")
+				
+				return time.perf_counter() - start
+		
+		latencies = sorted(await asyncio.gather(*(ask(index) for index in range(questions))))
+		
+		counters = metrics.snapshot()["counters"]
+		hedged = sum(series["value"] for series in counters.get("hedged_requests_total", []))
+		calls = embed_latency.calls + llm_latency.calls
+		
+		print(
+				f"{mode:>8}: p50 {percentile(latencies, 0.5):.2f}s, p95 {percentile(latencies, 0.95):.2f}s, "
+				f"p99 {percentile(latencies, 0.99):.2f}s, {calls} provider calls, "
+				f"hedge rate {hedged / (2 * questions):.1%}"
+				)
+
+
+if __name__ == "__main__":
+	
+	parser = argparse.ArgumentParser(description = "Load test of hedged requests.")
+	parser.add_argument("--questions", type = int, default = 2000)
+	parser.add_argument("--concurrency", type = int, default = 100)
+	parser.add_argument("--slow-rate", type = float, default = 0.05, help = "Share of provider calls that stall")
+	parser.add_argument("--percentile", type = float, default = 0.95, help = "Latency percentile after which to hedge")
+	args = parser.parse_args()
+	
+	asyncio.run(run(args.questions, args.concurrency, args.slow_rate, args.percentile))
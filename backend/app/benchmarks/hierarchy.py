@@ -0,0 +1,144 @@
+"""
+
+Latency and recall of hierarchical retrieval against flat search as a community's documents grow.
+
+A synthetic corpus mimics HOA documents: every chunk shares a common "HOA" direction, plus the
+topic of its document, the topic of its section and its own noise. Queries are paraphrases (noisy
+copies) of random chunks. Flat search compares a query with every chunk; hierarchical search
+compares it with the document centroids, then with the section centroids of the closest documents,
+and only searches the chunks of the closest sections, like Database.get_relevant_chunks_with_context
+with RETRIEVAL_SECTIONS set. Recall is the share of the flat top-k that hierarchical search finds.
+Run from backend/app:
+	
+	python -m benchmarks.hierarchy --documents 10 50 200 1000 --sections 8
+
+"""
+
+import argparse
+import time
+
+import numpy as np
+
+
+def normalize(vectors: np.ndarray) -> np.ndarray:
+	
+	return vectors / np.linalg.norm(vectors, axis = -1, keepdims = True)
+
+
+def build_corpus(rng: np.random.Generator, documents: int, sections: int, chunks: int, dimensions: int) -> dict:
+	
+	"""
+	
+	Generate the chunk embeddings of a community and their document and section centroids.
+	
+	"""
+	
+	common = rng.standard_normal(dimensions)
+	document_topics = rng.standard_normal((documents, 1, 1, dimensions))
+	section_topics = rng.standard_normal((documents, sections, 1, dimensions))
+	noise = rng.standard_normal((documents, sections, chunks, dimensions))
+	
+	embeddings = normalize(1.5 * common + 0.5 * document_topics + 0.5 * section_topics + noise).astype(np.float32)
+	
+	return {
+		"chunks": embeddings.reshape(-1, dimensions),
+		"sections": normalize(embeddings.mean(axis = 2)),
+		"documents": normalize(embeddings.mean(axis = (1, 2))),
+		"shape": (documents, sections, chunks),
+		}
+
+
+def flat_search(corpus: dict, query: np.ndarray, top_k: int) -> tuple[set, int]:
+	
+	scores = corpus["chunks"] @ query
+	
+	return set(np.argpartition(-scores, top_k)[:top_k].tolist()), len(scores)
+
+
+def hierarchical_search(corpus: dict, query: np.ndarray, top_k: int, documents: int, sections: int) -> tuple[set, int]:
+	
+	_, section_count, chunk_count = corpus["shape"]
+	
+	# Closest documents, then the closest sections within them
+	top_documents = np.argsort(-(corpus["documents"] @ query))[:documents]
+	candidates = corpus["sections"][top_documents] @ query
+	best = np.argsort(-candidates, axis = None)[:sections]
+	top_sections = top_documents[best // section_count] * section_count + best % section_count
+	
+	# Exact search over the chunks of those sections only
+	ids = (top_sections[:, None] * chunk_count + np.arange(chunk_count)).ravel()
+	scores = corpus["chunks"][ids] @ query
+	hits = ids[np.argsort(-scores)[:top_k]]
+	
+	# Every document centroid, the section centroids of the closest documents, and the chunks searched
+	return set(hits.tolist()), len(corpus["documents"]) + candidates.size + len(ids)
+
+
+def run(document_counts: list[int], sections_per_document: int, chunks_per_section: int, dimensions: int,
+		queries: int, top_k: int, documents: int, sections: int):
+	
+	"""
+	
+	Compare both searches on corpora of growing size.
+	
+	"""
+	
+	rng = np.random.default_rng(42)
+	
+	print(f"{'documents':>9} {'chunks':>7} | {'flat ms':>8} {'compared':>8} | {'routed ms':>9} {'compared':>8} {'recall':>7}")
+	
+	for count in document_counts:
+		
+		corpus = build_corpus(rng, count, sections_per_document, chunks_per_section, dimensions)
+		targets = rng.integers(0, len(corpus["chunks"]), queries)
+		paraphrases = normalize(corpus["chunks"][targets] + 0.05 * rng.standard_normal((queries, dimensions))).astype(np.float32)
+		
+		timings = {"flat": [], "routed": []}
+		compared = {"flat": 0, "routed": 0}
+		found = 0
+		
+		for query in paraphrases:
+			
+			start = time.perf_counter()
+			expected, flat_compared = flat_search(corpus, query, top_k)
+			timings["flat"].append(time.perf_counter() - start)
+			
+			start = time.perf_counter()
+			hits, routed_compared = hierarchical_search(corpus, query, top_k, documents, sections)
+			timings["routed"].append(time.perf_counter() - start)
+			
+			compared["flat"] += flat_compared
+			compared["routed"] += routed_compared
+			found += len(hits & expected)
+		
+		print(
+				f"{count:>9} {len(corpus['chunks']):>7} | "
+				f"{1000 * np.median(timings['flat']):>8.3f} {compared['flat'] // queries:>8} | "
+				f"{1000 * np.median(timings['routed']):>9.3f} {compared['routed'] // queries:>8} "
+				f"{found / (queries * top_k):>7.1%}"
+				)
+
+
+if __name__ == "__main__":
+	
+	parser = argparse.ArgumentParser(description = "Latency and recall of hierarchical retrieval.")
+	parser.add_argument("--documents", type = int, nargs = "+", default = [10, 50, 200, 1000], help = "Community sizes")
+	parser.add_argument("--sections-per-document", type = int, default = 12)
+	parser.add_argument("--chunks-per-section", type = int, default = 8)
+	parser.add_argument("--dimensions", type = int, default = 384)
+	parser.add_argument("--queries", type = int, default = 200)
+	parser.add_argument("--top-k", type = int, default = 3)
+	parser.add_argument("--routed-documents", type = int, default = 5, help = "RETRIEVAL_DOCUMENTS")
+	parser.add_argument("--sections", type = int, default = 8, help = "RETRIEVAL_SECTIONS")
+	args = parser.parse_args()
+	
+	run(
+			args.documents,
+			args.sections_per_document,
+			args.chunks_per_section,
+			args.dimensions,
+			args.queries,
+			args.top_k,
+			args.routed_documents,
+			args.sections,
+			)
@@ -0,0 +1,195 @@
+"""
+
+Benchmark of onboarding time for a new HOA: one-by-one uploads vs. a batch upload.
+
+The embedding API and database are simulated with fixed latencies so the benchmark measures the
+pipeline itself. Run from backend/app:
+
+	python -m benchmarks.onboarding --documents 10 --pages 40
+
+"""
+
+import argparse
+import asyncio
+import io
+import os
+import tempfile
+import time
+
+import fitz
+from starlette.datastructures import Headers, UploadFile
+
+from services.ingestion import IngestionService
+from services.upload_service import UploadService
+from utils.pdf_utils import PDFProcessor
+
+
+SENTENCE = "The owner of each lot shall maintain the exterior of the residence in good repair. "
+
+
+class SimulatedEmbedder:
+	
+	"""
+	
+	Embedding service stand-in with a per-request and per-input latency.
+	
+	"""
+	
+	def __init__(self, request_latency: float, input_latency: float, dims: int = 8):
+		
+		self.request_latency = request_latency
+		self.input_latency = input_latency
+		self.dims = dims
+		self.requests = 0
+	
+	
+	async def get_embeddings(
+			self,
+			texts: list[str],
+			priority: str = "background",
+			hoa_code: str | None = None,
+			) -> list[list[float]]:
+		
+		self.requests += 1
+		
+		await asyncio.sleep(self.request_latency + self.input_latency * len(texts))
+		
+		return [[0.0] * self.dims for _ in texts]
+
+
+class SimulatedDatabase:
+	
+	"""
+	
+	Database stand-in with a per-statement and per-row latency.
+	
+	"""
+	
+	def __init__(self, statement_latency: float, row_latency: float):
+		
+		self.statement_latency = statement_latency
+		self.row_latency = row_latency
+	
+	
+	async def get_storage_path(self, hoa_code, document_type):
+		
+		await asyncio.sleep(self.statement_latency)
+		
+		return None
+	
+	
+	async def get_unused_storage_paths(self, storage_paths):
+		
+		await asyncio.sleep(self.statement_latency)
+		
+		return []
+	
+	
+	async def link_existing_document(self, hoa_code, document_type, content_hash, storage_path = None):
+		
+		await asyncio.sleep(self.statement_latency)
+		
+		return None
+	
+	
+	async def store_document(self, hoa_code, document_type, content_hash, chunks, embeddings, storage_path = None):
+		
+		await asyncio.sleep(self.statement_latency + self.row_latency * len(chunks))
+		
+		return True
+
+
+def make_pdf(pages: int, title: str) -> bytes:
+	
+	"""
+	
+	Build a text-only PDF with the given number of pages and a unique title.
+	
+	"""
+	
+	doc = fitz.open()
+	
+	for number in range(pages):
+		
+		page = doc.new_page()
+		page.insert_textbox(page.rect + (36, 36, -36, -36), f"{title} page {number}. " + SENTENCE * 40, fontsize = 9)
+	
+	buffer = io.BytesIO()
+	doc.save(buffer)
+	
+	return buffer.getvalue()
+
+
+def make_upload(data: bytes, name: str) -> UploadFile:
+	
+	"""
+	
+	Wrap PDF bytes in an UploadFile, like FastAPI does for multipart uploads.
+	
+	"""
+	
+	spooled = tempfile.SpooledTemporaryFile(max_size = 1024 * 1024)
+	spooled.write(data)
+	spooled.seek(0)
+	
+	return UploadFile(file = spooled, filename = name, headers = Headers({"content-type": "application/pdf"}))
+
+
+async def run(documents: int, pages: int, request_latency: float, input_latency: float):
+	
+	"""
+	
+	Time the serial and batch ingestion of the same document set.
+	
+	"""
+	
+	pdfs = [make_pdf(pages, f"Document {i}") for i in range(documents)]
+	
+	with tempfile.TemporaryDirectory() as upload_dir:
+		
+		os.environ["S3_BUCKET_NAME"] = upload_dir
+		
+		timings = {}
+		
+		for mode in ("serial", "batch"):
+			
+			embedder = SimulatedEmbedder(request_latency, input_latency)
+			service = IngestionService(
+					SimulatedDatabase(0.002, 0.00002),
+					embedder,
+					UploadService(use_s3 = False),
+					PDFProcessor(),
+					)
+			
+			uploads = [(make_upload(pdf, f"doc_{i}.pdf"), f"document {i}") for i, pdf in enumerate(pdfs)]
+			
+			start = time.perf_counter()
+			
+			if mode == "serial":
+				
+				# One /upload/upload_pdf request after another
+				for file, document_type in uploads:
+					await service.ingest_document(file, "HOA-000-000-000", document_type)
+			
+			else:
+				
+				await service.ingest_documents("HOA-000-000-000", uploads)
+			
+			timings[mode] = time.perf_counter() - start
+			service.close()
+			
+			print(f"{mode:>6}: {timings[mode]:6.2f}s  ({embedder.requests} embedding requests)")
+		
+		print(f"speedup: {timings['serial'] / timings['batch']:.1f}x")
+
+
+if __name__ == "__main__":
+	
+	parser = argparse.ArgumentParser(description = "Benchmark HOA onboarding time.")
+	parser.add_argument("--documents", type = int, default = 10)
+	parser.add_argument("--pages", type = int, default = 40)
+	parser.add_argument("--request-latency", type = float, default = 0.4, help = "Seconds per embedding request")
+	parser.add_argument("--input-latency", type = float, default = 0.002, help = "Seconds per embedded chunk")
+	args = parser.parse_args()
+	
+	asyncio.run(run(args.documents, args.pages, args.request_latency, args.input_latency))
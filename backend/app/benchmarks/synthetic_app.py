@@ -0,0 +1,51 @@
+"""
+
+Synthetic query workload for `python server.py --bench`.
+
+GET /query does the CPU work of a real question (verifying the JWT, building the prompt from the
+retrieved chunks and encoding the response) around a simulated database round trip, without
+needing a database or OpenAI.
+
+"""
+
+import asyncio
+import os
+
+from fastapi import FastAPI, Header
+from jose import jwt
+
+
+# Simulated database round trip of a search, in seconds
+DB_LATENCY = float(os.getenv("SYNTHETIC_DB_LATENCY", "0.005"))
+
+SECRET_KEY = "synthetic"
+TOKEN = jwt.encode({"sub": "resident@example.com", "community_code": "HOA-000-000-000"}, SECRET_KEY, algorithm = "HS256")
+
+CHUNKS = [
+	{
+		"document_type": "bylaws",
+		"page_number": page,
+		"content": "The owner of each lot shall maintain the exterior of the residence in good repair. " * 12,
+		}
+	for page in range(9)
+	]
+
+app = FastAPI()
+
+
+@app.get("/")
+def read_root():
+	return {"message": "ok"}
+
+
+@app.get("/query")
+async def query(question: str, authorization: str = Header(...)):
+	
+	payload = jwt.decode(authorization.removeprefix("Bearer "), SECRET_KEY, algorithms = ["HS256"])
+	
+	await asyncio.sleep(DB_LATENCY)
+	
+	context = "\n\n".join(f"[{chunk['document_type']} - Page {chunk['page_number']}]\n{chunk['content']}" for chunk in CHUNKS)
+	prompt = f"Context:\n{context}\n\nQuestion: {question}\n\nAnswer:"
+	
+	return {"community": payload["community_code"], "prompt_length": len(prompt), "sources": CHUNKS[:3]}
@@ -1,3 +1,5 @@
+from contextlib import asynccontextmanager
+
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.security import OAuth2PasswordBearer
@@ -5,7 +7,13 @@ from routes.query import router as query_router
 from routes.upload import router as upload_router
 from routes.admin import router as admin_router
 from routes.auth import router as auth_router
+from routes.documents import router as documents_router
+from services.container import ServiceContainer
+from utils.accounting import RESOURCE_ACCOUNTING, ResourceAccountingMiddleware
+from utils.accounting_instance import accounting
 from utils.db_instance import db
+from utils.loop_monitor import LOOP_MONITOR, LoopMonitorMiddleware, loop_monitor
+from utils.metrics import metrics
 
 
 # "HOA-184-812-236"
@@ -33,6 +41,45 @@ http://127.0.0.1:8000/api/v1/docs
 
 """
 
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    
+    """
+    
+    Build the services before the first request and shut them down after the last one.
+    
+    """
+    
+    services = ServiceContainer(db, metrics)
+    
+    try:
+        
+        await services.start()
+    
+    except Exception:
+        
+        # Don't leave pools or worker processes behind when startup fails
+        await services.close()
+        raise
+    
+    app.state.services = services
+    
+    # Watch for code blocking the event loop (opt-in, see utils/loop_monitor.py)
+    if LOOP_MONITOR:
+        await loop_monitor.start(metrics)
+    
+    try:
+        yield
+    
+    finally:
+        
+        if LOOP_MONITOR:
+            await loop_monitor.stop()
+        
+        await services.close()
+
+
 app = FastAPI(
         title = "Neighbr API",
         description = "API for the Smart Policy Assistant",
@@ -53,7 +100,12 @@ app = FastAPI(
                 "name": "admin",
                 "description": "Admin operations.",
                 },
+            {
+                "name": "documents",
+                "description": "Catalog of each HOA's documents.",
+                },
             ],
+        lifespan = lifespan,
         )
 
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl = "auth/login")
@@ -67,21 +119,13 @@ app.add_middleware(
         allow_headers = ["*"],
         )
 
+# Account for the CPU time, memory, database rows and tokens of each request
+if RESOURCE_ACCOUNTING:
+    app.add_middleware(ResourceAccountingMiddleware, accountant = accounting)
 
-@app.on_event("startup")
-async def startup_event():
-    
-    await db.connect()
-    
-    # Create the table if it doesn't exist
-    await db.create_table_if_not_exists_embeddings()
-    await db.create_tables_for_users_and_communities()
-
-
-@app.on_event("shutdown")
-async def shutdown_event():
-    
-    await db.disconnect()
+# Attribute event loop blocks to the request being served
+if LOOP_MONITOR:
+    app.add_middleware(LoopMonitorMiddleware, monitor = loop_monitor)
 
 
 # Health check route
@@ -95,3 +139,4 @@ app.include_router(query_router, prefix = "/query", tags = ["query"])
 app.include_router(upload_router, prefix = "/upload", tags = ["upload"])
 app.include_router(admin_router, prefix = "/admin", tags = ["admin"])
 app.include_router(auth_router, prefix = "/auth", tags = ["auth"])
+app.include_router(documents_router, prefix = "/documents", tags = ["documents"])
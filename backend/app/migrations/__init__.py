@@ -0,0 +1,157 @@
+"""
+
+Versioned schema migrations.
+
+Each module in migrations/versions named vNNNN_<name>.py is one migration. It defines a
+DESCRIPTION and an ``async def upgrade(conn)``, and is applied once, in version order, inside
+its own transaction. Applied versions are recorded in the schema_migrations table.
+
+Apply pending migrations (from backend/app):
+	
+	python -m migrations upgrade
+
+"""
+
+import importlib
+import logging
+import pkgutil
+import re
+
+from migrations import versions
+
+
+# Arbitrary key for the advisory lock that serializes migration runs
+MIGRATION_LOCK_ID = 4_242_001
+
+# Migration modules must be named vNNNN_<name>
+_MODULE_PATTERN = re.compile(r"^v(\d{4})_\w+$")
+
+
+def load_migrations() -> list[tuple[int, object]]:
+	
+	"""
+	
+	Discover the migration modules, in version order.
+	
+	:return: List of (version, module) pairs
+	:rtype: list[tuple[int, module]]
+	
+	"""
+	
+	migrations = []
+	
+	for module_info in pkgutil.iter_modules(versions.__path__):
+		
+		match = _MODULE_PATTERN.match(module_info.name)
+		
+		if match:
+			
+			module = importlib.import_module(f"{versions.__name__}.{module_info.name}")
+			migrations.append((int(match.group(1)), module))
+	
+	migrations.sort(key = lambda item: item[0])
+	
+	# Two modules with the same number would be applied in an arbitrary order
+	numbers = [version for version, _ in migrations]
+	
+	if len(numbers) != len(set(numbers)):
+		raise RuntimeError(f"Duplicate migration versions: {numbers}")
+	
+	return migrations
+
+
+# Version the code expects the database to be at
+LATEST_VERSION = max((version for version, _ in load_migrations()), default = 0)
+
+
+async def apply_migrations(db) -> list[int]:
+	
+	"""
+	
+	Apply every pending migration, holding an advisory lock so concurrent runs wait for each other.
+	
+	:param db: Connected Database instance
+	:type db: Database
+	
+	:return: Versions that were applied
+	:rtype: list[int]
+	
+	"""
+	
+	applied = []
+	
+	async with db.pool.acquire() as conn:
+		
+		# Only one process migrates at a time; the others wait here and then find nothing to do
+		await conn.execute("SELECT pg_advisory_lock($1)", MIGRATION_LOCK_ID)
+		
+		try:
+			
+			await conn.execute(
+					"""
+					CREATE TABLE IF NOT EXISTS schema_migrations (
+					version INTEGER PRIMARY KEY,
+					description TEXT NOT NULL,
+					applied_at TIMESTAMPTZ NOT NULL DEFAULT now()
+					)
+					"""
+					)
+			
+			done = {row["version"] for row in await conn.fetch("SELECT version FROM schema_migrations")}
+			
+			for version, module in load_migrations():
+				
+				if version in done:
+					continue
+				
+				logging.info(f"Applying migration {version}: {module.DESCRIPTION}")
+				
+				# Each migration and its bookkeeping row commit together
+				async with conn.transaction():
+					
+					await module.upgrade(conn)
+					
+					await conn.execute(
+							"INSERT INTO schema_migrations (version, description) VALUES ($1, $2)",
+							version,
+							module.DESCRIPTION,
+							)
+				
+				applied.append(version)
+		
+		finally:
+			
+			await conn.execute("SELECT pg_advisory_unlock($1)", MIGRATION_LOCK_ID)
+	
+	return applied
+
+
+async def check_schema_version(db):
+	
+	"""
+	
+	Make sure the database schema is at the version this code expects.
+	
+	This is a single cheap query, meant to run on every worker startup instead of DDL.
+	
+	:param db: Connected Database instance
+	:type db: Database
+	
+	:return: None
+	:rtype: None
+	
+	"""
+	
+	version = await db.get_schema_version()
+	
+	if version < LATEST_VERSION:
+		
+		raise RuntimeError(
+				f"Database schema is at version {version}, but version {LATEST_VERSION} is required. "
+				f"Run `python -m migrations upgrade` from backend/app."
+				)
+	
+	if version > LATEST_VERSION:
+		
+		# A newer release already migrated the database; additive migrations keep this code working
+		logging.warning(f"Database schema version {version} is newer than this code ({LATEST_VERSION}).")
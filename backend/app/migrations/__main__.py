@@ -0,0 +1,55 @@
+import argparse
+import asyncio
+import logging
+
+from migrations import LATEST_VERSION, apply_migrations, load_migrations
+from services.db import Database
+
+
+async def main(argv: list[str] | None = None):
+	
+	"""
+	
+	Command line entry point for schema migrations.
+	
+	:param argv: Command line arguments (defaults to sys.argv)
+	:type argv: list[str] or None
+	
+	:return: None
+	:rtype: None
+	
+	"""
+	
+	parser = argparse.ArgumentParser(prog = "python -m migrations", description = "Manage the database schema.")
+	parser.add_argument("command", choices = ["upgrade", "status"])
+	args = parser.parse_args(argv)
+	
+	logging.basicConfig(level = logging.INFO, format = "%(message)s")
+	
+	db = Database()
+	await db.connect()
+	
+	try:
+		
+		if args.command == "upgrade":
+			
+			applied = await apply_migrations(db)
+			print(f"Applied migrations: {applied}" if applied else "Schema is up to date.")
+		
+		else:
+			
+			version = await db.get_schema_version()
+			
+			print(f"Database version: {version}")
+			print(f"Code version: {LATEST_VERSION}")
+			
+			for number, module in load_migrations():
+				print(f"  [{'x' if number <= version else ' '}] {number:04d} {module.DESCRIPTION}")
+	
+	finally:
+		
+		await db.disconnect()
+
+
+if __name__ == "__main__":
+	asyncio.run(main())
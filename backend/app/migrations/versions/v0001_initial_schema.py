@@ -0,0 +1,44 @@
+"""
+
+Initial schema: document embeddings, communities and users.
+
+Uses IF NOT EXISTS so databases created before migrations existed are adopted as-is.
+
+"""
+
+DESCRIPTION = "Initial schema"
+
+
+async def upgrade(conn):
+	
+	await conn.execute(
+			"""
+			CREATE EXTENSION IF NOT EXISTS vector;
+			
+			CREATE TABLE IF NOT EXISTS document_embeddings (
+			id SERIAL PRIMARY KEY,
+			hoa_code VARCHAR(50),
+			document_type VARCHAR(100),
+			chunk_index INTEGER,
+			page_number INTEGER,
+			content TEXT,
+			embedding VECTOR(3072)
+			);
+			
+			CREATE TABLE IF NOT EXISTS communities (
+			code VARCHAR(50) PRIMARY KEY,
+			name VARCHAR(100) NOT NULL,
+			max_households INTEGER NOT NULL,
+			current_households INTEGER NOT NULL DEFAULT 0
+			);
+			
+			CREATE TABLE IF NOT EXISTS users (
+			id SERIAL PRIMARY KEY,
+			name VARCHAR(100) NOT NULL,
+			email VARCHAR(100) UNIQUE NOT NULL,
+			hashed_password TEXT NOT NULL,
+			is_admin BOOLEAN DEFAULT FALSE,
+			community_code VARCHAR(50) REFERENCES communities(code) ON DELETE CASCADE
+			);
+			"""
+			)
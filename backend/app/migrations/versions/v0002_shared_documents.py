@@ -0,0 +1,38 @@
+"""
+
+Content-addressed documents shared across communities.
+
+"""
+
+DESCRIPTION = "Shared documents"
+
+
+async def upgrade(conn):
+	
+	await conn.execute(
+			"""
+			CREATE TABLE IF NOT EXISTS document_contents (
+			content_hash VARCHAR(64) PRIMARY KEY,
+			chunk_count INTEGER NOT NULL,
+			created_at TIMESTAMPTZ NOT NULL DEFAULT now()
+			);
+			
+			CREATE TABLE IF NOT EXISTS community_documents (
+			hoa_code VARCHAR(50) REFERENCES communities(code) ON DELETE CASCADE,
+			document_type VARCHAR(100) NOT NULL,
+			content_hash VARCHAR(64) NOT NULL REFERENCES document_contents(content_hash),
+			linked_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+			PRIMARY KEY (hoa_code, document_type)
+			);
+			
+			CREATE INDEX IF NOT EXISTS community_documents_content_hash_idx
+			ON community_documents (content_hash);
+			
+			ALTER TABLE document_embeddings
+			ADD COLUMN IF NOT EXISTS content_hash VARCHAR(64)
+			REFERENCES document_contents(content_hash) ON DELETE CASCADE;
+			
+			CREATE INDEX IF NOT EXISTS document_embeddings_content_hash_idx
+			ON document_embeddings (content_hash);
+			"""
+			)
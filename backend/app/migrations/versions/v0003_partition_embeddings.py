@@ -0,0 +1,97 @@
+"""
+
+Partition document_embeddings by community.
+
+The table is LIST-partitioned on hoa_code. Shared content gets its own partition and every
+other community falls into a DEFAULT partition that is itself HASH-partitioned, so each
+community's rows live in one small table. Large communities can later be moved into a
+dedicated partition with ``python -m utils.partitions promote <hoa_code>``.
+
+Existing rows are copied over inside the migration's transaction and the old table is dropped.
+
+"""
+
+DESCRIPTION = "Partition document embeddings by community"
+
+# Number of hash partitions behind the DEFAULT partition
+HASH_PARTITIONS = 8
+
+
+async def upgrade(conn):
+	
+	# Keep the old table (and its id sequence) around until the rows are copied
+	await conn.execute(
+			"""
+			ALTER TABLE document_embeddings RENAME TO document_embeddings_unpartitioned;
+			ALTER TABLE document_embeddings_unpartitioned
+			RENAME CONSTRAINT document_embeddings_pkey TO document_embeddings_unpartitioned_pkey;
+			ALTER INDEX IF EXISTS document_embeddings_content_hash_idx
+			RENAME TO document_embeddings_unpartitioned_content_hash_idx;
+			"""
+			)
+	
+	# The partition key has to be part of the primary key
+	await conn.execute(
+			"""
+			CREATE TABLE document_embeddings (
+			id INTEGER NOT NULL DEFAULT nextval('document_embeddings_id_seq'),
+			hoa_code VARCHAR(50) NOT NULL,
+			document_type VARCHAR(100),
+			chunk_index INTEGER,
+			page_number INTEGER,
+			content TEXT,
+			embedding VECTOR(3072),
+			content_hash VARCHAR(64) REFERENCES document_contents(content_hash) ON DELETE CASCADE,
+			PRIMARY KEY (hoa_code, id)
+			) PARTITION BY LIST (hoa_code);
+			
+			ALTER SEQUENCE document_embeddings_id_seq OWNED BY document_embeddings.id;
+			
+			CREATE TABLE document_embeddings_shared
+			PARTITION OF document_embeddings FOR VALUES IN ('SHARED');
+			
+			CREATE TABLE document_embeddings_default
+			PARTITION OF document_embeddings DEFAULT
+			PARTITION BY HASH (hoa_code);
+			"""
+			)
+	
+	for remainder in range(HASH_PARTITIONS):
+		
+		await conn.execute(
+				f"""
+				CREATE TABLE document_embeddings_default_{remainder}
+				PARTITION OF document_embeddings_default
+				FOR VALUES WITH (MODULUS {HASH_PARTITIONS}, REMAINDER {remainder})
+				"""
+				)
+	
+	# Rows without a community were never reachable by any query
+	await conn.execute(
+			"""
+			INSERT INTO document_embeddings (
+			id, hoa_code, document_type, chunk_index, page_number, content, embedding, content_hash
+			)
+			SELECT id, hoa_code, document_type, chunk_index, page_number, content, embedding, content_hash
+			FROM document_embeddings_unpartitioned
+			WHERE hoa_code IS NOT NULL;
+			
+			DROP TABLE document_embeddings_unpartitioned;
+			"""
+			)
+	
+	# Indexes on the parent are created on every partition, including ones attached later.
+	# pgvector only indexes up to 2000 dimensions of vector, so the HNSW index is built on
+	# a half-precision cast, which retrieval orders by.
+	await conn.execute(
+			"""
+			CREATE INDEX document_embeddings_context_idx
+			ON document_embeddings (hoa_code, document_type, page_number, chunk_index);
+			
+			CREATE INDEX document_embeddings_content_hash_idx
+			ON document_embeddings (content_hash);
+			
+			CREATE INDEX document_embeddings_embedding_idx
+			ON document_embeddings USING hnsw ((embedding::halfvec(3072)) halfvec_ip_ops);
+			"""
+			)
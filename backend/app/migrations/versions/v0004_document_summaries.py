@@ -0,0 +1,44 @@
+"""
+
+Section of each chunk, and pre-generated summaries and FAQs of stored documents.
+
+Summaries belong to the content (not to a community), so communities sharing a document share
+its summary, and a new version of a document gets a new one.
+
+"""
+
+DESCRIPTION = "Document sections, summaries and FAQs"
+
+
+async def upgrade(conn):
+	
+	await conn.execute(
+			"""
+			ALTER TABLE document_embeddings ADD COLUMN IF NOT EXISTS section TEXT;
+			
+			CREATE TABLE IF NOT EXISTS document_summaries (
+			content_hash VARCHAR(64) PRIMARY KEY REFERENCES document_contents(content_hash) ON DELETE CASCADE,
+			summary TEXT NOT NULL,
+			model VARCHAR(100) NOT NULL,
+			created_at TIMESTAMPTZ NOT NULL DEFAULT now()
+			);
+			
+			CREATE TABLE IF NOT EXISTS document_section_summaries (
+			content_hash VARCHAR(64) REFERENCES document_summaries(content_hash) ON DELETE CASCADE,
+			position INTEGER NOT NULL,
+			section TEXT,
+			first_page INTEGER NOT NULL,
+			last_page INTEGER NOT NULL,
+			summary TEXT NOT NULL,
+			PRIMARY KEY (content_hash, position)
+			);
+			
+			CREATE TABLE IF NOT EXISTS document_faqs (
+			content_hash VARCHAR(64) REFERENCES document_summaries(content_hash) ON DELETE CASCADE,
+			position INTEGER NOT NULL,
+			question TEXT NOT NULL,
+			answer TEXT NOT NULL,
+			PRIMARY KEY (content_hash, position)
+			);
+			"""
+			)
@@ -0,0 +1,50 @@
+"""
+
+Centroid vectors of each stored document and of each of its sections.
+
+Hierarchical retrieval compares a query with the document centroids, then with the section
+centroids of the closest documents, and only searches the chunks of the closest sections.
+Centroids belong to the content (like the chunks and summaries), and are built here for the
+content stored before this migration.
+
+"""
+
+DESCRIPTION = "Document and section centroids"
+
+
+async def upgrade(conn):
+	
+	await conn.execute(
+			"""
+			CREATE TABLE IF NOT EXISTS document_centroids (
+			content_hash VARCHAR(64) PRIMARY KEY REFERENCES document_contents(content_hash) ON DELETE CASCADE,
+			section_count INTEGER NOT NULL,
+			centroid VECTOR(3072) NOT NULL
+			);
+			
+			CREATE TABLE IF NOT EXISTS document_section_centroids (
+			content_hash VARCHAR(64) REFERENCES document_contents(content_hash) ON DELETE CASCADE,
+			section TEXT NOT NULL,
+			first_page INTEGER NOT NULL,
+			last_page INTEGER NOT NULL,
+			chunk_count INTEGER NOT NULL,
+			centroid VECTOR(3072) NOT NULL,
+			PRIMARY KEY (content_hash, section)
+			);
+			
+			INSERT INTO document_section_centroids (content_hash, section, first_page, last_page, chunk_count, centroid)
+			SELECT content_hash, COALESCE(section, ''), min(page_number), max(page_number), count(*),
+				l2_normalize(avg(embedding))
+			FROM document_embeddings
+			WHERE hoa_code = 'SHARED' AND content_hash IS NOT NULL
+			GROUP BY content_hash, COALESCE(section, '')
+			ON CONFLICT (content_hash, section) DO NOTHING;
+			
+			INSERT INTO document_centroids (content_hash, section_count, centroid)
+			SELECT content_hash, count(DISTINCT COALESCE(section, '')), l2_normalize(avg(embedding))
+			FROM document_embeddings
+			WHERE hoa_code = 'SHARED' AND content_hash IS NOT NULL
+			GROUP BY content_hash
+			ON CONFLICT (content_hash) DO NOTHING;
+			"""
+			)
@@ -0,0 +1,24 @@
+"""
+
+Conversation sessions, written through from the in-memory session store when SESSION_PERSIST is on.
+
+"""
+
+DESCRIPTION = "Conversation sessions"
+
+
+async def upgrade(conn):
+	
+	await conn.execute(
+			"""
+			CREATE TABLE IF NOT EXISTS conversation_sessions (
+			session_id UUID PRIMARY KEY,
+			hoa_code VARCHAR(50) NOT NULL REFERENCES communities(code) ON DELETE CASCADE,
+			owner VARCHAR(255) NOT NULL,
+			turns JSONB NOT NULL DEFAULT '[]',
+			updated_at TIMESTAMPTZ NOT NULL DEFAULT now()
+			);
+			
+			CREATE INDEX IF NOT EXISTS conversation_sessions_updated_at_idx ON conversation_sessions (updated_at);
+			"""
+			)
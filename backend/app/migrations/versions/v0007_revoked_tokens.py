@@ -0,0 +1,22 @@
+"""
+
+Revoked access tokens, by hash, kept until the token would have expired.
+
+"""
+
+DESCRIPTION = "Revoked tokens"
+
+
+async def upgrade(conn):
+	
+	await conn.execute(
+			"""
+			CREATE TABLE IF NOT EXISTS revoked_tokens (
+			token_hash CHAR(64) PRIMARY KEY,
+			expires_at TIMESTAMPTZ NOT NULL,
+			revoked_at TIMESTAMPTZ NOT NULL DEFAULT now()
+			);
+			
+			CREATE INDEX IF NOT EXISTS revoked_tokens_revoked_at_idx ON revoked_tokens (revoked_at);
+			"""
+			)
@@ -0,0 +1,46 @@
+"""
+
+Document catalog: community_documents becomes documents, with an id, a version, the storage path
+of the uploaded file and the ingestion time of each document, and document_contents gets the page
+count of the content next to its chunk count.
+
+Chunks stay content-addressed: they reference document_contents, so deleting the last catalog
+entry of some content and then the content removes its chunks, centroids and summaries by cascade.
+
+"""
+
+DESCRIPTION = "Document catalog"
+
+
+async def upgrade(conn):
+	
+	await conn.execute(
+			"""
+			ALTER TABLE community_documents RENAME TO documents;
+			ALTER TABLE documents RENAME CONSTRAINT community_documents_pkey TO documents_pkey;
+			ALTER INDEX community_documents_content_hash_idx RENAME TO documents_content_hash_idx;
+			ALTER TABLE documents RENAME COLUMN linked_at TO ingested_at;
+			
+			ALTER TABLE documents
+			ADD COLUMN id BIGSERIAL UNIQUE,
+			ADD COLUMN version INTEGER NOT NULL DEFAULT 1,
+			ADD COLUMN storage_path TEXT;
+			
+			ALTER TABLE document_contents ADD COLUMN page_count INTEGER;
+			"""
+			)
+	
+	# Chunk page numbers start at 1, so the last one is the page count (pages without text aside)
+	await conn.execute(
+			"""
+			UPDATE document_contents c
+			SET page_count = p.page_count
+			FROM (
+				SELECT content_hash, max(page_number) AS page_count
+				FROM document_embeddings
+				WHERE hoa_code = 'SHARED'
+				GROUP BY content_hash
+			) p
+			WHERE p.content_hash = c.content_hash
+			"""
+			)
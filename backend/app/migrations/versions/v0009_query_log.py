@@ -0,0 +1,37 @@
+"""
+
+Log of answered questions: who asked what, how long each stage took, which chunks were used and
+how many tokens it cost. Written in batches by services.query_log.
+
+"""
+
+DESCRIPTION = "Query log"
+
+
+async def upgrade(conn):
+	
+	await conn.execute(
+			"""
+			CREATE TABLE IF NOT EXISTS query_log (
+			id BIGSERIAL PRIMARY KEY,
+			asked_at TIMESTAMPTZ NOT NULL,
+			hoa_code TEXT NOT NULL,
+			kind TEXT NOT NULL,
+			query TEXT NOT NULL,
+			normalized_query TEXT NOT NULL,
+			status TEXT NOT NULL,
+			total_ms REAL NOT NULL,
+			embedding_ms REAL,
+			retrieval_ms REAL,
+			completion_ms REAL,
+			chunk_ids INTEGER[] NOT NULL DEFAULT '{}',
+			embedding_tokens INTEGER,
+			prompt_tokens INTEGER,
+			completion_tokens INTEGER,
+			coalesced BOOLEAN NOT NULL DEFAULT false,
+			context_reused BOOLEAN NOT NULL DEFAULT false
+			);
+			
+			CREATE INDEX IF NOT EXISTS query_log_hoa_code_asked_at_idx ON query_log (hoa_code, asked_at);
+			"""
+			)
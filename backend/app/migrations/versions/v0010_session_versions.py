@@ -0,0 +1,13 @@
+"""
+
+Version of each conversation session, bumped on every write, so a worker holding a session in
+memory can tell when another worker has added turns to it since.
+
+"""
+
+DESCRIPTION = "Conversation session versions"
+
+
+async def upgrade(conn):
+	
+	await conn.execute("ALTER TABLE conversation_sessions ADD COLUMN IF NOT EXISTS version INTEGER NOT NULL DEFAULT 0")
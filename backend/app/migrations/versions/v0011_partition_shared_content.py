@@ -0,0 +1,57 @@
+"""
+
+Hash-partition shared content by content hash.
+
+Since chunks are stored once per PDF, every community's content is written to the SHARED
+partition, so it had grown into one heap with a single vector index. The SHARED partition is
+rebuilt as HASH-partitioned on content_hash: each document's chunks live in one of its
+partitions, which are vacuumed and indexed on their own, and a search joining the documents of a
+community to their chunks only reads the partitions those documents hash to.
+
+Every unique constraint of a partitioned table must include all of its partition keys, and
+private chunks have no content hash, so the (hoa_code, id) primary key is dropped. Ids still
+come from the sequence, and nothing references them.
+
+Existing rows are copied over inside the migration's transaction and the old partition is dropped.
+
+"""
+
+DESCRIPTION = "Partition shared content by content hash"
+
+# Number of hash partitions behind the SHARED partition
+HASH_PARTITIONS = 16
+
+
+async def upgrade(conn):
+	
+	await conn.execute(
+			"""
+			ALTER TABLE document_embeddings DROP CONSTRAINT document_embeddings_pkey;
+			
+			ALTER TABLE document_embeddings DETACH PARTITION document_embeddings_shared;
+			ALTER TABLE document_embeddings_shared RENAME TO document_embeddings_shared_unpartitioned;
+			
+			CREATE TABLE document_embeddings_shared
+			PARTITION OF document_embeddings FOR VALUES IN ('SHARED')
+			PARTITION BY HASH (content_hash);
+			"""
+			)
+	
+	# The indexes of the parent are created on each of these
+	for remainder in range(HASH_PARTITIONS):
+		
+		await conn.execute(
+				f"""
+				CREATE TABLE document_embeddings_shared_{remainder}
+				PARTITION OF document_embeddings_shared
+				FOR VALUES WITH (MODULUS {HASH_PARTITIONS}, REMAINDER {remainder})
+				"""
+				)
+	
+	await conn.execute(
+			"""
+			INSERT INTO document_embeddings SELECT * FROM document_embeddings_shared_unpartitioned;
+			
+			DROP TABLE document_embeddings_shared_unpartitioned;
+			"""
+			)
@@ -1,7 +1,13 @@
+from datetime import datetime, timedelta, timezone
+
 from fastapi import APIRouter, Depends, HTTPException
 from pydantic import BaseModel, EmailStr
-from utils.auth import verify_token
+from services.container import get_purge_service
+from utils.accounting_instance import accounting
+from utils.auth import require_community, require_operator, verify_token
 from utils.db_instance import db
+from utils.loop_monitor import LOOP_MONITOR, loop_monitor
+from utils.metrics import metrics
 from utils.security import hash_password
 
 
@@ -155,19 +161,25 @@ async def upgrade_household_limit(
 @router.post("/delete_community", tags = ["admin"])
 async def delete_community(
 		request: DeleteCommunityRequest,
-		payload: dict = Depends(verify_token)
+		payload: dict = Depends(verify_token),
+		purge_service = Depends(get_purge_service)
 		):
 	
 	"""
 	
 	Delete a community by its HOA code.
 	
+	The community and its users are deleted right away; its chunks and files are purged by a
+	background job whose progress is returned.
+	
 	:param request: Request object containing community code
 	:type request: DeleteCommunityRequest
 	:param payload: Decoded JWT token payload
 	:type payload: dict
+	:param purge_service: The community purger of the app
+	:type purge_service: CommunityPurger
 	
-	:return: JSON response with success message
+	:return: JSON response with success message and the purge job
 	:rtype: dict
 	"""
 	
@@ -179,11 +191,11 @@ async def delete_community(
 			# Raise an HTTP exception if the user is not an admin
 			raise HTTPException(status_code = 403, detail = "Admin access required.")
 		
-		# Delete the community from the database
-		await db.delete_community_by_code(request.community_code)
+		# Delete the community from the database and purge its chunks and files in the background
+		job = await purge_service.start(request.community_code)
 		
 		# Return success message
-		return {"message": "Community deleted successfully"}
+		return {"message": "Community deleted successfully", "purge_job": job}
 	
 	# Handle case where the community code is not found or other errors
 	except Exception as e:
@@ -262,3 +274,193 @@ async def delete_user(
 	except Exception as e:
 		
 		raise HTTPException(status_code = 500, detail = str(e))
+
+
+@router.get("/metrics", tags = ["admin"])
+async def get_metrics(payload: dict = Depends(verify_token)):
+	
+	"""
+	
+	Get this worker's metrics, such as connection pool sizes and wait times.
+	
+	:param payload: Decoded JWT token payload
+	:type payload: dict
+	
+	:return: JSON response with counters, histograms and gauges
+	:rtype: dict
+	
+	"""
+	
+	# Check if the user is an admin
+	if not payload.get("is_admin"):
+		
+		# Raise an HTTP exception if the user is not an admin
+		raise HTTPException(status_code = 403, detail = "Admin access required.")
+	
+	return metrics.snapshot()
+
+
+@router.get("/purge_jobs/{job_id}", tags = ["admin"])
+async def get_purge_job(
+		job_id: str,
+		payload: dict = Depends(verify_token),
+		purge_service = Depends(get_purge_service)
+		):
+	
+	"""
+	
+	Get the progress of a purge job. Jobs are tracked by the worker that started them.
+	
+	:param job_id: ID of the job
+	:type job_id: str
+	:param payload: Decoded JWT token payload
+	:type payload: dict
+	:param purge_service: The community purger of the app
+	:type purge_service: CommunityPurger
+	
+	:return: JSON response with the progress of the job
+	:rtype: dict
+	
+	"""
+	
+	# Check if the user is an admin
+	if not payload.get("is_admin"):
+		
+		# Raise an HTTP exception if the user is not an admin
+		raise HTTPException(status_code = 403, detail = "Admin access required.")
+	
+	job = purge_service.get_job(job_id)
+	
+	if job is None:
+		raise HTTPException(status_code = 404, detail = "Purge job not found.")
+	
+	return job
+
+
+@router.post("/sweep_orphans", tags = ["admin"])
+async def sweep_orphans(
+		payload: dict = Depends(verify_token),
+		purge_service = Depends(get_purge_service)
+		):
+	
+	"""
+	
+	Start purging the chunks, content and files left behind by deleted communities. Operators only,
+	as it touches every community.
+	
+	:param payload: Decoded JWT token payload
+	:type payload: dict
+	:param purge_service: The community purger of the app
+	:type purge_service: CommunityPurger
+	
+	:return: JSON response with the sweep job
+	:rtype: dict
+	
+	"""
+	
+	require_operator(payload)
+	
+	return {"purge_job": purge_service.start_sweep()}
+
+
+@router.get("/top_questions", tags = ["admin"])
+async def get_top_questions(
+		hoa_code: str,
+		days: int = 7,
+		limit: int = 20,
+		payload: dict = Depends(verify_token)
+		):
+	
+	"""
+	
+	Get the questions a community asked most often in the last days, with their latency and token
+	cost, from the query log.
+	
+	:param hoa_code: HOA code of the community
+	:type hoa_code: str
+	:param days: Number of days to look back
+	:type days: int
+	:param limit: Number of questions returned
+	:type limit: int
+	:param payload: Decoded JWT token payload
+	:type payload: dict
+	
+	:return: JSON response with the top questions
+	:rtype: dict
+	
+	"""
+	
+	# Check if the user is an admin
+	if not payload.get("is_admin"):
+		
+		# Raise an HTTP exception if the user is not an admin
+		raise HTTPException(status_code = 403, detail = "Admin access required.")
+	
+	since = datetime.now(timezone.utc) - timedelta(days = days)
+	
+	return {"hoa_code": hoa_code, "since": since.isoformat(), "questions": await db.get_top_questions(hoa_code, since, limit)}
+
+
+@router.get("/event_loop", tags = ["admin"])
+async def get_event_loop_blocks(payload: dict = Depends(verify_token)):
+	
+	"""
+	
+	Get the latest times this worker's event loop was blocked, with the stack and route that
+	blocked it. Empty unless LOOP_MONITOR is set. Operators only, as the stacks expose the
+	server's code.
+	
+	:param payload: Decoded JWT token payload
+	:type payload: dict
+	
+	:return: JSON response with the monitor's settings and blocking reports, latest first
+	:rtype: dict
+	
+	"""
+	
+	require_operator(payload)
+	
+	return {
+		"enabled": LOOP_MONITOR,
+		"threshold_ms": loop_monitor.threshold * 1000,
+		"blocks": list(reversed(loop_monitor.reports)),
+		}
+
+
+@router.get("/resource_usage", tags = ["admin"])
+async def get_resource_usage(
+		hoa_code: str | None = None,
+		kind: str | None = None,
+		payload: dict = Depends(verify_token)
+		):
+	
+	"""
+	
+	Get the CPU time, peak memory, database rows and bytes and OpenAI tokens this worker's requests
+	and jobs used, summed per community, kind and route, with the latest ones. Operators see every
+	community; community admins only their own.
+	
+	:param hoa_code: HOA code of the community, or None for all (or the admin's own)
+	:type hoa_code: str or None
+	:param kind: "request", "ingestion" or "summary", or None for all
+	:type kind: str or None
+	:param payload: Decoded JWT token payload
+	:type payload: dict
+	
+	:return: JSON response with the totals (most CPU time first) and the latest usages
+	:rtype: dict
+	
+	"""
+	
+	# Check if the user is an admin
+	if not payload.get("is_admin"):
+		
+		# Raise an HTTP exception if the user is not an admin
+		raise HTTPException(status_code = 403, detail = "Admin access required.")
+	
+	if not payload.get("is_operator"):
+		
+		hoa_code = hoa_code or payload.get("community_code")
+		require_community(payload, hoa_code)
+	
+	return accounting.summary(hoa_code, kind)
@@ -1,5 +1,6 @@
 from fastapi import APIRouter, Form, HTTPException, status, Depends
-from utils.auth import create_access_token
+from fastapi.concurrency import run_in_threadpool
+from utils.auth import create_access_token, is_operator, oauth2_scheme, revoke_token
 from utils.db_instance import db
 from utils.security import hash_password, verify_password
 from utils.auth import verify_token
@@ -102,26 +103,24 @@ async def login(email: str = Form(...), password: str = Form(...)):
 	
 	"""
 	
-	# Fetch user from the database using the provided email
-	user = await db.get_user_by_email(email)
+	# Fetch the user and the name of their community in one query
+	user = await db.get_user_with_community(email)
 	
-	# Check if user exists and verify the password
-	if not user or not verify_password(password, user["hashed_password"]):
+	# Check if user exists and verify the password (bcrypt is slow on purpose, so keep it off the event loop)
+	if not user or not await run_in_threadpool(verify_password, password, user["hashed_password"]):
 		raise HTTPException(
 				status_code = status.HTTP_401_UNAUTHORIZED,
 				detail = "Invalid email or password."
 				)
 	
-	# Get community name
-	community = await db.get_community_by_code(user["community_code"])
-	
 	# Store user data in the token
 	token_data = {
 		"sub": email,
 		"user_id": str(user["id"]),
 		"community_code": str(user["community_code"]),
-		"community_name": community["name"],
+		"community_name": user["community_name"],
 		"is_admin": user["is_admin"],
+		"is_operator": is_operator(email),
 		}
 	
 	# Create the access token
@@ -141,4 +140,26 @@ async def verify_user(payload: dict = Depends(verify_token)):
 	Verify a user's token and return user payload if valid.
 	"""
 	
-	return {"status": "ok", "user": payload}
\ No newline at end of file
+	return {"status": "ok", "user": payload}
+
+
+@router.post("/logout")
+async def logout(token: str = Depends(oauth2_scheme), payload: dict = Depends(verify_token)):
+	
+	"""
+	
+	Revoke the user's token, in every worker, until it expires.
+	
+	:param token: The token being revoked
+	:type token: str
+	:param payload: Verified payload of the token
+	:type payload: dict
+	
+	:return: JSON response confirming the logout
+	:rtype: dict
+	
+	"""
+	
+	await revoke_token(token, payload, db)
+	
+	return {"status": "ok"}
\ No newline at end of file
@@ -0,0 +1,224 @@
+from fastapi import APIRouter, Depends, HTTPException, Query, Request
+from fastapi.responses import JSONResponse, Response
+from services.container import get_ingestion_service, get_page_renderer
+from services.page_renderer import RENDER_MAX_AGE, PageNotFoundError
+from utils.db_instance import db
+from utils.auth import require_community, verify_token
+
+
+router = APIRouter()
+
+
+@router.get(
+		"",
+		response_model = dict,
+		tags = ["documents"],
+		summary = "List an HOA's documents",
+		description = "Return the catalog entry of every document of an HOA, with its version, page count and chunk count."
+		)
+async def list_documents(
+		hoa_code: str,
+		payload: dict = Depends(verify_token)
+		):
+	
+	"""
+	
+	Endpoint to list the documents of a community.
+	
+	:param hoa_code: HOA code of the community
+	:type hoa_code: str
+	:param payload: Decoded JWT token payload
+	:type payload: dict
+	
+	:return: JSON response with one catalog entry per document
+	:rtype: dict
+	
+	"""
+	
+	require_community(payload, hoa_code)
+	
+	try:
+		
+		documents = await db.list_documents(hoa_code)
+		
+		return JSONResponse(content = {"documents": documents})
+	
+	except Exception as e:
+		
+		return JSONResponse(content = {"error": str(e)}, status_code = 500)
+
+
+@router.get(
+		"/{document_id}",
+		response_model = dict,
+		tags = ["documents"],
+		summary = "Get a document of an HOA",
+		description = "Return the catalog entry of one document."
+		)
+async def get_document(
+		document_id: int,
+		hoa_code: str,
+		payload: dict = Depends(verify_token)
+		):
+	
+	"""
+	
+	Endpoint to get one document of a community.
+	
+	:param document_id: ID of the document
+	:type document_id: int
+	:param hoa_code: HOA code of the community
+	:type hoa_code: str
+	:param payload: Decoded JWT token payload
+	:type payload: dict
+	
+	:return: JSON response with the catalog entry
+	:rtype: dict
+	
+	"""
+	
+	require_community(payload, hoa_code)
+	
+	document = await db.get_document(hoa_code, document_id)
+	
+	if document is None:
+		raise HTTPException(status_code = 404, detail = "Document not found.")
+	
+	return JSONResponse(content = document)
+
+
+@router.delete(
+		"/{document_id}",
+		response_model = dict,
+		tags = ["documents"],
+		summary = "Delete a document of an HOA",
+		description = "Remove a document from the HOA's catalog with its stored file. Its chunks are deleted too "
+		              "unless another HOA uses the same content."
+		)
+async def delete_document(
+		document_id: int,
+		hoa_code: str,
+		payload: dict = Depends(verify_token),
+		ingestion_service = Depends(get_ingestion_service)
+		):
+	
+	"""
+	
+	Endpoint to delete a document of a community.
+	
+	:param document_id: ID of the document
+	:type document_id: int
+	:param hoa_code: HOA code of the community
+	:type hoa_code: str
+	:param payload: Decoded JWT token payload
+	:type payload: dict
+	:param ingestion_service: The ingestion service of the app
+	:type ingestion_service: IngestionService
+	
+	:return: JSON response with the deleted document and number of chunks deleted
+	:rtype: dict
+	
+	"""
+	
+	# Check if the user is an admin
+	if not payload.get("is_admin"):
+		
+		# Raise an HTTP exception if the user is not an admin
+		raise HTTPException(status_code = 403, detail = "Admin access required.")
+	
+	require_community(payload, hoa_code)
+	
+	deleted = await ingestion_service.delete_document(hoa_code, document_id)
+	
+	if deleted is None:
+		raise HTTPException(status_code = 404, detail = "Document not found.")
+	
+	return JSONResponse(content = {"message": "Document deleted.", **deleted})
+
+
+@router.get(
+		"/{document_id}/pages/{page_number}",
+		response_class = Response,
+		tags = ["documents"],
+		summary = "Render a page of an HOA's document",
+		description = "Return an image of one page of a document, e.g. the page an answer cites. With highlight, the "
+		              "given text (such as the cited chunk) is highlighted, and with crop only the area around it is "
+		              "rendered. Images are cached; send the ETag back in If-None-Match to revalidate."
+		)
+async def get_document_page(
+		request: Request,
+		document_id: int,
+		page_number: int,
+		hoa_code: str,
+		zoom: float = 1.5,
+		image_format: str = Query("png", alias = "format"),
+		highlight: str | None = None,
+		crop: bool = False,
+		payload: dict = Depends(verify_token),
+		page_renderer = Depends(get_page_renderer)
+		):
+	
+	"""
+	
+	Endpoint to render a page of a community's document to PNG, JPEG or WebP.
+	
+	:param request: The current request
+	:type request: Request
+	:param document_id: ID of the document
+	:type document_id: int
+	:param page_number: Page to render, starting at 1
+	:type page_number: int
+	:param hoa_code: HOA code of the community
+	:type hoa_code: str
+	:param zoom: Zoom factor (1.0 is 72 dpi)
+	:type zoom: float
+	:param image_format: "png", "jpeg" or "webp"
+	:type image_format: str
+	:param highlight: Text to highlight on the page, or None
+	:type highlight: str or None
+	:param crop: Whether to only render the area around the highlighted text
+	:type crop: bool
+	:param payload: Decoded JWT token payload
+	:type payload: dict
+	:param page_renderer: The page renderer of the app
+	:type page_renderer: PageRenderer
+	
+	:return: The image, or 304 Not Modified if the client's copy is current
+	:rtype: Response
+	
+	"""
+	
+	require_community(payload, hoa_code)
+	
+	document = await db.get_document(hoa_code, document_id)
+	
+	if document is None:
+		raise HTTPException(status_code = 404, detail = "Document not found.")
+	
+	try:
+		
+		etag = '"' + page_renderer.render_key(document["content_hash"], page_number, zoom, image_format, highlight, crop) + '"'
+		
+		headers = {"ETag": etag, "Cache-Control": f"private, max-age={RENDER_MAX_AGE}"}
+		
+		# The client already has this render: skip the cache and the renderer altogether
+		if etag in request.headers.get("if-none-match", ""):
+			return Response(status_code = 304, headers = headers)
+		
+		rendered = await page_renderer.render(document, page_number, zoom, image_format, highlight, crop)
+	
+	except ValueError as e:
+		
+		raise HTTPException(status_code = 400, detail = str(e))
+	
+	except PageNotFoundError as e:
+		
+		raise HTTPException(status_code = 404, detail = str(e))
+	
+	except FileNotFoundError:
+		
+		raise HTTPException(status_code = 404, detail = "The file of this document is missing.")
+	
+	headers["X-Cache"] = "hit" if rendered["cached"] else "miss"
+	
+	return Response(content = rendered["content"], media_type = rendered["media_type"], headers = headers)
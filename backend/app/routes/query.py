@@ -1,7 +1,10 @@
+import json
+import uuid
+
 from fastapi import APIRouter, Depends, HTTPException
-from fastapi.responses import JSONResponse
-from services.rag import RAG
-from services.embeddings import EmbeddingService
+from fastapi.responses import JSONResponse, StreamingResponse
+from pydantic import BaseModel
+from services.container import get_rag_service, get_session_store
 from utils.db_instance import db
 from utils.auth import verify_token
 import os
@@ -9,9 +12,20 @@ import os
 
 router = APIRouter()
 
-# Create instances of necessary services
-embedding_service = EmbeddingService()
-rag_service = RAG(db, embedding_service)
+# Largest number of questions accepted by a single batch request
+MAX_BATCH_QUESTIONS = int(os.getenv("MAX_BATCH_QUESTIONS", "50"))
+
+
+class BatchQueryRequest(BaseModel):
+	
+	"""
+	
+	Batch query request model.
+	
+	"""
+	
+	hoa_code: str
+	queries: list[str]
 
 
 @router.post(
@@ -24,7 +38,8 @@ rag_service = RAG(db, embedding_service)
 async def answer_query(
 		query: str,
 		hoa_code: str,
-		payload: dict = Depends(verify_token)
+		payload: dict = Depends(verify_token),
+		rag_service = Depends(get_rag_service)
 		):
 	
 	"""
@@ -37,6 +52,8 @@ async def answer_query(
 	:type hoa_code: str
 	:param payload: Decoded JWT token payload
 	:type payload: dict
+	:param rag_service: The RAG service of the app
+	:type rag_service: RAG
 	
 	:return: JSON response with the answer and sources
 	:rtype: dict
@@ -55,3 +72,236 @@ async def answer_query(
 	except Exception as e:
 		# Handle errors (e.g., if any exception occurs during processing)
 		return JSONResponse(content = {"error": str(e)}, status_code = 500)
+
+
+@router.post(
+		"/answer_queries",
+		tags = ["query"],
+		summary = "Answer several queries based on HOA documents",
+		description = "Answer a batch of queries against one HOA's documents. Answers are streamed back as "
+		              "newline-delimited JSON, in the order they complete."
+		)
+async def answer_queries(
+		request: BatchQueryRequest,
+		payload: dict = Depends(verify_token),
+		rag_service = Depends(get_rag_service)
+		):
+	
+	"""
+	
+	Endpoint to answer a batch of queries, streaming each answer as soon as it is generated.
+	
+	:param request: Request object containing the HOA code and the queries
+	:type request: BatchQueryRequest
+	:param payload: Decoded JWT token payload
+	:type payload: dict
+	:param rag_service: The RAG service of the app
+	:type rag_service: RAG
+	
+	:return: Streaming response with one JSON object (index, question, answer) per line
+	:rtype: StreamingResponse
+	
+	"""
+	
+	if not request.queries:
+		
+		return JSONResponse(content = {"error": "At least one query is required."}, status_code = 400)
+	
+	if len(request.queries) > MAX_BATCH_QUESTIONS:
+		
+		return JSONResponse(
+				content = {"error": f"At most {MAX_BATCH_QUESTIONS} queries can be answered at once."},
+				status_code = 400
+				)
+	
+	try:
+		
+		# Embed and retrieve up front, so these failures still get a proper status code
+		contexts = await rag_service.retrieve_contexts(request.queries, request.hoa_code)
+	
+	except Exception as e:
+		
+		return JSONResponse(content = {"error": str(e)}, status_code = 500)
+	
+	async def lines():
+		
+		async for result in rag_service.stream_answers(request.queries, contexts, request.hoa_code):
+			yield json.dumps(result) + "\n"
+	
+	return StreamingResponse(lines(), media_type = "application/x-ndjson")
+
+
+@router.get(
+		"/summaries",
+		response_model = dict,
+		tags = ["query"],
+		summary = "Get the summaries and FAQs of an HOA's documents",
+		description = "Return the summaries, section summaries and suggested questions and answers generated when "
+		              "the documents were uploaded. No LLM is called."
+		)
+async def get_summaries(
+		hoa_code: str,
+		document_type: str | None = None,
+		payload: dict = Depends(verify_token)
+		):
+	
+	"""
+	
+	Endpoint to read the pre-generated summaries and FAQs of a community's documents.
+	
+	:param hoa_code: HOA code of the community
+	:type hoa_code: str
+	:param document_type: Only return this document
+	:type document_type: str or None
+	:param payload: Decoded JWT token payload
+	:type payload: dict
+	
+	:return: JSON response with one entry per document (summary is null while it is being generated)
+	:rtype: dict
+	
+	"""
+	
+	try:
+		
+		documents = await db.get_community_summaries(hoa_code, document_type)
+		
+		return JSONResponse(content = {"documents": documents})
+	
+	except Exception as e:
+		
+		return JSONResponse(content = {"error": str(e)}, status_code = 500)
+
+
+@router.post(
+		"/sessions",
+		response_model = dict,
+		tags = ["query"],
+		summary = "Start a conversation about an HOA's documents",
+		description = "Create a session in which follow-up questions are answered with the previous turns and "
+		              "their retrieved context."
+		)
+async def create_session(
+		hoa_code: str,
+		payload: dict = Depends(verify_token),
+		session_store = Depends(get_session_store)
+		):
+	
+	"""
+	
+	Endpoint to start a conversation session.
+	
+	:param hoa_code: HOA code to filter relevant documents
+	:type hoa_code: str
+	:param payload: Decoded JWT token payload
+	:type payload: dict
+	:param session_store: The conversation session store of the app
+	:type session_store: SessionStore
+	
+	:return: JSON response with the session ID
+	:rtype: dict
+	
+	"""
+	
+	try:
+		
+		session = await session_store.create(hoa_code, payload["sub"])
+		
+		return JSONResponse(content = {"session_id": session.id})
+	
+	except Exception as e:
+		
+		return JSONResponse(content = {"error": str(e)}, status_code = 500)
+
+
+@router.post(
+		"/sessions/{session_id}/answer",
+		response_model = dict,
+		tags = ["query"],
+		summary = "Answer the next question of a conversation",
+		description = "Answer a question, or a follow-up to the previous ones, reusing or extending the context "
+		              "retrieved earlier in the session."
+		)
+async def answer_session_query(
+		session_id: uuid.UUID,
+		query: str,
+		payload: dict = Depends(verify_token),
+		rag_service = Depends(get_rag_service),
+		session_store = Depends(get_session_store)
+		):
+	
+	"""
+	
+	Endpoint to answer a question within a conversation session.
+	
+	:param session_id: ID of the session
+	:type session_id: uuid.UUID
+	:param query: User's query/question
+	:type query: str
+	:param payload: Decoded JWT token payload
+	:type payload: dict
+	:param rag_service: The RAG service of the app
+	:type rag_service: RAG
+	:param session_store: The conversation session store of the app
+	:type session_store: SessionStore
+	
+	:return: JSON response with the answer and the number of turns so far
+	:rtype: dict
+	
+	"""
+	
+	session = await session_store.get(str(session_id))
+	
+	# Sessions of other residents look the same as missing ones
+	if session is None or session.owner != payload["sub"]:
+		raise HTTPException(status_code = 404, detail = "Session not found or expired.")
+	
+	try:
+		
+		answer = await rag_service.answer_turn(session, query)
+		
+		await session_store.save(session)
+		
+		return JSONResponse(content = {"answer": answer, "turns": len(session.turns)})
+	
+	except Exception as e:
+		
+		return JSONResponse(content = {"error": str(e)}, status_code = 500)
+
+
+@router.delete(
+		"/sessions/{session_id}",
+		response_model = dict,
+		tags = ["query"],
+		summary = "End a conversation",
+		description = "Delete a conversation session and its history."
+		)
+async def delete_session(
+		session_id: uuid.UUID,
+		payload: dict = Depends(verify_token),
+		session_store = Depends(get_session_store)
+		):
+	
+	"""
+	
+	Endpoint to end a conversation session.
+	
+	:param session_id: ID of the session
+	:type session_id: uuid.UUID
+	:param payload: Decoded JWT token payload
+	:type payload: dict
+	:param session_store: The conversation session store of the app
+	:type session_store: SessionStore
+	
+	:return: JSON response confirming the deletion
+	:rtype: dict
+	
+	"""
+	
+	session = await session_store.get(str(session_id))
+	
+	if session is None or session.owner != payload["sub"]:
+		raise HTTPException(status_code = 404, detail = "Session not found or expired.")
+	
+	await session_store.delete(session.id)
+	
+	return JSONResponse(content = {"message": "Session deleted."})
@@ -1,19 +1,15 @@
 from fastapi import APIRouter, UploadFile, File, Form, Depends, HTTPException
 from fastapi.responses import JSONResponse
-from services.upload_service import UploadService
-from utils.pdf_utils import PDFProcessor
-from services.embeddings import EmbeddingService
+from services.container import get_ingestion_service
+from services.upload_service import UploadTooLargeError
 import os
-from utils.db_instance import db
 from utils.auth import verify_token
 
 
 router = APIRouter()
 
-USE_S3 = os.getenv("USE_S3", "false").lower() == "true"
-upload_service = UploadService(use_s3 = USE_S3)
-pdf_processor = PDFProcessor()
-embedding_service = EmbeddingService()
+# Largest number of files accepted by a single batch upload
+MAX_BATCH_FILES = int(os.getenv("MAX_BATCH_FILES", "25"))
 
 
 @router.post(
@@ -27,7 +23,8 @@ async def upload_pdf(
         file: UploadFile = File(...),
         hoa_code: str = Form(...),
         document_type: str = Form(...),
-        payload: dict = Depends(verify_token)
+        payload: dict = Depends(verify_token),
+        ingestion_service = Depends(get_ingestion_service)
         ):
     
     """
@@ -41,6 +38,8 @@ async def upload_pdf(
     :type document_type: str
     :param payload: Decoded JWT token payload
     :type payload: dict
+    :param ingestion_service: The ingestion service of the app
+    :type ingestion_service: IngestionService
     
     :return: JSON response with the file path or URL
     :rtype: dict
@@ -58,43 +57,101 @@ async def upload_pdf(
     
     try:
         
-        # Save the file using the upload service
-        file_path = await upload_service.save_file(file, hoa_code = hoa_code, document_type = document_type)
+        # Store, parse, embed and index the document
+        result = await ingestion_service.ingest_document(file, hoa_code = hoa_code, document_type = document_type)
         
-        # Go back to the start of stream in case it was read during saving
-        file.file.seek(0)
+        # Return the response with file path and chunk information
+        return JSONResponse(
+                content = {
+                    "message": "File uploaded and processed successfully",
+                    "path": result["path"],
+                    "sha256": result["sha256"],
+                    "deduplicated": result["deduplicated"],
+                    }
+                )
+    
+    except UploadTooLargeError as e:
         
-        # Read the file bytes for processing
-        file_bytes = await file.read()
+        return JSONResponse(content = {"error": str(e)}, status_code = 413)
+    
+    except Exception as e:
         
-        # Extract chunks with metadata
-        chunk_data = pdf_processor.extract_and_chunk(file_bytes)
+        return JSONResponse(content = {"error": str(e)}, status_code = 500)
+
+
+@router.post(
+        "/upload_pdfs",
+        response_model = dict,
+        tags = ["upload"],
+        summary = "Upload several PDF files at once",
+        description = "Upload a batch of PDF files for one HOA and ingest them concurrently. "
+                      "Returns the status of each file."
+        )
+async def upload_pdfs(
+        files: list[UploadFile] = File(...),
+        document_types: list[str] = Form(...),
+        hoa_code: str = Form(...),
+        payload: dict = Depends(verify_token),
+        ingestion_service = Depends(get_ingestion_service)
+        ):
+    
+    """
+    Endpoint to upload and ingest a batch of PDF files for an HOA.
+    
+    :param files: PDF files to upload
+    :type files: list[UploadFile]
+    :param document_types: Description of each document, in the same order as the files
+    :type document_types: list[str]
+    :param hoa_code: 9-digit alphanumeric HOA code used for folder naming
+    :type hoa_code: str
+    :param payload: Decoded JWT token payload
+    :type payload: dict
+    :param ingestion_service: The ingestion service of the app
+    :type ingestion_service: IngestionService
+    
+    :return: JSON response with the status of each file
+    :rtype: dict
+    """
+    
+    # Check if the user is an admin
+    if not payload.get("is_admin"):
+        
+        # Raise an HTTP exception if the user is not an admin
+        raise HTTPException(status_code = 403, detail = "Admin access required.")
+    
+    if len(files) != len(document_types):
+        
+        return JSONResponse(content = {"error": "Each file needs exactly one document type."}, status_code = 400)
+    
+    if len(files) > MAX_BATCH_FILES:
         
-        # Get just the text from each chunk
-        texts = [item["chunk"] for item in chunk_data]
+        return JSONResponse(
+                content = {"error": f"At most {MAX_BATCH_FILES} files can be uploaded at once."},
+                status_code = 400
+                )
+    
+    if len(set(document_types)) != len(document_types):
+        
+        return JSONResponse(content = {"error": "Document types must be unique."}, status_code = 400)
+    
+    if not all(file.filename.endswith(".pdf") for file in files):
+        
+        return JSONResponse(content = {"error": "Only PDF files are allowed."}, status_code = 400)
+    
+    try:
         
-        # Generate embeddings for each text chunk
-        embeddings = await embedding_service.get_embeddings(texts)
+        # Ingest all documents concurrently
+        results = await ingestion_service.ingest_documents(hoa_code, list(zip(files, document_types)))
         
-        # Pair each embedding with its metadata
-        for item, embedding in zip(chunk_data, embeddings):
-            
-            # Insert the embedding into the database
-            await db.insert_embedding(
-                    hoa_code = hoa_code,
-                    document_type = document_type,
-                    chunk_index = item["chunk_index"],
-                    page_number = item["page_number"],
-                    content = item["chunk"],
-                    embedding = embedding,
-                    )
+        succeeded = sum(result["status"] == "ok" for result in results)
         
-        # Return the response with file path and chunk information
         return JSONResponse(
                 content = {
-                    "message": "File uploaded and processed successfully",
-                    "path": file_path,
-                    }
+                    "message": f"{succeeded} of {len(results)} files uploaded and processed successfully",
+                    "files": results,
+                    },
+                # 207 Multi-Status when only some of the files made it
+                status_code = 200 if succeeded == len(results) else 207
                 )
     
     except Exception as e:
@@ -0,0 +1,304 @@
+"""
+
+Production entrypoint: serves the API with several uvicorn worker processes.
+	
+	cd backend/app
+	python server.py --workers 4 --db-connections 80
+	python server.py --bench --bench-workers 1 2 4
+
+Each worker imports the app and opens its own database pools in the lifespan, after the worker
+process started, so no socket is shared between processes. With --db-connections (or
+DB_MAX_CONNECTIONS), each worker's pools are sized to its share of that budget. The OpenAI budget
+(OPENAI_REQUESTS_PER_MINUTE, OPENAI_TOKENS_PER_MINUTE) is split between the workers the same way.
+Workers use uvloop and httptools when installed, drain in-flight requests on shutdown, and are
+recycled after a number of requests (with jitter, so they don't all restart at once).
+
+"""
+
+import argparse
+import asyncio
+import importlib.util
+import logging
+import os
+import random
+import subprocess
+import sys
+import time
+
+import uvicorn
+
+
+# Worker processes (WEB_CONCURRENCY is also read by the pools and the OpenAI rate limiter to share their budgets)
+DEFAULT_WORKERS = int(os.getenv("WEB_CONCURRENCY", str(os.cpu_count() or 1)))
+
+HOST = os.getenv("SERVER_HOST", "0.0.0.0")
+PORT = int(os.getenv("SERVER_PORT", "8000"))
+
+# Recycle a worker after this many requests, plus up to the jitter (0 disables recycling)
+MAX_REQUESTS = int(os.getenv("SERVER_MAX_REQUESTS", "10000"))
+MAX_REQUESTS_JITTER = int(os.getenv("SERVER_MAX_REQUESTS_JITTER", "1000"))
+
+# Seconds in-flight requests get to finish on shutdown
+GRACEFUL_TIMEOUT = int(os.getenv("SERVER_GRACEFUL_TIMEOUT", "30"))
+
+# Seconds an idle keep-alive connection is kept open (above the load balancer's idle timeout)
+KEEP_ALIVE = int(os.getenv("SERVER_KEEP_ALIVE", "75"))
+
+
+def event_loop() -> str:
+	
+	"""
+	
+	Get the event loop implementation to use: uvloop if installed.
+	
+	"""
+	
+	return "uvloop" if importlib.util.find_spec("uvloop") else "asyncio"
+
+
+def http_protocol() -> str:
+	
+	"""
+	
+	Get the HTTP parser to use: httptools if installed.
+	
+	"""
+	
+	return "httptools" if importlib.util.find_spec("httptools") else "h11"
+
+
+class RecyclingServer(uvicorn.Server):
+	
+	"""
+	
+	uvicorn server whose request limit gets its own jitter in each worker, so workers are recycled
+	at different times.
+	
+	"""
+	
+	def __init__(self, config: uvicorn.Config, max_requests_jitter: int = 0):
+		
+		super().__init__(config)
+		
+		self.max_requests_jitter = max_requests_jitter
+	
+	
+	async def serve(self, sockets = None):
+		
+		# Runs in the worker process, after the supervisor started it
+		if self.config.limit_max_requests and self.max_requests_jitter:
+			self.config.limit_max_requests += random.randint(0, self.max_requests_jitter)
+		
+		await super().serve(sockets)
+
+
+def serve(
+		app: str = "main:app",
+		host: str = HOST,
+		port: int = PORT,
+		workers: int = DEFAULT_WORKERS,
+		db_connections: int | None = None,
+		max_requests: int = MAX_REQUESTS,
+		max_requests_jitter: int = MAX_REQUESTS_JITTER,
+		graceful_timeout: int = GRACEFUL_TIMEOUT,
+		):
+	
+	"""
+	
+	Run the app with a number of worker processes until interrupted.
+	
+	:param app: Import string of the ASGI app
+	:type app: str
+	:param host: Interface to bind
+	:type host: str
+	:param port: Port to bind
+	:type port: int
+	:param workers: Number of worker processes
+	:type workers: int
+	:param db_connections: Connections all workers may open together, or None for the default pool sizes
+	:type db_connections: int or None
+	:param max_requests: Requests after which a worker is recycled (0 to never recycle)
+	:type max_requests: int
+	:param max_requests_jitter: Random extra requests per worker, so workers are recycled at different times
+	:type max_requests_jitter: int
+	:param graceful_timeout: Seconds in-flight requests get to finish on shutdown
+	:type graceful_timeout: int
+	
+	:return: None
+	:rtype: None
+	
+	"""
+	
+	from uvicorn.supervisors import Multiprocess
+	
+	# Read in every worker to size its pools and rate limiter (the app isn't imported yet)
+	os.environ["WEB_CONCURRENCY"] = str(workers)
+	
+	if db_connections:
+		os.environ["DB_MAX_CONNECTIONS"] = str(db_connections)
+	
+	config = uvicorn.Config(
+			app,
+			host = host,
+			port = port,
+			workers = workers,
+			loop = event_loop(),
+			http = http_protocol(),
+			limit_max_requests = max_requests or None,
+			timeout_graceful_shutdown = graceful_timeout,
+			timeout_keep_alive = KEEP_ALIVE,
+			proxy_headers = True,
+			forwarded_allow_ips = "*",
+			)
+	
+	server = RecyclingServer(config, max_requests_jitter)
+	
+	logging.info(f"Serving {app} with {workers} workers ({config.loop}, {config.http}).")
+	
+	if workers > 1:
+		
+		# The supervisor starts the workers and replaces the ones that exit (e.g. after max_requests)
+		Multiprocess(config, target = server.run, sockets = [config.bind_socket()]).run()
+	
+	else:
+		
+		server.run()
+
+
+async def drive(url: str, token: str, concurrency: int, duration: float) -> int:
+	
+	"""
+	
+	Send requests from concurrent clients for a while.
+	
+	:return: Number of successful responses
+	:rtype: int
+	
+	"""
+	
+	import httpx
+	
+	completed = 0
+	deadline = time.perf_counter() + duration
+	
+	async with httpx.AsyncClient(limits = httpx.Limits(max_connections = concurrency), trust_env = False) as client:
+		
+		async def client_loop(index: int):
+			
+			nonlocal completed
+			
+			while time.perf_counter() < deadline:
+				
+				response = await client.get(
+						url,
+						params = {"question": f"when are dues due {index}"},
+						headers = {"Authorization": f"Bearer {token}"},
+						)
+				
+				completed += response.status_code == 200
+		
+		await asyncio.gather(*(client_loop(index) for index in range(concurrency)))
+	
+	return completed
+
+
+def bench(worker_counts: list[int], concurrency: int, duration: float, port: int):
+	
+	"""
+	
+	Report requests per second of the synthetic query workload for each number of workers.
+	
+	"""
+	
+	from benchmarks.synthetic_app import TOKEN
+	
+	print(f"{os.cpu_count()} CPUs, {concurrency} concurrent clients, {duration:.0f}s per run")
+	
+	for workers in worker_counts:
+		
+		server = subprocess.Popen(
+				[
+					sys.executable, "server.py",
+					"--app", "benchmarks.synthetic_app:app",
+					"--port", str(port),
+					"--workers", str(workers),
+					"--max-requests", "0",
+					],
+				stdout = subprocess.DEVNULL,
+				stderr = subprocess.DEVNULL,
+				)
+		
+		try:
+			
+			# Wait until the server answers
+			asyncio.run(wait_until_ready(f"http://127.0.0.1:{port}/"))
+			
+			# Warm every worker up, then measure
+			asyncio.run(drive(f"http://127.0.0.1:{port}/query", TOKEN, concurrency, 1.0))
+			completed = asyncio.run(drive(f"http://127.0.0.1:{port}/query", TOKEN, concurrency, duration))
+			
+			print(f"{workers:>3} workers: {completed / duration:8.0f} requests/s")
+		
+		finally:
+			
+			server.terminate()
+			server.wait()
+
+
+async def wait_until_ready(url: str, timeout: float = 30.0):
+	
+	import httpx
+	
+	deadline = time.perf_counter() + timeout
+	
+	async with httpx.AsyncClient(trust_env = False) as client:
+		
+		while time.perf_counter() < deadline:
+			
+			try:
+				
+				await client.get(url)
+				
+				return
+			
+			except httpx.TransportError:
+				await asyncio.sleep(0.05)
+	
+	raise TimeoutError(f"{url} did not answer within {timeout:.0f}s.")
+
+
+if __name__ == "__main__":
+	
+	parser = argparse.ArgumentParser(description = "Serve the API with several worker processes.")
+	parser.add_argument("--app", default = "main:app", help = "Import string of the ASGI app")
+	parser.add_argument("--host", default = HOST)
+	parser.add_argument("--port", type = int, default = PORT)
+	parser.add_argument("--workers", type = int, default = DEFAULT_WORKERS)
+	parser.add_argument("--db-connections", type = int, help = "Connections all workers may open together")
+	parser.add_argument("--max-requests", type = int, default = MAX_REQUESTS)
+	parser.add_argument("--max-requests-jitter", type = int, default = MAX_REQUESTS_JITTER)
+	parser.add_argument("--graceful-timeout", type = int, default = GRACEFUL_TIMEOUT)
+	parser.add_argument("--bench", action = "store_true", help = "Measure requests/second of a synthetic workload")
+	parser.add_argument("--bench-workers", type = int, nargs = "+", default = [1, 2, 4])
+	parser.add_argument("--bench-concurrency", type = int, default = 64)
+	parser.add_argument("--bench-duration", type = float, default = 10.0)
+	args = parser.parse_args()
+	
+	if args.bench:
+		
+		bench(args.bench_workers, args.bench_concurrency, args.bench_duration, args.port)
+	
+	else:
+		
+		logging.basicConfig(level = logging.INFO)
+		
+		serve(
+				args.app,
+				args.host,
+				args.port,
+				args.workers,
+				args.db_connections,
+				args.max_requests,
+				args.max_requests_jitter,
+				args.graceful_timeout,
+				)
@@ -0,0 +1,296 @@
+"""
+
+Service container: builds the services of the app once, when it starts, and hands them to the
+routes through FastAPI dependencies.
+
+Services pulling in heavy libraries (openai, PyMuPDF, boto3, numpy) are only imported when the
+container starts, so importing the app (in tests, tools or a worker that is still booting) is fast
+and doesn't fail on a missing OpenAI or AWS setting.
+
+"""
+
+import logging
+import os
+import time
+
+from fastapi import Request
+
+
+# Apply pending migrations at startup instead of requiring `python -m migrations upgrade`
+AUTO_MIGRATE = os.getenv("AUTO_MIGRATE", "false").lower() == "true"
+
+# Open every pooled connection and warm the busiest communities up before serving requests
+WARMUP = os.getenv("WARMUP", "false").lower() == "true"
+
+# Store uploads in S3 instead of on local disk
+USE_S3 = os.getenv("USE_S3", "false").lower() == "true"
+
+
+class ServiceContainer:
+	
+	"""
+	
+	Owns the long-lived services of the app and their startup and shutdown.
+	
+	"""
+	
+	def __init__(self, db, metrics):
+		
+		"""
+		
+		Initialize the ServiceContainer class.
+		
+		:param db: The Database instance shared by the services
+		:type db: Database
+		:param metrics: The metrics registry shared by the services
+		:type metrics: Metrics
+		
+		"""
+		
+		self.db = db
+		self.metrics = metrics
+		
+		self.embedding_service = None
+		self.rag_service = None
+		self.session_store = None
+		self.upload_service = None
+		self.pdf_processor = None
+		self.summary_service = None
+		self.ingestion_service = None
+		self.purge_service = None
+		self.page_renderer = None
+		self.query_log = None
+	
+	
+	def build(self):
+		
+		"""
+		
+		Import and build the services.
+		
+		:return: None
+		:rtype: None
+		
+		"""
+		
+		from services.embeddings import EmbeddingService
+		from services.ingestion import IngestionService
+		from services.page_renderer import PageRenderer
+		from services.purge import CommunityPurger
+		from services.query_log import QUERY_LOG, QueryLog
+		from services.rag import RAG
+		from services.sessions import SESSION_PERSIST, SessionStore
+		from services.summaries import SummaryService
+		from services.upload_service import UploadService
+		from utils.accounting_instance import accounting
+		from utils.limiter_instance import openai_limiter
+		from utils.pdf_utils import PDFProcessor
+		from utils.resilience import EMBEDDING_BUDGET, HEDGE_REQUESTS, RETRIEVAL_BUDGET, Hedger, StagePolicy
+		from utils.singleflight import SingleFlight
+		
+		self.embedding_service = EmbeddingService(limiter = openai_limiter, accounting = accounting)
+		
+		# Deadline of each question, split over its stages; slow OpenAI calls are optionally hedged
+		answer_policy = StagePolicy(
+				budgets = {"embedding": EMBEDDING_BUDGET, "retrieval": RETRIEVAL_BUDGET},
+				hedgers = {
+					"embedding": Hedger("embedding", metrics = self.metrics),
+					"completion": Hedger("completion", metrics = self.metrics),
+					} if HEDGE_REQUESTS else None,
+				metrics = self.metrics,
+				)
+		
+		# Answered questions are written to Postgres in the background
+		self.query_log = QueryLog(self.db, metrics = self.metrics) if QUERY_LOG else None
+		
+		self.rag_service = RAG(
+				self.db,
+				self.embedding_service,
+				coalescer = SingleFlight("answer_query", self.metrics),
+				limiter = openai_limiter,
+				policy = answer_policy,
+				query_log = self.query_log,
+				accounting = accounting,
+				)
+		
+		# Conversations of residents, optionally written through to Postgres
+		self.session_store = SessionStore(self.db if SESSION_PERSIST else None, metrics = self.metrics)
+		
+		self.upload_service = UploadService(use_s3 = USE_S3)
+		self.pdf_processor = PDFProcessor()
+		self.summary_service = SummaryService(
+				self.db,
+				RAG(self.db, self.embedding_service, limiter = openai_limiter, accounting = accounting),
+				accounting = accounting,
+				)
+		self.ingestion_service = IngestionService(
+				self.db,
+				self.embedding_service,
+				self.upload_service,
+				self.pdf_processor,
+				summarizer = self.summary_service,
+				accounting = accounting,
+				)
+		
+		# Removes the chunks and files of deleted communities in the background
+		self.purge_service = CommunityPurger(self.db, self.upload_service, metrics = self.metrics)
+		
+		# Renders pages of stored documents for citation previews, through an on-disk cache
+		self.page_renderer = PageRenderer(
+				self.upload_service,
+				coalescer = SingleFlight("render_page", self.metrics),
+				metrics = self.metrics,
+				)
+	
+	
+	async def start(self):
+		
+		"""
+		
+		Connect to the database, build the services and resume background work.
+		
+		:return: None
+		:rtype: None
+		
+		"""
+		
+		from migrations import apply_migrations, check_schema_version
+		from utils.accounting_instance import accounting
+		from utils.auth import token_cache
+		
+		started = time.perf_counter()
+		
+		await self.db.connect()
+		
+		# Verified tokens are cached per worker; revocations are shared through the database
+		token_cache.attach(self.db, self.metrics, accounting)
+		
+		# Development convenience: apply pending migrations on boot (the advisory lock keeps workers from racing)
+		if AUTO_MIGRATE:
+			await apply_migrations(self.db)
+		
+		# Only verify the schema version; migrations are applied with `python -m migrations upgrade`
+		await check_schema_version(self.db)
+		
+		self.build()
+		
+		if self.query_log:
+			self.query_log.start()
+		
+		# Resume summaries that were interrupted by a restart
+		await self.summary_service.schedule_missing()
+		
+		# The app only reports ready (and accepts requests) once the warm-up is done
+		if WARMUP:
+			
+			warmed = await self.db.warm_up()
+			
+			logging.info(f"Warmed up {warmed['connections']} connections with {warmed['searches']} searches.")
+		
+		self.metrics.observe("app_startup_seconds", time.perf_counter() - started)
+	
+	
+	async def close(self):
+		
+		"""
+		
+		Stop background work and close the database pools. Safe to call after a failed start.
+		
+		:return: None
+		:rtype: None
+		
+		"""
+		
+		# Stop the PDF parsing processes
+		if self.ingestion_service:
+			self.ingestion_service.close()
+		
+		# Stop the page rendering processes
+		if self.page_renderer:
+			self.page_renderer.close()
+		
+		# Stop background summaries; they are resumed on the next startup
+		if self.summary_service:
+			await self.summary_service.close()
+		
+		# Stop purges; the orphan sweeper finishes them
+		if self.purge_service:
+			await self.purge_service.close()
+		
+		# Write the questions still queued while the pools are open
+		if self.query_log:
+			await self.query_log.close()
+		
+		await self.db.disconnect()
+
+
+def get_services(request: Request) -> ServiceContainer:
+	
+	"""
+	
+	FastAPI dependency returning the container of the running app.
+	
+	:param request: The current request
+	:type request: Request
+	
+	:return: The service container
+	:rtype: ServiceContainer
+	
+	"""
+	
+	return request.app.state.services
+
+
+def get_rag_service(request: Request):
+	
+	"""
+	
+	FastAPI dependency returning the RAG service.
+	
+	"""
+	
+	return get_services(request).rag_service
+
+
+def get_session_store(request: Request):
+	
+	"""
+	
+	FastAPI dependency returning the conversation session store.
+	
+	"""
+	
+	return get_services(request).session_store
+
+
+def get_ingestion_service(request: Request):
+	
+	"""
+	
+	FastAPI dependency returning the ingestion service.
+	
+	"""
+	
+	return get_services(request).ingestion_service
+
+
+def get_purge_service(request: Request):
+	
+	"""
+	
+	FastAPI dependency returning the community purger.
+	
+	"""
+	
+	return get_services(request).purge_service
+
+
+def get_page_renderer(request: Request):
+	
+	"""
+	
+	FastAPI dependency returning the page renderer.
+	
+	"""
+	
+	return get_services(request).page_renderer
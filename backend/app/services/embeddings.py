@@ -13,7 +13,7 @@ class EmbeddingService:
 	
 	"""
 	
-	def __init__(self, model: str = "text-embedding-3-large"):
+	def __init__(self, model: str = "text-embedding-3-large", limiter = None, accounting = None):
 		
 		"""
 		
@@ -21,6 +21,10 @@ class EmbeddingService:
 		
 		:param model: The OpenAI model to use for generating embeddings. Default is "text-embedding-3-large".
 		:type model: str
+		:param limiter: The RateLimiter shared by all OpenAI calls, or None to not rate limit.
+		:type limiter: RateLimiter or None
+		:param accounting: ResourceAccountant charging the tokens to the request or job, or None.
+		:type accounting: ResourceAccountant or None
 		"""
 		
 		# Load the OpenAI API key from environment variables
@@ -37,8 +41,16 @@ class EmbeddingService:
 		# Set the model to use for generating embeddings
 		self.model = model
 		
+		self.limiter = limiter
+		self.accounting = accounting
 	
-	async def get_embeddings(self, texts: List[str]) -> List[List[float]]:
+	
+	async def get_embeddings(
+			self,
+			texts: List[str],
+			priority: str = "background",
+			hoa_code: str | None = None,
+			) -> List[List[float]]:
 		
 		"""
 		
@@ -46,6 +58,10 @@ class EmbeddingService:
 
 		:param texts: List of text strings to embed.
 		:type texts: List[str]
+		:param priority: Rate limiter lane, "interactive" or "background" (ingestion).
+		:type priority: str
+		:param hoa_code: Community the embeddings are for, used to share the rate limit fairly.
+		:type hoa_code: str or None
 		
 		:return: List of vector embeddings.
 		:rtype: List[List[float]]
@@ -54,10 +70,7 @@ class EmbeddingService:
 		try:
 			
 			# Create embeddings using the OpenAI API
-			response = await self.client.embeddings.create(
-					input = texts,
-					model = self.model
-					)
+			response = await self._create(texts, priority, hoa_code)
 			
 			# Return the embeddings from the response
 			return [record.embedding for record in response.data]
@@ -70,7 +83,13 @@ class EmbeddingService:
 			raise RuntimeError(f"Embedding generation failed: {str(e)}")
 	
 	
-	async def get_query_embedding(self, text: str) -> List[float]:
+	async def get_query_embedding(
+			self,
+			text: str,
+			priority: str = "interactive",
+			hoa_code: str | None = None,
+			trace: dict | None = None,
+			) -> List[float]:
 		
 		"""
 		
@@ -78,6 +97,12 @@ class EmbeddingService:
 
 		:param text: The query text to embed.
 		:type text: str
+		:param priority: Rate limiter lane, "interactive" or "background".
+		:type priority: str
+		:param hoa_code: Community the query is asked in, used to share the rate limit fairly.
+		:type hoa_code: str or None
+		:param trace: Dict of the query's statistics, which gets embedding_tokens, or None.
+		:type trace: dict or None
 
 		:return: Embedding vector for the query.
 		:rtype: List[float]
@@ -87,10 +112,10 @@ class EmbeddingService:
 			
 			clean_text = text.replace("\n", " ").strip()
 			
-			response = await self.client.embeddings.create(
-					input = [clean_text],
-					model = self.model
-					)
+			response = await self._create([clean_text], priority, hoa_code)
+			
+			if trace is not None and response.usage:
+				trace["embedding_tokens"] = response.usage.total_tokens
 			
 			# Return the embedding from the response
 			return response.data[0].embedding
@@ -103,3 +128,41 @@ class EmbeddingService:
 			
 			# Raise a runtime error with the exception message
 			raise RuntimeError(f"Query embedding generation failed: {str(e)}")
+	
+	
+	async def _create(self, texts: List[str], priority: str, hoa_code: str | None):
+		
+		"""
+		
+		Call the embeddings API, waiting for the rate limiter first.
+		
+		:param texts: List of text strings to embed.
+		:type texts: List[str]
+		:param priority: Rate limiter lane.
+		:type priority: str
+		:param hoa_code: Community the embeddings are for.
+		:type hoa_code: str or None
+		
+		:return: The API response.
+		:rtype: CreateEmbeddingResponse
+		"""
+		
+		if self.limiter is not None:
+			
+			estimated = sum(self.limiter.estimate_tokens(text) for text in texts)
+			
+			await self.limiter.acquire(estimated, priority = priority, hoa_code = hoa_code)
+		
+		response = await self.client.embeddings.create(input = texts, model = self.model)
+		
+		# Settle the difference between the estimate and what was really used
+		if self.limiter is not None:
+			self.limiter.record_usage(estimated, response.usage.total_tokens if response.usage else None)
+		
+		# Charge the tokens to the community and the request or job they were used for
+		if self.accounting and response.usage:
+			
+			self.accounting.attribute(hoa_code)
+			self.accounting.add(embedding_tokens = response.usage.total_tokens)
+		
+		return response
@@ -0,0 +1,719 @@
+import asyncio
+import contextlib
+import functools
+import inspect
+import logging
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+from fastapi import UploadFile
+from starlette.concurrency import run_in_threadpool
+
+
+# Maximum number of chunks sent to the embedding API in one request
+EMBEDDING_BATCH_SIZE = int(os.getenv("EMBEDDING_BATCH_SIZE", "256"))
+
+# Maximum number of embedding requests in flight for one ingestion
+EMBEDDING_CONCURRENCY = int(os.getenv("EMBEDDING_CONCURRENCY", "4"))
+
+# Number of processes used to parse PDFs of a batch in parallel
+PARSE_WORKERS = int(os.getenv("PARSE_WORKERS", str(min(4, os.cpu_count() or 1))))
+
+
+def measured(name: str):
+	
+	"""
+	
+	Decorate an ingestion method so the resources of each call are charged to the community of its
+	hoa_code argument, as a job of its own inside the upload request.
+	
+	:param name: Name of the job.
+	:type name: str
+	
+	:return: The decorator.
+	:rtype: Callable
+	
+	"""
+	
+	def decorator(method):
+		
+		signature = inspect.signature(method)
+		
+		@functools.wraps(method)
+		async def wrapper(self, *args, **kwargs):
+			
+			hoa_code = signature.bind(self, *args, **kwargs).arguments["hoa_code"]
+			
+			async with self._measure(name, hoa_code):
+				return await method(self, *args, **kwargs)
+		
+		return wrapper
+	
+	return decorator
+
+
+class IngestionService:
+	
+	"""
+	
+	Service that turns uploaded PDFs into stored files and embedded chunks.
+	
+	"""
+	
+	def __init__(
+			self,
+			db,
+			embedder,
+			upload_service,
+			pdf_processor,
+			embedding_batch_size: int = EMBEDDING_BATCH_SIZE,
+			embedding_concurrency: int = EMBEDDING_CONCURRENCY,
+			parse_workers: int = PARSE_WORKERS,
+			summarizer = None,
+			accounting = None,
+			):
+		
+		"""
+		
+		Initialize the service with the required dependencies.
+		
+		:param db: The Database instance to store chunks in.
+		:type db: Database
+		:param embedder: The EmbeddingService instance to embed chunks with.
+		:type embedder: EmbeddingService
+		:param upload_service: The UploadService instance to store files with.
+		:type upload_service: UploadService
+		:param pdf_processor: The PDFProcessor instance to extract chunks with.
+		:type pdf_processor: PDFProcessor
+		:param embedding_batch_size: Maximum number of chunks per embedding request.
+		:type embedding_batch_size: int
+		:param embedding_concurrency: Maximum number of embedding requests in flight.
+		:type embedding_concurrency: int
+		:param parse_workers: Number of processes used to parse batches of PDFs.
+		:type parse_workers: int
+		:param summarizer: The SummaryService instance that summarizes new content in the background, if any.
+		:type summarizer: SummaryService or None
+		:param accounting: The ResourceAccountant charging each ingestion job to its community, if any.
+		:type accounting: ResourceAccountant or None
+		
+		"""
+		
+		self.db = db
+		self.embedder = embedder
+		self.upload_service = upload_service
+		self.pdf_processor = pdf_processor
+		self.embedding_batch_size = embedding_batch_size
+		self.embedding_concurrency = embedding_concurrency
+		self.parse_workers = parse_workers
+		self.summarizer = summarizer
+		self.accounting = accounting
+		
+		# Created on first batch upload
+		self._parse_pool = None
+	
+	
+	def close(self):
+		
+		"""
+		
+		Shut down the parsing process pool, if it was started.
+		
+		:return: None
+		:rtype: None
+		
+		"""
+		
+		if self._parse_pool:
+			
+			self._parse_pool.shutdown(cancel_futures = True)
+			self._parse_pool = None
+	
+	
+	@measured("ingest_document")
+	async def ingest_document(self, file: UploadFile, hoa_code: str, document_type: str) -> dict:
+		
+		"""
+		
+		Store, parse, embed and index a single uploaded PDF.
+		
+		If the same PDF was already ingested (by this or another community), the community is
+		linked to the stored chunks and nothing is parsed or embedded.
+		
+		:param file: The uploaded PDF.
+		:type file: UploadFile
+		:param hoa_code: HOA code the document belongs to.
+		:type hoa_code: str
+		:param document_type: Description of the document.
+		:type document_type: str
+		
+		:return: Dict with the stored path, content hash, number of chunks and whether it was deduplicated.
+		:rtype: dict
+		
+		"""
+		
+		# Stream the upload to disk once (raises UploadTooLargeError)
+		stored = await self.upload_service.receive_file(file, hoa_code = hoa_code, document_type = document_type)
+		
+		# File of the version being replaced, deleted once nothing points at it anymore
+		previous_path = await self.db.get_storage_path(hoa_code, document_type)
+		
+		try:
+			
+			# Reuse the chunks and vectors of identical content
+			chunk_count = await self.db.link_existing_document(hoa_code, document_type, stored["sha256"], stored["key"])
+			
+			if chunk_count is not None:
+				
+				file_path = await self.upload_service.publish_file(stored)
+				await self._delete_unused_files([previous_path])
+				
+				return {"path": file_path, "sha256": stored["sha256"], "chunks": chunk_count, "deduplicated": True}
+			
+			# Parse on a worker thread while the file is being published
+			file_path, chunk_data = await self._publish_and_parse(
+					stored,
+					lambda: self._parse(run_in_threadpool, stored["local_path"]),
+					)
+			
+			# Embed the chunks, a batch at a time
+			embeddings = await self._embed([item["chunk"] for item in chunk_data], hoa_code)
+			
+			# Store all chunks in one statement
+			created = await self.db.store_document(
+					hoa_code, document_type, stored["sha256"], chunk_data, embeddings, storage_path = stored["key"]
+					)
+			
+			if created and self.summarizer:
+				self.summarizer.schedule(stored["sha256"], hoa_code)
+			
+			await self._delete_unused_files([previous_path])
+			
+			return {"path": file_path, "sha256": stored["sha256"], "chunks": len(chunk_data), "deduplicated": False}
+		
+		except Exception:
+			
+			# The published file, unless the catalog already pointed at the same content
+			await self._delete_unused_files([stored["key"]])
+			raise
+		
+		finally:
+			
+			# Remove the staging file, if any
+			self.upload_service.release_file(stored)
+	
+	
+	async def delete_document(self, hoa_code: str, document_id: int) -> dict | None:
+		
+		"""
+		
+		Remove a document from a community's catalog, with its stored file, and its chunks if no
+		other community uses the same content.
+		
+		:param hoa_code: HOA code the document belongs to.
+		:type hoa_code: str
+		:param document_id: ID of the catalog entry.
+		:type document_id: int
+		
+		:return: Dict with the document type, content hash, storage path and number of chunks deleted,
+		or None if the community has no such document.
+		:rtype: dict or None
+		
+		"""
+		
+		deleted = await self.db.delete_document(hoa_code, document_id)
+		
+		# Entries catalogued before storage paths were recorded only lose their chunks, and another
+		# entry of the community may point at the same content
+		if deleted:
+			await self._delete_unused_files([deleted["storage_path"]])
+		
+		return deleted
+	
+	
+	@measured("ingest_documents")
+	async def ingest_documents(self, hoa_code: str, documents: list[tuple[UploadFile, str]]) -> list[dict]:
+		
+		"""
+		
+		Ingest a batch of uploaded PDFs concurrently.
+		
+		PDFs are parsed in parallel in a process pool, the chunks of all documents are pooled into
+		full embedding requests, and each document is written with one bulk insert. Content that is
+		already stored, or that appears twice in the batch, is only linked. A failure only affects
+		the documents it touches.
+		
+		:param hoa_code: HOA code the documents belong to.
+		:type hoa_code: str
+		:param documents: List of (uploaded file, document type) pairs.
+		:type documents: list[tuple[UploadFile, str]]
+		
+		:return: One status dict per document, in the order given.
+		:rtype: list[dict]
+		
+		"""
+		
+		results = [
+			{"filename": file.filename, "document_type": document_type, "status": "pending"}
+			for file, document_type in documents
+			]
+		
+		# Stage 1: stream every upload to disk
+		stored = await asyncio.gather(
+				*(
+					self.upload_service.receive_file(file, hoa_code = hoa_code, document_type = document_type)
+					for file, document_type in documents
+					),
+				return_exceptions = True,
+				)
+		
+		try:
+			
+			# Files of the versions being replaced
+			previous_paths = await asyncio.gather(
+					*(self.db.get_storage_path(hoa_code, document_type) for _, document_type in documents)
+					)
+			
+			received = []
+			
+			for i, item in enumerate(stored):
+				
+				if isinstance(item, BaseException):
+					
+					self._fail(results[i], item)
+					continue
+				
+				results[i]["sha256"] = item["sha256"]
+				received.append(i)
+			
+			# Stage 2: link the documents whose content is already stored
+			linked = await asyncio.gather(
+					*(
+						self.db.link_existing_document(hoa_code, documents[i][1], stored[i]["sha256"], stored[i]["key"])
+						for i in received
+						),
+					return_exceptions = True,
+					)
+			
+			to_parse = []
+			to_publish = []
+			duplicates = {}
+			owners = {}
+			
+			for i, outcome in zip(received, linked):
+				
+				if isinstance(outcome, BaseException):
+					
+					self._fail(results[i], outcome)
+				
+				elif outcome is not None:
+					
+					# Already stored: only the file needs publishing
+					results[i].update(chunks = outcome, deduplicated = True)
+					to_publish.append(i)
+				
+				elif stored[i]["sha256"] in owners:
+					
+					# Same content as an earlier file of this batch: link it once that one is stored
+					duplicates[i] = owners[stored[i]["sha256"]]
+					to_publish.append(i)
+				
+				else:
+					
+					owners[stored[i]["sha256"]] = i
+					to_parse.append(i)
+			
+			loop = asyncio.get_running_loop()
+			pool = self._get_parse_pool() if to_parse else None
+			
+			# Stage 3: publish every file, parsing the new ones in parallel at the same time
+			outcomes = await asyncio.gather(
+					*(
+						self._publish_and_parse(
+								stored[i],
+								lambda i = i: self._parse(
+										functools.partial(loop.run_in_executor, pool), stored[i]["local_path"]
+										),
+								)
+						for i in to_parse
+						),
+					*(self.upload_service.publish_file(stored[i]) for i in to_publish),
+					return_exceptions = True,
+					)
+			
+			chunks_by_doc = {}
+			
+			for i, outcome in zip(to_parse + to_publish, outcomes):
+				
+				if isinstance(outcome, BaseException):
+					
+					self._fail(results[i], outcome)
+				
+				elif i in to_parse:
+					
+					results[i]["path"], chunks_by_doc[i] = outcome
+				
+				else:
+					
+					results[i]["path"] = outcome
+			
+			# Stage 4: embed the chunks of all new documents together, in full batches
+			embeddings_by_doc = await self._embed_across_documents(chunks_by_doc, results, hoa_code)
+			
+			# Stage 5: write each new document with one bulk insert, concurrently
+			doc_ids = list(embeddings_by_doc)
+			inserted = await asyncio.gather(
+					*(
+						self.db.store_document(
+								hoa_code,
+								documents[i][1],
+								stored[i]["sha256"],
+								chunks_by_doc[i],
+								embeddings_by_doc[i],
+								storage_path = stored[i]["key"],
+								)
+						for i in doc_ids
+						),
+					return_exceptions = True,
+					)
+			
+			for i, outcome in zip(doc_ids, inserted):
+				
+				if isinstance(outcome, BaseException):
+					
+					self._fail(results[i], outcome)
+				
+				else:
+					
+					results[i].update(chunks = len(chunks_by_doc[i]), deduplicated = False)
+					
+					if outcome and self.summarizer:
+						self.summarizer.schedule(stored[i]["sha256"], hoa_code)
+			
+			# Stage 6: link the in-batch duplicates to the content stored for their first copy
+			for i, owner in duplicates.items():
+				
+				if results[i]["status"] == "error":
+					continue
+				
+				if results[owner]["status"] == "error":
+					
+					self._fail(results[i], RuntimeError(results[owner]["error"]))
+					continue
+				
+				try:
+					
+					chunk_count = await self.db.link_existing_document(
+							hoa_code, documents[i][1], stored[i]["sha256"], stored[i]["key"]
+							)
+					results[i].update(chunks = chunk_count, deduplicated = True)
+				
+				except Exception as e:
+					
+					self._fail(results[i], e)
+			
+			# Everything that did not fail along the way made it
+			for result in results:
+				
+				if result["status"] == "pending":
+					result["status"] = "ok"
+			
+			# Stage 7: delete the files of replaced versions and failed uploads nothing points at
+			await self._delete_unused_files(
+					[previous_paths[i] for i, result in enumerate(results) if result["status"] == "ok"]
+					+ [stored[i]["key"] for i in received if results[i]["status"] == "error"]
+					)
+		
+		finally:
+			
+			# Remove the staging files, if any
+			for item in stored:
+				
+				if not isinstance(item, BaseException):
+					
+					self.upload_service.release_file(item)
+		
+		return results
+	
+	
+	async def _publish_and_parse(self, stored: dict, parse) -> tuple[str, list[dict]]:
+		
+		"""
+		
+		Publish a received file while its chunks are being extracted.
+		
+		:param stored: Dict returned by UploadService.receive_file.
+		:type stored: dict
+		:param parse: Callable returning an awaitable that parses the stored file.
+		:type parse: Callable
+		
+		:return: The published path or URL, and the extracted chunks.
+		:rtype: tuple[str, list[dict]]
+		
+		"""
+		
+		# Publish the stored file (S3 upload, if enabled) in the background
+		publish_task = asyncio.create_task(self.upload_service.publish_file(stored))
+		
+		try:
+			
+			chunk_data = await parse()
+		
+		except BaseException:
+			
+			# The S3 upload runs on a thread that can't be cancelled: let it finish, so the caller
+			# deletes the published file after it rather than before
+			await asyncio.wait([publish_task])
+			raise
+		
+		return await publish_task, chunk_data
+	
+	
+	async def _delete_unused_files(self, storage_paths: list[str | None]):
+		
+		"""
+		
+		Delete the stored files no catalog entry points at. Failures are only logged, as the
+		documents themselves were ingested (or failed) already.
+		
+		:param storage_paths: Storage keys of the candidate files (None entries are skipped).
+		:type storage_paths: list[str or None]
+		
+		"""
+		
+		storage_paths = list({path for path in storage_paths if path})
+		
+		if not storage_paths:
+			return
+		
+		try:
+			
+			for path in await self.db.get_unused_storage_paths(storage_paths):
+				await self.upload_service.delete_file(path)
+		
+		except Exception as e:
+			
+			logging.warning(f"Could not delete unused files {storage_paths}: {e}")
+	
+	
+	def _measure(self, name: str, hoa_code: str):
+		
+		"""
+		
+		Account for the resources of an ingestion job, if accounting is enabled.
+		
+		:param name: Name of the job.
+		:type name: str
+		:param hoa_code: HOA code the documents belong to.
+		:type hoa_code: str
+		
+		:return: Async context manager around the job.
+		:rtype: AsyncContextManager
+		
+		"""
+		
+		if self.accounting is None:
+			return contextlib.nullcontext()
+		
+		# Upload requests are charged to the community too, even when nothing gets embedded
+		self.accounting.attribute(hoa_code)
+		
+		return self.accounting.measure("ingestion", name, hoa_code = hoa_code)
+	
+	
+	async def _parse(self, run, path: str) -> list[dict]:
+		
+		"""
+		
+		Extract the chunks of a stored PDF on a worker thread or process, charging its CPU time.
+		
+		:param run: Coroutine function running a function and its arguments on the worker.
+		:type run: Callable
+		:param path: Local path of the stored PDF.
+		:type path: str
+		
+		:return: The extracted chunks.
+		:rtype: list[dict]
+		
+		"""
+		
+		if self.accounting is None:
+			return await run(self.pdf_processor.extract_and_chunk, path)
+		
+		return self.accounting.collect(await run(self.accounting.timed(self.pdf_processor.extract_and_chunk), path))
+	
+	
+	async def _embed(self, texts: list[str], hoa_code: str | None = None) -> list[list[float]]:
+		
+		"""
+		
+		Embed a list of texts in batches of at most embedding_batch_size, with bounded concurrency.
+		
+		:param texts: Texts to embed.
+		:type texts: list[str]
+		:param hoa_code: HOA code the texts belong to, for the rate limiter.
+		:type hoa_code: str or None
+		
+		:return: One embedding per text, in order.
+		:rtype: list[list[float]]
+		
+		"""
+		
+		batches = await self._embed_batches(self._split(texts), hoa_code)
+		
+		embeddings = []
+		
+		for batch in batches:
+			
+			# Fail the whole document if any of its batches failed
+			if isinstance(batch, BaseException):
+				raise batch
+			
+			embeddings.extend(batch)
+		
+		return embeddings
+	
+	
+	async def _embed_across_documents(
+			self,
+			chunks_by_doc: dict,
+			results: list[dict],
+			hoa_code: str | None = None,
+			) -> dict:
+		
+		"""
+		
+		Embed the chunks of several documents, filling each embedding request with chunks from
+		as many documents as needed.
+		
+		:param chunks_by_doc: Chunks of each document, keyed by its position in the batch.
+		:type chunks_by_doc: dict[int, list[dict]]
+		:param results: Per-document status dicts, updated for documents whose embeddings failed.
+		:type results: list[dict]
+		:param hoa_code: HOA code the documents belong to, for the rate limiter.
+		:type hoa_code: str or None
+		
+		:return: Embeddings of each successfully embedded document, keyed by its position.
+		:rtype: dict[int, list[list[float]]]
+		
+		"""
+		
+		# Flatten all chunks, remembering which document each one came from
+		owners = []
+		texts = []
+		
+		for i, chunk_data in chunks_by_doc.items():
+			
+			owners.extend([i] * len(chunk_data))
+			texts.extend(item["chunk"] for item in chunk_data)
+		
+		# Split positions rather than texts, so each result can be traced back to its chunks
+		index_batches = self._split(list(range(len(texts))))
+		
+		batches = await self._embed_batches([[texts[j] for j in batch] for batch in index_batches], hoa_code)
+		
+		embeddings_by_doc = {i: [] for i in chunks_by_doc}
+		failed = {}
+		
+		for index_batch, batch in zip(index_batches, batches):
+			
+			for position, j in enumerate(index_batch):
+				
+				if isinstance(batch, BaseException):
+					failed.setdefault(owners[j], batch)
+				
+				else:
+					embeddings_by_doc[owners[j]].append(batch[position])
+		
+		for i, error in failed.items():
+			
+			self._fail(results[i], error)
+			del embeddings_by_doc[i]
+		
+		return embeddings_by_doc
+	
+	
+	async def _embed_batches(self, batches: list[list[str]], hoa_code: str | None = None) -> list:
+		
+		"""
+		
+		Send embedding requests for several batches with bounded concurrency.
+		
+		:param batches: Batches of texts.
+		:type batches: list[list[str]]
+		:param hoa_code: HOA code the texts belong to, for the rate limiter.
+		:type hoa_code: str or None
+		
+		:return: Embeddings of each batch, or the exception it raised.
+		:rtype: list
+		
+		"""
+		
+		semaphore = asyncio.Semaphore(self.embedding_concurrency)
+		
+		async def embed(batch):
+			
+			async with semaphore:
+				
+				return await self.embedder.get_embeddings(batch, priority = "background", hoa_code = hoa_code)
+		
+		return await asyncio.gather(*(embed(batch) for batch in batches), return_exceptions = True)
+	
+	
+	def _split(self, items: list) -> list[list]:
+		
+		"""
+		
+		Split a list into batches of at most embedding_batch_size.
+		
+		:param items: Items to split.
+		:type items: list
+		
+		:return: List of batches.
+		:rtype: list[list]
+		
+		"""
+		
+		return [items[i:i + self.embedding_batch_size] for i in range(0, len(items), self.embedding_batch_size)]
+	
+	
+	def _get_parse_pool(self) -> ProcessPoolExecutor:
+		
+		"""
+		
+		Get the process pool used to parse batches, starting it if needed.
+		
+		:return: The process pool.
+		:rtype: ProcessPoolExecutor
+		
+		"""
+		
+		if self._parse_pool is None:
+			
+			# Spawn rather than fork: the server process runs threads and an event loop
+			self._parse_pool = ProcessPoolExecutor(
+					max_workers = self.parse_workers,
+					mp_context = multiprocessing.get_context("spawn"),
+					)
+		
+		return self._parse_pool
+	
+	
+	@staticmethod
+	def _fail(result: dict, error: BaseException):
+		
+		"""
+		
+		Mark a document of a batch as failed.
+		
+		:param result: Status dict of the document.
+		:type result: dict
+		:param error: The exception that made it fail.
+		:type error: BaseException
+		
+		"""
+		
+		logging.error(f"Failed to ingest {result['filename']}: {error}")
+		
+		result["status"] = "error"
+		result["error"] = str(error)
@@ -0,0 +1,773 @@
+"""
+
+Renders single pages of stored documents to images, for citation previews.
+
+A page (or the part of it around a snippet of text, with the snippet highlighted) is rendered with
+PyMuPDF in worker processes and kept in a size-bounded on-disk LRU cache. Renders are keyed by the
+content hash of the document, so they are shared by every community linking to the same content
+and stay valid until the content changes. Files stored before uploads were content-addressed live
+at a path every new version overwrites, so they are copied into the cache, and only once their
+hash matches the document's.
+
+"""
+
+import asyncio
+import hashlib
+import importlib.util
+import logging
+import multiprocessing
+import os
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+
+from starlette.concurrency import run_in_threadpool
+
+
+# Folder of the cache of rendered pages (and of the PDFs they are rendered from, unless stored
+# locally under their content hash)
+RENDER_CACHE_DIR = os.getenv("RENDER_CACHE_DIR", os.path.join(tempfile.gettempdir(), "neighbr-pages"))
+
+# Size the cache is kept under, least recently used files first out
+RENDER_CACHE_MAX_BYTES = int(os.getenv("RENDER_CACHE_MAX_MB", "512")) * 1024 * 1024
+
+# Number of processes rendering pages (0 renders on a thread of the server process)
+RENDER_WORKERS = int(os.getenv("RENDER_WORKERS", str(min(2, os.cpu_count() or 1))))
+
+# Zoom factors allowed (1.0 renders at 72 dpi); zooms are rounded to a quarter to bound the cache keys
+MIN_ZOOM = 0.5
+MAX_ZOOM = 4.0
+
+# Points of the page kept around a highlighted snippet when cropping to it
+SNIPPET_MARGIN = 36
+
+# Image formats and their media types (WebP is encoded with Pillow)
+IMAGE_FORMATS = {"png": "image/png", "jpeg": "image/jpeg", "webp": "image/webp"}
+
+# Quality of lossy formats
+IMAGE_QUALITY = 80
+
+# Seconds clients may reuse a page image before revalidating it with its ETag (the document may get a new version)
+RENDER_MAX_AGE = int(os.getenv("RENDER_MAX_AGE", "3600"))
+
+# Version of the rendering, part of every cache key: bump it when the output of render_page changes
+RENDER_VERSION = 1
+
+
+class PageNotFoundError(LookupError):
+	
+	"""
+	
+	Raised when a document doesn't have the requested page.
+	
+	"""
+
+
+def render_page(
+		pdf_path: str,
+		page_number: int,
+		zoom: float,
+		image_format: str,
+		highlight: str | None = None,
+		crop: bool = False,
+		) -> bytes:
+	
+	"""
+	
+	Render one page of a PDF to an image. Runs in a worker process.
+	
+	:param pdf_path: Path of the PDF on disk
+	:type pdf_path: str
+	:param page_number: Page to render, starting at 1
+	:type page_number: int
+	:param zoom: Zoom factor (1.0 is 72 dpi)
+	:type zoom: float
+	:param image_format: "png", "jpeg" or "webp"
+	:type image_format: str
+	:param highlight: Text to highlight on the page, or None
+	:type highlight: str or None
+	:param crop: Whether to only render the area around the highlighted text
+	:type crop: bool
+	
+	:return: The encoded image
+	:rtype: bytes
+	
+	"""
+	
+	import fitz  # PyMuPDF
+	
+	# PyMuPDF's own FileNotFoundError isn't the built-in one
+	if not os.path.exists(pdf_path):
+		raise FileNotFoundError(f"{pdf_path} is missing.")
+	
+	with fitz.open(pdf_path, filetype = "pdf") as doc:
+		
+		if not 1 <= page_number <= doc.page_count:
+			raise PageNotFoundError(f"Page {page_number} is out of range (1-{doc.page_count}).")
+		
+		page = doc[page_number - 1]
+		clip = None
+		
+		if highlight:
+			
+			rects = find_snippet(page, highlight)
+			
+			# The annotation only lives in this in-memory copy; the stored file is never written
+			if rects:
+				
+				page.add_highlight_annot(rects)
+				
+				if crop:
+					
+					clip = rects[0]
+					
+					for rect in rects[1:]:
+						clip |= rect
+					
+					# Keep some context around the snippet, across the full width of the page
+					clip = fitz.Rect(
+							page.rect.x0,
+							clip.y0 - SNIPPET_MARGIN,
+							page.rect.x1,
+							clip.y1 + SNIPPET_MARGIN,
+							) & page.rect
+		
+		pixmap = page.get_pixmap(matrix = fitz.Matrix(zoom, zoom), clip = clip, annots = True)
+	
+	if image_format == "png":
+		return pixmap.tobytes("png")
+	
+	if image_format == "jpeg":
+		return pixmap.tobytes("jpeg", jpg_quality = IMAGE_QUALITY)
+	
+	import io
+	
+	from PIL import Image
+	
+	image = Image.frombytes("RGB", (pixmap.width, pixmap.height), pixmap.samples)
+	output = io.BytesIO()
+	image.save(output, format = "WEBP", quality = IMAGE_QUALITY)
+	
+	return output.getvalue()
+
+
+def file_sha256(path: str) -> str:
+	
+	"""
+	
+	Hash a file, a block at a time.
+	
+	:param path: Path of the file
+	:type path: str
+	
+	:return: Hex SHA-256 of the file
+	:rtype: str
+	
+	"""
+	
+	digest = hashlib.sha256()
+	
+	with open(path, "rb") as f:
+		
+		while block := f.read(1024 * 1024):
+			digest.update(block)
+	
+	return digest.hexdigest()
+
+
+def find_snippet(page, snippet: str) -> list:
+	
+	"""
+	
+	Find the areas of a page covered by a snippet of its text.
+	
+	Chunks are stored with their whitespace collapsed and non-ASCII characters removed, so a long
+	snippet may not match the page word for word; its first words are searched for instead.
+	
+	:param page: PyMuPDF page
+	:type page: fitz.Page
+	:param snippet: Text to look for
+	:type snippet: str
+	
+	:return: Rectangles of the matched text, empty if it wasn't found
+	:rtype: list[fitz.Rect]
+	
+	"""
+	
+	words = snippet.split()
+	
+	for length in (len(words), 12, 6):
+		
+		rects = page.search_for(" ".join(words[:length]))
+		
+		if rects:
+			return rects
+	
+	return []
+
+
+class DiskLRUCache:
+	
+	"""
+	
+	Files on disk, evicted least recently used first once they add up to more than a size.
+	
+	Recency survives restarts through the modification time of the files, which is bumped on every
+	hit. Pinned files are never evicted. Methods do file I/O, so call them on a thread.
+	
+	"""
+	
+	def __init__(self, directory: str, max_bytes: int):
+		
+		"""
+		
+		Initialize the DiskLRUCache class, indexing the files already in the directory.
+		
+		:param directory: Folder of the cached files
+		:type directory: str
+		:param max_bytes: Size the cache is kept under
+		:type max_bytes: int
+		
+		"""
+		
+		self.directory = directory
+		self.max_bytes = max_bytes
+		self.size = 0
+		
+		# Size of each cached file, least recently used first, and how many times each file is pinned
+		self._entries = OrderedDict()
+		self._pins = {}
+		self._lock = threading.Lock()
+		
+		os.makedirs(directory, exist_ok = True)
+		
+		files = []
+		
+		for entry in os.scandir(directory):
+			
+			# Left behind by writes interrupted by a restart
+			if entry.name.endswith(".part"):
+				os.remove(entry.path)
+			
+			elif entry.is_file():
+				files.append(entry)
+		
+		for entry in sorted(files, key = lambda entry: entry.stat().st_mtime):
+			
+			self._entries[entry.name] = entry.stat().st_size
+			self.size += entry.stat().st_size
+	
+	
+	def path(self, key: str) -> str:
+		
+		"""
+		
+		Get the path a key is cached at.
+		
+		"""
+		
+		return os.path.join(self.directory, key)
+	
+	
+	def get(self, key: str) -> str | None:
+		
+		"""
+		
+		Look a key up, marking it as recently used.
+		
+		:param key: Cache key (a file name)
+		:type key: str
+		
+		:return: Path of the cached file, or None on a miss
+		:rtype: str or None
+		
+		"""
+		
+		with self._lock:
+			
+			if key not in self._entries:
+				return None
+			
+			self._entries.move_to_end(key)
+		
+		try:
+			
+			os.utime(self.path(key))
+		
+		except FileNotFoundError:
+			
+			# Removed behind our back
+			with self._lock:
+				self.size -= self._entries.pop(key, 0)
+			
+			return None
+		
+		return self.path(key)
+	
+	
+	def read(self, key: str) -> bytes | None:
+		
+		"""
+		
+		Read a cached file.
+		
+		:param key: Cache key
+		:type key: str
+		
+		:return: Contents, or None on a miss
+		:rtype: bytes or None
+		
+		"""
+		
+		path = self.get(key)
+		
+		if path is None:
+			return None
+		
+		try:
+			
+			with open(path, "rb") as file:
+				return file.read()
+		
+		except FileNotFoundError:
+			
+			return None
+	
+	
+	def pin(self, key: str) -> str | None:
+		
+		"""
+		
+		Look a key up and keep its file from being evicted until unpin() is called.
+		
+		:param key: Cache key
+		:type key: str
+		
+		:return: Path of the cached file, or None on a miss (nothing is pinned then)
+		:rtype: str or None
+		
+		"""
+		
+		with self._lock:
+			
+			if key not in self._entries or not os.path.exists(self.path(key)):
+				return None
+			
+			self._entries.move_to_end(key)
+			self._pins[key] = self._pins.get(key, 0) + 1
+		
+		return self.path(key)
+	
+	
+	def unpin(self, key: str):
+		
+		"""
+		
+		Release a pin taken with pin().
+		
+		:param key: Cache key
+		:type key: str
+		
+		:return: None
+		:rtype: None
+		
+		"""
+		
+		with self._lock:
+			
+			if self._pins.get(key, 0) > 1:
+				self._pins[key] -= 1
+			
+			else:
+				self._pins.pop(key, None)
+	
+	
+	def put(self, key: str, data: bytes):
+		
+		"""
+		
+		Store data under a key.
+		
+		:param key: Cache key
+		:type key: str
+		:param data: Contents of the file
+		:type data: bytes
+		
+		:return: None
+		:rtype: None
+		
+		"""
+		
+		part = f"{self.path(key)}.{threading.get_ident()}.part"
+		
+		with open(part, "wb") as file:
+			file.write(data)
+		
+		self.add(key, part)
+	
+	
+	def add(self, key: str, source: str):
+		
+		"""
+		
+		Move a file into the cache under a key, then evict files until the cache fits its size.
+		
+		:param key: Cache key
+		:type key: str
+		:param source: Path of the file, on the same file system as the cache
+		:type source: str
+		
+		:return: None
+		:rtype: None
+		
+		"""
+		
+		size = os.path.getsize(source)
+		
+		# Atomic: readers see the old file or the new one, never a partial write
+		os.replace(source, self.path(key))
+		
+		with self._lock:
+			
+			self.size += size - self._entries.pop(key, 0)
+			self._entries[key] = size
+			
+			evicted = []
+			
+			# Least recently used first, sparing the new file and the pinned ones
+			for name in list(self._entries):
+				
+				if self.size <= self.max_bytes:
+					break
+				
+				if name == key or name in self._pins:
+					continue
+				
+				self.size -= self._entries.pop(name)
+				evicted.append(name)
+		
+		for name in evicted:
+			
+			try:
+				
+				os.remove(self.path(name))
+			
+			except FileNotFoundError:
+				
+				pass
+
+
+class PageRenderer:
+	
+	"""
+	
+	Renders pages of stored documents to images through the on-disk cache.
+	
+	"""
+	
+	def __init__(
+			self,
+			upload_service,
+			cache_dir: str = RENDER_CACHE_DIR,
+			cache_max_bytes: int = RENDER_CACHE_MAX_BYTES,
+			workers: int = RENDER_WORKERS,
+			coalescer = None,
+			metrics = None,
+			):
+		
+		"""
+		
+		Initialize the PageRenderer class.
+		
+		:param upload_service: The UploadService instance the documents were stored with
+		:type upload_service: UploadService
+		:param cache_dir: Folder of the cache
+		:type cache_dir: str
+		:param cache_max_bytes: Size the cache is kept under
+		:type cache_max_bytes: int
+		:param workers: Number of rendering processes (0 renders on a thread)
+		:type workers: int
+		:param coalescer: SingleFlight that merges concurrent requests for the same render (or PDF download), or None
+		:type coalescer: SingleFlight or None
+		:param metrics: Optional metrics registry
+		:type metrics: Metrics or None
+		
+		"""
+		
+		self.upload_service = upload_service
+		self.cache = DiskLRUCache(cache_dir, cache_max_bytes)
+		self.workers = workers
+		self.coalescer = coalescer
+		self.metrics = metrics
+		
+		# Created on first render
+		self._pool = None
+	
+	
+	def close(self):
+		
+		"""
+		
+		Shut down the rendering processes, if they were started.
+		
+		:return: None
+		:rtype: None
+		
+		"""
+		
+		if self._pool:
+			
+			self._pool.shutdown(cancel_futures = True)
+			self._pool = None
+	
+	
+	@staticmethod
+	def render_key(
+			content_hash: str,
+			page_number: int,
+			zoom: float,
+			image_format: str,
+			highlight: str | None = None,
+			crop: bool = False,
+			) -> str:
+		
+		"""
+		
+		Get the cache key (also used as ETag) of a render, checking its parameters.
+		
+		:param content_hash: Content hash of the document
+		:type content_hash: str
+		:param page_number: Page to render, starting at 1
+		:type page_number: int
+		:param zoom: Zoom factor, between MIN_ZOOM and MAX_ZOOM
+		:type zoom: float
+		:param image_format: One of IMAGE_FORMATS
+		:type image_format: str
+		:param highlight: Text to highlight, or None
+		:type highlight: str or None
+		:param crop: Whether to only render the area around the highlighted text
+		:type crop: bool
+		
+		:return: Hex digest naming the render
+		:rtype: str
+		
+		"""
+		
+		if image_format not in IMAGE_FORMATS:
+			raise ValueError(f"Unsupported image format {image_format!r} (use {', '.join(IMAGE_FORMATS)}).")
+		
+		if image_format == "webp" and not importlib.util.find_spec("PIL"):
+			raise ValueError("WebP images need Pillow; use png or jpeg.")
+		
+		if not MIN_ZOOM <= zoom <= MAX_ZOOM:
+			raise ValueError(f"Zoom must be between {MIN_ZOOM} and {MAX_ZOOM}.")
+		
+		# Normalized the way the renderer sees them, so equivalent requests share an entry
+		zoom = round(zoom * 4) / 4
+		highlight = " ".join(highlight.split()) if highlight else ""
+		crop = crop and bool(highlight)
+		
+		parts = f"{RENDER_VERSION}:{content_hash}:{page_number}:{zoom}:{image_format}:{int(crop)}:{highlight}"
+		
+		return hashlib.sha256(parts.encode("utf-8")).hexdigest()
+	
+	
+	async def render(
+			self,
+			document: dict,
+			page_number: int,
+			zoom: float = 1.5,
+			image_format: str = "png",
+			highlight: str | None = None,
+			crop: bool = False,
+			) -> dict:
+		
+		"""
+		
+		Get an image of a page of a document, rendering it if it isn't cached.
+		
+		:param document: Catalog entry of the document (see Database.get_document)
+		:type document: dict
+		:param page_number: Page to render, starting at 1
+		:type page_number: int
+		:param zoom: Zoom factor, between MIN_ZOOM and MAX_ZOOM
+		:type zoom: float
+		:param image_format: One of IMAGE_FORMATS
+		:type image_format: str
+		:param highlight: Text to highlight, or None
+		:type highlight: str or None
+		:param crop: Whether to only render the area around the highlighted text
+		:type crop: bool
+		
+		:return: Dict with content (bytes), media_type, etag and cached (whether it was a cache hit)
+		:rtype: dict
+		
+		"""
+		
+		key = self.render_key(document["content_hash"], page_number, zoom, image_format, highlight, crop)
+		
+		# Checked before touching the PDF, as far as the catalog knows the page count
+		if document.get("page_count") and not 1 <= page_number <= document["page_count"]:
+			raise PageNotFoundError(f"Page {page_number} is out of range (1-{document['page_count']}).")
+		
+		content = await run_in_threadpool(self.cache.read, key)
+		cached = content is not None
+		
+		if not cached:
+			
+			content = await self._coalesce(
+					key,
+					lambda: self._render(key, document, page_number, round(zoom * 4) / 4, image_format, highlight, crop),
+					)
+		
+		if self.metrics:
+			self.metrics.increment("page_render_cache_total", result = "hit" if cached else "miss")
+		
+		return {"content": content, "media_type": IMAGE_FORMATS[image_format], "etag": key, "cached": cached}
+	
+	
+	async def _render(
+			self,
+			key: str,
+			document: dict,
+			page_number: int,
+			zoom: float,
+			image_format: str,
+			highlight: str | None,
+			crop: bool,
+			) -> bytes:
+		
+		pdf_path, pinned = await self._source_path(document)
+		
+		started = time.perf_counter()
+		
+		try:
+			
+			if self.workers:
+				
+				loop = asyncio.get_running_loop()
+				
+				content = await loop.run_in_executor(
+						self._get_pool(), render_page, pdf_path, page_number, zoom, image_format, highlight, crop
+						)
+			
+			else:
+				
+				content = await run_in_threadpool(render_page, pdf_path, page_number, zoom, image_format, highlight, crop)
+		
+		finally:
+			
+			# The downloaded PDF can be evicted again once the page is rendered
+			if pinned:
+				self.cache.unpin(pinned)
+		
+		if self.metrics:
+			self.metrics.observe("page_render_seconds", time.perf_counter() - started, format = image_format)
+		
+		await run_in_threadpool(self.cache.put, key, content)
+		
+		return content
+	
+	
+	async def _source_path(self, document: dict) -> tuple[str, str | None]:
+		
+		"""
+		
+		Get a local path of a document's PDF, copying it into the cache when stored on S3 or at a
+		path newer versions overwrite. A copied PDF is pinned in the cache: unpin it once the render
+		is done.
+		
+		:return: Path of the PDF, and the cache key it is pinned under (None for files used in place)
+		:rtype: tuple[str, str or None]
+		
+		"""
+		
+		storage_path = document.get("storage_path") or self.upload_service.build_file_path(
+				document["hoa_code"], document["document_type"]
+				)
+		
+		content_path = self.upload_service.build_content_path(document["hoa_code"], document["content_hash"])
+		
+		# A local file stored under its content hash can only hold this version
+		if not self.upload_service.use_s3 and storage_path == content_path:
+			
+			path = os.path.join(self.upload_service.upload_dir, storage_path)
+			
+			if not os.path.exists(path):
+				raise FileNotFoundError(f"The file of document {document['id']} is missing.")
+			
+			return path, None
+		
+		# Cached like the renders, so the rendering of other pages doesn't download it again
+		key = f"{document['content_hash']}.pdf"
+		
+		while True:
+			
+			path = await run_in_threadpool(self.cache.pin, key)
+			
+			if path is not None:
+				return path, key
+			
+			# Missing, or evicted by another render before it could be pinned: download it (again)
+			await self._coalesce(key, lambda: self._download(key, storage_path, document["content_hash"]))
+	
+	
+	async def _download(self, key: str, storage_path: str, content_hash: str) -> str:
+		
+		part = f"{self.cache.path(key)}.part"
+		
+		logging.info(f"Downloading {storage_path} to render its pages.")
+		
+		try:
+			
+			await self.upload_service.download_file(storage_path, part)
+		
+		except Exception as e:
+			
+			if os.path.exists(part):
+				os.remove(part)
+			
+			# S3 reports a missing object as a client error
+			if getattr(e, "response", {}).get("Error", {}).get("Code") in ("404", "NoSuchKey"):
+				raise FileNotFoundError(f"{storage_path} is missing from storage.") from e
+			
+			raise
+		
+		# The path may hold a newer version, whose pages must not be cached under this one's hash
+		if await run_in_threadpool(file_sha256, part) != content_hash:
+			
+			os.remove(part)
+			raise FileNotFoundError(f"{storage_path} holds another version of the document.")
+		
+		await run_in_threadpool(self.cache.add, key, part)
+		
+		return self.cache.path(key)
+	
+	
+	async def _coalesce(self, key: str, fn):
+		
+		if self.coalescer is None:
+			return await fn()
+		
+		return await self.coalescer.do(key, fn)
+	
+	
+	def _get_pool(self) -> ProcessPoolExecutor:
+		
+		"""
+		
+		Get the process pool pages are rendered in, starting it if needed.
+		
+		"""
+		
+		if self._pool is None:
+			
+			# Spawn rather than fork: the server process runs threads and an event loop
+			self._pool = ProcessPoolExecutor(
+					max_workers = self.workers,
+					mp_context = multiprocessing.get_context("spawn"),
+					)
+		
+		return self._pool
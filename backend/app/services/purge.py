@@ -0,0 +1,417 @@
+"""
+
+Purge of deleted communities: their private chunks, the shared content only they linked to, and
+their stored files.
+
+Deleting a community only removes its row (and by cascade its users, catalog entries and
+conversations) right away. Everything else is removed by a background job in small batches, each
+its own transaction, with a pause in between, so a large community never holds locks for long or
+writes all of its WAL at once. The orphan sweeper finishes purges that were interrupted and cleans
+up after communities deleted before purging existed.
+
+Usage (from backend/app):
+	
+	python -m services.purge community HOA-520-293-884
+	python -m services.purge orphans
+
+"""
+
+import asyncio
+import logging
+import os
+import re
+import time
+import uuid
+
+
+# Most private chunks deleted per transaction
+PURGE_BATCH_SIZE = int(os.getenv("PURGE_BATCH_SIZE", "1000"))
+
+# Seconds to wait between two batches, to leave room for the regular workload (and replication)
+PURGE_BATCH_PAUSE = float(os.getenv("PURGE_BATCH_PAUSE", "0.1"))
+
+# Finished jobs kept for progress requests
+PURGE_JOB_HISTORY = int(os.getenv("PURGE_JOB_HISTORY", "100"))
+
+# Storage folders of communities, named after the codes made by Database.generate_hoa_code
+HOA_FOLDER_PATTERN = re.compile(r"^HOA-\d{3}-\d{3}-\d{3}$")
+
+
+class CommunityPurger:
+	
+	"""
+	
+	Runs purge jobs in the background and keeps their progress.
+	
+	Progress of a job is a dict with id, kind ("community" or "orphans"), hoa_code, status
+	("running", "done", "failed" or "cancelled"), stage, chunks_deleted, contents_deleted,
+	files_deleted, started_at, finished_at and error.
+	
+	"""
+	
+	def __init__(
+			self,
+			db,
+			upload_service,
+			batch_size: int = PURGE_BATCH_SIZE,
+			pause: float = PURGE_BATCH_PAUSE,
+			metrics = None,
+			):
+		
+		"""
+		
+		Initialize the CommunityPurger class.
+		
+		:param db: The Database instance
+		:type db: Database
+		:param upload_service: The UploadService instance the files were stored with
+		:type upload_service: UploadService
+		:param batch_size: Most private chunks deleted per transaction
+		:type batch_size: int
+		:param pause: Seconds to wait between two batches
+		:type pause: float
+		:param metrics: Optional metrics registry
+		:type metrics: Metrics or None
+		
+		"""
+		
+		self.db = db
+		self.upload_service = upload_service
+		self.batch_size = batch_size
+		self.pause = pause
+		self.metrics = metrics
+		
+		# Progress of the running and recently finished jobs, by id
+		self._jobs = {}
+		self._tasks = {}
+	
+	
+	async def start(self, hoa_code: str) -> dict:
+		
+		"""
+		
+		Delete a community now and purge what it leaves behind in the background.
+		
+		:param hoa_code: HOA code of the community
+		:type hoa_code: str
+		
+		:return: Progress of the purge job
+		:rtype: dict
+		
+		"""
+		
+		content_hashes = await self.db.delete_community_by_code(hoa_code)
+		
+		return self._schedule("community", hoa_code, lambda job: self.purge_leftovers(hoa_code, content_hashes, job))
+	
+	
+	def start_sweep(self) -> dict:
+		
+		"""
+		
+		Sweep up the leftovers of every deleted community in the background.
+		
+		:return: Progress of the sweep job
+		:rtype: dict
+		
+		"""
+		
+		return self._schedule("orphans", None, self.sweep_orphans)
+	
+	
+	def get_job(self, job_id: str) -> dict | None:
+		
+		"""
+		
+		Get the progress of a job.
+		
+		:param job_id: ID of the job
+		:type job_id: str
+		
+		:return: Progress, or None if the job is unknown
+		:rtype: dict or None
+		
+		"""
+		
+		return self._jobs.get(job_id)
+	
+	
+	async def close(self):
+		
+		"""
+		
+		Cancel the running jobs; the orphan sweeper finishes them later.
+		
+		:return: None
+		:rtype: None
+		
+		"""
+		
+		tasks = list(self._tasks.values())
+		
+		for task in tasks:
+			task.cancel()
+		
+		await asyncio.gather(*tasks, return_exceptions = True)
+	
+	
+	async def purge_community(self, hoa_code: str) -> dict:
+		
+		"""
+		
+		Delete a community and purge what it leaves behind, waiting for the end.
+		
+		:param hoa_code: HOA code of the community
+		:type hoa_code: str
+		
+		:return: Progress of the finished job
+		:rtype: dict
+		
+		"""
+		
+		content_hashes = await self.db.delete_community_by_code(hoa_code)
+		job = self._new_job("community", hoa_code)
+		
+		await self._run(job, lambda job: self.purge_leftovers(hoa_code, content_hashes, job))
+		
+		return job
+	
+	
+	async def sweep(self) -> dict:
+		
+		"""
+		
+		Sweep up the leftovers of every deleted community, waiting for the end.
+		
+		:return: Progress of the finished job
+		:rtype: dict
+		
+		"""
+		
+		job = self._new_job("orphans", None)
+		
+		await self._run(job, self.sweep_orphans)
+		
+		return job
+	
+	
+	async def purge_leftovers(self, hoa_code: str, content_hashes: list[str], job: dict):
+		
+		"""
+		
+		Purge the private chunks, unlinked content and files of a deleted community.
+		
+		:param hoa_code: HOA code of the deleted community
+		:type hoa_code: str
+		:param content_hashes: Content the community's documents pointed at
+		:type content_hashes: list[str]
+		:param job: Progress of the job, updated as batches complete
+		:type job: dict
+		
+		:return: None
+		:rtype: None
+		
+		"""
+		
+		await self._purge_chunks(hoa_code, job)
+		
+		# Content shared with other communities stays
+		job["stage"] = "contents"
+		
+		for content_hash in content_hashes:
+			await self._purge_content(content_hash, job)
+		
+		job["stage"] = "files"
+		job["files_deleted"] += await self.upload_service.delete_folder(f"{hoa_code}/")
+	
+	
+	async def sweep_orphans(self, job: dict):
+		
+		"""
+		
+		Purge the private chunks of HOA codes without a community, content no community links to,
+		and the storage folders of deleted communities.
+		
+		:param job: Progress of the job, updated as batches complete
+		:type job: dict
+		
+		:return: None
+		:rtype: None
+		
+		"""
+		
+		job["stage"] = "scan"
+		job["hoa_codes"] = await self.db.get_orphaned_hoa_codes()
+		
+		for hoa_code in job["hoa_codes"]:
+			await self._purge_chunks(hoa_code, job)
+		
+		job["stage"] = "contents"
+		
+		for content_hash in await self.db.get_unlinked_content_hashes():
+			await self._purge_content(content_hash, job)
+		
+		job["stage"] = "files"
+		
+		communities = await self.db.get_community_codes()
+		
+		for folder in await self.upload_service.list_folders():
+			
+			# Only touch folders named like a community, in case the storage is shared with anything else
+			if HOA_FOLDER_PATTERN.match(folder) and folder not in communities:
+				job["files_deleted"] += await self.upload_service.delete_folder(f"{folder}/")
+	
+	
+	async def _purge_chunks(self, hoa_code: str, job: dict):
+		
+		job["stage"] = "chunks"
+		
+		while True:
+			
+			deleted = await self.db.delete_community_chunks(hoa_code, self.batch_size)
+			job["chunks_deleted"] += deleted
+			
+			if self.metrics:
+				self.metrics.increment("purge_chunks_deleted_total", deleted)
+			
+			if deleted < self.batch_size:
+				break
+			
+			await asyncio.sleep(self.pause)
+	
+	
+	async def _purge_content(self, content_hash: str, job: dict):
+		
+		# One document's chunks per transaction
+		deleted = await self.db.drop_unlinked_content(content_hash)
+		
+		if deleted:
+			
+			job["contents_deleted"] += 1
+			job["chunks_deleted"] += deleted
+			
+			if self.metrics:
+				self.metrics.increment("purge_chunks_deleted_total", deleted)
+			
+			await asyncio.sleep(self.pause)
+	
+	
+	def _new_job(self, kind: str, hoa_code: str | None) -> dict:
+		
+		job = {
+			"id": str(uuid.uuid4()),
+			"kind": kind,
+			"hoa_code": hoa_code,
+			"status": "running",
+			"stage": "chunks",
+			"chunks_deleted": 0,
+			"contents_deleted": 0,
+			"files_deleted": 0,
+			"started_at": time.time(),
+			"finished_at": None,
+			"error": None,
+			}
+		
+		self._jobs[job["id"]] = job
+		
+		# Forget the oldest finished jobs
+		finished = [job_id for job_id, item in self._jobs.items() if item["status"] != "running"]
+		
+		for job_id in finished[:max(0, len(finished) - PURGE_JOB_HISTORY)]:
+			del self._jobs[job_id]
+		
+		return job
+	
+	
+	def _schedule(self, kind: str, hoa_code: str | None, work) -> dict:
+		
+		job = self._new_job(kind, hoa_code)
+		
+		task = asyncio.create_task(self._run(job, work))
+		self._tasks[job["id"]] = task
+		task.add_done_callback(lambda _: self._tasks.pop(job["id"], None))
+		
+		return job
+	
+	
+	async def _run(self, job: dict, work):
+		
+		try:
+			
+			await work(job)
+			
+			job["status"] = "done"
+		
+		except asyncio.CancelledError:
+			
+			job["status"] = "cancelled"
+			raise
+		
+		except Exception as e:
+			
+			logging.exception(f"Purge job {job['id']} ({job['kind']} {job['hoa_code'] or ''}) failed")
+			
+			job["status"] = "failed"
+			job["error"] = str(e)
+		
+		finally:
+			
+			job["finished_at"] = time.time()
+			
+			if job["status"] == "done":
+				logging.info(
+						f"Purge job {job['id']} deleted {job['chunks_deleted']} chunks, "
+						f"{job['contents_deleted']} documents and {job['files_deleted']} files."
+						)
+
+
+async def main(argv: list[str] | None = None):
+	
+	"""
+	
+	Command line entry point.
+	
+	"""
+	
+	import argparse
+	import json
+	
+	from services.container import USE_S3
+	from services.db import Database
+	from services.upload_service import UploadService
+	
+	parser = argparse.ArgumentParser(description = "Purge deleted communities.")
+	parser.add_argument("--batch-size", type = int, default = PURGE_BATCH_SIZE)
+	parser.add_argument("--pause", type = float, default = PURGE_BATCH_PAUSE)
+	subparsers = parser.add_subparsers(dest = "command", required = True)
+	community = subparsers.add_parser("community", help = "Delete a community and purge everything it owns")
+	community.add_argument("hoa_code")
+	subparsers.add_parser("orphans", help = "Purge the leftovers of deleted communities")
+	args = parser.parse_args(argv)
+	
+	logging.basicConfig(level = logging.INFO)
+	
+	db = Database()
+	await db.connect()
+	
+	try:
+		
+		purger = CommunityPurger(db, UploadService(use_s3 = USE_S3), batch_size = args.batch_size, pause = args.pause)
+		
+		if args.command == "community":
+			
+			job = await purger.purge_community(args.hoa_code)
+		
+		else:
+			
+			job = await purger.sweep()
+		
+		print(json.dumps(job, indent = 2))
+	
+	finally:
+		
+		await db.disconnect()
+
+
+if __name__ == "__main__":
+	asyncio.run(main())
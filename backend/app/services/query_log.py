@@ -0,0 +1,218 @@
+"""
+
+Query log: a record of every answered question, written to Postgres in the background.
+
+Answering a question only puts its entry on a bounded in-memory queue. A background task takes
+entries off the queue and writes them in batches with COPY, so logging adds no database round
+trip to the request. When the queue is full (the database is slow or down), new entries are
+dropped and counted rather than held in memory or waited on.
+
+"""
+
+import asyncio
+import logging
+import os
+
+
+# Log answered questions
+QUERY_LOG = os.getenv("QUERY_LOG", "true").lower() == "true"
+
+# Entries waiting to be written; more are dropped
+QUERY_LOG_QUEUE_SIZE = int(os.getenv("QUERY_LOG_QUEUE_SIZE", "10000"))
+
+# Most entries written per COPY
+QUERY_LOG_BATCH_SIZE = int(os.getenv("QUERY_LOG_BATCH_SIZE", "500"))
+
+# Seconds an entry may wait for its batch to fill up
+QUERY_LOG_FLUSH_INTERVAL = float(os.getenv("QUERY_LOG_FLUSH_INTERVAL", "1.0"))
+
+
+class QueryLog:
+	
+	"""
+	
+	Bounded queue of query log entries and the task writing them to the database.
+	
+	An entry is a dict with the columns of the query_log table (see Database.write_query_log).
+	
+	"""
+	
+	def __init__(
+			self,
+			db,
+			queue_size: int = QUERY_LOG_QUEUE_SIZE,
+			batch_size: int = QUERY_LOG_BATCH_SIZE,
+			flush_interval: float = QUERY_LOG_FLUSH_INTERVAL,
+			metrics = None,
+			):
+		
+		"""
+		
+		Initialize the QueryLog class.
+		
+		:param db: The Database instance to write to
+		:type db: Database
+		:param queue_size: Entries waiting to be written, above which new ones are dropped
+		:type queue_size: int
+		:param batch_size: Most entries written per COPY
+		:type batch_size: int
+		:param flush_interval: Seconds an entry may wait for its batch to fill up
+		:type flush_interval: float
+		:param metrics: Optional metrics registry
+		:type metrics: Metrics or None
+		
+		"""
+		
+		self.db = db
+		self.batch_size = batch_size
+		self.flush_interval = flush_interval
+		self.metrics = metrics
+		
+		self._queue = asyncio.Queue(maxsize = queue_size)
+		self._task = None
+		self._writing = None
+		
+		# Totals since startup, also exported as counters
+		self.recorded = 0
+		self.dropped = 0
+		self.written = 0
+		self.failed = 0
+	
+	
+	def start(self):
+		
+		"""
+		
+		Start the writer task.
+		
+		:return: None
+		:rtype: None
+		
+		"""
+		
+		if self.metrics:
+			self.metrics.register_gauge("query_log_queue_depth", self._queue.qsize)
+		
+		self._task = asyncio.create_task(self._run())
+	
+	
+	def record(self, entry: dict):
+		
+		"""
+		
+		Queue an entry to be written. Never waits: the entry is dropped if the queue is full.
+		
+		:param entry: Columns of the query_log row
+		:type entry: dict
+		
+		:return: None
+		:rtype: None
+		
+		"""
+		
+		try:
+			
+			self._queue.put_nowait(entry)
+			
+			self.recorded += 1
+			self._count("recorded")
+		
+		except asyncio.QueueFull:
+			
+			self.dropped += 1
+			self._count("dropped")
+	
+	
+	async def flush(self):
+		
+		"""
+		
+		Write every queued entry now.
+		
+		:return: None
+		:rtype: None
+		
+		"""
+		
+		while not self._queue.empty():
+			await self._write(self._take(self.batch_size))
+	
+	
+	async def close(self):
+		
+		"""
+		
+		Stop the writer task and write what is left in the queue.
+		
+		:return: None
+		:rtype: None
+		
+		"""
+		
+		if self._task:
+			
+			self._task.cancel()
+			await asyncio.gather(self._task, return_exceptions = True)
+			self._task = None
+		
+		# A batch being written when the task was cancelled still goes in
+		if self._writing:
+			await self._writing
+		
+		await self.flush()
+	
+	
+	async def _run(self):
+		
+		while True:
+			
+			# Wait for a first entry, then give the batch a moment to fill up
+			batch = [await self._queue.get()]
+			
+			try:
+				
+				if self._queue.qsize() < self.batch_size - 1:
+					await asyncio.sleep(self.flush_interval)
+			
+			finally:
+				
+				# Entries taken off the queue are written even when the task is cancelled meanwhile
+				batch.extend(self._take(self.batch_size - 1))
+				
+				self._writing = asyncio.ensure_future(self._write(batch))
+				await asyncio.shield(self._writing)
+				self._writing = None
+	
+	
+	def _take(self, limit: int) -> list[dict]:
+		
+		batch = []
+		
+		while len(batch) < limit and not self._queue.empty():
+			batch.append(self._queue.get_nowait())
+		
+		return batch
+	
+	
+	async def _write(self, batch: list[dict]):
+		
+		try:
+			
+			await self.db.write_query_log(batch)
+			
+			self.written += len(batch)
+			self._count("written", len(batch))
+		
+		# The log is best effort: a failed batch is counted and dropped, not retried
+		except Exception as e:
+			
+			logging.error(f"Failed to write {len(batch)} query log entries: {e}")
+			
+			self.failed += len(batch)
+			self._count("failed", len(batch))
+	
+	
+	def _count(self, outcome: str, amount: int = 1):
+		
+		if self.metrics:
+			self.metrics.increment("query_log_entries_total", amount, outcome = outcome)
@@ -1,8 +1,21 @@
+import asyncio
 import logging
+import time
+from datetime import datetime, timezone
 from openai import AsyncOpenAI
 import os
 
 
+# Maximum number of LLM completions in flight for one batch of questions
+ANSWER_CONCURRENCY = int(os.getenv("ANSWER_CONCURRENCY", "8"))
+
+# Tokens reserved for each generated answer when rate limiting completions
+ANSWER_TOKEN_ESTIMATE = int(os.getenv("ANSWER_TOKEN_ESTIMATE", "500"))
+
+# Returned in place of an answer when a question fails
+ERROR_ANSWER = "Sorry, something went wrong while processing your query."
+
+
 class RAG:
 	
 	"""
@@ -11,7 +24,17 @@ class RAG:
 	
 	"""
 	
-	def __init__(self, db, embedder, model: str = "gpt-4.1-mini"):
+	def __init__(
+			self,
+			db,
+			embedder,
+			model: str = "gpt-4.1-mini",
+			coalescer = None,
+			limiter = None,
+			policy = None,
+			query_log = None,
+			accounting = None,
+			):
 		
 		"""
 	
@@ -23,12 +46,27 @@ class RAG:
 		:type embedder: EmbeddingService
 		:param model: The OpenAI model to use for generating the answer.
 		:type model: str
+		:param coalescer: SingleFlight that merges identical concurrent queries of a community, or None.
+		:type coalescer: SingleFlight or None
+		:param limiter: The RateLimiter shared by all OpenAI calls, or None to not rate limit.
+		:type limiter: RateLimiter or None
+		:param policy: StagePolicy giving each query a deadline (and hedging slow calls), or None for no timeouts.
+		:type policy: StagePolicy or None
+		:param query_log: QueryLog recording every answered question, or None to not log them.
+		:type query_log: QueryLog or None
+		:param accounting: ResourceAccountant charging the tokens to the request or job, or None.
+		:type accounting: ResourceAccountant or None
 		
 		"""
 		
 		self.db = db
 		self.embedder = embedder
 		self.model = model
+		self.coalescer = coalescer
+		self.limiter = limiter
+		self.policy = policy
+		self.query_log = query_log
+		self.accounting = accounting
 		self.openai_client = AsyncOpenAI(api_key = os.getenv("OPENAI_API_KEY"))
 		
 		# Check if the OpenAI API key is set
@@ -76,7 +114,14 @@ class RAG:
 		return prompt
 	
 	
-	async def generate_answer(self, prompt: str) -> str:
+	async def generate_answer(
+			self,
+			prompt: str,
+			priority: str = "interactive",
+			hoa_code: str | None = None,
+			history: list[dict] | None = None,
+			trace: dict | None = None,
+			) -> str:
 		
 		"""
 		
@@ -84,6 +129,14 @@ class RAG:
 
 		:param prompt: The prompt string that provides context and the user's question.
 		:type prompt: str
+		:param priority: Rate limiter lane, "interactive" or "background" (e.g. summaries).
+		:type priority: str
+		:param hoa_code: Community the answer is for, used to share the rate limit fairly.
+		:type hoa_code: str or None
+		:param history: Previous questions and answers of the conversation, oldest first.
+		:type history: list[dict] or None
+		:param trace: Dict of the query's statistics, which gets prompt_tokens and completion_tokens, or None.
+		:type trace: dict or None
 		
 		:return: The answer generated by OpenAI.
 		:rtype: str
@@ -92,16 +145,47 @@ class RAG:
 		
 		try:
 			
+			# Earlier turns of the conversation come before the new question
+			messages = [{"role": "system", "content": "You are a helpful assistant."}]
+			
+			for turn in history or []:
+				
+				messages.append({"role": "user", "content": turn["question"]})
+				messages.append({"role": "assistant", "content": turn["answer"]})
+			
+			messages.append({"role": "user", "content": prompt})
+			
+			if self.limiter:
+				
+				estimated = sum(self.limiter.estimate_tokens(message["content"]) for message in messages)
+				estimated += ANSWER_TOKEN_ESTIMATE
+				
+				await self.limiter.acquire(estimated, priority = priority, hoa_code = hoa_code)
+			
 			# Generate the answer using OpenAI's chat completion API
 			response = await self.openai_client.chat.completions.create(
 					model = self.model,
-					messages = [
-						{"role": "system", "content": "You are a helpful assistant."},
-						{"role": "user", "content": prompt},
-						],
+					messages = messages,
 					temperature = 0.3
 					)
 			
+			if self.limiter:
+				self.limiter.record_usage(estimated, response.usage.total_tokens if response.usage else None)
+			
+			if trace is not None and response.usage:
+				
+				trace["prompt_tokens"] = response.usage.prompt_tokens
+				trace["completion_tokens"] = response.usage.completion_tokens
+			
+			# Charge the tokens to the community and the request or job they were used for
+			if self.accounting and response.usage:
+				
+				self.accounting.attribute(hoa_code)
+				self.accounting.add(
+						prompt_tokens = response.usage.prompt_tokens,
+						completion_tokens = response.usage.completion_tokens,
+						)
+			
 			# Return the generated answer
 			return response.choices[0].message.content.strip()
 		
@@ -115,6 +199,113 @@ class RAG:
 			raise RuntimeError(f"LLM generation failed: {str(e)}")
 	
 	
+	@staticmethod
+	def normalize_query(query: str) -> str:
+		
+		"""
+		
+		Normalize a query so trivially different spellings of the same question are coalesced.
+		
+		:param query: The user's question
+		:type query: str
+		
+		:return: Lowercased query with whitespace collapsed and trailing punctuation removed
+		:rtype: str
+		
+		"""
+		
+		return " ".join(query.lower().split()).rstrip("?!. ")
+	
+	
+	async def _stage(self, stage: str, fn, deadline, trace: dict | None = None):
+		
+		"""
+		
+		Run one stage of a query, under the policy if there is one.
+		
+		:param stage: Name of the stage ("embedding", "retrieval" or "completion")
+		:type stage: str
+		:param fn: Function returning the awaitable of the stage
+		:type fn: Callable[[], Awaitable]
+		:param deadline: Deadline of the query, or None without a policy
+		:type deadline: Deadline or None
+		:param trace: Dict of the query's statistics, which gets the duration of the stage, or None
+		:type trace: dict or None
+		
+		:return: Result of the stage
+		:rtype: Any
+		
+		"""
+		
+		started = time.perf_counter()
+		
+		try:
+			
+			if self.policy is None:
+				return await fn()
+			
+			return await self.policy.run(stage, fn, deadline)
+		
+		finally:
+			
+			if trace is not None:
+				trace[f"{stage}_ms"] = (time.perf_counter() - started) * 1000
+	
+	
+	async def _answer_query(self, query: str, hoa_code: str, trace: dict) -> str:
+		
+		"""
+		
+		Embed the query, retrieve its context and generate the answer.
+		
+		:param query: The user's question
+		:type query: str
+		:param hoa_code: The HOA code to filter documents by
+		:type hoa_code: str
+		:param trace: Dict the stage durations, chunk IDs and token counts of the query are added to
+		:type trace: dict
+		
+		:return: The answer to the query, including sources
+		:rtype: str
+		
+		"""
+		
+		# Every stage runs within what is left of the query's deadline
+		deadline = self.policy.start() if self.policy else None
+		
+		# Step 1: Generate embedding for the query
+		query_embedding = await self._stage(
+				"embedding",
+				lambda: self.embedder.get_query_embedding(query, hoa_code = hoa_code, trace = trace),
+				deadline,
+				trace,
+				)
+		
+		# Step 2: Fetch relevant chunks (with context) from the database
+		relevant_chunks = await self._stage(
+				"retrieval",
+				lambda: self.db.get_relevant_chunks_with_context(query_embedding, hoa_code),
+				deadline,
+				trace,
+				)
+		
+		trace["chunk_ids"] = [chunk["id"] for chunk in relevant_chunks if chunk.get("id") is not None]
+		
+		# Step 3: Build the prompt for the LLM
+		prompt = await self.build_prompt(relevant_chunks, query)
+		
+		# Step 4: Generate an answer from OpenAI
+		answer = await self._stage(
+				"completion",
+				lambda: self.generate_answer(prompt, hoa_code = hoa_code, trace = trace),
+				deadline,
+				trace,
+				)
+		
+		# Step 5: Return full response (answer + sources)
+		return f"{answer}"
+	
+	
 	async def answer_query(self, query: str, hoa_code: str) -> str:
 		
 		"""
@@ -132,22 +323,30 @@ class RAG:
 		
 		"""
 		
+		started = time.perf_counter()
+		trace = {}
+		
 		try:
 			
-			# Step 1: Generate embedding for the query
-			query_embedding = await self.embedder.get_query_embedding(query)
-			
-			# Step 2: Fetch relevant chunks (with context) from the database
-			relevant_chunks = await self.db.get_relevant_chunks_with_context(query_embedding, hoa_code)
+			if self.coalescer is None:
+				
+				answer = await self._answer_query(query, hoa_code, trace)
 			
-			# Step 3: Build the prompt for the LLM
-			prompt = await self.build_prompt(relevant_chunks, query)
+			else:
+				
+				async def answer_and_trace():
+					return await self._answer_query(query, hoa_code, trace), trace
+				
+				# Residents asking the same question at the same time share one embedding, search and completion
+				answer, shared = await self.coalescer.do((hoa_code, self.normalize_query(query)), answer_and_trace)
+				
+				# Joined another resident's call: same chunks, but none of the time or tokens were spent here
+				if shared is not trace:
+					trace.update(chunk_ids = shared.get("chunk_ids", []), coalesced = True)
 			
-			# Step 4: Generate an answer from OpenAI
-			answer = await self.generate_answer(prompt)
+			self._log_query("query", hoa_code, query, started, trace)
 			
-			# Step 5: Return full response (answer + sources)
-			return f"{answer}"
+			return answer
 		
 		# Handle any exceptions that occur during the process
 		except Exception as e:
@@ -155,5 +354,242 @@ class RAG:
 			# Log the error
 			logging.error(f"Failed to answer query: {str(e)}")
 			
+			self._log_query("query", hoa_code, query, started, trace, status = "error")
+			
 			# Return a generic error message
-			return "Sorry, something went wrong while processing your query."
+			return ERROR_ANSWER
+	
+	
+	def _log_query(self, kind: str, hoa_code: str, query: str, started: float, trace: dict, status: str = "ok"):
+		
+		"""
+		
+		Queue the query log entry of an answered question, if questions are logged.
+		
+		:param kind: "query" or "conversation"
+		:type kind: str
+		:param hoa_code: The HOA code the question was asked in
+		:type hoa_code: str
+		:param query: The question
+		:type query: str
+		:param started: time.perf_counter() when the question came in
+		:type started: float
+		:param trace: Stage durations, chunk IDs, token counts and cache flags of the question
+		:type trace: dict
+		:param status: "ok", or "error" if it failed
+		:type status: str
+		
+		:return: None
+		:rtype: None
+		
+		"""
+		
+		if self.query_log is None:
+			return
+		
+		self.query_log.record(
+				{
+					**trace,
+					"asked_at": datetime.now(timezone.utc),
+					"hoa_code": hoa_code,
+					"kind": kind,
+					"query": query,
+					"normalized_query": self.normalize_query(query),
+					"status": status,
+					"total_ms": (time.perf_counter() - started) * 1000,
+					"chunk_ids": trace.get("chunk_ids", []),
+					"coalesced": trace.get("coalesced", False),
+					"context_reused": trace.get("context_reused", False),
+					}
+				)
+	
+	
+	async def _answer_turn(self, session, query: str, trace: dict) -> str:
+		
+		"""
+		
+		Answer a question of a conversation, reusing or extending the chunks of the previous turns.
+		
+		:param session: The conversation
+		:type session: Session
+		:param query: The resident's question
+		:type query: str
+		:param trace: Dict the stage durations, chunk IDs and token counts of the question are added to
+		:type trace: dict
+		
+		:return: The answer to the question
+		:rtype: str
+		
+		"""
+		
+		deadline = self.policy.start() if self.policy else None
+		hoa_code = session.hoa_code
+		
+		# Step 1: Embed the question together with the previous one
+		query_embedding = await self._stage(
+				"embedding",
+				lambda: self.embedder.get_query_embedding(session.search_text(query), hoa_code = hoa_code, trace = trace),
+				deadline,
+				trace,
+				)
+		
+		# Step 2: Stay on the chunks of the previous turns if the subject didn't change, or add fresh ones
+		if session.reuses(query_embedding):
+			
+			chunks = session.context()
+			trace["context_reused"] = True
+		
+		else:
+			
+			fresh = await self._stage(
+					"retrieval",
+					lambda: self.db.get_relevant_chunks_with_context(query_embedding, hoa_code),
+					deadline,
+					trace,
+					)
+			
+			chunks = session.context([dict(chunk) for chunk in fresh])
+		
+		# Step 3: Answer with the chunks and the recent turns of the conversation
+		trace["chunk_ids"] = [chunk["id"] for chunk in chunks if chunk.get("id") is not None]
+		
+		prompt = await self.build_prompt(chunks, query)
+		
+		answer = await self._stage(
+				"completion",
+				lambda: self.generate_answer(prompt, hoa_code = hoa_code, history = session.history(), trace = trace),
+				deadline,
+				trace,
+				)
+		
+		session.add_turn(query, answer, chunks, query_embedding)
+		
+		return answer
+	
+	
+	async def answer_turn(self, session, query: str) -> str:
+		
+		"""
+		
+		Answer the next question of a conversation session.
+		
+		:param session: The conversation, from the SessionStore
+		:type session: Session
+		:param query: The resident's question
+		:type query: str
+		
+		:return: The answer, including sources (a generic error message if it failed; the turn is then not recorded)
+		:rtype: str
+		
+		"""
+		
+		started = time.perf_counter()
+		trace = {}
+		
+		try:
+			
+			# Turns of one conversation build on each other, so they are answered in order
+			async with session.lock:
+				answer = await self._answer_turn(session, query, trace)
+			
+			self._log_query("conversation", session.hoa_code, query, started, trace)
+			
+			return answer
+		
+		except Exception as e:
+			
+			logging.error(f"Failed to answer conversation turn: {str(e)}")
+			
+			self._log_query("conversation", session.hoa_code, query, started, trace, status = "error")
+			
+			return ERROR_ANSWER
+	
+	
+	async def retrieve_contexts(self, queries: list[str], hoa_code: str) -> list[list[dict]]:
+		
+		"""
+		
+		Embed several questions in one API call and fetch the relevant chunks of all of them in one query.
+		
+		:param queries: The user's questions
+		:type queries: list[str]
+		:param hoa_code: The HOA code to filter documents by
+		:type hoa_code: str
+		
+		:return: For each question, its chunks with context
+		:rtype: list[list[dict]]
+		
+		"""
+		
+		# Step 1: Generate the embeddings of all questions at once
+		query_embeddings = await self.embedder.get_embeddings(
+				[query.replace("\n", " ").strip() for query in queries],
+				priority = "interactive",
+				hoa_code = hoa_code,
+				)
+		
+		# Step 2: Fetch the relevant chunks for every question in a single round trip
+		return await self.db.get_relevant_chunks_for_queries(query_embeddings, hoa_code)
+	
+	
+	async def stream_answers(
+			self,
+			queries: list[str],
+			contexts: list[list[dict]],
+			hoa_code: str | None = None,
+			concurrency: int = ANSWER_CONCURRENCY,
+			):
+		
+		"""
+		
+		Generate the answers of several questions, yielding each one as soon as it is ready.
+		
+		:param queries: The user's questions
+		:type queries: list[str]
+		:param contexts: The chunks of each question, from retrieve_contexts
+		:type contexts: list[list[dict]]
+		:param hoa_code: The HOA code the questions are asked in
+		:type hoa_code: str or None
+		:param concurrency: Maximum number of LLM completions in flight
+		:type concurrency: int
+		
+		:return: Async iterator of dicts with the index, question and answer (and error, if it failed)
+		:rtype: AsyncIterator[dict]
+		
+		"""
+		
+		semaphore = asyncio.Semaphore(concurrency)
+		
+		async def answer(index: int) -> dict:
+			
+			result = {"index": index, "question": queries[index]}
+			
+			try:
+				
+				prompt = await self.build_prompt(contexts[index], queries[index])
+				
+				async with semaphore:
+					result["answer"] = await self.generate_answer(prompt, hoa_code = hoa_code)
+			
+			# One failed completion should not take the whole batch down
+			except Exception as e:
+				
+				logging.error(f"Failed to answer query {index}: {str(e)}")
+				
+				result["answer"] = ERROR_ANSWER
+				result["error"] = str(e)
+			
+			return result
+		
+		tasks = [asyncio.create_task(answer(index)) for index in range(len(queries))]
+		
+		try:
+			
+			for next_done in asyncio.as_completed(tasks):
+				yield await next_done
+		
+		finally:
+			
+			# Stop generating if the client went away
+			for task in tasks:
+				task.cancel()
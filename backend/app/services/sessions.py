@@ -0,0 +1,446 @@
+"""
+
+Conversation sessions: the recent turns of a resident's conversation and the chunks retrieved for them.
+
+Sessions are kept in a bounded in-memory LRU. With SESSION_PERSIST, every turn is also written to
+Postgres, so a conversation survives a restart and can continue on another worker. Each write bumps
+the session's version: a worker checks it before using its in-memory copy, and a write based on an
+outdated copy is merged with the turns the other worker added instead of overwriting them.
+
+"""
+
+import asyncio
+import os
+import time
+import uuid
+from collections import OrderedDict
+
+import numpy as np
+
+
+# Sessions kept in memory, and how long an idle session lives (seconds)
+SESSION_MAX_SESSIONS = int(os.getenv("SESSION_MAX_SESSIONS", "1000"))
+SESSION_TTL = int(os.getenv("SESSION_TTL", "1800"))
+
+# Write sessions through to Postgres
+SESSION_PERSIST = os.getenv("SESSION_PERSIST", "false").lower() == "true"
+
+# Tokens of previous turns sent to the LLM with a follow-up
+SESSION_HISTORY_TOKENS = int(os.getenv("SESSION_HISTORY_TOKENS", "2000"))
+
+# Chunks carried over from turn to turn, and turns kept per session
+SESSION_MAX_CHUNKS = int(os.getenv("SESSION_MAX_CHUNKS", "12"))
+SESSION_MAX_TURNS = 20
+
+# A follow-up at least this similar to the previous question reuses its context without retrieval
+SESSION_REUSE_SIMILARITY = float(os.getenv("SESSION_REUSE_SIMILARITY", "0.9"))
+
+
+def estimate_tokens(text: str) -> int:
+	
+	"""
+	
+	Roughly estimate the number of tokens of a text (about 4 characters per token in English).
+	
+	:param text: Text to estimate
+	:type text: str
+	
+	:return: Estimated number of tokens
+	:rtype: int
+	
+	"""
+	
+	return len(text) // 4 + 1
+
+
+def chunk_key(chunk: dict) -> tuple:
+	
+	"""
+	
+	Get the key identifying a chunk within a community.
+	
+	:param chunk: Chunk with document_type, page_number and chunk_index
+	:type chunk: dict
+	
+	:return: Key of the chunk
+	:rtype: tuple
+	
+	"""
+	
+	return chunk["document_type"], chunk["page_number"], chunk["chunk_index"]
+
+
+class Session:
+	
+	"""
+	
+	One conversation of a resident with the documents of their community.
+	
+	"""
+	
+	def __init__(self, session_id: str, hoa_code: str, owner: str, turns: list[dict] | None = None, version: int = 0):
+		
+		"""
+		
+		Initialize the Session class.
+		
+		:param session_id: Unique ID of the session
+		:type session_id: str
+		:param hoa_code: Community the conversation is about
+		:type hoa_code: str
+		:param owner: Email of the resident who started it
+		:type owner: str
+		:param turns: Previous turns (question, answer and chunks), oldest first
+		:type turns: list[dict] or None
+		:param version: Version of the stored session the turns were read from
+		:type version: int
+		
+		"""
+		
+		self.id = session_id
+		self.hoa_code = hoa_code
+		self.owner = owner
+		self.turns = turns or []
+		self.version = version
+		self.updated = time.monotonic()
+		
+		# Turns added since the session was last read or written
+		self.pending = []
+		
+		# Turns of a session are answered one at a time
+		self.lock = asyncio.Lock()
+		
+		# Embedding of the last question (not persisted), to tell whether a follow-up changes subject
+		self.last_embedding = None
+	
+	
+	def search_text(self, query: str) -> str:
+		
+		"""
+		
+		Get the text to embed for a question: a follow-up is embedded with the previous question, so
+		"what about corner lots?" keeps its subject.
+		
+		:param query: The resident's question
+		:type query: str
+		
+		:return: Text to embed
+		:rtype: str
+		
+		"""
+		
+		if not self.turns:
+			return query
+		
+		return f"{self.turns[-1]['question']}\n{query}"
+	
+	
+	def reuses(self, query_embedding: list[float]) -> bool:
+		
+		"""
+		
+		Check whether a question is close enough to the previous one to answer it from the same chunks.
+		
+		:param query_embedding: Embedding of search_text(query)
+		:type query_embedding: list[float]
+		
+		:return: True if no new retrieval is needed
+		:rtype: bool
+		
+		"""
+		
+		if self.last_embedding is None or not self.turns:
+			return False
+		
+		query = np.asarray(query_embedding, dtype = np.float32)
+		similarity = float(query @ self.last_embedding) / float(np.linalg.norm(query) * np.linalg.norm(self.last_embedding))
+		
+		return similarity >= SESSION_REUSE_SIMILARITY
+	
+	
+	def context(self, fresh: list[dict] | None = None) -> list[dict]:
+		
+		"""
+		
+		Get the chunks to answer the next question with: the freshly retrieved ones first, then those
+		of the most recent turns, without duplicates and up to SESSION_MAX_CHUNKS.
+		
+		:param fresh: Chunks retrieved for the new question, or None when reusing
+		:type fresh: list[dict] or None
+		
+		:return: Chunks with document_type, page_number, chunk_index and content
+		:rtype: list[dict]
+		
+		"""
+		
+		chunks = {}
+		
+		for chunk in [*(fresh or []), *(chunk for turn in reversed(self.turns) for chunk in turn["chunks"])]:
+			
+			if len(chunks) >= SESSION_MAX_CHUNKS:
+				break
+			
+			chunks.setdefault(chunk_key(chunk), chunk)
+		
+		return list(chunks.values())
+	
+	
+	def history(self, budget: int = SESSION_HISTORY_TOKENS) -> list[dict]:
+		
+		"""
+		
+		Get the most recent turns that fit in a token budget.
+		
+		:param budget: Tokens the questions and answers may use
+		:type budget: int
+		
+		:return: Dicts with question and answer, oldest first
+		:rtype: list[dict]
+		
+		"""
+		
+		history = []
+		
+		for turn in reversed(self.turns):
+			
+			budget -= estimate_tokens(turn["question"]) + estimate_tokens(turn["answer"])
+			
+			if budget < 0:
+				break
+			
+			history.append({"question": turn["question"], "answer": turn["answer"]})
+		
+		return history[::-1]
+	
+	
+	def add_turn(self, question: str, answer: str, chunks: list[dict], query_embedding: list[float]):
+		
+		"""
+		
+		Record an answered question.
+		
+		:param question: The resident's question
+		:type question: str
+		:param answer: The generated answer
+		:type answer: str
+		:param chunks: Chunks the answer was generated from
+		:type chunks: list[dict]
+		:param query_embedding: Embedding the chunks were retrieved with
+		:type query_embedding: list[float]
+		
+		:return: None
+		:rtype: None
+		
+		"""
+		
+		turn = {
+			"question": question,
+			"answer": answer,
+			"chunks": [
+				{key: chunk.get(key) for key in ("id", "document_type", "page_number", "chunk_index", "content")}
+				for chunk in chunks
+				],
+			}
+		
+		self.turns.append(turn)
+		self.pending.append(turn)
+		
+		del self.turns[:-SESSION_MAX_TURNS]
+		
+		self.last_embedding = np.asarray(query_embedding, dtype = np.float32)
+		self.updated = time.monotonic()
+
+
+class SessionStore:
+	
+	"""
+	
+	Bounded LRU of conversation sessions, optionally backed by Postgres.
+	
+	"""
+	
+	def __init__(self, db = None, max_sessions: int = SESSION_MAX_SESSIONS, ttl: int = SESSION_TTL, metrics = None):
+		
+		"""
+		
+		Initialize the SessionStore class.
+		
+		:param db: Database to write sessions through to, or None to keep them in memory only
+		:type db: Database or None
+		:param max_sessions: Sessions kept in memory; the least recently used are evicted
+		:type max_sessions: int
+		:param ttl: Seconds after which an idle session expires
+		:type ttl: int
+		:param metrics: Registry to report the number of sessions to, or None
+		:type metrics: Metrics or None
+		
+		"""
+		
+		self.db = db
+		self.max_sessions = max_sessions
+		self.ttl = ttl
+		
+		self._sessions = OrderedDict()
+		
+		if metrics:
+			metrics.register_gauge("conversation_sessions", lambda: len(self._sessions))
+	
+	
+	def __len__(self) -> int:
+		
+		return len(self._sessions)
+	
+	
+	async def create(self, hoa_code: str, owner: str) -> Session:
+		
+		"""
+		
+		Start a new session.
+		
+		:param hoa_code: Community the conversation is about
+		:type hoa_code: str
+		:param owner: Email of the resident
+		:type owner: str
+		
+		:return: The new session
+		:rtype: Session
+		
+		"""
+		
+		session = Session(str(uuid.uuid4()), hoa_code, owner)
+		
+		self._put(session)
+		await self.save(session)
+		
+		return session
+	
+	
+	async def get(self, session_id: str) -> Session | None:
+		
+		"""
+		
+		Get a session, loading it from Postgres if this process doesn't have it or has an outdated copy.
+		
+		:param session_id: ID of the session
+		:type session_id: str
+		
+		:return: The session, or None if it doesn't exist or expired
+		:rtype: Session or None
+		
+		"""
+		
+		session = self._sessions.get(session_id)
+		
+		if session is not None:
+			
+			if time.monotonic() - session.updated > self.ttl:
+				
+				await self.delete(session_id)
+				
+				return None
+			
+			self._sessions.move_to_end(session_id)
+			
+			if self.db is None:
+				return session
+		
+		elif self.db is None:
+			return None
+		
+		# Only reads the turns again if another worker changed the session since this copy
+		row = await self.db.get_conversation_session(session_id, self.ttl, session.version if session else None)
+		
+		if row is None:
+			
+			# Ended or expired on another worker
+			self._sessions.pop(session_id, None)
+			
+			return None
+		
+		if session is None:
+			
+			session = Session(session_id, row["hoa_code"], row["owner"], row["turns"], row["version"])
+			self._put(session)
+		
+		elif row["turns"] is not None:
+			
+			session.turns = row["turns"]
+			session.version = row["version"]
+			
+			# The previous question may not be the one this copy embedded last
+			session.last_embedding = None
+		
+		return session
+	
+	
+	async def save(self, session: Session):
+		
+		"""
+		
+		Write a session through to Postgres (no-op without a database). If another worker added turns
+		since this copy was read, the new turns of this copy are added after them.
+		
+		:param session: The session
+		:type session: Session
+		
+		:return: None
+		:rtype: None
+		
+		"""
+		
+		if self.db is None:
+			return
+		
+		while True:
+			
+			version = await self.db.save_conversation_session(
+					session.id, session.hoa_code, session.owner, session.turns, session.version
+					)
+			
+			if version is not None:
+				break
+			
+			row = await self.db.get_conversation_session(session.id, self.ttl)
+			
+			# Ended on another worker meanwhile
+			if row is None:
+				
+				self._sessions.pop(session.id, None)
+				
+				return
+			
+			session.turns = (row["turns"] + session.pending)[-SESSION_MAX_TURNS:]
+			session.version = row["version"]
+		
+		session.version = version
+		session.pending = []
+	
+	
+	async def delete(self, session_id: str):
+		
+		"""
+		
+		End a session.
+		
+		:param session_id: ID of the session
+		:type session_id: str
+		
+		:return: None
+		:rtype: None
+		
+		"""
+		
+		self._sessions.pop(session_id, None)
+		
+		if self.db is not None:
+			await self.db.delete_conversation_session(session_id)
+	
+	
+	def _put(self, session: Session):
+		
+		self._sessions[session.id] = session
+		self._sessions.move_to_end(session.id)
+		
+		# Evict the least recently used sessions (they stay in Postgres, if any)
+		while len(self._sessions) > self.max_sessions:
+			self._sessions.popitem(last = False)
@@ -0,0 +1,348 @@
+import asyncio
+import json
+import logging
+import os
+
+
+# Maximum number of LLM calls in flight across all documents being summarized
+SUMMARY_CONCURRENCY = int(os.getenv("SUMMARY_CONCURRENCY", "4"))
+
+# Maximum number of characters of document text summarized by one LLM call
+SUMMARY_SECTION_CHARS = int(os.getenv("SUMMARY_SECTION_CHARS", "12000"))
+
+# Number of likely resident questions generated per document
+FAQ_COUNT = int(os.getenv("FAQ_COUNT", "8"))
+
+
+def group_sections(chunks: list, max_chars: int = SUMMARY_SECTION_CHARS) -> list[dict]:
+	
+	"""
+	
+	Group consecutive chunks of the same section, splitting sections longer than one LLM call can take.
+	
+	:param chunks: Chunks in document order, with page_number, section and content
+	:type chunks: list
+	:param max_chars: Maximum number of characters per group
+	:type max_chars: int
+	
+	:return: Dicts with section, first_page, last_page and text
+	:rtype: list[dict]
+	
+	"""
+	
+	groups = []
+	
+	for chunk in chunks:
+		
+		current = groups[-1] if groups else None
+		
+		# Start a new group at every heading, and when the current one is full
+		starts_group = (
+			current is None
+			or current["section"] != chunk["section"]
+			or len(current["text"]) + len(chunk["content"]) > max_chars
+			)
+		
+		if starts_group:
+			
+			current = {"section": chunk["section"], "first_page": chunk["page_number"], "text": ""}
+			groups.append(current)
+		
+		current["last_page"] = chunk["page_number"]
+		current["text"] += chunk["content"] + "\n"
+	
+	return groups
+
+
+def parse_faqs(text: str) -> list[dict]:
+	
+	"""
+	
+	Parse the JSON list of questions and answers returned by the LLM.
+	
+	:param text: LLM response, possibly with prose or a code fence around the JSON
+	:type text: str
+	
+	:return: Dicts with question and answer (empty if the response can't be parsed)
+	:rtype: list[dict]
+	
+	"""
+	
+	try:
+		
+		items = json.loads(text[text.index("["):text.rindex("]") + 1])
+	
+	except ValueError:
+		
+		logging.warning("Could not parse the generated FAQs.")
+		
+		return []
+	
+	return [
+		{"question": str(item["question"]).strip(), "answer": str(item["answer"]).strip()}
+		for item in items
+		if isinstance(item, dict) and item.get("question") and item.get("answer")
+		]
+
+
+class SummaryService:
+	
+	"""
+	
+	Service that pre-generates summaries and FAQs of ingested documents in the background.
+	
+	Sections are summarized in parallel (map), then combined into a document summary (reduce), so
+	the read-only summaries endpoint never waits on an LLM.
+	
+	"""
+	
+	def __init__(
+			self,
+			db,
+			llm,
+			concurrency: int = SUMMARY_CONCURRENCY,
+			section_chars: int = SUMMARY_SECTION_CHARS,
+			faq_count: int = FAQ_COUNT,
+			accounting = None,
+			):
+		
+		"""
+		
+		Initialize the service with the required dependencies.
+		
+		:param db: The Database instance to read chunks from and store summaries in.
+		:type db: Database
+		:param llm: The RAG instance whose generate_answer runs the completions.
+		:type llm: RAG
+		:param concurrency: Maximum number of LLM calls in flight.
+		:type concurrency: int
+		:param section_chars: Maximum number of characters summarized by one LLM call.
+		:type section_chars: int
+		:param faq_count: Number of questions generated per document.
+		:type faq_count: int
+		:param accounting: ResourceAccountant charging each summarization to its community, or None.
+		:type accounting: ResourceAccountant or None
+		
+		"""
+		
+		self.db = db
+		self.llm = llm
+		self.section_chars = section_chars
+		self.faq_count = faq_count
+		self.accounting = accounting
+		
+		self._semaphore = asyncio.Semaphore(concurrency)
+		
+		# Running summarization task of each content hash
+		self._tasks = {}
+	
+	
+	def schedule(self, content_hash: str, hoa_code: str | None = None):
+		
+		"""
+		
+		Summarize stored content in the background, unless it is already being summarized.
+		
+		:param content_hash: SHA-256 of the PDF
+		:type content_hash: str
+		:param hoa_code: Community the summary is made for (the first to upload the content), if known
+		:type hoa_code: str or None
+		
+		:return: None
+		:rtype: None
+		
+		"""
+		
+		if content_hash in self._tasks:
+			return
+		
+		task = asyncio.create_task(self._run(content_hash, hoa_code))
+		self._tasks[content_hash] = task
+		task.add_done_callback(lambda _: self._tasks.pop(content_hash, None))
+	
+	
+	async def schedule_missing(self):
+		
+		"""
+		
+		Schedule every stored document that has no summary yet.
+		
+		:return: None
+		:rtype: None
+		
+		"""
+		
+		for content_hash in await self.db.get_unsummarized_content_hashes():
+			self.schedule(content_hash)
+	
+	
+	async def close(self):
+		
+		"""
+		
+		Cancel the running summarizations; they are picked up again by schedule_missing.
+		
+		:return: None
+		:rtype: None
+		
+		"""
+		
+		tasks = list(self._tasks.values())
+		
+		for task in tasks:
+			task.cancel()
+		
+		await asyncio.gather(*tasks, return_exceptions = True)
+	
+	
+	async def _run(self, content_hash: str, hoa_code: str | None = None):
+		
+		try:
+			
+			if self.accounting is None:
+				
+				await self.summarize_document(content_hash)
+				return
+			
+			# A job of its own, not part of the upload that scheduled it
+			async with self.accounting.measure("summary", content_hash, hoa_code = hoa_code, nested = False):
+				await self.summarize_document(content_hash)
+		
+		except asyncio.CancelledError:
+			raise
+		
+		except Exception:
+			
+			logging.exception(f"Failed to summarize document {content_hash}")
+	
+	
+	async def summarize_document(self, content_hash: str) -> bool:
+		
+		"""
+		
+		Generate and store the section summaries, document summary and FAQs of stored content.
+		
+		:param content_hash: SHA-256 of the PDF
+		:type content_hash: str
+		
+		:return: True if a summary was stored, False if there was nothing to do
+		:rtype: bool
+		
+		"""
+		
+		if await self.db.has_document_summary(content_hash):
+			return False
+		
+		chunks = await self.db.get_document_chunks(content_hash)
+		
+		if not chunks:
+			return False
+		
+		sections = group_sections(chunks, self.section_chars)
+		
+		# Map: summarize every section in parallel
+		section_summaries = await asyncio.gather(*(self._summarize_section(section) for section in sections))
+		
+		for section, summary in zip(sections, section_summaries):
+			section["summary"] = summary
+		
+		# Reduce: combine the section summaries into one
+		summary = await self._reduce([self._label(section) + section["summary"] for section in sections])
+		
+		faqs = await self._generate_faqs(sections)
+		
+		stored_sections = [
+			{key: section[key] for key in ("section", "first_page", "last_page", "summary")}
+			for section in sections
+			]
+		
+		return await self.db.store_document_summary(content_hash, summary, self.llm.model, stored_sections, faqs)
+	
+	
+	async def _complete(self, prompt: str) -> str:
+		
+		async with self._semaphore:
+			return await self.llm.generate_answer(prompt, priority = "background")
+	
+	
+	@staticmethod
+	def _label(section: dict) -> str:
+		
+		pages = (
+			f"Page {section['first_page']}" if section["first_page"] == section["last_page"]
+			else f"Pages {section['first_page']}-{section['last_page']}"
+			)
+		
+		return f"[{section['section'] or 'Introduction'} - {pages}]\n"
+	
+	
+	async def _summarize_section(self, section: dict) -> str:
+		
+		prompt = (
+			"Summarize the following part of an HOA governing document for residents in plain language. "
+			"Keep every rule, amount, deadline and requirement. Use at most 150 words and only the text below.\n\n"
+			f"{self._label(section)}{section['text']}\n\n"
+			"Summary:"
+			)
+		
+		return await self._complete(prompt)
+	
+	
+	async def _reduce(self, summaries: list[str]) -> str:
+		
+		"""
+		
+		Combine summaries into one, in rounds, so no single call exceeds the size limit.
+		
+		:param summaries: Summaries in document order
+		:type summaries: list[str]
+		
+		:return: Combined summary
+		:rtype: str
+		
+		"""
+		
+		# Group the summaries into calls that fit the size limit
+		groups, current = [], []
+		
+		for summary in summaries:
+			
+			# At least two per call, so every round makes progress
+			if len(current) >= 2 and sum(map(len, current)) + len(summary) > self.section_chars:
+				
+				groups.append(current)
+				current = []
+			
+			current.append(summary)
+		
+		groups.append(current)
+		
+		combined = await asyncio.gather(
+				*(
+					self._complete(
+							"Combine the following summaries of parts of an HOA governing document into one "
+							"overview for residents, in plain language, of at most 250 words. Mention the most "
+							"important rules, fees and deadlines.\n\n"
+							+ "\n\n".join(group)
+							+ "\n\nOverview:"
+							)
+					for group in groups
+					)
+				)
+		
+		return combined[0] if len(combined) == 1 else await self._reduce(combined)
+	
+	
+	async def _generate_faqs(self, sections: list[dict]) -> list[dict]:
+		
+		context = "\n\n".join(self._label(section) + section["summary"] for section in sections)
+		
+		prompt = (
+			f"Below are summaries of the sections of an HOA governing document. Write the {self.faq_count} "
+			"questions residents are most likely to ask about it, each with a short answer that uses ONLY "
+			"these summaries and cites its source as: Source: [section] Page [page_number].\n"
+			'Respond with a JSON array of objects with "question" and "answer" keys, and nothing else.\n\n'
+			f"{context[:self.section_chars]}"
+			)
+		
+		return parse_faqs(await self._complete(prompt))[:self.faq_count]
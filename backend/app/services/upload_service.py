@@ -1,12 +1,35 @@
+import hashlib
 import os
-import boto3
+import shutil
+import tempfile
 from fastapi import UploadFile
-from botocore.exceptions import NoCredentialsError, ClientError
 from dotenv import load_dotenv
+from starlette.concurrency import run_in_threadpool
 
 
 load_dotenv()
 
+# Size of each multipart part sent to S3 (S3 requires at least 5 MB per part)
+S3_PART_SIZE = int(os.getenv("S3_PART_SIZE_MB", "8")) * 1024 * 1024
+
+# Number of parts uploaded in parallel for a single file
+S3_MAX_CONCURRENCY = int(os.getenv("S3_MAX_CONCURRENCY", "4"))
+
+# Largest upload accepted, in bytes
+MAX_UPLOAD_BYTES = int(os.getenv("MAX_UPLOAD_MB", "50")) * 1024 * 1024
+
+# Size of the blocks the upload is streamed in
+UPLOAD_CHUNK_SIZE = 1024 * 1024
+
+
+class UploadTooLargeError(ValueError):
+    
+    """
+    
+    Raised when an upload exceeds the maximum allowed size.
+    
+    """
+
 
 class UploadService:
     
@@ -14,9 +37,22 @@ class UploadService:
     
     Service for handling file uploads. (S3 or local)
     
+    Uploads go through three steps:
+    
+    - receive_file streams the upload once, in fixed-size blocks, hashing it and writing it to disk
+      (its final location when storing locally, a staging file when storing on S3).
+    - publish_file makes the stored file available at its final location (a multipart S3 upload
+      from the staging file, or nothing for local storage).
+    - release_file removes the staging file, if any.
+    
+    The file on disk can be handed to the PDF parser by path while it is being published.
+    
+    Files are stored under their SHA-256, so publishing a new version of a document never
+    overwrites the file the catalog points at until the new version replaces it.
+    
     """
     
-    def __init__(self, use_s3: bool = False):
+    def __init__(self, use_s3: bool = False, max_upload_bytes: int = MAX_UPLOAD_BYTES):
         
         """
         
@@ -24,11 +60,15 @@ class UploadService:
 
         :param use_s3: Boolean flag to indicate if S3 should be used for file uploads.
         :type use_s3: bool
+        :param max_upload_bytes: Largest upload accepted, in bytes.
+        :type max_upload_bytes: int
         
         """
         
         self.use_s3 = use_s3
         
+        self.max_upload_bytes = max_upload_bytes
+        
         self.upload_dir = os.getenv("S3_BUCKET_NAME")
         
         # Create the upload directory if it doesn't exist
@@ -40,7 +80,69 @@ class UploadService:
             # Get S3 bucket name from environment variables (also used for the local path)
             self.bucket_name = os.getenv("S3_BUCKET_NAME")
             
+            # boto3 is slow to import, so it is only loaded when S3 is used
+            import boto3
+            from boto3.s3.transfer import TransferConfig
+            
             self.s3_client = boto3.client("s3")
+            
+            # Files above one part are sent as a multipart upload, streamed from disk part by part
+            self.transfer_config = TransferConfig(
+                    multipart_threshold = S3_PART_SIZE,
+                    multipart_chunksize = S3_PART_SIZE,
+                    max_concurrency = S3_MAX_CONCURRENCY,
+                    )
+            
+            # Uploads are staged on local disk before being sent to S3
+            self.staging_dir = os.getenv("UPLOAD_STAGING_DIR", tempfile.gettempdir())
+    
+    
+    @staticmethod
+    def build_file_path(hoa_code: str, document_type: str) -> str:
+        
+        """
+        
+        Build the storage path (local relative path or S3 key) documents were stored under before
+        their files were content-addressed (see build_content_path).
+        
+        :param hoa_code: The 9-digit alphanumeric HOA code to organize files by community.
+        :type hoa_code: str
+        :param document_type: A descriptive name for the type of document being uploaded
+        :type document_type: str
+        
+        :return: The storage path, namespaced by HOA code.
+        :rtype: str
+        
+        """
+        
+        # Sanitize and format the document_type to be file-safe
+        safe_name = document_type.strip().replace(" ", "_").lower() + ".pdf"
+        
+        # Create the folder path using the HOA code
+        folder_path = f"{hoa_code}/docs/"
+        
+        # Ensure the folder path ends with a slash
+        return folder_path + safe_name
+    
+    
+    @staticmethod
+    def build_content_path(hoa_code: str, content_hash: str) -> str:
+        
+        """
+        
+        Build the storage path (local relative path or S3 key) of an uploaded file from its content.
+        
+        :param hoa_code: The 9-digit alphanumeric HOA code to organize files by community.
+        :type hoa_code: str
+        :param content_hash: SHA-256 of the file.
+        :type content_hash: str
+        
+        :return: The storage path, namespaced by HOA code.
+        :rtype: str
+        
+        """
+        
+        return f"{hoa_code}/docs/{content_hash}.pdf"
     
     
     async def save_file(self, file: UploadFile, hoa_code: str, document_type: str) -> str:
@@ -59,93 +161,348 @@ class UploadService:
         :rtype: str
         """
         
-        # Sanitize and format the document_type to be file-safe
-        safe_name = document_type.strip().replace(" ", "_").lower() + ".pdf"
+        # Stream the upload to disk
+        stored = await self.receive_file(file, hoa_code = hoa_code, document_type = document_type)
         
-        # Create the folder path using the HOA code
-        folder_path = f"{hoa_code}/docs/"
+        try:
+            
+            # Move it to its final location
+            return await self.publish_file(stored)
         
-        # Ensure the folder path ends with a slash
-        file_path = folder_path + safe_name
+        finally:
+            
+            # Clean up the staging file, if any
+            self.release_file(stored)
+    
+    
+    async def receive_file(self, file: UploadFile, hoa_code: str, document_type: str) -> dict:
         
-        # Check if S3 is enabled
+        """
+        
+        Stream the upload to disk in a single pass, computing its SHA-256 and enforcing the size limit.
+        
+        Local uploads are written to a temporary file next to their final path and atomically
+        renamed into place. S3 uploads are written to a staging file for publish_file to send.
+        Either way the storage key is derived from the content (see build_content_path), so a file
+        with other content already stored for the same document is left alone.
+        
+        :param file: The file to be uploaded.
+        :type file: UploadFile
+        :param hoa_code: The 9-digit alphanumeric HOA code to organize files by community.
+        :type hoa_code: str
+        :param document_type: A descriptive name for the type of document being uploaded
+        :type document_type: str
+        
+        :return: Dict with the storage key, local path, sha256, size and content type of the upload.
+        :rtype: dict
+        
+        """
+        
+        # Reject uploads whose size is already known to be too large before reading anything
+        if file.size is not None and file.size > self.max_upload_bytes:
+            
+            raise UploadTooLargeError(f"File exceeds the maximum upload size of {self.max_upload_bytes} bytes.")
+        
+        # Pick where the bytes should land on disk
         if self.use_s3:
             
-            return await self._upload_to_s3(file, file_path)
+            target_dir = self.staging_dir
         
-        # If S3 is not enabled, save the file locally
         else:
             
-            return await self._save_to_local(file, file_path)
+            target_dir = os.path.join(self.upload_dir, hoa_code, "docs")
+        
+        # Create the directory if it doesn't exist
+        os.makedirs(target_dir, exist_ok = True)
+        
+        # Write to a temporary file so a failed upload never leaves a partial document behind
+        fd, temp_path = tempfile.mkstemp(dir = target_dir, suffix = ".part")
+        
+        digest = hashlib.sha256()
+        size = 0
+        
+        try:
+            
+            # Start from the beginning of the spooled temp file
+            await file.seek(0)
+            
+            with os.fdopen(fd, "wb") as out:
+                
+                # Read the upload block by block; each block is hashed and written exactly once
+                while chunk := await file.read(UPLOAD_CHUNK_SIZE):
+                    
+                    size += len(chunk)
+                    
+                    # Stop as soon as the limit is crossed
+                    if size > self.max_upload_bytes:
+                        
+                        raise UploadTooLargeError(
+                                f"File exceeds the maximum upload size of {self.max_upload_bytes} bytes."
+                                )
+                    
+                    # Hash and write on a worker thread so the event loop is not blocked
+                    await run_in_threadpool(self._write_block, out, digest, chunk)
+            
+            file_path = self.build_content_path(hoa_code, digest.hexdigest())
+            final_path = None
+            
+            # Local uploads are renamed into their final place (identical content if it exists)
+            if not self.use_s3:
+                
+                final_path = os.path.join(self.upload_dir, file_path)
+                os.replace(temp_path, final_path)
+        
+        except BaseException:
+            
+            # Remove the partial file
+            if os.path.exists(temp_path):
+                
+                os.remove(temp_path)
+            
+            raise
+        
+        return {
+            "key": file_path,
+            "local_path": final_path or temp_path,
+            "sha256": digest.hexdigest(),
+            "size": size,
+            "content_type": file.content_type or "application/pdf",
+            }
     
     
-    async def _save_to_local(self, file: UploadFile, file_path: str) -> str:
+    @staticmethod
+    def _write_block(out, digest, chunk: bytes):
         
         """
         
-        Save file locally with HOA-specific folder structure.
-
-        :param file: The file to be saved.
-        :type file: UploadFile
-        :param file_path: The local path including folder and filename.
-        :type file_path: str
-
-        :return: Path to the saved local file.
+        Hash a block of the upload and append it to the output file.
+        
+        :param out: Open output file.
+        :type out: io.BufferedWriter
+        :param digest: Running hash of the upload.
+        :type digest: hashlib._Hash
+        :param chunk: Block of bytes read from the upload.
+        :type chunk: bytes
+        
+        """
+        
+        digest.update(chunk)
+        
+        out.write(chunk)
+    
+    
+    async def publish_file(self, stored: dict) -> str:
+        
+        """
+        
+        Make a received file available at its final location.
+        
+        :param stored: Dict returned by receive_file.
+        :type stored: dict
+        
+        :return: The path or URL where the file is saved.
         :rtype: str
         
         """
         
-        # Sanitize and format the file path
-        full_path = os.path.join(self.upload_dir, file_path)
+        # Check if S3 is enabled
+        if self.use_s3:
+            
+            return await self._upload_to_s3(stored)
+        
+        # Local files were already written to their final path
+        return stored["local_path"]
+    
+    
+    def release_file(self, stored: dict):
         
-        # Create the directory if it doesn't exist
-        os.makedirs(os.path.dirname(full_path), exist_ok = True)
+        """
         
-        # Write the file to the local path
-        with open(full_path, "wb") as f:
+        Remove the staging file of a received upload, if it has one.
+        
+        :param stored: Dict returned by receive_file.
+        :type stored: dict
+        
+        """
+        
+        # Only S3 uploads are staged; local files are the stored document
+        if self.use_s3 and os.path.exists(stored["local_path"]):
             
-            # Read the file bytes
-            content = await file.read()
+            os.remove(stored["local_path"])
+    
+    
+    async def delete_file(self, key: str):
+        
+        """
+        
+        Delete a stored document from S3 or local disk. Missing files are ignored.
+        
+        :param key: Storage key (local relative path or S3 key) of the document.
+        :type key: str
+        
+        """
+        
+        if self.use_s3:
+            
+            await run_in_threadpool(self.s3_client.delete_object, Bucket = self.bucket_name, Key = key)
             
-            # Write the content to the file
-            f.write(content)
+            return
         
-        # Return the local file path
-        return full_path
+        try:
+            
+            await run_in_threadpool(os.remove, os.path.join(self.upload_dir, key))
+        
+        except FileNotFoundError:
+            
+            pass
     
     
-    async def _upload_to_s3(self, file: UploadFile, file_path: str) -> str:
+    async def download_file(self, key: str, path: str):
         
         """
         
-        Upload the file to an S3 bucket under the HOA-specific folder.
-
-        :param file: The file to upload.
-        :type file: UploadFile
-        :param file_path: The S3 key (path) for the file.
-        :type file_path: str
-
+        Copy a stored document from S3 or local disk to a local path.
+        
+        :param key: Storage key (local relative path or S3 key) of the document.
+        :type key: str
+        :param path: Local path to write the file to.
+        :type path: str
+        
+        """
+        
+        if self.use_s3:
+            
+            await run_in_threadpool(self.s3_client.download_file, self.bucket_name, key, path)
+            
+            return
+        
+        await run_in_threadpool(shutil.copyfile, os.path.join(self.upload_dir, key), path)
+    
+    
+    async def delete_folder(self, prefix: str) -> int:
+        
+        """
+        
+        Delete every stored file under a folder (e.g. a community's "HOA-.../"), from S3 or local disk.
+        
+        :param prefix: Folder of the storage keys to delete, ending with a slash.
+        :type prefix: str
+        
+        :return: Number of files deleted.
+        :rtype: int
+        
+        """
+        
+        if self.use_s3:
+            
+            return await run_in_threadpool(self._delete_s3_prefix, prefix)
+        
+        return await run_in_threadpool(self._delete_local_folder, os.path.join(self.upload_dir, prefix))
+    
+    
+    async def list_folders(self) -> list[str]:
+        
+        """
+        
+        List the top-level folders of the storage (one per community that uploaded files).
+        
+        :return: Folder names, without the trailing slash.
+        :rtype: list[str]
+        
+        """
+        
+        if self.use_s3:
+            
+            def list_s3() -> list[str]:
+                
+                paginator = self.s3_client.get_paginator("list_objects_v2")
+                
+                return [
+                    common["Prefix"].rstrip("/")
+                    for page in paginator.paginate(Bucket = self.bucket_name, Delimiter = "/")
+                    for common in page.get("CommonPrefixes", [])
+                    ]
+            
+            return await run_in_threadpool(list_s3)
+        
+        return [entry.name for entry in os.scandir(self.upload_dir) if entry.is_dir()]
+    
+    
+    def _delete_s3_prefix(self, prefix: str) -> int:
+        
+        """
+        
+        Delete the S3 objects under a prefix, 1000 (the most one request takes) at a time.
+        
+        """
+        
+        deleted = 0
+        paginator = self.s3_client.get_paginator("list_objects_v2")
+        
+        for page in paginator.paginate(Bucket = self.bucket_name, Prefix = prefix):
+            
+            objects = [{"Key": item["Key"]} for item in page.get("Contents", [])]
+            
+            if objects:
+                
+                self.s3_client.delete_objects(Bucket = self.bucket_name, Delete = {"Objects": objects, "Quiet": True})
+                deleted += len(objects)
+        
+        return deleted
+    
+    
+    @staticmethod
+    def _delete_local_folder(path: str) -> int:
+        
+        """
+        
+        Delete a local folder and the files in it.
+        
+        """
+        
+        if not os.path.isdir(path):
+            
+            return 0
+        
+        deleted = sum(len(files) for _, _, files in os.walk(path))
+        
+        shutil.rmtree(path)
+        
+        return deleted
+    
+    
+    async def _upload_to_s3(self, stored: dict) -> str:
+        
+        """
+        
+        Upload a staged file to an S3 bucket under the HOA-specific folder.
+        
+        :param stored: Dict returned by receive_file.
+        :type stored: dict
+        
         :return: Public URL to access the uploaded file.
         :rtype: str
         """
         
+        from botocore.exceptions import ClientError, NoCredentialsError
+        
         try:
             
-            # Read the file bytes
-            file_content = await file.read()
-        
-            # Upload the file to S3
-            self.s3_client.put_object(
-                    Bucket = self.bucket_name,
-                    Key = file_path,
-                    Body = file_content,
-                    ContentType = file.content_type,
+            # Stream the staging file to S3 in multipart parts on a worker thread,
+            # so the event loop is never blocked by the transfer
+            await run_in_threadpool(
+                    self.s3_client.upload_file,
+                    stored["local_path"],
+                    self.bucket_name,
+                    stored["key"],
+                    ExtraArgs = {"ContentType": stored["content_type"]},
+                    Config = self.transfer_config,
                     )
             
             # Return the public URL
-            return f"https://{self.bucket_name}.s3.amazonaws.com/{file_path}"
+            return f"https://{self.bucket_name}.s3.amazonaws.com/{stored['key']}"
         
         ## Handle S3 upload errors
         except (NoCredentialsError, ClientError) as e:
-        
+            
             raise RuntimeError(f"S3 upload failed: {e}")
@@ -0,0 +1,696 @@
+"""
+
+Resource accounting: what each request and background job costs in CPU time, peak memory,
+database rows and bytes and OpenAI tokens, attributed to its community and route.
+
+A ResourceUsage is opened for every request (by ResourceAccountingMiddleware) and every ingestion
+and summary job, and held in a context variable, so the services doing the work add to it without
+it being passed around: the database counts the rows and bytes of every query, the embedding and
+completion calls the tokens reported by the API. A job run by a request is nested in it and counts
+for both.
+
+CPU time is the time the event loop thread spent while the usage was open, plus the time of the
+threads and processes work was handed to. Requests in flight at the same time share the loop
+thread, so each is charged for all of it; their usages are marked as overlapped.
+
+Peak memory is measured with tracemalloc, which slows every allocation down, so it is only traced
+while a sample of the requests (RESOURCE_MEMORY_SAMPLE_RATE) is in flight. It covers the
+allocations of the whole process in that time, but not those of other processes.
+
+A request is attributed to the community of the caller once their token is verified, or by the
+services working for it, never from what the client sent. Requests no route matched are all summed under
+"unmatched".
+
+Finished usages are logged, summed per community, kind and route, and the latest are kept for
+/admin/resource_usage. The sums of the least recently used combinations are dropped past
+RESOURCE_USAGE_TOTALS.
+
+"""
+
+import contextvars
+import functools
+import logging
+import os
+import random
+import time
+import tracemalloc
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager
+
+
+# Account for the resources of requests and jobs
+RESOURCE_ACCOUNTING = os.getenv("RESOURCE_ACCOUNTING", "true").lower() == "true"
+
+# Share of the requests and jobs whose peak memory is traced (0 to never trace)
+RESOURCE_MEMORY_SAMPLE_RATE = float(os.getenv("RESOURCE_MEMORY_SAMPLE_RATE", "0"))
+
+# Finished usages kept in memory
+RESOURCE_USAGE_RECENT = int(os.getenv("RESOURCE_USAGE_RECENT", "200"))
+
+# Sums per community, kind and route kept in memory
+RESOURCE_USAGE_TOTALS = int(os.getenv("RESOURCE_USAGE_TOTALS", "1000"))
+
+# Amounts a usage adds up
+COUNTERS = ("cpu_ms", "db_queries", "db_rows", "db_bytes", "embedding_tokens", "prompt_tokens", "completion_tokens")
+
+# Usage of the request or job the current task works for
+_current = contextvars.ContextVar("resource_usage", default = None)
+
+
+def estimate_size(value) -> int:
+	
+	"""
+	
+	Estimate the bytes a value takes on the wire, without encoding it.
+	
+	:param value: Query argument, record or column value
+	:type value: Any
+	
+	:return: Estimated size in bytes
+	:rtype: int
+	
+	"""
+	
+	if value is None:
+		return 0
+	
+	if isinstance(value, (str, bytes, bytearray, memoryview)):
+		return len(value)
+	
+	# Records, arrays and argument lists
+	if isinstance(value, (list, tuple)) or hasattr(value, "values"):
+		return sum(estimate_size(item) for item in (value.values() if hasattr(value, "values") else value))
+	
+	# Numbers, booleans, timestamps and UUIDs
+	return 8
+
+
+def timed_call(fn, *args, **kwargs) -> tuple:
+	
+	"""
+	
+	Call a function and measure the CPU time of the thread running it. Module level, so it can be
+	sent to a process pool.
+	
+	:param fn: Function to call
+	:type fn: Callable
+	
+	:return: The result of the call and the CPU time it took, in seconds
+	:rtype: tuple[Any, float]
+	
+	"""
+	
+	started = time.thread_time()
+	result = fn(*args, **kwargs)
+	
+	return result, time.thread_time() - started
+
+
+class ResourceUsage:
+	
+	"""
+	
+	Resources used by one request or job.
+	
+	"""
+	
+	def __init__(self, kind: str, name: str | None, hoa_code: str | None = None, parent = None):
+		
+		"""
+		
+		Initialize the ResourceUsage class.
+		
+		:param kind: What is accounted for ("request", "ingestion" or "summary")
+		:type kind: str
+		:param name: Route ("METHOD /path/template") or job name
+		:type name: str or None
+		:param hoa_code: Community the resources are used for, if known yet
+		:type hoa_code: str or None
+		:param parent: Usage of the request or job this one is nested in, which it adds to
+		:type parent: ResourceUsage or None
+		
+		"""
+		
+		self.kind = kind
+		self.name = name
+		self.hoa_code = hoa_code
+		self.parent = parent
+		self.counters = dict.fromkeys(COUNTERS, 0)
+		self.started_at = time.time()
+		self.wall_ms = None
+		self.peak_memory_bytes = None
+		self.overlapped = False
+		self.closed = False
+		
+		# Set by the accountant while the usage is open
+		self.sampled = False
+		self._started = time.perf_counter()
+		self._thread_cpu = time.thread_time()
+		self._memory_baseline = 0
+		self._memory_peak = 0
+	
+	
+	@property
+	def root(self):
+		
+		"""
+		
+		Outermost usage this one is nested in (itself if it isn't nested).
+		
+		"""
+		
+		usage = self
+		
+		while usage.parent is not None:
+			usage = usage.parent
+		
+		return usage
+	
+	
+	def add(self, **amounts):
+		
+		"""
+		
+		Add amounts to this usage and the usages it is nested in. Work that outlives its request
+		(tasks it started) is not counted anymore once the request is done.
+		
+		:return: None
+		:rtype: None
+		
+		"""
+		
+		usage = self
+		
+		while usage is not None:
+			
+			if not usage.closed:
+				
+				for name, amount in amounts.items():
+					usage.counters[name] += amount
+			
+			usage = usage.parent
+	
+	
+	def attribute(self, hoa_code: str):
+		
+		"""
+		
+		Attribute this usage, and the usages it is nested in, to a community if they aren't yet.
+		
+		:param hoa_code: HOA code of the community
+		:type hoa_code: str
+		
+		:return: None
+		:rtype: None
+		
+		"""
+		
+		usage = self
+		
+		while usage is not None:
+			
+			if usage.hoa_code is None:
+				usage.hoa_code = hoa_code
+			
+			usage = usage.parent
+	
+	
+	def as_dict(self) -> dict:
+		
+		"""
+		
+		Get the usage as a dict, for logs and JSON responses.
+		
+		:return: Dict with the kind, name, community, times and amounts
+		:rtype: dict
+		
+		"""
+		
+		return {
+			"kind": self.kind,
+			"name": self.name,
+			"hoa_code": self.hoa_code,
+			"started_at": self.started_at,
+			"wall_ms": self.wall_ms,
+			**{name: round(amount, 1) if name == "cpu_ms" else amount for name, amount in self.counters.items()},
+			"peak_memory_bytes": self.peak_memory_bytes,
+			"overlapped": self.overlapped,
+			}
+
+
+class AccountedConnection:
+	
+	"""
+	
+	Database connection adding the rows and bytes of its queries to a usage. Anything else is passed
+	through to the asyncpg connection.
+	
+	"""
+	
+	def __init__(self, conn, usage: ResourceUsage):
+		
+		self._conn = conn
+		self._usage = usage
+	
+	
+	def __getattr__(self, name):
+		
+		return getattr(self._conn, name)
+	
+	
+	async def fetch(self, query, *args, **kwargs):
+		
+		rows = await self._conn.fetch(query, *args, **kwargs)
+		
+		self._count(len(rows), estimate_size(args) + sum(estimate_size(row) for row in rows))
+		
+		return rows
+	
+	
+	async def fetchrow(self, query, *args, **kwargs):
+		
+		row = await self._conn.fetchrow(query, *args, **kwargs)
+		
+		self._count(0 if row is None else 1, estimate_size(args) + estimate_size(row))
+		
+		return row
+	
+	
+	async def fetchval(self, query, *args, **kwargs):
+		
+		value = await self._conn.fetchval(query, *args, **kwargs)
+		
+		self._count(0 if value is None else 1, estimate_size(args) + estimate_size(value))
+		
+		return value
+	
+	
+	async def execute(self, query, *args, **kwargs):
+		
+		status = await self._conn.execute(query, *args, **kwargs)
+		
+		# Status of the last command, such as "INSERT 0 12" or "DELETE 3"
+		count = status.rsplit(" ", 1)[-1] if status else ""
+		
+		self._count(int(count) if count.isdigit() else 0, estimate_size(args))
+		
+		return status
+	
+	
+	async def executemany(self, query, args, **kwargs):
+		
+		args = list(args)
+		
+		await self._conn.executemany(query, args, **kwargs)
+		
+		self._count(len(args), estimate_size(args))
+	
+	
+	async def copy_records_to_table(self, table_name, *, records, **kwargs):
+		
+		records = list(records)
+		
+		status = await self._conn.copy_records_to_table(table_name, records = records, **kwargs)
+		
+		self._count(len(records), estimate_size(records))
+		
+		return status
+	
+	
+	def _count(self, rows: int, size: int):
+		
+		self._usage.add(db_queries = 1, db_rows = rows, db_bytes = size)
+
+
+class ResourceAccountant:
+	
+	"""
+	
+	Opens and closes usages, and keeps the totals and latest usages of this process.
+	
+	"""
+	
+	def __init__(
+			self,
+			enabled: bool = RESOURCE_ACCOUNTING,
+			memory_sample_rate: float = RESOURCE_MEMORY_SAMPLE_RATE,
+			recent: int = RESOURCE_USAGE_RECENT,
+			totals: int = RESOURCE_USAGE_TOTALS,
+			metrics = None,
+			):
+		
+		"""
+		
+		Initialize the ResourceAccountant class.
+		
+		:param enabled: Whether usages are opened at all
+		:type enabled: bool
+		:param memory_sample_rate: Share of the requests and jobs whose peak memory is traced
+		:type memory_sample_rate: float
+		:param recent: Finished usages kept in memory
+		:type recent: int
+		:param totals: Sums per community, kind and route kept in memory
+		:type totals: int
+		:param metrics: Registry to export CPU time and tokens to, or None
+		:type metrics: Metrics or None
+		
+		"""
+		
+		self.enabled = enabled
+		self.memory_sample_rate = memory_sample_rate
+		self.metrics = metrics
+		self.recent = deque(maxlen = recent)
+		
+		# Sums per (kind, hoa_code, name), since startup, least recently updated first
+		self.totals = OrderedDict()
+		self.max_totals = totals
+		
+		# Open usages that aren't nested, and open usages whose memory is traced
+		self._active = set()
+		self._traced = set()
+		self._started_tracing = False
+	
+	
+	def current(self) -> ResourceUsage | None:
+		
+		"""
+		
+		Get the usage of the request or job the current task works for.
+		
+		:return: The usage, or None outside of one
+		:rtype: ResourceUsage or None
+		
+		"""
+		
+		return _current.get()
+	
+	
+	def add(self, **amounts):
+		
+		"""
+		
+		Add amounts (see COUNTERS) to the current usage, if any.
+		
+		:return: None
+		:rtype: None
+		
+		"""
+		
+		usage = _current.get()
+		
+		if usage is not None:
+			usage.add(**amounts)
+	
+	
+	def attribute(self, hoa_code: str | None):
+		
+		"""
+		
+		Attribute the current usage to a community, if it isn't yet.
+		
+		:param hoa_code: HOA code of the community, or None
+		:type hoa_code: str or None
+		
+		:return: None
+		:rtype: None
+		
+		"""
+		
+		usage = _current.get()
+		
+		if usage is not None and hoa_code:
+			usage.attribute(hoa_code)
+	
+	
+	def connection(self, conn):
+		
+		"""
+		
+		Wrap a database connection to count its queries in the current usage.
+		
+		:param conn: Connection acquired from a pool
+		:type conn: asyncpg.Connection
+		
+		:return: The wrapped connection, or the connection itself outside of a usage
+		:rtype: AccountedConnection or asyncpg.Connection
+		
+		"""
+		
+		usage = _current.get()
+		
+		return conn if usage is None or usage.closed else AccountedConnection(conn, usage)
+	
+	
+	def timed(self, fn):
+		
+		"""
+		
+		Wrap a function handed to a thread or process pool so it reports its CPU time. Await the
+		result with collect().
+		
+		:param fn: Function to run in the pool (picklable, for a process pool)
+		:type fn: Callable
+		
+		:return: Picklable function returning the result and the CPU time
+		:rtype: Callable
+		
+		"""
+		
+		return functools.partial(timed_call, fn)
+	
+	
+	def collect(self, outcome: tuple):
+		
+		"""
+		
+		Add the CPU time of a timed() call to the current usage.
+		
+		:param outcome: Value returned by the timed() function
+		:type outcome: tuple[Any, float]
+		
+		:return: The result of the call
+		:rtype: Any
+		
+		"""
+		
+		result, cpu = outcome
+		
+		self.add(cpu_ms = cpu * 1000)
+		
+		return result
+	
+	
+	@asynccontextmanager
+	async def measure(self, kind: str, name: str | None = None, hoa_code: str | None = None, nested: bool = True):
+		
+		"""
+		
+		Account for the resources used inside the block.
+		
+		:param kind: What is accounted for ("request", "ingestion" or "summary")
+		:type kind: str
+		:param name: Route or job name; can also be set on the usage inside the block
+		:type name: str or None
+		:param hoa_code: Community the resources are used for, if known
+		:type hoa_code: str or None
+		:param nested: Whether the block adds to the usage it runs in (False for background jobs)
+		:type nested: bool
+		
+		:return: Async context manager yielding the usage, or None when accounting is off
+		:rtype: AsyncContextManager[ResourceUsage or None]
+		
+		"""
+		
+		if not self.enabled:
+			
+			yield None
+			return
+		
+		parent = _current.get() if nested else None
+		
+		if parent is not None and parent.closed:
+			parent = None
+		
+		usage = ResourceUsage(kind, name, hoa_code = hoa_code, parent = parent)
+		
+		if parent is None:
+			
+			# Requests in flight at the same time share the event loop's CPU time
+			if self._active:
+				
+				usage.overlapped = True
+				
+				for other in self._active:
+					other.overlapped = True
+			
+			self._active.add(usage)
+		
+		if (parent.sampled if parent else random.random() < self.memory_sample_rate):
+			self._trace(usage)
+		
+		token = _current.set(usage)
+		
+		try:
+			yield usage
+		
+		finally:
+			
+			_current.reset(token)
+			self._close(usage)
+	
+	
+	def summary(self, hoa_code: str | None = None, kind: str | None = None) -> dict:
+		
+		"""
+		
+		Get the totals and the latest usages, optionally of one community or kind.
+		
+		:param hoa_code: HOA code of the community, or None for all
+		:type hoa_code: str or None
+		:param kind: Kind of usage, or None for all
+		:type kind: str or None
+		
+		:return: Dict with the totals (most CPU time first) and latest usages (latest first)
+		:rtype: dict
+		
+		"""
+		
+		def matches(entry: dict) -> bool:
+			return (hoa_code is None or entry["hoa_code"] == hoa_code) and (kind is None or entry["kind"] == kind)
+		
+		totals = [total for total in self.totals.values() if matches(total)]
+		
+		return {
+			"totals": sorted(totals, key = lambda total: total["cpu_ms"], reverse = True),
+			"recent": [entry for entry in reversed(self.recent) if matches(entry)],
+			}
+	
+	
+	def _trace(self, usage: ResourceUsage):
+		
+		usage.sampled = True
+		
+		if not tracemalloc.is_tracing():
+			
+			tracemalloc.start()
+			self._started_tracing = True
+		
+		else:
+			
+			# Keep the peak of the traced usages before counting this one's from now on
+			peak = tracemalloc.get_traced_memory()[1]
+			
+			for other in self._traced:
+				other._memory_peak = max(other._memory_peak, peak)
+			
+			tracemalloc.reset_peak()
+		
+		usage._memory_baseline = tracemalloc.get_traced_memory()[0]
+		self._traced.add(usage)
+	
+	
+	def _close(self, usage: ResourceUsage):
+		
+		usage.wall_ms = round((time.perf_counter() - usage._started) * 1000, 1)
+		usage.counters["cpu_ms"] += (time.thread_time() - usage._thread_cpu) * 1000
+		usage.closed = True
+		
+		self._active.discard(usage)
+		usage.overlapped = usage.overlapped or usage.root.overlapped
+		
+		if usage in self._traced:
+			
+			peak = max(usage._memory_peak, tracemalloc.get_traced_memory()[1])
+			usage.peak_memory_bytes = max(0, peak - usage._memory_baseline)
+			
+			self._traced.discard(usage)
+			
+			if not self._traced and self._started_tracing:
+				
+				tracemalloc.stop()
+				self._started_tracing = False
+		
+		entry = usage.as_dict()
+		
+		self.recent.append(entry)
+		self._add_to_totals(entry)
+		
+		# Nested usages are part of their parent's, so only outermost ones are exported
+		if self.metrics and usage.parent is None:
+			
+			self.metrics.increment("resource_cpu_seconds_total", usage.counters["cpu_ms"] / 1000, kind = usage.kind)
+			
+			for name in ("embedding_tokens", "prompt_tokens", "completion_tokens"):
+				
+				if usage.counters[name]:
+					self.metrics.increment("openai_tokens_total", usage.counters[name], kind = usage.kind, type = name[:-7])
+		
+		logging.info("Resource usage: " + " ".join(f"{key}={value}" for key, value in entry.items() if key != "started_at"))
+	
+	
+	def _add_to_totals(self, entry: dict):
+		
+		key = (entry["kind"], entry["hoa_code"], entry["name"])
+		total = self.totals.get(key)
+		
+		if total is None:
+			
+			if len(self.totals) >= self.max_totals:
+				self.totals.popitem(last = False)
+			
+			total = self.totals[key] = {
+				"kind": entry["kind"],
+				"hoa_code": entry["hoa_code"],
+				"name": entry["name"],
+				"count": 0,
+				"wall_ms": 0,
+				**dict.fromkeys(COUNTERS, 0),
+				"peak_memory_bytes": None,
+				}
+		
+		else:
+			
+			self.totals.move_to_end(key)
+		
+		total["count"] += 1
+		total["wall_ms"] = round(total["wall_ms"] + entry["wall_ms"], 1)
+		
+		for name in COUNTERS:
+			total[name] = round(total[name] + entry[name], 1)
+		
+		if entry["peak_memory_bytes"] is not None:
+			total["peak_memory_bytes"] = max(total["peak_memory_bytes"] or 0, entry["peak_memory_bytes"])
+
+
+class ResourceAccountingMiddleware:
+	
+	"""
+	
+	ASGI middleware accounting for the resources of every HTTP request. The community is attributed
+	by the services once the caller is authenticated.
+	
+	"""
+	
+	def __init__(self, app, accountant: ResourceAccountant):
+		
+		self.app = app
+		self.accountant = accountant
+	
+	
+	async def __call__(self, scope, receive, send):
+		
+		if scope["type"] != "http" or not self.accountant.enabled:
+			return await self.app(scope, receive, send)
+		
+		async with self.accountant.measure("request") as usage:
+			
+			try:
+				
+				await self.app(scope, receive, send)
+			
+			finally:
+				
+				# FastAPI adds the matched route to the scope. Unmatched paths are whatever clients send,
+				# so they share a single name
+				route = scope.get("route")
+				usage.name = f"{scope['method']} {getattr(route, 'path', 'unmatched')}"
@@ -0,0 +1,6 @@
+from utils.accounting import ResourceAccountant
+from utils.metrics import metrics
+
+
+# Resources of the requests and jobs of this process, attributed to communities and routes
+accounting = ResourceAccountant(metrics = metrics)
@@ -1,9 +1,13 @@
-from datetime import datetime, timedelta
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
 from jose import JWTError, jwt
 from fastapi import HTTPException, status, Depends
 from fastapi.security import OAuth2PasswordBearer
 from typing import Optional
+import hashlib
+import logging
 import os
+import time
 
 
 # You can move these to environment variables in production
@@ -11,9 +15,261 @@ SECRET_KEY = os.getenv("JWT_SECRET_KEY")
 ALGORITHM = os.getenv("JWT_ALGORITHM")
 ACCESS_TOKEN_EXPIRE_MINUTES = 44640  # 31 days
 
+# Verified token payloads kept per process, so repeated requests skip the signature check
+TOKEN_CACHE_SIZE = int(os.getenv("TOKEN_CACHE_SIZE", "10000"))
+
+# Seconds between loads of tokens revoked by other workers (from the revoked_tokens table)
+REVOCATION_REFRESH = float(os.getenv("REVOCATION_REFRESH", "30"))
+
+# Emails of the operators of the service, whose tokens may act across communities (comma-separated)
+OPERATOR_EMAILS = {email.strip().lower() for email in os.getenv("OPERATOR_EMAILS", "").split(",") if email.strip()}
+
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl = "/auth/login")
 
 
+def token_key(token: str) -> str:
+	
+	"""
+	
+	Hash a token, so the cache and the revocation list never hold usable tokens.
+	
+	:param token: Encoded JWT token
+	:type token: str
+	
+	:return: Hex SHA-256 of the token
+	:rtype: str
+	
+	"""
+	
+	return hashlib.sha256(token.encode("utf-8")).hexdigest()
+
+
+class TokenCache:
+	
+	"""
+	
+	Bounded LRU of verified token payloads, keyed by token hash, each entry expiring at the token's
+	exp, and the list of revoked token hashes (also kept until the token would have expired).
+	
+	Revocations are written to the database by the worker that revokes the token; the other workers
+	load them every REVOCATION_REFRESH seconds once a database is attached. With a resource
+	accountant attached, the request of each verified token is attributed to the user's community.
+	
+	"""
+	
+	def __init__(self, max_size: int = TOKEN_CACHE_SIZE, refresh: float = REVOCATION_REFRESH, metrics = None):
+		
+		"""
+		
+		Initialize the TokenCache class.
+		
+		:param max_size: Most payloads kept; the least recently used one is evicted first
+		:type max_size: int
+		:param refresh: Seconds between loads of the revocation list from the database
+		:type refresh: float
+		:param metrics: Optional metrics registry for hits and misses
+		:type metrics: Metrics or None
+		
+		"""
+		
+		self.max_size = max_size
+		self.refresh_interval = refresh
+		self.metrics = metrics
+		self.db = None
+		self.accounting = None
+		
+		# Token hash -> verified payload
+		self._payloads = OrderedDict()
+		
+		# Token hash -> exp of the revoked token
+		self._revoked = {}
+		
+		self._loaded_at = None
+		self._revoked_since = None
+	
+	
+	def __len__(self):
+		return len(self._payloads)
+	
+	
+	def attach(self, db, metrics = None, accounting = None):
+		
+		"""
+		
+		Share revocations with the other workers through the database.
+		
+		:param db: The Database instance
+		:type db: Database
+		:param metrics: Optional metrics registry for hits and misses
+		:type metrics: Metrics or None
+		:param accounting: Optional resource accountant to attribute requests to their community
+		:type accounting: ResourceAccountant or None
+		
+		:return: None
+		:rtype: None
+		
+		"""
+		
+		self.db = db
+		self.metrics = metrics or self.metrics
+		self.accounting = accounting or self.accounting
+		self._loaded_at = None
+		self._revoked_since = None
+	
+	
+	def get(self, key: str, now: float | None = None) -> dict | None:
+		
+		"""
+		
+		Get the payload of a verified token that hasn't expired or been revoked.
+		
+		:param key: Hash of the token
+		:type key: str
+		:param now: Current UNIX time (defaults to time.time())
+		:type now: float or None
+		
+		:return: The payload, or None if the token must be verified
+		:rtype: dict or None
+		
+		"""
+		
+		now = time.time() if now is None else now
+		payload = self._payloads.get(key)
+		
+		# Expired entries are dropped; decoding the token again rejects it
+		if payload is not None and payload["exp"] <= now:
+			
+			del self._payloads[key]
+			payload = None
+		
+		if payload is not None:
+			self._payloads.move_to_end(key)
+		
+		if self.metrics:
+			self.metrics.increment("token_cache_hits_total" if payload is not None else "token_cache_misses_total")
+		
+		return payload
+	
+	
+	def put(self, key: str, payload: dict):
+		
+		"""
+		
+		Cache the payload of a verified token until its exp.
+		
+		:param key: Hash of the token
+		:type key: str
+		:param payload: Decoded payload
+		:type payload: dict
+		
+		:return: None
+		:rtype: None
+		
+		"""
+		
+		# Tokens without an expiration are verified on every request
+		if not isinstance(payload.get("exp"), (int, float)):
+			return
+		
+		self._payloads[key] = payload
+		self._payloads.move_to_end(key)
+		
+		while len(self._payloads) > self.max_size:
+			self._payloads.popitem(last = False)
+	
+	
+	def revoke(self, key: str, expires_at: float):
+		
+		"""
+		
+		Revoke a token in this process.
+		
+		:param key: Hash of the token
+		:type key: str
+		:param expires_at: exp of the token, after which it doesn't need to be remembered
+		:type expires_at: float
+		
+		:return: None
+		:rtype: None
+		
+		"""
+		
+		self._revoked[key] = expires_at
+		self._payloads.pop(key, None)
+	
+	
+	def is_revoked(self, key: str, now: float | None = None) -> bool:
+		
+		"""
+		
+		Check whether a token was revoked.
+		
+		:param key: Hash of the token
+		:type key: str
+		:param now: Current UNIX time (defaults to time.time())
+		:type now: float or None
+		
+		:return: True if the token was revoked
+		:rtype: bool
+		
+		"""
+		
+		expires_at = self._revoked.get(key)
+		
+		if expires_at is None:
+			return False
+		
+		# The token expired anyway, so it no longer needs to be listed
+		if expires_at <= (time.time() if now is None else now):
+			
+			del self._revoked[key]
+			
+			return False
+		
+		return True
+	
+	
+	async def refresh(self):
+		
+		"""
+		
+		Load the tokens revoked since the last load, if a database is attached and the revocation
+		list is stale. If the database can't be reached, the list loaded last is kept until the next
+		refresh, so cached tokens are still served.
+		
+		:return: None
+		:rtype: None
+		
+		"""
+		
+		if self.db is None:
+			return
+		
+		now = time.monotonic()
+		
+		if self._loaded_at is not None and now - self._loaded_at < self.refresh_interval:
+			return
+		
+		# Claimed before awaiting, so concurrent requests don't all load the list
+		self._loaded_at = now
+		
+		try:
+			revoked, self._revoked_since = await self.db.get_revoked_tokens(self._revoked_since)
+		
+		except Exception as e:
+			
+			# Failing here would fail every request while the database is down; tokens revoked by
+			# other workers in the meantime are picked up once it is back (_revoked_since is kept)
+			logging.warning(f"Could not load revoked tokens, retrying in {self.refresh_interval:.0f} s: {e}")
+			return
+		
+		for key, expires_at in revoked:
+			self.revoke(key, expires_at)
+
+
+token_cache = TokenCache()
+
+
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
 	
 	"""
@@ -43,12 +299,14 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
 	return jwt.encode(to_encode, SECRET_KEY, algorithm = ALGORITHM)
 
 
-def verify_token(token: str = Depends(oauth2_scheme)):
+async def verify_token(token: str = Depends(oauth2_scheme)):
 	
 	"""
 	
 	Verify the JWT token and decode its payload.
 	
+	Tokens verified before are served from the token cache until they expire, unless revoked.
+	
 	:param token: JWT token to verify
 	:type token: str
 	
@@ -57,16 +315,116 @@ def verify_token(token: str = Depends(oauth2_scheme)):
 	
 	"""
 	
-	try:
+	key = token_key(token)
+	
+	# Pick up tokens revoked by other workers
+	await token_cache.refresh()
+	
+	if token_cache.is_revoked(key):
+		raise HTTPException(status_code = status.HTTP_401_UNAUTHORIZED, detail = "Invalid or expired token")
+	
+	# Skip the signature check of a token verified before
+	payload = token_cache.get(key)
+	
+	if payload is None:
 		
-		# Decode the token using the secret key and algorithm
-		payload = jwt.decode(token, SECRET_KEY, algorithms = [ALGORITHM])
+		try:
+			
+			# Decode the token using the secret key and algorithm
+			payload = jwt.decode(token, SECRET_KEY, algorithms = [ALGORITHM])
 		
-		# Return the payload
-		return payload
-	
-	# Handle token expiration and invalid token errors
-	except JWTError:
+		# Handle token expiration and invalid token errors
+		except JWTError:
+			
+			# Raise an HTTP exception if the token is invalid or expired
+			raise HTTPException(status_code = status.HTTP_401_UNAUTHORIZED, detail = "Invalid or expired token")
 		
-		# Raise an HTTP exception if the token is invalid or expired
-		raise HTTPException(status_code = status.HTTP_401_UNAUTHORIZED, detail = "Invalid or expired token")
+		token_cache.put(key, payload)
+	
+	# The caller is authenticated: charge the request to their community
+	if token_cache.accounting:
+		token_cache.accounting.attribute(payload.get("community_code"))
+	
+	# Return the payload
+	return payload
+
+
+def require_community(payload: dict, hoa_code: str):
+	
+	"""
+	
+	Check that a user belongs to the community a request is about.
+	
+	:param payload: Decoded JWT token payload
+	:type payload: dict
+	:param hoa_code: HOA code of the community
+	:type hoa_code: str
+	
+	:return: None
+	:rtype: None
+	
+	"""
+	
+	if hoa_code != payload.get("community_code"):
+		raise HTTPException(status_code = status.HTTP_403_FORBIDDEN, detail = "Access to this community is not allowed.")
+
+
+def is_operator(email: str) -> bool:
+	
+	"""
+	
+	Check whether a user operates the service, rather than administering a single community.
+	
+	:param email: User's email address
+	:type email: str
+	
+	:return: True if the email is one of OPERATOR_EMAILS
+	:rtype: bool
+	
+	"""
+	
+	return email.strip().lower() in OPERATOR_EMAILS
+
+
+def require_operator(payload: dict):
+	
+	"""
+	
+	Check that a user operates the service, for actions and data spanning every community.
+	
+	:param payload: Decoded JWT token payload
+	:type payload: dict
+	
+	:return: None
+	:rtype: None
+	
+	"""
+	
+	if not payload.get("is_operator"):
+		raise HTTPException(status_code = status.HTTP_403_FORBIDDEN, detail = "Operator access required.")
+
+
+async def revoke_token(token: str, payload: dict, db = None):
+	
+	"""
+	
+	Revoke a token until it expires, in this process and (with a database) in the other workers.
+	
+	:param token: Encoded JWT token
+	:type token: str
+	:param payload: Verified payload of the token
+	:type payload: dict
+	:param db: Optional Database instance recording the revocation
+	:type db: Database or None
+	
+	:return: None
+	:rtype: None
+	
+	"""
+	
+	key = token_key(token)
+	
+	if db is not None:
+		await db.revoke_token(key, datetime.fromtimestamp(payload["exp"], tz = timezone.utc))
+	
+	token_cache.revoke(key, payload["exp"])
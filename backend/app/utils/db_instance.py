@@ -1,4 +1,6 @@
 from services.db import Database
+from utils.accounting_instance import accounting
+from utils.metrics import metrics
 
 
-db = Database()
+db = Database(metrics = metrics, accounting = accounting)
@@ -0,0 +1,531 @@
+"""
+
+Streaming export/import of document embeddings.
+
+Exports are written as a directory containing:
+	
+	chunks.parquet   metadata and chunk text (one row per chunk)
+	embeddings.npy   contiguous float32 matrix, row i belongs to chunks.parquet row i
+	links.parquet    which shared documents each community links to
+	manifest.json    format version, row count, vector dimension and the HOA codes included
+
+Importing skips the content and documents the database already has, so an export can be imported
+again, or next to an overlapping one, without duplicating chunks.
+
+Usage (from backend/app):
+	
+	python -m utils.embeddings_io export ./dump --hoa-code HOA-520-293-884
+	python -m utils.embeddings_io import ./dump
+
+"""
+
+import argparse
+import asyncio
+import json
+import os
+from datetime import datetime, timezone
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from migrations import apply_migrations
+from services.db import SHARED_HOA_CODE, Database
+
+
+# Number of rows fetched / written per batch
+DEFAULT_BATCH_SIZE = 1000
+
+# Names of the files inside an export directory
+CHUNKS_FILE = "chunks.parquet"
+VECTORS_FILE = "embeddings.npy"
+LINKS_FILE = "links.parquet"
+MANIFEST_FILE = "manifest.json"
+
+# Version of the export layout, bumped whenever the files change (2 added content hashes, sections
+# and links.parquet); imports only read this one
+FORMAT_VERSION = 2
+
+# Arrow schema for the chunk metadata
+CHUNK_SCHEMA = pa.schema(
+		[
+			("hoa_code", pa.string()),
+			("document_type", pa.string()),
+			("content_hash", pa.string()),
+			("chunk_index", pa.int32()),
+			("page_number", pa.int32()),
+			("section", pa.string()),
+			("content", pa.string()),
+			]
+		)
+
+# Arrow schema for the community -> shared document links
+LINK_SCHEMA = pa.schema(
+		[
+			("hoa_code", pa.string()),
+			("document_type", pa.string()),
+			("content_hash", pa.string()),
+			]
+		)
+
+
+async def export_embeddings(
+		db: Database,
+		output_dir: str,
+		hoa_codes: list[str] | None = None,
+		batch_size: int = DEFAULT_BATCH_SIZE,
+		) -> dict:
+	
+	"""
+	
+	Stream document embeddings out of PostgreSQL into an export directory.
+	
+	Rows are read through a server-side cursor, so only one batch is held in memory at a time.
+	Vectors are written straight into a memory-mapped .npy file.
+	
+	:param db: Connected Database instance
+	:type db: Database
+	:param output_dir: Directory to write the export to (created if missing)
+	:type output_dir: str
+	:param hoa_codes: Optional list of HOA codes to export, along with the shared documents they link to.
+		All rows are exported if omitted.
+	:type hoa_codes: list[str] or None
+	:param batch_size: Number of rows fetched per round trip
+	:type batch_size: int
+	
+	:return: The manifest written alongside the export
+	:rtype: dict
+	
+	"""
+	
+	os.makedirs(output_dir, exist_ok = True)
+	
+	# Only filter by HOA code when some were given
+	args = [hoa_codes] if hoa_codes else []
+	links_where = "WHERE hoa_code = ANY($1::text[])" if hoa_codes else ""
+	where_clause = f"""
+		WHERE hoa_code = ANY($1::text[])
+		OR (
+			hoa_code = '{SHARED_HOA_CODE}'
+			AND content_hash IN (SELECT content_hash FROM documents WHERE hoa_code = ANY($1::text[]))
+		)
+	""" if hoa_codes else ""
+	
+	async with db.pool.acquire() as conn:
+		
+		# Server-side cursors only live inside a transaction
+		async with conn.transaction(readonly = True, isolation = "repeatable_read"):
+			
+			# Links are small enough to fetch in one go
+			links = await conn.fetch(
+					f"SELECT hoa_code, document_type, content_hash FROM documents {links_where}",
+					*args
+					)
+			
+			pq.write_table(
+					pa.Table.from_pylist([dict(link) for link in links], schema = LINK_SCHEMA),
+					os.path.join(output_dir, LINKS_FILE),
+					)
+			
+			# Count rows and get the vector dimension up front to size the .npy file
+			stats = await conn.fetchrow(
+					f"""
+					SELECT count(*) AS total, max(vector_dims(embedding)) AS dims
+					FROM document_embeddings
+					{where_clause}
+					""",
+					*args
+					)
+			
+			total = stats["total"]
+			dims = stats["dims"] or 0
+			
+			# Pre-allocate the vector matrix on disk
+			vectors = np.lib.format.open_memmap(
+					os.path.join(output_dir, VECTORS_FILE),
+					mode = "w+",
+					dtype = np.float32,
+					shape = (total, dims),
+					)
+			
+			writer = pq.ParquetWriter(os.path.join(output_dir, CHUNKS_FILE), CHUNK_SCHEMA)
+			
+			try:
+				
+				# Cast the vector to real[] so asyncpg decodes it with its binary float4 codec
+				cursor = conn.cursor(
+						f"""
+						SELECT hoa_code, document_type, content_hash, chunk_index, page_number, section, content,
+							embedding::real[] AS embedding
+						FROM document_embeddings
+						{where_clause}
+						ORDER BY hoa_code, document_type, page_number, chunk_index
+						""",
+						*args,
+						prefetch = batch_size,
+						)
+				
+				written = 0
+				batch = []
+				
+				async for row in cursor:
+					
+					batch.append(row)
+					
+					if len(batch) >= batch_size:
+						written = _write_batch(writer, vectors, batch, written)
+						batch = []
+				
+				# Flush whatever is left over
+				if batch:
+					written = _write_batch(writer, vectors, batch, written)
+			
+			finally:
+				
+				writer.close()
+				vectors.flush()
+				del vectors
+	
+	manifest = {
+		"format_version": FORMAT_VERSION,
+		"rows": written,
+		"dims": dims,
+		"hoa_codes": sorted(hoa_codes) if hoa_codes else None,
+		"exported_at": datetime.now(timezone.utc).isoformat(),
+		}
+	
+	with open(os.path.join(output_dir, MANIFEST_FILE), "w") as f:
+		json.dump(manifest, f, indent = 2)
+	
+	return manifest
+
+
+def _write_batch(writer: pq.ParquetWriter, vectors: np.ndarray, batch: list, offset: int) -> int:
+	
+	"""
+	
+	Write one batch of rows to the Parquet writer and the vector matrix.
+	
+	:param writer: Open Parquet writer for the chunk metadata
+	:type writer: pq.ParquetWriter
+	:param vectors: Memory-mapped vector matrix
+	:type vectors: np.ndarray
+	:param batch: Rows fetched from the cursor
+	:type batch: list
+	:param offset: Index of the first row of this batch in the export
+	:type offset: int
+	
+	:return: Offset of the next batch
+	:rtype: int
+	
+	"""
+	
+	table = pa.Table.from_pydict(
+			{
+				"hoa_code": [row["hoa_code"] for row in batch],
+				"document_type": [row["document_type"] for row in batch],
+				"content_hash": [row["content_hash"] for row in batch],
+				"chunk_index": [row["chunk_index"] for row in batch],
+				"page_number": [row["page_number"] for row in batch],
+				"section": [row["section"] for row in batch],
+				"content": [row["content"] for row in batch],
+				},
+			schema = CHUNK_SCHEMA,
+			)
+	
+	writer.write_table(table)
+	
+	# Copy the vectors into their rows of the matrix
+	vectors[offset:offset + len(batch)] = np.asarray([row["embedding"] for row in batch], dtype = np.float32)
+	
+	return offset + len(batch)
+
+
+async def import_embeddings(
+		db: Database,
+		input_dir: str,
+		hoa_codes: list[str] | None = None,
+		batch_size: int = DEFAULT_BATCH_SIZE,
+		) -> int:
+	
+	"""
+	
+	Bulk-restore an export directory into the document_embeddings table.
+	
+	Batches are streamed with COPY into a temporary staging table and moved into place with a
+	single INSERT ... SELECT per batch. Shared documents are restored with their links, for the
+	communities that exist in the target database. No embedding API calls are made.
+	
+	Shared content already stored, and private documents a community already has chunks of, are
+	skipped, so their chunks and counts aren't duplicated.
+	
+	:param db: Connected Database instance
+	:type db: Database
+	:param input_dir: Directory produced by export_embeddings
+	:type input_dir: str
+	:param hoa_codes: Optional list of HOA codes to restore. Everything in the export is restored if omitted.
+	:type hoa_codes: list[str] or None
+	:param batch_size: Number of rows copied per batch
+	:type batch_size: int
+	
+	:return: Number of rows restored
+	:rtype: int
+	
+	"""
+	
+	with open(os.path.join(input_dir, MANIFEST_FILE)) as f:
+		manifest = json.load(f)
+	
+	if manifest.get("format_version") != FORMAT_VERSION:
+		raise ValueError(
+				f"Unsupported export format version {manifest.get('format_version')} "
+				f"(expected {FORMAT_VERSION}); export the data again with this version."
+				)
+	
+	# Memory-map the vectors so only the rows of the current batch are paged in
+	vectors = np.load(os.path.join(input_dir, VECTORS_FILE), mmap_mode = "r")
+	
+	if vectors.shape[0] != manifest["rows"]:
+		raise ValueError(
+				f"Export is inconsistent: {vectors.shape[0]} vectors for {manifest['rows']} rows."
+				)
+	
+	parquet = pq.ParquetFile(os.path.join(input_dir, CHUNKS_FILE))
+	wanted = set(hoa_codes) if hoa_codes else None
+	
+	# Keep the links of the wanted communities, and the shared content they point to
+	links = [
+		link for link in pq.read_table(os.path.join(input_dir, LINKS_FILE)).to_pylist()
+		if wanted is None or link["hoa_code"] in wanted
+		]
+	wanted_hashes = {link["content_hash"] for link in links}
+	restored_hashes = set()
+	restored = 0
+	
+	# Content and private documents found in the database before the import, and those checked
+	skipped = set()
+	checked = set()
+	offset = 0
+	
+	async with db.pool.acquire() as conn:
+		
+		async with conn.transaction():
+			
+			# Staging table uses real[] so COPY can use asyncpg's binary codecs
+			await conn.execute(
+					"""
+					CREATE TEMPORARY TABLE document_embeddings_import (
+					hoa_code VARCHAR(50),
+					document_type VARCHAR(100),
+					content_hash VARCHAR(64),
+					chunk_index INTEGER,
+					page_number INTEGER,
+					section TEXT,
+					content TEXT,
+					embedding REAL[]
+					) ON COMMIT DROP
+					"""
+					)
+			
+			for record_batch in parquet.iter_batches(batch_size = batch_size):
+				
+				columns = record_batch.to_pydict()
+				count = record_batch.num_rows
+				batch_vectors = vectors[offset:offset + count]
+				offset += count
+				
+				records = [
+					(
+						columns["hoa_code"][i],
+						columns["document_type"][i],
+						columns["content_hash"][i],
+						columns["chunk_index"][i],
+						columns["page_number"][i],
+						columns["section"][i],
+						columns["content"][i],
+						batch_vectors[i].tolist(),
+						)
+					for i in range(count)
+					if wanted is None
+					or columns["hoa_code"][i] in wanted
+					or (columns["hoa_code"][i] == SHARED_HOA_CODE and columns["content_hash"][i] in wanted_hashes)
+					]
+				
+				keys = {_stored_as(record) for record in records}
+				skipped |= await _find_stored(conn, keys - checked)
+				checked |= keys
+				records = [record for record in records if _stored_as(record) not in skipped]
+				
+				if not records:
+					continue
+				
+				await conn.copy_records_to_table("document_embeddings_import", records = records)
+				
+				# Register the shared content the batch belongs to
+				await conn.execute(
+						"""
+						INSERT INTO document_contents (content_hash, chunk_count, page_count)
+						SELECT content_hash, count(*), max(page_number)
+						FROM document_embeddings_import
+						WHERE content_hash IS NOT NULL
+						GROUP BY content_hash
+						ON CONFLICT (content_hash)
+						DO UPDATE SET
+							chunk_count = document_contents.chunk_count + EXCLUDED.chunk_count,
+							page_count = GREATEST(document_contents.page_count, EXCLUDED.page_count)
+						"""
+						)
+				
+				# Move the batch into the real table, casting the arrays back to vectors
+				await conn.execute(
+						"""
+						INSERT INTO document_embeddings (
+						hoa_code, document_type, content_hash, chunk_index, page_number, section, content, embedding
+						)
+						SELECT hoa_code, document_type, content_hash, chunk_index, page_number, section, content,
+							embedding::vector
+						FROM document_embeddings_import
+						"""
+						)
+				
+				await conn.execute("TRUNCATE document_embeddings_import")
+				
+				restored_hashes.update(record[2] for record in records if record[0] == SHARED_HOA_CODE)
+				restored += len(records)
+			
+			# Centroids are derived data, so they are rebuilt rather than exported
+			if restored_hashes:
+				await Database.build_centroids(conn, sorted(restored_hashes))
+			
+			# Restore the links of the communities that exist in this database
+			await conn.execute(
+					"""
+					INSERT INTO documents (hoa_code, document_type, content_hash)
+					SELECT t.hoa_code, t.document_type, t.content_hash
+					FROM UNNEST($1::text[], $2::text[], $3::text[]) AS t(hoa_code, document_type, content_hash)
+					WHERE EXISTS (SELECT 1 FROM communities WHERE code = t.hoa_code)
+					AND EXISTS (SELECT 1 FROM document_contents WHERE content_hash = t.content_hash)
+					ON CONFLICT (hoa_code, document_type) DO NOTHING
+					""",
+					[link["hoa_code"] for link in links],
+					[link["document_type"] for link in links],
+					[link["content_hash"] for link in links],
+					)
+	
+	return restored
+
+
+def _stored_as(record: tuple) -> tuple[str, str]:
+	
+	"""
+	
+	Get what an imported row belongs to: its shared content, or its community's private document.
+	
+	:param record: Row as copied to the staging table
+	:type record: tuple
+	
+	:return: (SHARED_HOA_CODE, content hash) or (HOA code, document type)
+	:rtype: tuple[str, str]
+	
+	"""
+	
+	hoa_code, document_type, content_hash = record[:3]
+	
+	return (hoa_code, content_hash) if hoa_code == SHARED_HOA_CODE else (hoa_code, document_type)
+
+
+async def _find_stored(conn, keys: set[tuple[str, str]]) -> set[tuple[str, str]]:
+	
+	"""
+	
+	Find which of the content and private documents of an import the database already has.
+	
+	:param conn: Connection of the import
+	:type conn: asyncpg.Connection
+	:param keys: Values of _stored_as
+	:type keys: set[tuple[str, str]]
+	
+	:return: The keys already stored
+	:rtype: set[tuple[str, str]]
+	
+	"""
+	
+	content_hashes = [key[1] for key in keys if key[0] == SHARED_HOA_CODE]
+	documents = [key for key in keys if key[0] != SHARED_HOA_CODE]
+	found = set()
+	
+	if content_hashes:
+		
+		rows = await conn.fetch(
+				"SELECT content_hash FROM document_contents WHERE content_hash = ANY($1::text[])",
+				content_hashes,
+				)
+		found.update((SHARED_HOA_CODE, row["content_hash"]) for row in rows)
+	
+	if documents:
+		
+		rows = await conn.fetch(
+				"""
+				SELECT DISTINCT e.hoa_code, e.document_type
+				FROM UNNEST($1::text[], $2::text[]) AS t(hoa_code, document_type)
+				JOIN document_embeddings e ON e.hoa_code = t.hoa_code AND e.document_type = t.document_type
+				""",
+				[key[0] for key in documents],
+				[key[1] for key in documents],
+				)
+		found.update((row["hoa_code"], row["document_type"]) for row in rows)
+	
+	return found
+
+
+async def main(argv: list[str] | None = None):
+	
+	"""
+	
+	Command line entry point.
+	
+	:param argv: Command line arguments (defaults to sys.argv)
+	:type argv: list[str] or None
+	
+	:return: None
+	:rtype: None
+	
+	"""
+	
+	parser = argparse.ArgumentParser(description = "Export or import document embeddings.")
+	parser.add_argument("command", choices = ["export", "import"])
+	parser.add_argument("path", help = "Export directory")
+	parser.add_argument(
+			"--hoa-code",
+			action = "append",
+			dest = "hoa_codes",
+			help = "Restrict to this HOA code (can be repeated)",
+			)
+	parser.add_argument("--batch-size", type = int, default = DEFAULT_BATCH_SIZE)
+	args = parser.parse_args(argv)
+	
+	db = Database()
+	await db.connect()
+	
+	try:
+		
+		if args.command == "export":
+			
+			manifest = await export_embeddings(db, args.path, args.hoa_codes, args.batch_size)
+			print(f"Exported {manifest['rows']} rows to {args.path}")
+		
+		else:
+			
+			# Make sure the target tables exist on a fresh database
+			await apply_migrations(db)
+			
+			restored = await import_embeddings(db, args.path, args.hoa_codes, args.batch_size)
+			print(f"Imported {restored} rows from {args.path}")
+	
+	finally:
+		
+		await db.disconnect()
+
+
+if __name__ == "__main__":
+	asyncio.run(main())
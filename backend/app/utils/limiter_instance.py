@@ -0,0 +1,18 @@
+import os
+
+from utils.metrics import metrics
+from utils.rate_limiter import RateLimiter
+
+
+# Budget of the OpenAI organization, shared by every embedding and completion request of the server
+OPENAI_REQUESTS_PER_MINUTE = int(os.getenv("OPENAI_REQUESTS_PER_MINUTE", "3000"))
+OPENAI_TOKENS_PER_MINUTE = int(os.getenv("OPENAI_TOKENS_PER_MINUTE", "1000000"))
+
+# Each worker process limits itself to its share of the budget (WEB_CONCURRENCY is set by server.py)
+WEB_CONCURRENCY = max(1, int(os.getenv("WEB_CONCURRENCY", "1")))
+
+openai_limiter = RateLimiter(
+		max(1, OPENAI_REQUESTS_PER_MINUTE // WEB_CONCURRENCY),
+		max(1, OPENAI_TOKENS_PER_MINUTE // WEB_CONCURRENCY),
+		metrics = metrics,
+		)
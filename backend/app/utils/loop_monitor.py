@@ -0,0 +1,342 @@
+"""
+
+Event loop monitor: measures how late the event loop runs its callbacks, and catches the code
+that blocks it.
+
+A heartbeat task sleeps for a short interval and records how much later than asked it woke up
+(event_loop_lag_seconds). A watchdog thread checks the heartbeat: when the loop hasn't beaten for
+longer than the threshold, the callback running on it is blocking everything else, so the
+watchdog takes the stack of the loop's thread and the route of the request being served. The
+report is logged (and kept for /admin/event_loop) once the loop recovers.
+
+Opt-in with LOOP_MONITOR=true. With LOOP_MONITOR_STRICT=true (for tests), a request that blocked
+the loop longer than the threshold raises EventLoopBlockedError once it completes.
+
+"""
+
+import asyncio
+import logging
+import os
+import sys
+import threading
+import time
+import traceback
+import weakref
+from collections import deque
+
+
+# Run the monitor
+LOOP_MONITOR = os.getenv("LOOP_MONITOR", "false").lower() == "true"
+
+# Fail requests that blocked the loop (for tests)
+LOOP_MONITOR_STRICT = os.getenv("LOOP_MONITOR_STRICT", "false").lower() == "true"
+
+# Milliseconds the loop may be blocked before the blocking code is captured
+LOOP_BLOCK_THRESHOLD_MS = float(os.getenv("LOOP_BLOCK_THRESHOLD_MS", "100"))
+
+# Seconds between two heartbeats
+LOOP_LAG_INTERVAL = float(os.getenv("LOOP_LAG_INTERVAL", "0.05"))
+
+# Blocking reports kept in memory
+LOOP_BLOCK_REPORTS = int(os.getenv("LOOP_BLOCK_REPORTS", "50"))
+
+# Innermost stack frames kept in a report
+STACK_DEPTH = 30
+
+
+class EventLoopBlockedError(RuntimeError):
+	
+	"""
+	
+	Raised in strict mode by a request that blocked the event loop longer than the threshold.
+	
+	"""
+
+
+class LoopMonitor:
+	
+	"""
+	
+	Heartbeat task and watchdog thread of one event loop.
+	
+	A report is a dict with started_at (UNIX time), blocked_ms, route ("METHOD /path/template", or
+	None outside of a request) and stack (formatted frames of the loop's thread, innermost last).
+	
+	"""
+	
+	def __init__(
+			self,
+			threshold_ms: float = LOOP_BLOCK_THRESHOLD_MS,
+			interval: float = LOOP_LAG_INTERVAL,
+			strict: bool = LOOP_MONITOR_STRICT,
+			reports: int = LOOP_BLOCK_REPORTS,
+			):
+		
+		"""
+		
+		Initialize the LoopMonitor class.
+		
+		:param threshold_ms: Milliseconds the loop may be blocked before the blocking code is captured
+		:type threshold_ms: float
+		:param interval: Seconds between two heartbeats
+		:type interval: float
+		:param strict: Whether requests that blocked the loop raise EventLoopBlockedError
+		:type strict: bool
+		:param reports: Blocking reports kept in memory
+		:type reports: int
+		
+		"""
+		
+		self.threshold = threshold_ms / 1000
+		self.interval = interval
+		self.strict = strict
+		self.metrics = None
+		self.reports = deque(maxlen = reports)
+		
+		self._loop = None
+		self._loop_thread = None
+		self._task = None
+		self._watchdog = None
+		self._stopped = threading.Event()
+		
+		# Time of the last heartbeat, and the report of the block in progress (written by the watchdog)
+		self._beat = time.monotonic()
+		self._open = None
+		
+		# Scope of the request each task is serving, and the reports of requests that blocked (strict mode)
+		self._requests = weakref.WeakKeyDictionary()
+		self._blocked = weakref.WeakKeyDictionary()
+	
+	
+	async def start(self, metrics = None):
+		
+		"""
+		
+		Start monitoring the running event loop.
+		
+		:param metrics: Registry to export the lag and blocking counts to, or None
+		:type metrics: Metrics or None
+		
+		:return: None
+		:rtype: None
+		
+		"""
+		
+		self.metrics = metrics
+		self._loop = asyncio.get_running_loop()
+		self._loop_thread = threading.get_ident()
+		self._beat = time.monotonic()
+		self._stopped.clear()
+		
+		self._task = asyncio.create_task(self._heartbeat())
+		self._watchdog = threading.Thread(target = self._watch, name = "loop-watchdog", daemon = True)
+		self._watchdog.start()
+	
+	
+	async def stop(self):
+		
+		"""
+		
+		Stop the heartbeat and the watchdog.
+		
+		:return: None
+		:rtype: None
+		
+		"""
+		
+		self._stopped.set()
+		
+		if self._task:
+			
+			self._task.cancel()
+			await asyncio.gather(self._task, return_exceptions = True)
+			self._task = None
+		
+		if self._watchdog:
+			
+			self._watchdog.join()
+			self._watchdog = None
+	
+	
+	def serving(self, scope: dict):
+		
+		"""
+		
+		Mark the current task as serving a request.
+		
+		:param scope: ASGI scope of the request
+		:type scope: dict
+		
+		:return: The task, to pass to served()
+		:rtype: asyncio.Task
+		
+		"""
+		
+		task = asyncio.current_task()
+		self._requests[task] = scope
+		
+		return task
+	
+	
+	def served(self, task):
+		
+		"""
+		
+		Mark a task as done with its request.
+		
+		:param task: Task returned by serving()
+		:type task: asyncio.Task
+		
+		:return: Report of the longest block the request caused, or None
+		:rtype: dict or None
+		
+		"""
+		
+		# The request may finish right after blocking, before the heartbeat had a chance to run
+		report = self._open
+		
+		if report is not None and report["task"] is task:
+			
+			now = time.monotonic()
+			self._open = None
+			self._close(report, now - self._beat - self.interval)
+			self._beat = now
+		
+		self._requests.pop(task, None)
+		
+		return self._blocked.pop(task, None)
+	
+	
+	async def _heartbeat(self):
+		
+		while True:
+			
+			expected = time.monotonic() + self.interval
+			
+			await asyncio.sleep(self.interval)
+			
+			now = time.monotonic()
+			lag = max(0.0, now - expected)
+			self._beat = now
+			
+			if self.metrics:
+				self.metrics.observe("event_loop_lag_seconds", lag)
+			
+			# The watchdog caught the loop blocked; it ran until just before this heartbeat
+			report, self._open = self._open, None
+			
+			if report:
+				self._close(report, lag)
+	
+	
+	def _watch(self):
+		
+		# Runs on its own thread, so it keeps running while the loop is blocked
+		while not self._stopped.wait(min(self.interval, self.threshold) / 2):
+			
+			stalled = time.monotonic() - self._beat - self.interval
+			
+			if stalled > self.threshold and self._open is None:
+				self._open = self._capture()
+	
+	
+	def _capture(self) -> dict:
+		
+		frame = sys._current_frames().get(self._loop_thread)
+		
+		try:
+			
+			task = asyncio.current_task(self._loop)
+		
+		except RuntimeError:
+			
+			task = None
+		
+		scope = self._requests.get(task) if task else None
+		
+		return {
+			"started_at": time.time() - (time.monotonic() - self._beat - self.interval),
+			"blocked_ms": None,
+			"route": self._route(scope),
+			"stack": traceback.format_stack(frame)[-STACK_DEPTH:] if frame else [],
+			"task": task,
+			}
+	
+	
+	@staticmethod
+	def _route(scope: dict | None) -> str | None:
+		
+		if scope is None:
+			return None
+		
+		# FastAPI adds the matched route to the scope; before routing, only the raw path is known
+		route = scope.get("route")
+		
+		return f"{scope.get('method', 'WS')} {getattr(route, 'path', scope.get('path'))}"
+	
+	
+	def _close(self, report: dict, blocked: float):
+		
+		task = report.pop("task")
+		report["blocked_ms"] = round(max(blocked, self.threshold) * 1000, 1)
+		
+		self.reports.append(report)
+		
+		if self.metrics:
+			self.metrics.increment("event_loop_blocked_total", route = report["route"] or "background")
+		
+		logging.warning(
+				f"Event loop blocked for {report['blocked_ms']:.0f} ms by {report['route'] or 'a background task'}:\n"
+				+ "".join(report["stack"])
+				)
+		
+		if task is not None and task in self._requests:
+			
+			previous = self._blocked.get(task)
+			
+			if previous is None or previous["blocked_ms"] < report["blocked_ms"]:
+				self._blocked[task] = report
+
+
+class LoopMonitorMiddleware:
+	
+	"""
+	
+	ASGI middleware telling the monitor which request each task is serving.
+	
+	Plain ASGI rather than BaseHTTPMiddleware, so the endpoint runs in the same task as the
+	middleware and blocks are attributed to the right request.
+	
+	"""
+	
+	def __init__(self, app, monitor: LoopMonitor):
+		
+		self.app = app
+		self.monitor = monitor
+	
+	
+	async def __call__(self, scope, receive, send):
+		
+		if scope["type"] not in ("http", "websocket"):
+			return await self.app(scope, receive, send)
+		
+		task = self.monitor.serving(scope)
+		
+		try:
+			
+			await self.app(scope, receive, send)
+		
+		finally:
+			
+			blocked = self.monitor.served(task)
+		
+		if blocked and self.monitor.strict:
+			
+			raise EventLoopBlockedError(
+					f"{blocked['route']} blocked the event loop for {blocked['blocked_ms']:.0f} ms "
+					f"(threshold {self.monitor.threshold * 1000:.0f} ms):\n" + "".join(blocked["stack"])
+					)
+
+
+# Process-wide monitor, started by the app's lifespan when LOOP_MONITOR is set
+loop_monitor = LoopMonitor()
@@ -0,0 +1,634 @@
+"""
+
+Database maintenance: size, bloat and index-health reports, and throttled VACUUM (ANALYZE) and
+REINDEX CONCURRENTLY.
+
+Reports are printed as JSON for dashboards (--format jsonl prints one record per line, with a
+"kind" field); vacuum and reindex print a JSON line per table or index as it completes. Bloat is
+measured with the pgstattuple extension when it is installed (CREATE EXTENSION pgstattuple), and
+estimated from dead tuple counts otherwise.
+
+Usage (from backend/app):
+	
+	python -m utils.maintenance report
+	python -m utils.maintenance communities --community HOA-520-293-884
+	python -m utils.maintenance tables
+	python -m utils.maintenance indexes
+	python -m utils.maintenance vacuum --min-dead-ratio 0.1 --pause 5
+	python -m utils.maintenance reindex --index document_embeddings_default_0_content_hash_idx
+
+"""
+
+import asyncio
+import json
+import os
+import sys
+import time
+from datetime import datetime, timezone
+
+
+# Tables vacuumed by default once this share of their tuples is dead
+VACUUM_MIN_DEAD_RATIO = float(os.getenv("MAINTENANCE_VACUUM_MIN_DEAD_RATIO", "0.1"))
+
+# Cost-based throttling of manual VACUUM, which is unthrottled by default (milliseconds, cost units)
+VACUUM_COST_DELAY = float(os.getenv("MAINTENANCE_VACUUM_COST_DELAY", "2"))
+VACUUM_COST_LIMIT = int(os.getenv("MAINTENANCE_VACUUM_COST_LIMIT", "200"))
+
+# B-tree indexes rebuilt by default below this average leaf density (percent, pgstattuple only)
+REINDEX_MAX_LEAF_DENSITY = float(os.getenv("MAINTENANCE_REINDEX_MAX_LEAF_DENSITY", "60"))
+
+# Seconds to wait between two operations, to leave room for the regular workload (and replication)
+MAINTENANCE_PAUSE = float(os.getenv("MAINTENANCE_PAUSE", "5"))
+
+# Relations below this size aren't scanned by pgstattuple
+BLOAT_SCAN_MIN_BYTES = int(os.getenv("MAINTENANCE_BLOAT_SCAN_MIN_BYTES", str(8 * 2 ** 20)))
+
+
+async def has_pgstattuple(conn) -> bool:
+	
+	"""
+	
+	Check whether the pgstattuple extension is installed.
+	
+	:param conn: Database connection
+	:type conn: asyncpg.Connection
+	
+	:return: True if bloat can be measured instead of estimated
+	:rtype: bool
+	
+	"""
+	
+	return bool(await conn.fetchval("SELECT 1 FROM pg_extension WHERE extname = 'pgstattuple'"))
+
+
+def attribute_community_sizes(groups: list[dict], links: list[dict], communities: set[str], shared_hoa_code: str) -> list[dict]:
+	
+	"""
+	
+	Attribute chunk rows and bytes to communities.
+	
+	Private chunks belong to the community whose HOA code they carry. Shared content is counted
+	in full for every community linking to it ("linked"), and split evenly between them
+	("attributed"), so the attributed bytes of all communities add up to the table.
+	
+	:param groups: Rows, embedding_bytes and content_bytes per hoa_code and content_hash
+	:type groups: list[dict]
+	:param links: hoa_code and content_hash of every catalog entry
+	:type links: list[dict]
+	:param communities: HOA codes of the existing communities
+	:type communities: set[str]
+	:param shared_hoa_code: HOA code of the shared content
+	:type shared_hoa_code: str
+	
+	:return: One dict per HOA code, largest first
+	:rtype: list[dict]
+	
+	"""
+	
+	linkers = {}
+	
+	for link in links:
+		linkers.setdefault(link["content_hash"], set()).add(link["hoa_code"])
+	
+	sizes = {}
+	
+	def entry(hoa_code: str) -> dict:
+		
+		return sizes.setdefault(
+				hoa_code,
+				{
+					"hoa_code": hoa_code,
+					"community_exists": hoa_code in communities,
+					"documents": 0,
+					"private_rows": 0,
+					"private_bytes": 0,
+					"linked_rows": 0,
+					"linked_bytes": 0,
+					"attributed_bytes": 0,
+					}
+				)
+	
+	for hoa_code in communities:
+		entry(hoa_code)
+	
+	for link in links:
+		entry(link["hoa_code"])["documents"] += 1
+	
+	for group in groups:
+		
+		group_bytes = group["embedding_bytes"] + group["content_bytes"]
+		
+		if group["hoa_code"] != shared_hoa_code:
+			
+			item = entry(group["hoa_code"])
+			item["private_rows"] += group["rows"]
+			item["private_bytes"] += group_bytes
+			item["attributed_bytes"] += group_bytes
+			
+			continue
+		
+		owners = linkers.get(group["content_hash"], set())
+		
+		# Shared content no community links to any more is left for the orphan sweeper
+		if not owners:
+			owners = {shared_hoa_code}
+		
+		for hoa_code in owners:
+			
+			item = entry(hoa_code)
+			item["linked_rows"] += group["rows"]
+			item["linked_bytes"] += group_bytes
+			item["attributed_bytes"] += group_bytes // len(owners)
+	
+	return sorted(sizes.values(), key = lambda item: item["attributed_bytes"], reverse = True)
+
+
+async def community_sizes(db, hoa_code: str | None = None) -> list[dict]:
+	
+	"""
+	
+	Report chunk rows and bytes per community (see attribute_community_sizes).
+	
+	Bytes are the stored (possibly compressed or TOASTed) sizes of the embedding and chunk text
+	columns. This reads all of document_embeddings, or only the community's rows and the content it
+	links to when hoa_code is given.
+	
+	:param db: Connected Database instance
+	:type db: Database
+	:param hoa_code: HOA code to report on, or None for every community
+	:type hoa_code: str or None
+	
+	:return: One dict per HOA code, largest first
+	:rtype: list[dict]
+	
+	"""
+	
+	from services.db import SHARED_HOA_CODE
+	
+	async with db.acquire("ingestion") as conn:
+		
+		if hoa_code:
+			
+			links = await conn.fetch(
+					"""
+					SELECT hoa_code, content_hash
+					FROM documents
+					WHERE content_hash IN (SELECT content_hash FROM documents WHERE hoa_code = $1)
+					""",
+					hoa_code,
+					)
+			communities = {hoa_code} if await conn.fetchval("SELECT 1 FROM communities WHERE code = $1", hoa_code) else set()
+		
+		else:
+			
+			links = await conn.fetch("SELECT hoa_code, content_hash FROM documents")
+			communities = {row["code"] for row in await conn.fetch("SELECT code FROM communities")}
+		
+		# One pass over the chunks; pg_column_size reads the stored size without detoasting
+		groups = await conn.fetch(
+				"""
+				SELECT hoa_code, content_hash, count(*) AS rows,
+					coalesce(sum(pg_column_size(embedding)), 0)::bigint AS embedding_bytes,
+					coalesce(sum(pg_column_size(content)), 0)::bigint AS content_bytes
+				FROM document_embeddings
+				WHERE $1::text IS NULL
+					OR hoa_code = $1
+					OR (hoa_code = $2 AND content_hash IN (SELECT content_hash FROM documents WHERE hoa_code = $1))
+				GROUP BY hoa_code, content_hash
+				""",
+				hoa_code,
+				SHARED_HOA_CODE,
+				timeout = None,
+				)
+	
+	sizes = attribute_community_sizes([dict(row) for row in groups], [dict(row) for row in links], communities, SHARED_HOA_CODE)
+	
+	if hoa_code:
+		
+		# Other communities sharing its content only appear for the split
+		sizes = [item for item in sizes if item["hoa_code"] == hoa_code]
+	
+	return sizes
+
+
+async def table_health(db) -> list[dict]:
+	
+	"""
+	
+	Report the size and bloat of every table (and partition) of the app.
+	
+	Sizes are split into heap, TOAST (chunk text and embeddings) and indexes. Dead tuples and the
+	last (auto)vacuum and (auto)analyze come from the statistics collector. bloat_bytes is measured
+	with pgstattuple_approx on tables above BLOAT_SCAN_MIN_BYTES when available (bloat_source
+	"pgstattuple"), and estimated as the dead share of the heap otherwise ("estimate").
+	
+	:param db: Connected Database instance
+	:type db: Database
+	
+	:return: One dict per table, largest first
+	:rtype: list[dict]
+	
+	"""
+	
+	async with db.acquire("ingestion") as conn:
+		
+		rows = await conn.fetch(
+				"""
+				SELECT s.relid::regclass::text AS "table",
+					pg_total_relation_size(s.relid) AS total_bytes,
+					pg_relation_size(s.relid) AS heap_bytes,
+					coalesce(pg_total_relation_size(nullif(c.reltoastrelid, 0)), 0) AS toast_bytes,
+					pg_indexes_size(s.relid) AS index_bytes,
+					s.n_live_tup AS live_tuples,
+					s.n_dead_tup AS dead_tuples,
+					coalesce(t.n_dead_tup, 0) AS toast_dead_tuples,
+					coalesce(s.n_dead_tup::float8 / nullif(s.n_live_tup + s.n_dead_tup, 0), 0) AS dead_ratio,
+					s.n_mod_since_analyze AS modified_since_analyze,
+					greatest(s.last_vacuum, s.last_autovacuum) AS last_vacuum,
+					greatest(s.last_analyze, s.last_autoanalyze) AS last_analyze
+				FROM pg_stat_user_tables s
+				JOIN pg_class c ON c.oid = s.relid
+				LEFT JOIN pg_stat_all_tables t ON t.relid = c.reltoastrelid
+				WHERE c.relkind IN ('r', 'm')
+				ORDER BY total_bytes DESC
+				"""
+				)
+		
+		tables = [dict(row) for row in rows]
+		measure = await has_pgstattuple(conn)
+		
+		for table in tables:
+			
+			table["bloat_source"] = "estimate"
+			table["bloat_bytes"] = int(table["heap_bytes"] * table["dead_ratio"])
+			
+			if measure and table["heap_bytes"] >= BLOAT_SCAN_MIN_BYTES:
+				
+				# Reads the pages the visibility map doesn't mark all-visible
+				stats = await conn.fetchrow(
+						"SELECT dead_tuple_len, approx_free_space FROM pgstattuple_approx($1::regclass)",
+						table["table"],
+						timeout = None,
+						)
+				
+				table["bloat_source"] = "pgstattuple"
+				table["bloat_bytes"] = stats["dead_tuple_len"] + stats["approx_free_space"]
+			
+			table["bloat_ratio"] = table["bloat_bytes"] / table["heap_bytes"] if table["heap_bytes"] else 0.0
+	
+	return tables
+
+
+async def index_health(db) -> list[dict]:
+	
+	"""
+	
+	Report the size, usage and bloat of every index of the app.
+	
+	An index is flagged "unused" when it was never scanned since the statistics were reset and
+	doesn't enforce a constraint, and "invalid" when a failed CREATE or REINDEX CONCURRENTLY left it
+	behind (it is maintained on writes but never used, so it should be dropped). B-tree leaf
+	density comes from pgstatindex when available; HNSW indexes report their bytes per row instead.
+	
+	:param db: Connected Database instance
+	:type db: Database
+	
+	:return: One dict per index, largest first
+	:rtype: list[dict]
+	
+	"""
+	
+	async with db.acquire("ingestion") as conn:
+		
+		rows = await conn.fetch(
+				"""
+				SELECT s.indexrelid::regclass::text AS index,
+					s.relid::regclass::text AS "table",
+					am.amname AS method,
+					pg_relation_size(s.indexrelid) AS bytes,
+					greatest(c.reltuples, 0)::bigint AS rows,
+					s.idx_scan AS scans,
+					s.idx_tup_read AS tuples_read,
+					s.idx_tup_fetch AS tuples_fetched,
+					x.indisunique OR x.indisprimary OR x.indisexclusion AS enforces_constraint,
+					x.indisvalid AS valid
+				FROM pg_stat_user_indexes s
+				JOIN pg_index x ON x.indexrelid = s.indexrelid
+				JOIN pg_class c ON c.oid = s.indexrelid
+				JOIN pg_am am ON am.oid = c.relam
+				ORDER BY bytes DESC
+				"""
+				)
+		
+		indexes = [dict(row) for row in rows]
+		measure = await has_pgstattuple(conn)
+		
+		for index in indexes:
+			
+			index["unused"] = index["scans"] == 0 and not index["enforces_constraint"]
+			index["invalid"] = not index["valid"]
+			index["bytes_per_row"] = index["bytes"] // index["rows"] if index["rows"] else None
+			index["leaf_density"] = None
+			
+			if measure and index["method"] == "btree" and index["valid"] and index["bytes"] >= BLOAT_SCAN_MIN_BYTES:
+				
+				# Reads the whole index
+				index["leaf_density"] = await conn.fetchval(
+						"SELECT avg_leaf_density FROM pgstatindex($1::regclass)",
+						index["index"],
+						timeout = None,
+						)
+	
+	return indexes
+
+
+async def report(db, communities: bool = True) -> dict:
+	
+	"""
+	
+	Build the full report: tables, indexes and, unless skipped, community sizes.
+	
+	:param db: Connected Database instance
+	:type db: Database
+	:param communities: Whether to include the community sizes (a full scan of the chunks)
+	:type communities: bool
+	
+	:return: Dict with generated_at, stats_reset, tables, indexes and communities
+	:rtype: dict
+	
+	"""
+	
+	async with db.acquire("ingestion") as conn:
+		
+		# Scan counts are relative to this
+		stats_reset = await conn.fetchval("SELECT stats_reset FROM pg_stat_database WHERE datname = current_database()")
+	
+	return {
+		"generated_at": datetime.now(timezone.utc),
+		"stats_reset": stats_reset,
+		"tables": await table_health(db),
+		"indexes": await index_health(db),
+		"communities": await community_sizes(db) if communities else None,
+		}
+
+
+async def vacuum(
+		db,
+		tables: list[str] | None = None,
+		min_dead_ratio: float = VACUUM_MIN_DEAD_RATIO,
+		pause: float = MAINTENANCE_PAUSE,
+		cost_delay: float = VACUUM_COST_DELAY,
+		cost_limit: int = VACUUM_COST_LIMIT,
+		):
+	
+	"""
+	
+	Run VACUUM (ANALYZE) on the given tables, or on those with enough dead tuples, one at a time.
+	
+	Each table's TOAST table is vacuumed with it. Partitions are vacuumed one by one (rather than
+	through document_embeddings) so the pause applies between them.
+	
+	:param db: Connected Database instance
+	:type db: Database
+	:param tables: Tables to vacuum, or None to pick them by dead tuple ratio
+	:type tables: list[str] or None
+	:param min_dead_ratio: Share of dead tuples above which a table is picked
+	:type min_dead_ratio: float
+	:param pause: Seconds to wait between two tables
+	:type pause: float
+	:param cost_delay: vacuum_cost_delay of the session in milliseconds (0 disables throttling)
+	:type cost_delay: float
+	:param cost_limit: vacuum_cost_limit of the session
+	:type cost_limit: int
+	
+	:return: Async iterator of one dict per vacuumed table
+	:rtype: AsyncIterator[dict]
+	
+	"""
+	
+	health = {table["table"]: table for table in await table_health(db)}
+	
+	if tables is None:
+		targets = [name for name, table in health.items() if table["dead_ratio"] >= min_dead_ratio]
+	
+	else:
+		
+		unknown = [name for name in tables if name not in health]
+		
+		# Names are interpolated, so only accept those the catalog returned
+		if unknown:
+			raise ValueError(f"Unknown tables: {', '.join(unknown)}")
+		
+		targets = tables
+	
+	for position, name in enumerate(targets):
+		
+		if position:
+			await asyncio.sleep(pause)
+		
+		async with db.acquire("ingestion") as conn:
+			
+			# Session settings, reset when the connection goes back to the pool
+			await conn.execute("SET statement_timeout = 0")
+			await conn.execute(f"SET vacuum_cost_delay = {float(cost_delay)}")
+			await conn.execute(f"SET vacuum_cost_limit = {int(cost_limit)}")
+			
+			started = time.perf_counter()
+			
+			await conn.execute(f"VACUUM (ANALYZE) {name}", timeout = None)
+			
+			yield {
+				"table": name,
+				"dead_tuples_before": health[name]["dead_tuples"],
+				"dead_ratio_before": health[name]["dead_ratio"],
+				"seconds": time.perf_counter() - started,
+				}
+
+
+async def reindex(
+		db,
+		indexes: list[str] | None = None,
+		max_leaf_density: float = REINDEX_MAX_LEAF_DENSITY,
+		pause: float = MAINTENANCE_PAUSE,
+		max_operations: int | None = None,
+		):
+	
+	"""
+	
+	Rebuild the given indexes, or the bloated B-tree indexes, with REINDEX CONCURRENTLY.
+	
+	Indexes are rebuilt one at a time without blocking reads or writes. Picking bloated indexes
+	needs pgstattuple; HNSW indexes are only rebuilt when named, since rebuilding them is slow.
+	
+	:param db: Connected Database instance
+	:type db: Database
+	:param indexes: Indexes to rebuild, or None to pick the bloated ones
+	:type indexes: list[str] or None
+	:param max_leaf_density: Average leaf density (percent) below which a B-tree index is picked
+	:type max_leaf_density: float
+	:param pause: Seconds to wait between two indexes
+	:type pause: float
+	:param max_operations: Most indexes rebuilt in this run, or None for all
+	:type max_operations: int or None
+	
+	:return: Async iterator of one dict per rebuilt index
+	:rtype: AsyncIterator[dict]
+	
+	"""
+	
+	health = {index["index"]: index for index in await index_health(db)}
+	
+	if indexes is None:
+		
+		targets = [
+			name for name, index in health.items()
+			if index["leaf_density"] is not None and index["leaf_density"] < max_leaf_density
+			]
+	
+	else:
+		
+		unknown = [name for name in indexes if name not in health]
+		
+		# Names are interpolated, so only accept those the catalog returned
+		if unknown:
+			raise ValueError(f"Unknown indexes: {', '.join(unknown)}")
+		
+		targets = indexes
+	
+	for position, name in enumerate(targets[:max_operations]):
+		
+		if position:
+			await asyncio.sleep(pause)
+		
+		async with db.acquire("ingestion") as conn:
+			
+			await conn.execute("SET statement_timeout = 0")
+			
+			started = time.perf_counter()
+			
+			# Can't run in a transaction block; asyncpg runs single statements in autocommit
+			await conn.execute(f"REINDEX INDEX CONCURRENTLY {name}", timeout = None)
+			
+			bytes_after = await conn.fetchval("SELECT pg_relation_size($1::regclass)", name)
+			
+			yield {
+				"index": name,
+				"bytes_before": health[name]["bytes"],
+				"bytes_after": bytes_after,
+				"leaf_density_before": health[name]["leaf_density"],
+				"seconds": time.perf_counter() - started,
+				}
+
+
+def emit(kind: str, records, output_format: str):
+	
+	"""
+	
+	Print records as JSON.
+	
+	:param kind: Kind of the records, added to each one in jsonl format
+	:type kind: str
+	:param records: A dict, or a list of dicts
+	:type records: dict or list[dict]
+	:param output_format: "json" for one document, "jsonl" for one record per line
+	:type output_format: str
+	
+	:return: None
+	:rtype: None
+	
+	"""
+	
+	if output_format == "json":
+		
+		print(json.dumps(records, indent = 2, default = str))
+		
+		return
+	
+	for record in records if isinstance(records, list) else [records]:
+		print(json.dumps({"kind": kind, **record}, default = str))
+	
+	sys.stdout.flush()
+
+
+async def main(argv: list[str] | None = None):
+	
+	"""
+	
+	Command line entry point.
+	
+	:param argv: Command line arguments (defaults to sys.argv)
+	:type argv: list[str] or None
+	
+	:return: None
+	:rtype: None
+	
+	"""
+	
+	import argparse
+	
+	from services.db import Database
+	
+	parser = argparse.ArgumentParser(description = "Report on and maintain the database.")
+	parser.add_argument("--format", choices = ["json", "jsonl"], default = "json", dest = "output_format")
+	subparsers = parser.add_subparsers(dest = "command", required = True)
+	
+	report_parser = subparsers.add_parser("report", help = "Tables, indexes and community sizes")
+	report_parser.add_argument("--skip-communities", action = "store_true", help = "Don't scan the chunks")
+	communities = subparsers.add_parser("communities", help = "Chunk rows and bytes per community")
+	communities.add_argument("--community", help = "HOA code to report on")
+	subparsers.add_parser("tables", help = "Table sizes, dead tuples and bloat")
+	subparsers.add_parser("indexes", help = "Index sizes, usage and bloat")
+	
+	vacuum_parser = subparsers.add_parser("vacuum", help = "VACUUM (ANALYZE) tables with dead tuples")
+	vacuum_parser.add_argument("--table", action = "append", dest = "tables", help = "Table to vacuum (repeatable)")
+	vacuum_parser.add_argument("--min-dead-ratio", type = float, default = VACUUM_MIN_DEAD_RATIO)
+	vacuum_parser.add_argument("--pause", type = float, default = MAINTENANCE_PAUSE)
+	vacuum_parser.add_argument("--cost-delay", type = float, default = VACUUM_COST_DELAY, help = "Milliseconds")
+	vacuum_parser.add_argument("--cost-limit", type = int, default = VACUUM_COST_LIMIT)
+	
+	reindex_parser = subparsers.add_parser("reindex", help = "REINDEX CONCURRENTLY bloated indexes")
+	reindex_parser.add_argument("--index", action = "append", dest = "indexes", help = "Index to rebuild (repeatable)")
+	reindex_parser.add_argument("--max-leaf-density", type = float, default = REINDEX_MAX_LEAF_DENSITY)
+	reindex_parser.add_argument("--pause", type = float, default = MAINTENANCE_PAUSE)
+	reindex_parser.add_argument("--max-ops", type = int, dest = "max_operations")
+	args = parser.parse_args(argv)
+	
+	db = Database()
+	await db.connect()
+	
+	try:
+		
+		if args.command == "report":
+			
+			emit("report", await report(db, communities = not args.skip_communities), args.output_format)
+		
+		elif args.command == "communities":
+			
+			emit("community", await community_sizes(db, args.community), args.output_format)
+		
+		elif args.command == "tables":
+			
+			emit("table", await table_health(db), args.output_format)
+		
+		elif args.command == "indexes":
+			
+			emit("index", await index_health(db), args.output_format)
+		
+		elif args.command == "vacuum":
+			
+			# Print each table as it is done, so progress shows on long runs
+			async for done in vacuum(db, args.tables, args.min_dead_ratio, args.pause, args.cost_delay, args.cost_limit):
+				emit("vacuum", [done], "jsonl")
+		
+		else:
+			
+			async for done in reindex(db, args.indexes, args.max_leaf_density, args.pause, args.max_operations):
+				emit("reindex", [done], "jsonl")
+	
+	finally:
+		
+		await db.disconnect()
+
+
+if __name__ == "__main__":
+	asyncio.run(main())
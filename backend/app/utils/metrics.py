@@ -0,0 +1,212 @@
+"""
+
+In-process metrics: counters, histograms and gauges, exposed as JSON at /admin/metrics.
+
+Each worker process keeps its own numbers.
+
+"""
+
+import bisect
+import threading
+import time
+from contextlib import contextmanager
+
+
+# Upper bounds (seconds) of the histogram buckets; the last bucket catches everything else
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class Metrics:
+	
+	"""
+	
+	Registry of named metrics, each split by an optional set of labels.
+	
+	"""
+	
+	def __init__(self, buckets: tuple[float, ...] = DEFAULT_BUCKETS):
+		
+		"""
+		
+		Initialize the Metrics class.
+		
+		:param buckets: Upper bounds of the histogram buckets
+		:type buckets: tuple[float, ...]
+		
+		"""
+		
+		self.buckets = tuple(buckets)
+		self._counters = {}
+		self._histograms = {}
+		self._gauges = {}
+		self._lock = threading.Lock()
+	
+	
+	@staticmethod
+	def _key(name: str, labels: dict) -> tuple:
+		
+		return name, tuple(sorted(labels.items()))
+	
+	
+	def increment(self, name: str, amount: float = 1, **labels):
+		
+		"""
+		
+		Add to a counter.
+		
+		:param name: Metric name
+		:type name: str
+		:param amount: Amount to add
+		:type amount: float
+		:param labels: Labels of the series
+		
+		:return: None
+		:rtype: None
+		
+		"""
+		
+		key = self._key(name, labels)
+		
+		with self._lock:
+			self._counters[key] = self._counters.get(key, 0) + amount
+	
+	
+	def observe(self, name: str, value: float, **labels):
+		
+		"""
+		
+		Record one observation (usually a duration in seconds) in a histogram.
+		
+		:param name: Metric name
+		:type name: str
+		:param value: Observed value
+		:type value: float
+		:param labels: Labels of the series
+		
+		:return: None
+		:rtype: None
+		
+		"""
+		
+		key = self._key(name, labels)
+		
+		with self._lock:
+			
+			histogram = self._histograms.get(key)
+			
+			if histogram is None:
+				
+				histogram = {"count": 0, "sum": 0.0, "max": 0.0, "buckets": [0] * (len(self.buckets) + 1)}
+				self._histograms[key] = histogram
+			
+			histogram["count"] += 1
+			histogram["sum"] += value
+			histogram["max"] = max(histogram["max"], value)
+			histogram["buckets"][bisect.bisect_left(self.buckets, value)] += 1
+	
+	
+	@contextmanager
+	def timer(self, name: str, **labels):
+		
+		"""
+		
+		Observe how long the body of a with block takes.
+		
+		:param name: Metric name
+		:type name: str
+		:param labels: Labels of the series
+		
+		"""
+		
+		started = time.perf_counter()
+		
+		try:
+			yield
+		
+		finally:
+			self.observe(name, time.perf_counter() - started, **labels)
+	
+	
+	def register_gauge(self, name: str, callback):
+		
+		"""
+		
+		Register a gauge, read when a snapshot is taken.
+		
+		:param name: Metric name
+		:type name: str
+		:param callback: Function returning a number, or a dict of label value to number
+		:type callback: Callable[[], float | dict]
+		
+		:return: None
+		:rtype: None
+		
+		"""
+		
+		with self._lock:
+			self._gauges[name] = callback
+	
+	
+	def snapshot(self) -> dict:
+		
+		"""
+		
+		Get the current value of every metric.
+		
+		:return: Dict with "counters", "histograms" and "gauges", each mapping a metric name to its series
+		:rtype: dict
+		
+		"""
+		
+		with self._lock:
+			
+			counters = dict(self._counters)
+			histograms = {key: dict(value, buckets = list(value["buckets"])) for key, value in self._histograms.items()}
+			gauges = dict(self._gauges)
+		
+		snapshot = {"counters": {}, "histograms": {}, "gauges": {}}
+		
+		for (name, labels), value in counters.items():
+			snapshot["counters"].setdefault(name, []).append({"labels": dict(labels), "value": value})
+		
+		for (name, labels), histogram in histograms.items():
+			
+			# Report cumulative bucket counts, keyed by upper bound
+			bounds = [str(bound) for bound in self.buckets] + ["+Inf"]
+			cumulative = [sum(histogram["buckets"][:i + 1]) for i in range(len(bounds))]
+			
+			snapshot["histograms"].setdefault(name, []).append(
+					{
+						"labels": dict(labels),
+						"count": histogram["count"],
+						"sum": histogram["sum"],
+						"max": histogram["max"],
+						"buckets": dict(zip(bounds, cumulative)),
+						}
+					)
+		
+		for name, callback in gauges.items():
+			snapshot["gauges"][name] = callback()
+		
+		return snapshot
+	
+	
+	def reset(self):
+		
+		"""
+		
+		Forget all counters and histograms (gauges stay registered).
+		
+		:return: None
+		:rtype: None
+		
+		"""
+		
+		with self._lock:
+			
+			self._counters.clear()
+			self._histograms.clear()
+
+
+# Process-wide registry
+metrics = Metrics()
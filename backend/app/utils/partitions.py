@@ -0,0 +1,202 @@
+"""
+
+Manage the partitions of document_embeddings.
+
+Uploaded documents are stored once for every community, in the SHARED partition, which is
+hash-partitioned on content_hash. Promoting a community does not move them.
+
+Private chunks, written before content was shared, are spread over the hash partitions behind
+the DEFAULT partition. A community with many of them can be moved into a dedicated partition,
+which gets its own vector and metadata indexes and can be vacuumed, reindexed or dropped on its
+own.
+
+Usage (from backend/app):
+	
+	python -m utils.partitions list
+	python -m utils.partitions promote HOA-520-293-884
+
+"""
+
+import argparse
+import asyncio
+import re
+
+from services.db import DEDICATED_PARTITION_SQL, SHARED_HOA_CODE, Database
+
+
+# HOA codes are interpolated into DDL, so only allow the characters they are made of
+HOA_CODE_PATTERN = re.compile(r"^[A-Za-z0-9-]+$")
+
+# Number of communities shown by the list command
+TOP_COMMUNITIES = 10
+
+
+def partition_name(hoa_code: str) -> str:
+	
+	"""
+	
+	Get the name of a community's dedicated partition.
+	
+	:param hoa_code: 9-digit alphanumeric HOA code
+	:type hoa_code: str
+	
+	:return: Table name
+	:rtype: str
+	
+	"""
+	
+	if not HOA_CODE_PATTERN.match(hoa_code) or hoa_code == SHARED_HOA_CODE:
+		raise ValueError(f"Invalid HOA code: {hoa_code!r}")
+	
+	return f"document_embeddings_{hoa_code.lower().replace('-', '_')}"
+
+
+async def promote_community(db: Database, hoa_code: str) -> int:
+	
+	"""
+	
+	Move a community's private rows out of the DEFAULT partition into a dedicated partition. The
+	chunks of its documents stay in the SHARED partition.
+	
+	Runs in a single transaction, so queries never see the community half-moved. Writes to the
+	DEFAULT partition wait until it commits.
+	
+	:param db: Connected Database instance
+	:type db: Database
+	:param hoa_code: 9-digit alphanumeric HOA code
+	:type hoa_code: str
+	
+	:return: Number of rows moved
+	:rtype: int
+	
+	"""
+	
+	name = partition_name(hoa_code)
+	
+	async with db.pool.acquire() as conn:
+		async with conn.transaction():
+			
+			if await conn.fetchval(DEDICATED_PARTITION_SQL, hoa_code):
+				raise ValueError(f"{hoa_code} already has a dedicated partition.")
+			
+			await conn.execute(f"CREATE TABLE {name} (LIKE document_embeddings INCLUDING DEFAULTS)")
+			
+			# Move the rows in one statement; only the community's hash partition is scanned
+			moved = await conn.fetchval(
+					f"""
+					WITH moved AS (
+						DELETE FROM document_embeddings_default WHERE hoa_code = $1 RETURNING *
+					), inserted AS (
+						INSERT INTO {name} SELECT * FROM moved RETURNING 1
+					)
+					SELECT count(*) FROM inserted
+					""",
+					hoa_code,
+					)
+			
+			# A matching CHECK lets ATTACH skip scanning the new partition
+			await conn.execute(
+					f"""
+					ALTER TABLE {name} ADD CONSTRAINT {name}_hoa_code_check CHECK (hoa_code = '{hoa_code}');
+					ALTER TABLE document_embeddings ATTACH PARTITION {name} FOR VALUES IN ('{hoa_code}');
+					ALTER TABLE {name} DROP CONSTRAINT {name}_hoa_code_check;
+					"""
+					)
+	
+	return moved
+
+
+async def list_partitions(db: Database) -> dict:
+	
+	"""
+	
+	Describe the partitions of document_embeddings and the communities with the most private rows
+	outside of a dedicated partition.
+	
+	:param db: Connected Database instance
+	:type db: Database
+	
+	:return: Dict with "partitions" (name, bound, estimated rows, bytes) and "candidates" (hoa_code, rows)
+	:rtype: dict
+	
+	"""
+	
+	async with db.pool.acquire() as conn:
+		
+		partitions = await conn.fetch(
+				"""
+				SELECT c.relname AS name,
+					pg_get_expr(c.relpartbound, c.oid) AS bound,
+					greatest(c.reltuples, 0)::bigint AS rows,
+					pg_total_relation_size(c.oid) AS bytes
+				FROM pg_partition_tree('document_embeddings') t
+				JOIN pg_class c ON c.oid = t.relid
+				WHERE t.isleaf
+				ORDER BY bytes DESC
+				"""
+				)
+		
+		candidates = await conn.fetch(
+				"""
+				SELECT hoa_code, count(*) AS rows
+				FROM document_embeddings_default
+				GROUP BY hoa_code
+				ORDER BY rows DESC
+				LIMIT $1
+				""",
+				TOP_COMMUNITIES,
+				)
+	
+	return {"partitions": [dict(row) for row in partitions], "candidates": [dict(row) for row in candidates]}
+
+
+async def main(argv: list[str] | None = None):
+	
+	"""
+	
+	Command line entry point.
+	
+	:param argv: Command line arguments (defaults to sys.argv)
+	:type argv: list[str] or None
+	
+	:return: None
+	:rtype: None
+	
+	"""
+	
+	parser = argparse.ArgumentParser(description = "Manage document_embeddings partitions.")
+	subparsers = parser.add_subparsers(dest = "command", required = True)
+	subparsers.add_parser("list", help = "Show partitions and the largest communities without one")
+	promote = subparsers.add_parser("promote", help = "Move a community into a dedicated partition")
+	promote.add_argument("hoa_code")
+	args = parser.parse_args(argv)
+	
+	db = Database()
+	await db.connect()
+	
+	try:
+		
+		if args.command == "promote":
+			
+			moved = await promote_community(db, args.hoa_code)
+			print(f"Moved {moved} rows into {partition_name(args.hoa_code)}")
+		
+		else:
+			
+			described = await list_partitions(db)
+			
+			for row in described["partitions"]:
+				print(f"{row['name']:<48} {row['bound']:<45} ~{row['rows']:>10} rows {row['bytes'] / 2 ** 20:>10.1f} MB")
+			
+			print("\nCommunities with the most private rows in the DEFAULT partition:")
+			
+			for row in described["candidates"]:
+				print(f"  {row['hoa_code']:<20} {row['rows']:>10} rows")
+	
+	finally:
+		
+		await db.disconnect()
+
+
+if __name__ == "__main__":
+	asyncio.run(main())
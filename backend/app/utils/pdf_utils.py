@@ -1,9 +1,17 @@
+import os
 import re
 from typing import Dict, List
 
 import fitz  # PyMuPDF
 
 
+# Lines that start a new section of a governing document, e.g. "ARTICLE IV" or "Section 3.2 Assessments"
+SECTION_HEADING_PATTERN = re.compile(r"^\s*(article|section|§)\s*([ivxlc]+|\d+(\.\d+)*)\b", re.IGNORECASE)
+
+# Longest section title kept (headings sometimes run into the first sentence)
+MAX_SECTION_TITLE_LENGTH = 100
+
+
 class PDFProcessor:
 	
 	"""
@@ -32,10 +40,12 @@ class PDFProcessor:
 	
 		Extracts text from each page of the PDF and splits into chunks with page metadata.
 		
-		:param file_stream: File-like object representing the PDF.
-		:type file_stream: io.BytesIO or similar
+		:param file_stream: PDF bytes, or the path of a PDF on disk (opened by PyMuPDF without loading
+		it into memory first).
+		:type file_stream: bytes or str
 		
-		:return: List of dicts, each with 'chunk', 'page_number', etc.
+		:return: List of dicts, each with 'chunk', 'page_number', 'chunk_index' and 'section' (the heading the
+		chunk falls under, or None before the first heading).
 		:rtype: List[Dict]
 		
 		"""
@@ -43,37 +53,91 @@ class PDFProcessor:
 		# Initialize an empty list to store the results
 		results = []
 		
-		# Open the PDF file using PyMuPDF
-		with fitz.open(stream = file_stream, filetype = "pdf") as doc:
+		# Sections carry over from one page to the next
+		section = None
+		
+		# Open the PDF file using PyMuPDF, straight from disk when given a path
+		if isinstance(file_stream, (str, os.PathLike)):
+			
+			doc = fitz.open(file_stream, filetype = "pdf")
+		
+		else:
+			
+			doc = fitz.open(stream = file_stream, filetype = "pdf")
+		
+		with doc:
 			
 			# Iterate through each page in the PDF
 			for page_number, page in enumerate(doc, start = 1):
 				
-				# Extract and normalize text
-				text = page.get_text()
+				chunk_index = 0
 				
-				text = re.sub(r"\s+", " ", text).strip()
-				
-				text = re.sub(r"[^\x00-\x7F]+", "", text)
-				
-				# Chunk the page text
-				page_chunks = self.chunk_text(text)
-				
-				# Iterate through each chunk and append metadata
-				for chunk_index, chunk in enumerate(page_chunks):
+				# Chunks never straddle a section heading
+				for section, text in self.split_sections(page.get_text(), section):
+					
+					# Normalize text
+					text = re.sub(r"\s+", " ", text).strip()
 					
-					results.append(
-							{
-								"chunk": chunk,
-								"page_number": page_number,
-								"chunk_index": chunk_index
-								}
-							)
+					text = re.sub(r"[^\x00-\x7F]+", "", text)
+					
+					if not text:
+						continue
+					
+					# Chunk the section text and append metadata
+					for chunk in self.chunk_text(text):
+						
+						results.append(
+								{
+									"chunk": chunk,
+									"page_number": page_number,
+									"chunk_index": chunk_index,
+									"section": section,
+									}
+								)
+						
+						chunk_index += 1
 		
 		# Return the list of chunks with metadata
 		return results
 	
 	
+	@staticmethod
+	def split_sections(text: str, section: str | None = None) -> List[tuple]:
+		
+		"""
+		
+		Split the raw text of a page at section headings such as "Article IV" or "Section 3.2".
+		
+		:param text: Raw page text, one line per line of the PDF.
+		:type text: str
+		:param section: Section in effect at the top of the page.
+		:type section: str or None
+		
+		:return: List of (section, text) pairs, in page order.
+		:rtype: List[tuple]
+		"""
+		
+		parts, lines = [], []
+		
+		for line in text.splitlines():
+			
+			if SECTION_HEADING_PATTERN.match(line):
+				
+				# Close the text under the previous heading
+				if lines:
+					parts.append((section, "\n".join(lines)))
+				
+				section = re.sub(r"\s+", " ", line).strip()[:MAX_SECTION_TITLE_LENGTH]
+				lines = []
+			
+			lines.append(line)
+		
+		if lines:
+			parts.append((section, "\n".join(lines)))
+		
+		return parts
+	
+	
 	def chunk_text(self, text: str) -> List[str]:
 		
 		"""
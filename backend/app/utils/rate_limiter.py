@@ -0,0 +1,281 @@
+"""
+
+Priority-aware token-bucket rate limiter for the OpenAI API.
+
+Every embedding and completion request asks the limiter for one request and an estimated number
+of tokens before it is sent. Requests wait in one of two lanes:
+	
+	interactive   resident questions, always served first
+	background    ingestion and summaries, served with whatever capacity is left
+
+Within a lane, communities are served by start-time fair queuing on tokens, so a community
+uploading hundreds of documents can't monopolize throughput: each one gets its weighted share.
+
+"""
+
+import asyncio
+import heapq
+import itertools
+import time
+
+
+# Lanes, in the order they are served
+INTERACTIVE = "interactive"
+BACKGROUND = "background"
+LANES = (INTERACTIVE, BACKGROUND)
+
+
+class RateLimiter:
+	
+	"""
+	
+	Token buckets for requests and tokens per minute, shared by every OpenAI caller of the process.
+	
+	"""
+	
+	def __init__(
+			self,
+			requests_per_minute: int,
+			tokens_per_minute: int,
+			weights: dict[str, float] | None = None,
+			metrics = None,
+			):
+		
+		"""
+		
+		Initialize the RateLimiter class.
+		
+		:param requests_per_minute: Request budget
+		:type requests_per_minute: int
+		:param tokens_per_minute: Token budget
+		:type tokens_per_minute: int
+		:param weights: Share of each HOA code within its lane (default 1)
+		:type weights: dict[str, float] or None
+		:param metrics: Registry to record wait times in, or None
+		:type metrics: Metrics or None
+		
+		"""
+		
+		self.request_capacity = float(requests_per_minute)
+		self.token_capacity = float(tokens_per_minute)
+		self.request_rate = requests_per_minute / 60
+		self.token_rate = tokens_per_minute / 60
+		self.weights = weights or {}
+		self.metrics = metrics
+		
+		# Both buckets start full
+		self._requests = self.request_capacity
+		self._tokens = self.token_capacity
+		self._updated = time.monotonic()
+		
+		self._reset_queues()
+	
+	
+	def _reset_queues(self):
+		
+		# Waiting requests of each lane, ordered by virtual start tag
+		self._queues = {lane: [] for lane in LANES}
+		
+		# Virtual time of each lane and the last finish tag of each community in it
+		self._virtual_time = {lane: 0.0 for lane in LANES}
+		self._finish_tags = {lane: {} for lane in LANES}
+		
+		self._sequence = itertools.count()
+		self._loop = None
+		self._wakeup = None
+		self._scheduler = None
+	
+	
+	@staticmethod
+	def estimate_tokens(text: str) -> int:
+		
+		"""
+		
+		Roughly estimate the number of tokens of a text (about 4 characters per token in English).
+		
+		:param text: Text to estimate
+		:type text: str
+		
+		:return: Estimated number of tokens
+		:rtype: int
+		
+		"""
+		
+		return len(text) // 4 + 1
+	
+	
+	def queued(self) -> dict[str, int]:
+		
+		"""
+		
+		Get the number of waiting requests in each lane.
+		
+		:return: Dict mapping each lane to its queue length
+		:rtype: dict[str, int]
+		
+		"""
+		
+		return {lane: len(queue) for lane, queue in self._queues.items()}
+	
+	
+	async def acquire(self, tokens: int, priority: str = INTERACTIVE, hoa_code: str | None = None):
+		
+		"""
+		
+		Wait until a request with this many tokens may be sent.
+		
+		:param tokens: Estimated tokens of the request (prompt plus expected output)
+		:type tokens: int
+		:param priority: INTERACTIVE or BACKGROUND
+		:type priority: str
+		:param hoa_code: Community the request is made for, or None for shared work
+		:type hoa_code: str or None
+		
+		:return: None
+		:rtype: None
+		
+		"""
+		
+		if priority not in self._queues:
+			raise ValueError(f"Unknown priority: {priority!r}")
+		
+		self._bind_loop()
+		
+		# A request larger than the whole budget would never fit
+		tokens = min(float(tokens), self.token_capacity)
+		
+		# Start-time fair queuing: a community's next request starts where its previous one finished
+		flow = hoa_code or ""
+		start = max(self._virtual_time[priority], self._finish_tags[priority].get(flow, 0.0))
+		self._finish_tags[priority][flow] = start + tokens / self.weights.get(flow, 1.0)
+		
+		future = self._loop.create_future()
+		heapq.heappush(self._queues[priority], (start, next(self._sequence), tokens, future))
+		self._wakeup.set()
+		
+		started = time.perf_counter()
+		
+		# Cancelled waiters are skipped by the scheduler
+		await future
+		
+		if self.metrics:
+			self.metrics.observe("openai_limiter_wait_seconds", time.perf_counter() - started, lane = priority)
+	
+	
+	def record_usage(self, estimated: int, actual: int | None):
+		
+		"""
+		
+		Correct the token bucket once the API reported how many tokens a request really used.
+		
+		:param estimated: Tokens passed to acquire
+		:type estimated: int
+		:param actual: Tokens reported by the API, or None if unknown
+		:type actual: int or None
+		
+		:return: None
+		:rtype: None
+		
+		"""
+		
+		if actual is None:
+			return
+		
+		self._refill()
+		
+		# The bucket may go negative, which delays the next requests until the debt is paid
+		self._tokens -= actual - min(float(estimated), self.token_capacity)
+	
+	
+	def _bind_loop(self):
+		
+		loop = asyncio.get_running_loop()
+		
+		if self._loop is loop:
+			return
+		
+		# First use, or the previous event loop is gone (e.g. between tests)
+		self._reset_queues()
+		self._loop = loop
+		self._wakeup = asyncio.Event()
+		self._scheduler = loop.create_task(self._schedule())
+		
+		if self.metrics:
+			self.metrics.register_gauge("openai_limiter_queued", self.queued)
+	
+	
+	def _refill(self):
+		
+		now = time.monotonic()
+		elapsed = now - self._updated
+		self._updated = now
+		
+		self._requests = min(self.request_capacity, self._requests + elapsed * self.request_rate)
+		self._tokens = min(self.token_capacity, self._tokens + elapsed * self.token_rate)
+	
+	
+	def _next(self):
+		
+		"""
+		
+		Get the lane and entry of the request to serve next, dropping cancelled ones.
+		
+		"""
+		
+		for lane in LANES:
+			
+			queue = self._queues[lane]
+			
+			while queue and queue[0][3].done():
+				heapq.heappop(queue)
+			
+			if queue:
+				return lane, queue[0]
+		
+		return None, None
+	
+	
+	async def _schedule(self):
+		
+		while True:
+			
+			lane, entry = self._next()
+			
+			if entry is None:
+				
+				self._wakeup.clear()
+				await self._wakeup.wait()
+				
+				continue
+			
+			start, _, tokens, future = entry
+			
+			self._refill()
+			
+			# Time until both buckets hold enough for this request
+			wait = max(
+					(1 - self._requests) / self.request_rate,
+					(tokens - self._tokens) / self.token_rate,
+					0,
+					)
+			
+			if wait <= 0:
+				
+				heapq.heappop(self._queues[lane])
+				
+				self._requests -= 1
+				self._tokens -= tokens
+				self._virtual_time[lane] = start
+				
+				future.set_result(None)
+				
+				continue
+			
+			# Sleep until there is capacity, or until a new request (maybe a more urgent one) arrives
+			self._wakeup.clear()
+			
+			try:
+				await asyncio.wait_for(self._wakeup.wait(), wait)
+			
+			except asyncio.TimeoutError:
+				pass
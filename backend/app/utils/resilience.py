@@ -0,0 +1,346 @@
+"""
+
+Deadlines and hedged requests for the stages of the RAG pipeline.
+
+A query gets one end-to-end deadline. Each stage (embedding, retrieval, completion) runs with the
+smaller of its own budget and the time left, and is cancelled when that runs out. Stages calling a
+provider with a long latency tail can be hedged: if the first request hasn't answered by the
+usual (percentile) latency of that stage, a second identical request is sent, the first answer
+wins and the other request is cancelled.
+
+"""
+
+import asyncio
+import os
+import time
+from collections import deque
+
+
+# End-to-end time allowed for answering a query, in seconds
+ANSWER_DEADLINE = float(os.getenv("ANSWER_DEADLINE", "30"))
+
+# Budgets of the stages before the completion, which gets whatever time is left
+EMBEDDING_BUDGET = float(os.getenv("EMBEDDING_BUDGET", "5"))
+RETRIEVAL_BUDGET = float(os.getenv("RETRIEVAL_BUDGET", "5"))
+
+# Send a hedged request when the first one is slower than this percentile of recent latencies
+HEDGE_REQUESTS = os.getenv("HEDGE_REQUESTS", "false").lower() == "true"
+HEDGE_PERCENTILE = float(os.getenv("HEDGE_PERCENTILE", "0.95"))
+
+# Number of recent latencies the threshold is computed from, and how many are needed first
+HEDGE_WINDOW = 500
+HEDGE_MIN_SAMPLES = 20
+
+
+class DeadlineExceeded(TimeoutError):
+	
+	"""
+	
+	Raised when a stage runs out of time.
+	
+	"""
+	
+	def __init__(self, stage: str, timeout: float):
+		
+		super().__init__(f"The {stage} stage did not finish within {timeout:.2f}s.")
+		
+		self.stage = stage
+		self.timeout = timeout
+
+
+class Deadline:
+	
+	"""
+	
+	Point in time by which a whole operation has to be done.
+	
+	"""
+	
+	def __init__(self, seconds: float):
+		
+		"""
+		
+		Initialize the Deadline class.
+		
+		:param seconds: Time allowed from now
+		:type seconds: float
+		
+		"""
+		
+		self.expires = time.monotonic() + seconds
+	
+	
+	def remaining(self) -> float:
+		
+		"""
+		
+		Get the time left, in seconds (never negative).
+		
+		:return: Seconds left
+		:rtype: float
+		
+		"""
+		
+		return max(0.0, self.expires - time.monotonic())
+	
+	
+	def budget(self, seconds: float | None = None) -> float:
+		
+		"""
+		
+		Get the time a stage may take: its own budget, capped by the time left.
+		
+		:param seconds: Budget of the stage, or None to allow all the time left
+		:type seconds: float or None
+		
+		:return: Seconds the stage may take
+		:rtype: float
+		
+		"""
+		
+		remaining = self.remaining()
+		
+		return remaining if seconds is None else min(seconds, remaining)
+
+
+class Hedger:
+	
+	"""
+	
+	Sends a second request when the first one is slower than usual, and keeps the first answer.
+	
+	"""
+	
+	def __init__(
+			self,
+			name: str,
+			percentile: float = HEDGE_PERCENTILE,
+			window: int = HEDGE_WINDOW,
+			min_samples: int = HEDGE_MIN_SAMPLES,
+			min_delay: float = 0.05,
+			metrics = None,
+			):
+		
+		"""
+		
+		Initialize the Hedger class.
+		
+		:param name: Name used to label the metrics
+		:type name: str
+		:param percentile: Latency percentile (0-1) after which a hedged request is sent
+		:type percentile: float
+		:param window: Number of recent latencies kept
+		:type window: int
+		:param min_samples: Latencies needed before hedging starts
+		:type min_samples: int
+		:param min_delay: Shortest wait before hedging, in seconds
+		:type min_delay: float
+		:param metrics: Registry to count hedged requests in, or None
+		:type metrics: Metrics or None
+		
+		"""
+		
+		self.name = name
+		self.percentile = percentile
+		self.min_samples = min_samples
+		self.min_delay = min_delay
+		self.metrics = metrics
+		
+		self._latencies = deque(maxlen = window)
+	
+	
+	def delay(self) -> float | None:
+		
+		"""
+		
+		Get how long to wait for the first request before hedging.
+		
+		:return: Seconds, or None while there are too few latencies to tell what is slow
+		:rtype: float or None
+		
+		"""
+		
+		if len(self._latencies) < self.min_samples:
+			return None
+		
+		ordered = sorted(self._latencies)
+		
+		return max(self.min_delay, ordered[min(len(ordered) - 1, int(self.percentile * len(ordered)))])
+	
+	
+	async def run(self, fn):
+		
+		"""
+		
+		Run fn(), and run it a second time if the first call is slow. The first success wins.
+		
+		:param fn: Function returning the awaitable to run; it must be safe to call twice
+		:type fn: Callable[[], Awaitable]
+		
+		:return: Result of the first call that succeeded
+		:rtype: Any
+		
+		"""
+		
+		delay = self.delay()
+		started = time.perf_counter()
+		
+		tasks = [asyncio.ensure_future(fn())]
+		
+		try:
+			
+			if delay is not None:
+				
+				done, _ = await asyncio.wait(tasks, timeout = delay)
+				
+				if not done:
+					
+					tasks.append(asyncio.ensure_future(fn()))
+					self._count("hedged_requests_total")
+			
+			pending = set(tasks)
+			error = None
+			
+			# Return the first success; only fail once every request failed
+			while pending:
+				
+				done, pending = await asyncio.wait(pending, return_when = asyncio.FIRST_COMPLETED)
+				
+				for task in done:
+					
+					if task.exception() is None:
+						
+						self._latencies.append(time.perf_counter() - started)
+						
+						if task is not tasks[0]:
+							self._count("hedge_wins_total")
+						
+						return task.result()
+					
+					error = task.exception()
+			
+			raise error
+		
+		finally:
+			
+			# Cancel the loser (or both, if the caller was cancelled)
+			for task in tasks:
+				
+				if not task.done():
+					task.cancel()
+	
+	
+	def _count(self, name: str):
+		
+		if self.metrics:
+			self.metrics.increment(name, call = self.name)
+
+
+class StagePolicy:
+	
+	"""
+	
+	End-to-end deadline, per-stage budgets and optional hedging for a multi-stage operation.
+	
+	"""
+	
+	def __init__(
+			self,
+			deadline: float = ANSWER_DEADLINE,
+			budgets: dict[str, float] | None = None,
+			hedgers: dict[str, Hedger] | None = None,
+			metrics = None,
+			):
+		
+		"""
+		
+		Initialize the StagePolicy class.
+		
+		:param deadline: End-to-end time allowed, in seconds
+		:type deadline: float
+		:param budgets: Time allowed for each stage, in seconds; stages without one get the time left
+		:type budgets: dict[str, float] or None
+		:param hedgers: Hedger of each stage that should be hedged
+		:type hedgers: dict[str, Hedger] or None
+		:param metrics: Registry to record stage durations and timeouts in, or None
+		:type metrics: Metrics or None
+		
+		"""
+		
+		self.deadline = deadline
+		self.budgets = budgets or {}
+		self.hedgers = hedgers or {}
+		self.metrics = metrics
+	
+	
+	def start(self) -> Deadline:
+		
+		"""
+		
+		Start the clock for one operation.
+		
+		:return: Its deadline
+		:rtype: Deadline
+		
+		"""
+		
+		return Deadline(self.deadline)
+	
+	
+	async def run(self, stage: str, fn, deadline: Deadline):
+		
+		"""
+		
+		Run one stage within its budget, hedging it if configured.
+		
+		:param stage: Name of the stage
+		:type stage: str
+		:param fn: Function returning the awaitable of the stage
+		:type fn: Callable[[], Awaitable]
+		:param deadline: Deadline of the operation
+		:type deadline: Deadline
+		
+		:return: Result of the stage
+		:rtype: Any
+		
+		"""
+		
+		timeout = deadline.budget(self.budgets.get(stage))
+		hedger = self.hedgers.get(stage)
+		
+		# Timeout raised by the stage itself (such as a connection pool's PoolTimeoutError), which is
+		# its own error rather than the budget running out
+		own_timeout = None
+		
+		async def run_stage():
+			
+			nonlocal own_timeout
+			
+			try:
+				return await (hedger.run(fn) if hedger else fn())
+			
+			except asyncio.TimeoutError as e:
+				
+				own_timeout = e
+				raise
+		
+		started = time.perf_counter()
+		
+		try:
+			
+			return await asyncio.wait_for(run_stage(), timeout)
+		
+		except asyncio.TimeoutError as e:
+			
+			if e is own_timeout:
+				raise
+			
+			if self.metrics:
+				self.metrics.increment("stage_deadline_exceeded_total", stage = stage)
+			
+			raise DeadlineExceeded(stage, timeout) from None
+		
+		finally:
+			
+			if self.metrics:
+				self.metrics.observe("stage_duration_seconds", time.perf_counter() - started, stage = stage)
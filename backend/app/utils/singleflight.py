@@ -0,0 +1,120 @@
+"""
+
+Single-flight coalescing of identical concurrent calls.
+
+While a call for a key is in flight, later callers with the same key wait for its result (or
+error) instead of starting their own. Nothing is cached once the call finishes.
+
+"""
+
+import asyncio
+
+
+class SingleFlight:
+	
+	"""
+	
+	Coalesces concurrent calls that share a key into one underlying computation.
+	
+	"""
+	
+	def __init__(self, name: str, metrics = None):
+		
+		"""
+		
+		Initialize the SingleFlight class.
+		
+		:param name: Name used to label the metrics
+		:type name: str
+		:param metrics: Registry to count leaders and coalesced callers in, or None
+		:type metrics: Metrics or None
+		
+		"""
+		
+		self.name = name
+		self.metrics = metrics
+		
+		# Running task and number of waiting callers of each key
+		self._calls = {}
+	
+	
+	def in_flight(self) -> int:
+		
+		"""
+		
+		Get the number of keys currently being computed.
+		
+		:return: Number of keys
+		:rtype: int
+		
+		"""
+		
+		return len(self._calls)
+	
+	
+	async def do(self, key, fn):
+		
+		"""
+		
+		Run fn() for the key, or join the call already running for it.
+		
+		The computation runs in its own task, so a caller that is cancelled (e.g. the client went
+		away) does not cancel it for the others. It is only cancelled once every caller is gone.
+		
+		:param key: Hashable key identifying identical calls
+		:type key: Hashable
+		:param fn: Function returning the awaitable to run
+		:type fn: Callable[[], Awaitable]
+		
+		:return: Result of the computation (its exception is raised to every caller)
+		:rtype: Any
+		
+		"""
+		
+		call = self._calls.get(key)
+		
+		if call is None:
+			
+			call = {"task": asyncio.ensure_future(fn()), "waiters": 0}
+			self._calls[key] = call
+			
+			# Forget the key as soon as the computation ends, so later calls start a fresh one
+			call["task"].add_done_callback(lambda _: self._forget(key, call))
+			
+			self._count("leader")
+		
+		else:
+			
+			self._count("coalesced")
+		
+		call["waiters"] += 1
+		
+		try:
+			
+			return await asyncio.shield(call["task"])
+		
+		except asyncio.CancelledError:
+			
+			# Stop computing a result nobody is waiting for anymore
+			if call["waiters"] == 1 and not call["task"].done():
+				
+				call["task"].cancel()
+				self._forget(key, call)
+			
+			raise
+		
+		finally:
+			
+			call["waiters"] -= 1
+	
+	
+	def _forget(self, key, call: dict):
+		
+		if self._calls.get(key) is call:
+			del self._calls[key]
+	
+	
+	def _count(self, role: str):
+		
+		if self.metrics:
+			self.metrics.increment("singleflight_calls_total", call = self.name, role = role)
@@ -39,8 +39,6 @@ export const uploadDocument = async (
   }
 };
 
-// In a real app, you'd have endpoints to list and download documents
-// This is a placeholder for demonstration purposes
 export const getDocuments = async (hoaCode: string) => {
   try {
     const token = await SecureStore.getItemAsync('auth_token');
@@ -48,33 +46,72 @@ export const getDocuments = async (hoaCode: string) => {
       throw new Error('Not authenticated');
     }
 
-    // This is a mock response since we don't have an actual endpoint
-    // In a real app, you would make an API call here
-    return [
-      {
-        id: '1',
-        name: 'HOA Bylaws',
-        type: 'bylaws',
-        uploadDate: '2023-10-15',
-        url: 'https://example.com/bylaws.pdf',
-      },
-      {
-        id: '2',
-        name: 'Community Guidelines',
-        type: 'guidelines',
-        uploadDate: '2023-09-01',
-        url: 'https://example.com/guidelines.pdf',
-      },
-      {
-        id: '3',
-        name: 'Architectural Standards',
-        type: 'standards',
-        uploadDate: '2023-08-20',
-        url: 'https://example.com/standards.pdf',
+    const response = await axios.get(`${API_URL}/documents`, {
+      params: { hoa_code: hoaCode },
+      headers: {
+        Authorization: `Bearer ${token}`,
       },
-    ];
+    });
+
+    return response.data.documents.map((document: any) => ({
+      id: String(document.id),
+      name: document.document_type,
+      type: document.document_type,
+      version: document.version,
+      pageCount: document.page_count,
+      uploadDate: document.ingested_at.slice(0, 10),
+      url: document.storage_path,
+    }));
   } catch (error) {
     console.error('Get documents error:', error);
     throw new Error('Failed to fetch documents');
   }
-};
\ No newline at end of file
+};
+
+export const deleteDocument = async (hoaCode: string, documentId: string) => {
+  try {
+    const token = await SecureStore.getItemAsync('auth_token');
+    if (!token) {
+      throw new Error('Not authenticated');
+    }
+
+    const response = await axios.delete(`${API_URL}/documents/${documentId}`, {
+      params: { hoa_code: hoaCode },
+      headers: {
+        Authorization: `Bearer ${token}`,
+      },
+    });
+
+    return response.data;
+  } catch (error) {
+    console.error('Delete document error:', error);
+    if (axios.isAxiosError(error) && error.response) {
+      throw new Error(error.response.data.detail || 'Delete failed');
+    }
+    throw new Error('Network error. Please try again later.');
+  }
+};
+
+export const getPageImageSource = async (
+  hoaCode: string,
+  documentId: string,
+  page: number,
+  options: { zoom?: number; format?: 'png' | 'jpeg' | 'webp'; highlight?: string; crop?: boolean } = {}
+) => {
+  const token = await SecureStore.getItemAsync('auth_token');
+  if (!token) {
+    throw new Error('Not authenticated');
+  }
+
+  const params = new URLSearchParams({ hoa_code: hoaCode });
+  if (options.zoom) params.append('zoom', String(options.zoom));
+  if (options.format) params.append('format', options.format);
+  if (options.highlight) params.append('highlight', options.highlight);
+  if (options.crop) params.append('crop', 'true');
+
+  // Image source for <Image>: the page is rendered (and cached) by the API instead of downloading the PDF
+  return {
+    uri: `${API_URL}/documents/${documentId}/pages/${page}?${params.toString()}`,
+    headers: { Authorization: `Bearer ${token}` },
+  };
+};
@@ -0,0 +1,76 @@
+import asyncio
+
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from backend.app.utils.accounting import ResourceAccountant, ResourceAccountingMiddleware
+
+
+class FakeConnection:
+    async def fetch(self, query, *args):
+        return [{"id": 1, "content": "Dues are due monthly."}, {"id": 2, "content": "No pets."}]
+
+
+def build_app(accountant):
+    app = FastAPI()
+    app.add_middleware(ResourceAccountingMiddleware, accountant = accountant)
+
+    @app.get("/answers/{item}")
+    async def answer(item: str, hoa_code: str | None = None):
+        # Stands in for the services attributing the request once the caller is authenticated
+        accountant.attribute(hoa_code)
+        rows = await accountant.connection(FakeConnection()).fetch("SELECT id, content FROM chunks WHERE hoa = $1", "HOA-1")
+        accountant.add(embedding_tokens = 5, prompt_tokens = 100, completion_tokens = 20)
+
+        async with accountant.measure("ingestion", "ingest_document", hoa_code = "HOA-1"):
+            accountant.collect(accountant.timed(bytearray)(10_000_000))
+
+        return {"rows": len(rows)}
+
+    return app
+
+
+def test_requests_and_nested_jobs_are_accounted_per_community_and_route():
+    accountant = ResourceAccountant(memory_sample_rate = 1)
+
+    with TestClient(build_app(accountant)) as client:
+        assert client.get("/answers/1", params = {"hoa_code": "HOA-1"}).json() == {"rows": 2}
+        client.get("/answers/2")
+        client.get("/missing/1", params = {"hoa_code": "HOA-2"})
+        client.get("/missing/2")
+
+    job, request = accountant.recent[0], accountant.recent[1]
+    assert [(entry["name"], entry["hoa_code"]) for entry in list(accountant.recent)[-2:]] == [("GET unmatched", None)] * 2
+
+    assert (request["kind"], request["name"], request["hoa_code"]) == ("request", "GET /answers/{item}", "HOA-1")
+    assert (request["db_queries"], request["db_rows"]) == (1, 2)
+    assert request["db_bytes"] == len("HOA-1") + 8 + len("Dues are due monthly.") + 8 + len("No pets.")
+    assert (request["embedding_tokens"], request["prompt_tokens"], request["completion_tokens"]) == (5, 100, 20)
+
+    # The job's memory and worker CPU count for the request it ran in
+    assert job["peak_memory_bytes"] >= 10_000_000
+    assert request["peak_memory_bytes"] >= job["peak_memory_bytes"]
+    assert request["cpu_ms"] >= job["cpu_ms"]
+
+    # Requests without a community are kept apart
+    totals = accountant.summary(kind = "request")["totals"]
+    assert sorted((total["hoa_code"] or "", total["name"], total["count"]) for total in totals) == [
+        ("", "GET /answers/{item}", 1),
+        ("", "GET unmatched", 2),
+        ("HOA-1", "GET /answers/{item}", 1),
+        ]
+    assert accountant.summary(hoa_code = "HOA-1", kind = "ingestion")["totals"][0]["count"] == 2
+
+
+def test_totals_drop_the_least_recently_updated_sums():
+    accountant = ResourceAccountant(totals = 2)
+
+    async def run():
+        for hoa_code in ("HOA-1", "HOA-2", "HOA-1", "HOA-3"):
+            async with accountant.measure("summary", "summarize", hoa_code = hoa_code):
+                pass
+
+    asyncio.run(run())
+
+    totals = accountant.summary()["totals"]
+    assert sorted((total["hoa_code"], total["count"]) for total in totals) == [("HOA-1", 2), ("HOA-3", 1)]
@@ -0,0 +1,105 @@
+import asyncio
+import time
+
+import pytest
+from fastapi import HTTPException
+
+from backend.app.utils import auth
+from backend.app.utils.accounting import ResourceAccountant
+from backend.app.utils.auth import TokenCache
+
+
+@pytest.fixture
+def cache(monkeypatch):
+    monkeypatch.setattr(auth, "SECRET_KEY", "test")
+    monkeypatch.setattr(auth, "ALGORITHM", "HS256")
+    cache = TokenCache(max_size = 2)
+    monkeypatch.setattr(auth, "token_cache", cache)
+    return cache
+
+
+def test_verified_tokens_are_cached_until_revoked(cache, monkeypatch):
+    token = auth.create_access_token({"sub": "resident@example.com"})
+    payload = asyncio.run(auth.verify_token(token))
+
+    # The second request is answered without decoding the token
+    monkeypatch.setattr(auth.jwt, "decode", lambda *args, **kwargs: pytest.fail("decoded again"))
+    assert asyncio.run(auth.verify_token(token)) is payload
+
+    asyncio.run(auth.revoke_token(token, payload))
+
+    with pytest.raises(HTTPException) as error:
+        asyncio.run(auth.verify_token(token))
+
+    assert error.value.status_code == 401
+
+
+def test_entries_expire_with_the_token_and_are_bounded(cache):
+    now = time.time()
+
+    cache.put("a", {"exp": now + 60})
+    cache.put("b", {"exp": now + 1})
+    cache.get("a")
+    cache.put("c", {"exp": now + 60})
+
+    # "b" was the least recently used entry
+    assert len(cache) == 2
+    assert cache.get("b") is None
+    assert cache.get("a") is not None
+    assert cache.get("c", now = now + 120) is None
+
+
+def test_users_only_reach_their_own_community():
+    payload = {"sub": "admin@example.com", "community_code": "HOA-1", "is_admin": True}
+
+    auth.require_community(payload, "HOA-1")
+
+    with pytest.raises(HTTPException) as error:
+        auth.require_community(payload, "HOA-2")
+
+    assert error.value.status_code == 403
+
+
+def test_only_operators_act_across_communities(monkeypatch):
+    monkeypatch.setattr(auth, "OPERATOR_EMAILS", {"ops@example.com"})
+
+    assert auth.is_operator(" Ops@example.com")
+    assert not auth.is_operator("admin@example.com")
+
+    auth.require_operator({"sub": "ops@example.com", "is_operator": True})
+
+    with pytest.raises(HTTPException) as error:
+        auth.require_operator({"sub": "admin@example.com", "is_admin": True})
+
+    assert error.value.status_code == 403
+
+
+def test_cached_tokens_are_served_while_the_database_is_down(cache, monkeypatch):
+    class FailingDatabase:
+        calls = 0
+
+        async def get_revoked_tokens(self, since):
+            self.calls += 1
+            raise ConnectionError("database is down")
+
+    db = FailingDatabase()
+    cache.attach(db)
+    token = auth.create_access_token({"sub": "resident@example.com"})
+
+    # Only the first request tries the database until the next refresh is due
+    payload = asyncio.run(auth.verify_token(token))
+    assert asyncio.run(auth.verify_token(token)) is payload
+    assert db.calls == 1
+
+
+def test_requests_are_charged_to_the_callers_community(cache):
+    accountant = ResourceAccountant()
+    cache.attach(None, accounting = accountant)
+    token = auth.create_access_token({"sub": "resident@example.com", "community_code": "HOA-1"})
+
+    async def run():
+        async with accountant.measure("request") as usage:
+            await auth.verify_token(token)
+        return usage
+
+    assert asyncio.run(run()).hoa_code == "HOA-1"
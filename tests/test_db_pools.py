@@ -0,0 +1,71 @@
+import asyncio
+
+import pytest
+
+from backend.app.services.db import POOL_SETTINGS, Database, PoolTimeoutError, budget_pool_sizes
+from backend.app.utils.metrics import Metrics
+
+
+class FakePool:
+    def __init__(self, size):
+        self.free = asyncio.Queue()
+        for i in range(size):
+            self.free.put_nowait(f"conn-{i}")
+
+    async def acquire(self, timeout = None):
+        return await asyncio.wait_for(self.free.get(), timeout)
+
+    async def release(self, conn):
+        self.free.put_nowait(conn)
+
+
+def make_database(metrics):
+    db = Database(metrics = metrics)
+    db.pools = {"auth": FakePool(1), "retrieval": FakePool(1), "ingestion": FakePool(1)}
+    db.pool = db.pools["auth"]
+    return db
+
+
+def test_busy_workload_does_not_block_other_pools(monkeypatch):
+    monkeypatch.setitem(POOL_SETTINGS["ingestion"], "acquire_timeout", 0.05)
+    metrics = Metrics()
+    db = make_database(metrics)
+
+    async def run():
+        async with db.acquire("ingestion"):
+            # Ingestion is exhausted, but logins still get a connection right away
+            async with db.acquire("auth") as conn:
+                assert conn == "conn-0"
+
+            with pytest.raises(PoolTimeoutError):
+                async with db.acquire("ingestion"):
+                    pass
+
+    asyncio.run(run())
+
+    snapshot = metrics.snapshot()
+    assert snapshot["counters"]["db_pool_timeouts_total"] == [{"labels": {"pool": "ingestion"}, "value": 1}]
+    waits = {tuple(s["labels"].values()): s["count"] for s in snapshot["histograms"]["db_pool_wait_seconds"]}
+    assert waits == {("ingestion",): 1, ("auth",): 1}
+
+
+def test_histogram_buckets_are_cumulative():
+    metrics = Metrics(buckets = (0.1, 1.0))
+
+    for value in (0.05, 0.5, 0.5, 3.0):
+        metrics.observe("latency", value, route = "query")
+
+    [series] = metrics.snapshot()["histograms"]["latency"]
+    assert series["count"] == 4
+    assert series["max"] == 3.0
+    assert series["buckets"] == {"0.1": 1, "1.0": 3, "+Inf": 4}
+
+
+def test_connection_budget_is_shared_between_workers():
+    sizes = budget_pool_sizes(90, 4)
+
+    assert sum(size["max_size"] for size in sizes.values()) <= 90 // 4
+    assert sizes["retrieval"]["max_size"] > sizes["auth"]["max_size"] > sizes["ingestion"]["max_size"]
+
+    # Every workload keeps at least one connection, even on a tiny budget
+    assert all(size["max_size"] == 1 and size["min_size"] == 1 for size in budget_pool_sizes(4, 4).values())
@@ -0,0 +1,152 @@
+import asyncio
+import os
+import sys
+from contextlib import asynccontextmanager
+
+import numpy as np
+import pytest
+
+# The export tool runs from backend/app, with the app's modules importable at top level
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "backend", "app"))
+
+from utils.embeddings_io import export_embeddings, import_embeddings  # noqa: E402
+
+
+DIMS = 3072
+
+
+class FakeCursor:
+    def __init__(self, rows):
+        self.rows = rows
+
+    def __aiter__(self):
+        return self._iterate()
+
+    async def _iterate(self):
+        for row in self.rows:
+            yield row
+
+
+class FakeConnection:
+    def __init__(self, rows = (), links = (), stored_hashes = ()):
+        self.rows = list(rows)
+        self.links = list(links)
+        self.stored_hashes = set(stored_hashes)
+        self.copied = []
+        self.statements = []
+
+    @asynccontextmanager
+    async def transaction(self, **kwargs):
+        yield
+
+    async def fetch(self, query, *args):
+        if "FROM document_contents" in query:
+            return [{"content_hash": content_hash} for content_hash in args[0] if content_hash in self.stored_hashes]
+        if "FROM UNNEST" in query:
+            return []
+        return self.links
+
+    async def fetchrow(self, query, *args):
+        return {"total": len(self.rows), "dims": len(self.rows[0]["embedding"]) if self.rows else None}
+
+    def cursor(self, query, *args, prefetch = None):
+        return FakeCursor(self.rows)
+
+    async def execute(self, query, *args):
+        self.statements.append((" ".join(query.split()), args))
+
+    async def copy_records_to_table(self, table_name, records):
+        self.copied.extend(records)
+
+
+class FakePool:
+    def __init__(self, conn):
+        self.conn = conn
+
+    @asynccontextmanager
+    async def acquire(self):
+        yield self.conn
+
+
+class FakeDatabase:
+    def __init__(self, conn):
+        self.pool = FakePool(conn)
+
+
+def test_export_and_import_round_trip_rows_in_order_with_float32_vectors(tmp_path):
+    vectors = np.random.default_rng(0).standard_normal((5, DIMS)).astype(np.float32)
+    rows = [
+        {
+            "hoa_code": "HOA-1",
+            "document_type": "bylaws",
+            "content_hash": "a" * 64,
+            "chunk_index": index % 2,
+            "page_number": index // 2 + 1,
+            "section": None if index == 0 else f"Article {index}",
+            "content": f"Chunk {index}",
+            "embedding": vector.tolist(),
+            }
+        for index, vector in enumerate(vectors)
+        ]
+    links = [{"hoa_code": "HOA-1", "document_type": "bylaws", "content_hash": "a" * 64}]
+
+    manifest = asyncio.run(
+            export_embeddings(FakeDatabase(FakeConnection(rows, links)), str(tmp_path), batch_size = 2)
+            )
+
+    assert (manifest["rows"], manifest["dims"]) == (5, DIMS)
+
+    exported = np.load(tmp_path / "embeddings.npy")
+    assert exported.dtype == np.float32
+    assert np.array_equal(exported, vectors)
+
+    target = FakeConnection()
+    restored = asyncio.run(import_embeddings(FakeDatabase(target), str(tmp_path), batch_size = 2))
+
+    assert restored == 5
+    assert [record[:7] for record in target.copied] == [
+        tuple(row[column] for column in ("hoa_code", "document_type", "content_hash", "chunk_index", "page_number", "section", "content"))
+        for row in rows
+        ]
+    assert np.array_equal(np.asarray([record[7] for record in target.copied], dtype = np.float32), vectors)
+
+    # The links are restored with the content
+    link_args = target.statements[-1][1]
+    assert link_args == (["HOA-1"], ["bylaws"], ["a" * 64])
+
+
+def shared_rows(content_hash, count):
+    return [
+        {
+            "hoa_code": "SHARED",
+            "document_type": "bylaws",
+            "content_hash": content_hash,
+            "chunk_index": index,
+            "page_number": 1,
+            "section": None,
+            "content": f"Chunk {index}",
+            "embedding": [float(index)] * DIMS,
+            }
+        for index in range(count)
+        ]
+
+
+def test_import_skips_content_that_is_already_stored(tmp_path):
+    rows = shared_rows("a" * 64, 3) + shared_rows("b" * 64, 2)
+    asyncio.run(export_embeddings(FakeDatabase(FakeConnection(rows)), str(tmp_path), batch_size = 2))
+
+    # "a" spans two batches, and neither of them is imported
+    target = FakeConnection(stored_hashes = {"a" * 64})
+    restored = asyncio.run(import_embeddings(FakeDatabase(target), str(tmp_path), batch_size = 2))
+
+    assert restored == 2
+    assert {record[2] for record in target.copied} == {"b" * 64}
+
+
+def test_import_rejects_other_format_versions(tmp_path):
+    asyncio.run(export_embeddings(FakeDatabase(FakeConnection(shared_rows("a" * 64, 1))), str(tmp_path)))
+    manifest_path = tmp_path / "manifest.json"
+    manifest_path.write_text(manifest_path.read_text().replace('"format_version": 2', '"format_version": 1'))
+
+    with pytest.raises(ValueError):
+        asyncio.run(import_embeddings(FakeDatabase(FakeConnection()), str(tmp_path)))
@@ -0,0 +1,100 @@
+import asyncio
+import json
+
+from backend.app.services.db import Database
+
+
+# (document type, section, page, chunk index, id, embedding)
+CHUNKS = [
+    ("bylaws", "Pets", 1, 0, 1, [0.9, 0.1, 0.0]),
+    ("bylaws", "Pets", 1, 1, 2, [0.8, 0.0, 0.2]),
+    ("bylaws", "Parking", 2, 0, 3, [0.0, 0.0, 1.0]),
+    ("bylaws", "Parking", 2, 1, 4, [0.1, 0.0, 0.9]),
+    # Closest chunk overall, in a document that is far from the query as a whole
+    ("rules", "", 1, 0, 5, [1.0, 0.0, 0.0]),
+    ("rules", "", 1, 1, 6, [0.0, 1.0, 0.0]),
+    ]
+
+DOCUMENT_CENTROIDS = {"bylaws": [0.9, 0.1, 0.0], "rules": [0.0, 1.0, 0.0]}
+SECTION_CENTROIDS = {("bylaws", "Pets"): [1.0, 0.0, 0.0], ("bylaws", "Parking"): [0.0, 0.0, 1.0], ("rules", ""): [0.3, 0.7, 0.0]}
+
+
+def distance(a, b):
+    # pgvector's <#> is the negative inner product
+    return -sum(x * y for x, y in zip(a, b))
+
+
+class FakeConnection:
+    """Evaluates the retrieval queries over CHUNKS, the way Postgres would."""
+
+    def __init__(self):
+        self.routing = None
+
+    async def fetch(self, query, *args):
+        if "LEAD(chunk_index)" in query:
+            return self._neighbours(args[1])
+
+        if "UNNEST" in query:
+            wanted = set(zip(*args[1:]))
+            rows = [chunk for chunk in CHUNKS if (chunk[0], chunk[3], chunk[2]) in wanted]
+            return [
+                {"id": c[4], "chunk_index": c[3], "content": f"chunk {c[4]}", "document_type": c[0], "page_number": c[2]}
+                for c in sorted(rows, key = lambda c: (c[0], c[2], c[3]))
+                ]
+
+        hoa_code, embedding_str, top_k, *routing = args
+        query_embedding = json.loads(embedding_str)
+        scope = CHUNKS
+
+        if "top_documents" in query:
+            self.routing = routing
+            documents, sections = routing
+            top_documents = sorted(DOCUMENT_CENTROIDS, key = lambda d: distance(DOCUMENT_CENTROIDS[d], query_embedding))[:documents]
+            top_sections = sorted(
+                    (key for key in SECTION_CENTROIDS if key[0] in top_documents),
+                    key = lambda key: distance(SECTION_CENTROIDS[key], query_embedding),
+                    )[:sections]
+            scope = [chunk for chunk in CHUNKS if (chunk[0], chunk[1]) in top_sections]
+
+        ranked = sorted(scope, key = lambda chunk: distance(chunk[5], query_embedding))[:top_k]
+        return [{"chunk_index": c[3], "document_type": c[0], "page_number": c[2]} for c in ranked]
+
+    @staticmethod
+    def _neighbours(document_types):
+        rows = []
+        for c in CHUNKS:
+            if c[0] not in document_types:
+                continue
+            page = sorted(x[3] for x in CHUNKS if x[0] == c[0] and x[2] == c[2])
+            position = page.index(c[3])
+            rows.append({
+                "chunk_index": c[3],
+                "document_type": c[0],
+                "page_number": c[2],
+                "next_chunk": page[position + 1] if position + 1 < len(page) else None,
+                "prev_chunk": page[position - 1] if position > 0 else None,
+                })
+        return rows
+
+
+def search(sections, documents):
+    conn = FakeConnection()
+    rows = asyncio.run(
+            Database()._search_chunks_with_context(conn, str([1.0, 0.0, 0.0]), "HOA-1", 1, sections, documents)
+            )
+    return conn, [row["id"] for row in rows]
+
+
+def test_routed_search_only_compares_the_closest_sections_of_the_closest_documents():
+    conn, ids = search(sections = 1, documents = 1)
+
+    # $4 is the number of documents and $5 the number of sections
+    assert conn.routing == [1, 1]
+    assert ids == [1, 2]
+
+
+def test_flat_search_compares_every_chunk():
+    conn, ids = search(sections = 0, documents = 1)
+
+    assert conn.routing is None
+    assert ids == [5, 6]
@@ -0,0 +1,225 @@
+import asyncio
+import io
+import tempfile
+
+import fitz
+import pytest
+from starlette.datastructures import Headers, UploadFile
+
+from backend.app.services.ingestion import IngestionService
+from backend.app.services.upload_service import UploadService
+from backend.app.utils.accounting import ResourceAccountant
+from backend.app.utils.pdf_utils import PDFProcessor
+
+
+# Helper: Create a PDF with one page per text
+def create_test_pdf(*texts: str) -> bytes:
+    buffer = io.BytesIO()
+    doc = fitz.open()
+    for text in texts:
+        doc.new_page().insert_text((72, 72), text)
+    doc.save(buffer)
+    return buffer.getvalue()
+
+
+def make_upload_file(data: bytes, filename: str) -> UploadFile:
+    spooled = tempfile.SpooledTemporaryFile()
+    spooled.write(data)
+    spooled.seek(0)
+    return UploadFile(file = spooled, filename = filename, headers = Headers({"content-type": "application/pdf"}))
+
+
+class FakeEmbedder:
+    def __init__(self, fail_on = None):
+        self.batches = []
+        self.fail_on = fail_on
+
+    async def get_embeddings(self, texts, priority = "background", hoa_code = None):
+        self.batches.append(list(texts))
+        if self.fail_on and any(self.fail_on in text for text in texts):
+            raise RuntimeError("Embedding generation failed")
+        return [[float(len(text))] for text in texts]
+
+
+class FakeDatabase:
+    def __init__(self):
+        self.inserted = {}
+        self.contents = {}
+        self.links = {}
+        self.paths = {}
+
+    async def link_existing_document(self, hoa_code, document_type, content_hash, storage_path = None):
+        if content_hash not in self.contents:
+            return None
+        self.links[(hoa_code, document_type)] = content_hash
+        self.paths[(hoa_code, document_type)] = storage_path
+        return self.contents[content_hash]
+
+    async def store_document(self, hoa_code, document_type, content_hash, chunks, embeddings, storage_path = None):
+        assert len(chunks) == len(embeddings)
+        created = content_hash not in self.contents
+        if created:
+            self.inserted[document_type] = list(zip(chunks, embeddings))
+            self.contents[content_hash] = len(chunks)
+        self.links[(hoa_code, document_type)] = content_hash
+        self.paths[(hoa_code, document_type)] = storage_path
+        return created
+
+    async def get_storage_path(self, hoa_code, document_type):
+        return self.paths.get((hoa_code, document_type))
+
+    async def get_unused_storage_paths(self, storage_paths):
+        return [path for path in storage_paths if path not in self.paths.values()]
+
+    async def delete_document(self, hoa_code, document_id):
+        document_type = document_id
+        content_hash = self.links.pop((hoa_code, document_type), None)
+        if content_hash is None:
+            return None
+        return {"document_type": document_type, "content_hash": content_hash,
+                "storage_path": self.paths.pop((hoa_code, document_type)), "chunks_deleted": 0}
+
+
+@pytest.fixture
+def upload_service(monkeypatch, tmp_path):
+    monkeypatch.setenv("S3_BUCKET_NAME", str(tmp_path))
+    return UploadService(use_s3 = False)
+
+
+def test_batch_fills_embedding_requests_across_documents(upload_service):
+    embedder = FakeEmbedder()
+    db = FakeDatabase()
+    service = IngestionService(db, embedder, upload_service, PDFProcessor(), embedding_batch_size = 3, parse_workers = 2)
+
+    documents = [
+        (make_upload_file(create_test_pdf("Bylaws one.", "Bylaws two."), "bylaws.pdf"), "bylaws"),
+        (make_upload_file(create_test_pdf("Rules one.", "Rules two.", "Rules three."), "rules.pdf"), "rules"),
+        ]
+
+    try:
+        results = asyncio.run(service.ingest_documents("HOA-1", documents))
+    finally:
+        service.close()
+
+    assert [result["status"] for result in results] == ["ok", "ok"]
+    assert [result["chunks"] for result in results] == [2, 3]
+
+    # Five chunks in total go out as one full batch of three and one of two
+    assert [len(batch) for batch in embedder.batches] == [3, 2]
+
+    # Every chunk keeps its own embedding
+    for chunks in db.inserted.values():
+        assert all(embedding == [float(len(chunk["chunk"]))] for chunk, embedding in chunks)
+
+
+def test_batch_reports_per_file_failures(upload_service):
+    embedder = FakeEmbedder(fail_on = "Minutes")
+    db = FakeDatabase()
+    service = IngestionService(db, embedder, upload_service, PDFProcessor(), embedding_batch_size = 1, parse_workers = 2)
+
+    documents = [
+        (make_upload_file(create_test_pdf("Rules one."), "rules.pdf"), "rules"),
+        (make_upload_file(b"not a pdf", "broken.pdf"), "broken"),
+        (make_upload_file(create_test_pdf("Minutes one."), "minutes.pdf"), "minutes"),
+        ]
+
+    try:
+        results = asyncio.run(service.ingest_documents("HOA-1", documents))
+    finally:
+        service.close()
+
+    assert [result["status"] for result in results] == ["ok", "error", "error"]
+    assert "Embedding generation failed" in results[2]["error"]
+    assert list(db.inserted) == ["rules"]
+
+
+def test_identical_content_is_embedded_once(upload_service):
+    embedder = FakeEmbedder()
+    db = FakeDatabase()
+    service = IngestionService(db, embedder, upload_service, PDFProcessor(), parse_workers = 1)
+    statute = create_test_pdf("State HOA statute.")
+
+    try:
+        results = asyncio.run(
+                service.ingest_documents(
+                        "HOA-1",
+                        [
+                            (make_upload_file(statute, "statute.pdf"), "statute"),
+                            (make_upload_file(statute, "statute_copy.pdf"), "statute copy"),
+                            ],
+                        )
+                )
+        again = asyncio.run(service.ingest_document(make_upload_file(statute, "statute.pdf"), "HOA-2", "statute"))
+    finally:
+        service.close()
+
+    assert [result["status"] for result in results] == ["ok", "ok"]
+    assert [result["deduplicated"] for result in results] == [False, True]
+    assert again["deduplicated"] and again["chunks"] == 1
+
+    # Parsed and embedded once, linked three times
+    assert len(embedder.batches) == 1
+    assert list(db.inserted) == ["statute"]
+    assert set(db.links) == {("HOA-1", "statute"), ("HOA-1", "statute copy"), ("HOA-2", "statute")}
+
+    # Each catalog entry points at its own community's copy of the file
+    assert db.paths[("HOA-2", "statute")] == f"HOA-2/docs/{db.links[('HOA-2', 'statute')]}.pdf"
+
+
+def test_deleting_a_document_removes_its_file(upload_service, tmp_path):
+    db = FakeDatabase()
+    service = IngestionService(db, FakeEmbedder(), upload_service, PDFProcessor(), parse_workers = 1)
+
+    try:
+        result = asyncio.run(service.ingest_document(make_upload_file(create_test_pdf("Rules."), "rules.pdf"), "HOA-1", "rules"))
+        deleted = asyncio.run(service.delete_document("HOA-1", "rules"))
+    finally:
+        service.close()
+
+    assert deleted["storage_path"] == f"HOA-1/docs/{result['sha256']}.pdf"
+    assert not (tmp_path / deleted["storage_path"]).exists()
+    assert result["path"] == str(tmp_path / deleted["storage_path"])
+    assert asyncio.run(service.delete_document("HOA-1", "rules")) is None
+
+
+def test_a_failed_new_version_leaves_the_current_file_alone(upload_service, tmp_path):
+    db = FakeDatabase()
+    service = IngestionService(db, FakeEmbedder(fail_on = "broken"), upload_service, PDFProcessor(), parse_workers = 1)
+    first = create_test_pdf("Rules one.")
+
+    try:
+        asyncio.run(service.ingest_document(make_upload_file(first, "rules.pdf"), "HOA-1", "rules"))
+        with pytest.raises(RuntimeError):
+            asyncio.run(service.ingest_document(make_upload_file(create_test_pdf("Rules broken."), "rules.pdf"), "HOA-1", "rules"))
+        current = db.paths[("HOA-1", "rules")]
+        assert (tmp_path / current).read_bytes() == first
+        assert sorted(path.name for path in (tmp_path / "HOA-1" / "docs").iterdir()) == [current.rsplit("/", 1)[1]]
+
+        # Once a new version replaces it, the previous file goes
+        asyncio.run(service.ingest_document(make_upload_file(create_test_pdf("Rules two."), "rules.pdf"), "HOA-1", "rules"))
+    finally:
+        service.close()
+
+    assert not (tmp_path / current).exists()
+    assert (tmp_path / db.paths[("HOA-1", "rules")]).exists()
+
+
+def test_uploads_of_stored_content_are_charged_to_the_community(upload_service):
+    accountant = ResourceAccountant()
+    db = FakeDatabase()
+    service = IngestionService(db, FakeEmbedder(), upload_service, PDFProcessor(), parse_workers = 1, accounting = accountant)
+    rules = create_test_pdf("Rules.")
+
+    async def upload():
+        async with accountant.measure("request") as usage:
+            await service.ingest_document(make_upload_file(rules, "rules.pdf"), "HOA-1", "rules")
+        return usage
+
+    try:
+        asyncio.run(service.ingest_document(make_upload_file(rules, "rules.pdf"), "HOA-2", "rules"))
+        request = asyncio.run(upload())
+    finally:
+        service.close()
+
+    # Nothing was embedded, yet the request is the community's
+    assert request.hoa_code == "HOA-1"
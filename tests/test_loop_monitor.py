@@ -0,0 +1,53 @@
+import asyncio
+import time
+from contextlib import asynccontextmanager
+
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from backend.app.utils.loop_monitor import EventLoopBlockedError, LoopMonitor, LoopMonitorMiddleware
+from backend.app.utils.metrics import Metrics
+
+
+def build_app(monitor, metrics):
+    @asynccontextmanager
+    async def lifespan(app):
+        await monitor.start(metrics)
+        yield
+        await monitor.stop()
+
+    app = FastAPI(lifespan = lifespan)
+    app.add_middleware(LoopMonitorMiddleware, monitor = monitor)
+
+    @app.get("/blocking/{item}")
+    async def blocking(item: str):
+        time.sleep(0.3)
+        return {"item": item}
+
+    @app.get("/awaiting")
+    async def awaiting():
+        await asyncio.sleep(0.3)
+        return {}
+
+    return app
+
+
+def test_strict_mode_fails_requests_that_block_the_loop():
+    metrics = Metrics()
+    monitor = LoopMonitor(threshold_ms = 100, interval = 0.01, strict = True)
+
+    with TestClient(build_app(monitor, metrics)) as client:
+        assert client.get("/awaiting").status_code == 200
+
+        with pytest.raises(EventLoopBlockedError, match = "GET /blocking/{item}"):
+            client.get("/blocking/1")
+
+    report = monitor.reports[-1]
+    assert report["route"] == "GET /blocking/{item}"
+    assert report["blocked_ms"] >= 100
+    assert any("time.sleep" in frame for frame in report["stack"])
+
+    snapshot = metrics.snapshot()
+    assert snapshot["counters"]["event_loop_blocked_total"]
+    assert snapshot["histograms"]["event_loop_lag_seconds"]
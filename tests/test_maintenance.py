@@ -0,0 +1,26 @@
+from backend.app.utils.maintenance import attribute_community_sizes
+
+
+def test_shared_content_is_split_between_linking_communities():
+    groups = [
+        {"hoa_code": "HOA-111-111-111", "content_hash": "own", "rows": 4, "embedding_bytes": 400, "content_bytes": 100},
+        {"hoa_code": "SHARED", "content_hash": "bylaws", "rows": 10, "embedding_bytes": 900, "content_bytes": 100},
+        {"hoa_code": "SHARED", "content_hash": "stale", "rows": 2, "embedding_bytes": 150, "content_bytes": 50},
+        ]
+    links = [
+        {"hoa_code": "HOA-111-111-111", "content_hash": "bylaws"},
+        {"hoa_code": "HOA-222-222-222", "content_hash": "bylaws"},
+        ]
+
+    sizes = {item["hoa_code"]: item for item in attribute_community_sizes(groups, links, {"HOA-111-111-111", "HOA-222-222-222", "HOA-333-333-333"}, "SHARED")}
+
+    assert sizes["HOA-111-111-111"]["private_bytes"] == 500
+    assert sizes["HOA-111-111-111"]["linked_rows"] == 10
+    assert sizes["HOA-111-111-111"]["attributed_bytes"] == 1000
+    assert sizes["HOA-222-222-222"]["attributed_bytes"] == 500
+    assert sizes["HOA-222-222-222"]["documents"] == 1
+    # Unlinked shared content is reported on its own; empty communities still appear
+    assert sizes["SHARED"]["attributed_bytes"] == 200
+    assert not sizes["SHARED"]["community_exists"]
+    assert sizes["HOA-333-333-333"]["attributed_bytes"] == 0
+    assert sum(item["attributed_bytes"] for item in sizes.values()) == 1700
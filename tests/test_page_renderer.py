@@ -0,0 +1,104 @@
+import asyncio
+import hashlib
+import os
+import shutil
+
+import fitz
+import pytest
+
+from backend.app.services.page_renderer import DiskLRUCache, PageNotFoundError, PageRenderer
+from backend.app.services.upload_service import UploadService
+
+
+@pytest.fixture
+def document(monkeypatch, tmp_path):
+    monkeypatch.setenv("S3_BUCKET_NAME", str(tmp_path / "uploads"))
+    with fitz.open() as pdf:
+        for number in range(3):
+            pdf.new_page().insert_text((72, 72), f"Page {number + 1}: assessments are due on the first of the month.")
+        data = pdf.tobytes()
+    content_hash = hashlib.sha256(data).hexdigest()
+    path = tmp_path / "uploads" / "HOA-111-111-111" / "docs" / f"{content_hash}.pdf"
+    path.parent.mkdir(parents = True)
+    path.write_bytes(data)
+    return {
+        "id": 1,
+        "hoa_code": "HOA-111-111-111",
+        "document_type": "Bylaws",
+        "content_hash": content_hash,
+        "page_count": 3,
+        "storage_path": f"HOA-111-111-111/docs/{content_hash}.pdf",
+        }
+
+
+def test_pages_are_rendered_once_then_served_from_cache(document, tmp_path):
+    renderer = PageRenderer(UploadService(use_s3 = False), cache_dir = str(tmp_path / "cache"), workers = 0)
+
+    first = asyncio.run(renderer.render(document, 2, highlight = "assessments are due", crop = True))
+    second = asyncio.run(renderer.render(document, 2, highlight = "assessments  are due", crop = True))
+
+    assert first["content"].startswith(b"\x89PNG")
+    assert not first["cached"] and second["cached"]
+    assert first["etag"] == second["etag"]
+    assert second["content"] == first["content"]
+
+    with pytest.raises(PageNotFoundError):
+        asyncio.run(renderer.render(document, 4))
+    with pytest.raises(ValueError):
+        asyncio.run(renderer.render(document, 1, zoom = 10))
+
+
+def test_cache_evicts_least_recently_used_files(tmp_path):
+    cache = DiskLRUCache(str(tmp_path), max_bytes = 25)
+    cache.put("a", b"x" * 10)
+    cache.put("b", b"x" * 10)
+    assert cache.read("a")
+    cache.put("c", b"x" * 10)
+
+    assert cache.read("b") is None
+    assert cache.read("a") and cache.read("c")
+    assert sorted(os.listdir(tmp_path)) == ["a", "c"]
+    # The index is rebuilt from the files on disk
+    assert DiskLRUCache(str(tmp_path), max_bytes = 25).size == 20
+
+
+def test_pinned_files_are_not_evicted(tmp_path):
+    cache = DiskLRUCache(str(tmp_path), max_bytes = 25)
+    cache.put("source.pdf", b"x" * 10)
+    assert cache.pin("source.pdf")
+    cache.put("b", b"x" * 10)
+    cache.put("c", b"x" * 10)
+
+    assert cache.read("b") is None
+    assert sorted(os.listdir(tmp_path)) == ["c", "source.pdf"]
+    cache.unpin("source.pdf")
+    cache.put("d", b"x" * 10)
+    assert cache.read("source.pdf") is None
+    assert cache.pin("source.pdf") is None
+
+
+def test_missing_files_raise_file_not_found(document, tmp_path):
+    renderer = PageRenderer(UploadService(use_s3 = False), cache_dir = str(tmp_path / "cache"), workers = 0)
+    os.remove(tmp_path / "uploads" / document["storage_path"])
+
+    with pytest.raises(FileNotFoundError):
+        asyncio.run(renderer.render(document, 1))
+
+
+def test_files_at_legacy_paths_are_only_rendered_for_their_own_version(document, tmp_path):
+    renderer = PageRenderer(UploadService(use_s3 = False), cache_dir = str(tmp_path / "cache"), workers = 0)
+    docs = tmp_path / "uploads" / "HOA-111-111-111" / "docs"
+    shutil.move(docs / f"{document['content_hash']}.pdf", docs / "bylaws.pdf")
+    legacy = {**document, "storage_path": "HOA-111-111-111/docs/bylaws.pdf"}
+
+    assert asyncio.run(renderer.render(legacy, 1))["content"].startswith(b"\x89PNG")
+
+    # A newer version overwrote the file: pages of the old one aren't rendered from it
+    with fitz.open() as pdf:
+        pdf.new_page().insert_text((72, 72), "A newer version.")
+        pdf.save(str(docs / "bylaws.pdf"))
+    stale = {**legacy, "content_hash": "0" * 64}
+
+    with pytest.raises(FileNotFoundError):
+        asyncio.run(renderer.render(stale, 1))
+    assert not any(name.startswith("0" * 64) for name in os.listdir(tmp_path / "cache"))
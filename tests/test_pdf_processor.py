@@ -47,3 +47,18 @@ def test_chunk_text(pdf_processor):
     assert all(isinstance(chunk, str) for chunk in chunks)
     assert all(len(chunk) <= 50 for chunk in chunks)
     assert len(chunks) >= 2  # Should break into multiple chunks
+
+
+def test_chunks_are_labelled_with_their_section(pdf_processor):
+    doc = fitz.open()
+    doc.new_page().insert_text((72, 72), "Preamble.\nARTICLE IV\nDues are monthly.\nSection 4.2 Late fees\nLate fees apply.")
+    doc.new_page().insert_text((72, 72), "Fees double after 60 days.")
+
+    chunks = pdf_processor.extract_and_chunk(doc.tobytes())
+
+    assert [(chunk["page_number"], chunk["chunk_index"], chunk["section"]) for chunk in chunks] == [
+        (1, 0, None),
+        (1, 1, "ARTICLE IV"),
+        (1, 2, "Section 4.2 Late fees"),
+        (2, 0, "Section 4.2 Late fees"),
+    ]
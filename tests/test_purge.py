@@ -0,0 +1,83 @@
+import asyncio
+
+import pytest
+
+from backend.app.services.purge import CommunityPurger
+from backend.app.services.upload_service import UploadService
+
+
+class FakeDatabase:
+    def __init__(self):
+        self.communities = {"HOA-111-111-111", "HOA-222-222-222"}
+        self.chunks = {"HOA-111-111-111": 25, "HOA-333-333-333": 7}
+        # Content hash -> (chunk count, communities linking to it)
+        self.contents = {"own": (4, {"HOA-111-111-111"}), "shared": (9, {"HOA-111-111-111", "HOA-222-222-222"})}
+        self.batches = []
+
+    async def delete_community_by_code(self, hoa_code):
+        self.communities.discard(hoa_code)
+        hashes = [content_hash for content_hash, (_, links) in self.contents.items() if hoa_code in links]
+        for content_hash in hashes:
+            self.contents[content_hash][1].discard(hoa_code)
+        return hashes
+
+    async def delete_community_chunks(self, hoa_code, batch_size):
+        deleted = min(batch_size, self.chunks.get(hoa_code, 0))
+        self.chunks[hoa_code] = self.chunks.get(hoa_code, 0) - deleted
+        self.batches.append(deleted)
+        return deleted
+
+    async def drop_unlinked_content(self, content_hash):
+        chunk_count, links = self.contents[content_hash]
+        if links:
+            return 0
+        del self.contents[content_hash]
+        return chunk_count
+
+    async def get_orphaned_hoa_codes(self):
+        return [code for code, count in self.chunks.items() if count and code not in self.communities]
+
+    async def get_unlinked_content_hashes(self):
+        return [content_hash for content_hash, (_, links) in self.contents.items() if not links]
+
+    async def get_community_codes(self):
+        return set(self.communities)
+
+
+@pytest.fixture
+def upload_service(monkeypatch, tmp_path):
+    monkeypatch.setenv("S3_BUCKET_NAME", str(tmp_path))
+    for folder in ("HOA-111-111-111", "HOA-222-222-222", "HOA-333-333-333", "backups"):
+        (tmp_path / folder / "docs").mkdir(parents = True)
+        (tmp_path / folder / "docs" / "bylaws.pdf").write_bytes(b"%PDF")
+    return UploadService(use_s3 = False)
+
+
+def test_purge_deletes_in_batches_and_keeps_shared_content(upload_service, tmp_path):
+    db = FakeDatabase()
+    purger = CommunityPurger(db, upload_service, batch_size = 10, pause = 0)
+
+    job = asyncio.run(purger.purge_community("HOA-111-111-111"))
+
+    assert job["status"] == "done"
+    assert db.batches == [10, 10, 5]
+    assert job["chunks_deleted"] == 25 + 4
+    assert job["contents_deleted"] == 1 and "shared" in db.contents
+    assert job["files_deleted"] == 1
+    assert not (tmp_path / "HOA-111-111-111").exists()
+    assert (tmp_path / "HOA-222-222-222").exists()
+
+
+def test_sweeper_cleans_up_after_deleted_communities(upload_service, tmp_path):
+    db = FakeDatabase()
+    purger = CommunityPurger(db, upload_service, batch_size = 10, pause = 0)
+
+    job = asyncio.run(purger.sweep())
+
+    assert job["hoa_codes"] == ["HOA-333-333-333"]
+    assert db.chunks["HOA-333-333-333"] == 0
+    assert not (tmp_path / "HOA-333-333-333").exists()
+
+    # Folders that don't belong to a community are left alone
+    assert (tmp_path / "backups").exists()
+    assert (tmp_path / "HOA-111-111-111").exists()
@@ -0,0 +1,66 @@
+import asyncio
+
+from backend.app.services.query_log import QueryLog
+from backend.app.services.rag import RAG
+from backend.app.utils.singleflight import SingleFlight
+
+
+class FakeDatabase:
+    def __init__(self):
+        self.batches = []
+
+    async def write_query_log(self, entries):
+        self.batches.append(entries)
+
+    async def get_relevant_chunks_with_context(self, query_embedding, hoa_code):
+        return [{"id": 7, "document_type": "bylaws", "page_number": 1, "chunk_index": 0, "content": "Dues are due monthly."}]
+
+
+class FakeEmbedder:
+    async def get_query_embedding(self, text, priority = "interactive", hoa_code = None, trace = None):
+        trace["embedding_tokens"] = 5
+        return [1.0]
+
+
+def test_entries_are_written_in_batches_and_dropped_when_full():
+    db = FakeDatabase()
+    query_log = QueryLog(db, queue_size = 5, batch_size = 2, flush_interval = 0)
+
+    async def run():
+        for index in range(7):
+            query_log.record({"query": f"question {index}"})
+        query_log.start()
+        await asyncio.sleep(0.01)
+        await query_log.close()
+
+    asyncio.run(run())
+
+    assert [len(batch) for batch in db.batches] == [2, 2, 1]
+    assert (query_log.written, query_log.dropped) == (5, 2)
+
+
+def test_coalesced_questions_are_logged_without_their_cost(monkeypatch):
+    monkeypatch.setenv("OPENAI_API_KEY", "test")
+    db = FakeDatabase()
+    query_log = QueryLog(db)
+    rag = RAG(db, FakeEmbedder(), coalescer = SingleFlight("answer_query"), query_log = query_log)
+
+    async def generate_answer(prompt, priority = "interactive", hoa_code = None, history = None, trace = None):
+        await asyncio.sleep(0.01)
+        trace.update(prompt_tokens = 100, completion_tokens = 20)
+        return "On the first of the month."
+
+    rag.generate_answer = generate_answer
+
+    async def run():
+        await asyncio.gather(rag.answer_query("When are dues due?", "HOA-1"), rag.answer_query("when are dues due", "HOA-1"))
+        await query_log.flush()
+
+    asyncio.run(run())
+
+    leader, follower = db.batches[0]
+    assert leader["chunk_ids"] == follower["chunk_ids"] == [7]
+    assert (leader["coalesced"], leader["prompt_tokens"], leader["embedding_tokens"]) == (False, 100, 5)
+    assert leader["embedding_ms"] is not None and leader["completion_ms"] >= 10
+    assert follower["coalesced"] and "prompt_tokens" not in follower
+    assert leader["normalized_query"] == follower["normalized_query"] == "when are dues due"
@@ -0,0 +1,76 @@
+import asyncio
+
+import pytest
+
+from backend.app.services.rag import ERROR_ANSWER, RAG
+
+
+class FakeEmbedder:
+    def __init__(self):
+        self.calls = []
+
+    async def get_embeddings(self, texts, priority = "background", hoa_code = None):
+        self.calls.append(texts)
+        return [[float(i)] for i in range(len(texts))]
+
+
+class FakeDatabase:
+    def __init__(self):
+        self.calls = []
+
+    async def get_relevant_chunks_for_queries(self, query_embeddings, hoa_code):
+        self.calls.append((query_embeddings, hoa_code))
+        return [
+            [{"document_type": "bylaws", "page_number": 1, "chunk_index": 0, "content": f"context {i}"}]
+            for i in range(len(query_embeddings))
+        ]
+
+
+@pytest.fixture
+def rag(monkeypatch):
+    monkeypatch.setenv("OPENAI_API_KEY", "test")
+    return RAG(FakeDatabase(), FakeEmbedder())
+
+
+def test_batch_is_embedded_and_retrieved_once(rag):
+    queries = ["Can I paint my door?", "When are dues\ndue?"]
+
+    contexts = asyncio.run(rag.retrieve_contexts(queries, "HOA-1"))
+
+    assert rag.embedder.calls == [["Can I paint my door?", "When are dues due?"]]
+    assert len(rag.db.calls) == 1
+    assert [context[0]["content"] for context in contexts] == ["context 0", "context 1"]
+
+
+def test_answers_stream_as_they_complete_with_bounded_concurrency(rag):
+    in_flight = 0
+    peak = 0
+
+    async def generate_answer(prompt, priority = "interactive", hoa_code = None):
+        nonlocal in_flight, peak
+        in_flight += 1
+        peak = max(peak, in_flight)
+        # The first question is the slowest, so it should come back last
+        await asyncio.sleep(0.2 if "question 0" in prompt else 0.01)
+        in_flight -= 1
+        if "question 3" in prompt:
+            raise RuntimeError("LLM generation failed")
+        return prompt.split("Question: ")[1].split("\n")[0].upper()
+
+    rag.generate_answer = generate_answer
+    queries = [f"question {i}" for i in range(6)]
+    contexts = [[] for _ in queries]
+
+    async def run():
+        return [result async for result in rag.stream_answers(queries, contexts, concurrency = 2)]
+
+    results = asyncio.run(run())
+
+    assert peak == 2
+    assert results[-1]["index"] == 0
+    assert sorted(result["index"] for result in results) == list(range(6))
+
+    by_index = {result["index"]: result for result in results}
+    assert by_index[1]["answer"] == "QUESTION 1"
+    assert by_index[3]["answer"] == ERROR_ANSWER
+    assert "error" in by_index[3]
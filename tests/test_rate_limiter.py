@@ -0,0 +1,59 @@
+import asyncio
+
+from backend.app.utils.rate_limiter import BACKGROUND, INTERACTIVE, RateLimiter
+
+
+def test_interactive_requests_jump_the_background_queue():
+    # 600 requests per minute: one every 0.1s once the burst is spent
+    limiter = RateLimiter(requests_per_minute = 600, tokens_per_minute = 10 ** 9)
+    limiter._requests = 0
+    order = []
+
+    async def request(name, priority):
+        await limiter.acquire(1, priority = priority, hoa_code = "HOA-1")
+        order.append(name)
+
+    async def run():
+        background = [asyncio.create_task(request(f"b{i}", BACKGROUND)) for i in range(3)]
+        await asyncio.sleep(0.01)
+        interactive = asyncio.create_task(request("i", INTERACTIVE))
+        await asyncio.gather(*background, interactive)
+
+    asyncio.run(run())
+    assert order.index("i") <= 1
+
+
+def test_communities_share_a_lane_fairly():
+    limiter = RateLimiter(requests_per_minute = 10 ** 6, tokens_per_minute = 60 * 1000)
+    limiter._tokens = 0
+    served = []
+
+    async def request(hoa_code):
+        await limiter.acquire(100, priority = BACKGROUND, hoa_code = hoa_code)
+        served.append(hoa_code)
+
+    async def run():
+        # A big upload queues 8 requests before a small community asks for 2
+        big = [asyncio.create_task(request("HOA-BIG")) for _ in range(8)]
+        await asyncio.sleep(0)
+        small = [asyncio.create_task(request("HOA-SMALL")) for _ in range(2)]
+        await asyncio.gather(*big, *small)
+
+    asyncio.run(run())
+    # The small community is not stuck behind the whole backlog of the big one
+    assert max(i for i, hoa_code in enumerate(served) if hoa_code == "HOA-SMALL") <= 4
+
+
+def test_cancelled_waiter_does_not_consume_budget():
+    limiter = RateLimiter(requests_per_minute = 600, tokens_per_minute = 10 ** 9)
+    limiter._requests = 0
+
+    async def run():
+        waiter = asyncio.create_task(limiter.acquire(1))
+        await asyncio.sleep(0.01)
+        waiter.cancel()
+        await asyncio.gather(waiter, return_exceptions = True)
+        await asyncio.wait_for(limiter.acquire(1), timeout = 0.5)
+        return limiter.queued()
+
+    assert asyncio.run(run()) == {INTERACTIVE: 0, BACKGROUND: 0}
@@ -0,0 +1,98 @@
+import asyncio
+
+import pytest
+
+from backend.app.utils.metrics import Metrics
+from backend.app.utils.resilience import DeadlineExceeded, Hedger, StagePolicy
+
+
+def test_stage_is_cancelled_when_its_budget_runs_out():
+    metrics = Metrics()
+    policy = StagePolicy(deadline = 1, budgets = {"embedding": 0.02}, metrics = metrics)
+    cancelled = False
+
+    async def embed():
+        nonlocal cancelled
+        try:
+            await asyncio.sleep(1)
+        except asyncio.CancelledError:
+            cancelled = True
+            raise
+
+    async def run():
+        await policy.run("embedding", embed, policy.start())
+
+    with pytest.raises(DeadlineExceeded) as error:
+        asyncio.run(run())
+
+    assert error.value.stage == "embedding"
+    assert cancelled
+    assert metrics.snapshot()["counters"]["stage_deadline_exceeded_total"][0]["value"] == 1
+
+
+def test_timeouts_raised_by_a_stage_are_not_deadlines():
+    metrics = Metrics()
+    policy = StagePolicy(deadline = 1, metrics = metrics)
+
+    class PoolTimeoutError(TimeoutError):
+        pass
+
+    async def retrieve():
+        raise PoolTimeoutError("no connection available")
+
+    async def run():
+        await policy.run("retrieval", retrieve, policy.start())
+
+    with pytest.raises(PoolTimeoutError):
+        asyncio.run(run())
+
+    assert "stage_deadline_exceeded_total" not in metrics.snapshot()["counters"]
+
+def test_hedged_request_wins_and_loser_is_cancelled():
+    metrics = Metrics()
+    hedger = Hedger("completion", percentile = 0.9, min_samples = 3, metrics = metrics)
+    hedger._latencies.extend([0.01, 0.01, 0.01])
+    calls = []
+    cancelled = []
+
+    async def complete():
+        attempt = len(calls)
+        calls.append(attempt)
+        try:
+            # The first request is stuck, the hedged one is fast
+            await asyncio.sleep(1 if attempt == 0 else 0.01)
+        except asyncio.CancelledError:
+            cancelled.append(attempt)
+            raise
+        return f"answer {attempt}"
+
+    async def run():
+        result = await hedger.run(complete)
+        await asyncio.sleep(0)
+        return result
+
+    assert asyncio.run(run()) == "answer 1"
+    assert calls == [0, 1]
+    assert cancelled == [0]
+
+    counters = metrics.snapshot()["counters"]
+    assert counters["hedged_requests_total"][0]["value"] == 1
+    assert counters["hedge_wins_total"][0]["value"] == 1
+
+
+def test_no_hedging_until_enough_latencies_are_known():
+    hedger = Hedger("embedding", min_samples = 3)
+    calls = 0
+
+    async def embed():
+        nonlocal calls
+        calls += 1
+        await asyncio.sleep(0.01)
+        return [0.0]
+
+    async def run():
+        return [await hedger.run(embed) for _ in range(3)]
+
+    asyncio.run(run())
+    assert calls == 3
+    assert hedger.delay() is not None
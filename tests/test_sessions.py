@@ -0,0 +1,148 @@
+import asyncio
+
+import pytest
+
+from backend.app.services.rag import RAG
+from backend.app.services.sessions import Session, SessionStore
+
+
+class FakeEmbedder:
+    def __init__(self, vectors):
+        self.vectors = vectors
+        self.texts = []
+
+    async def get_query_embedding(self, text, priority = "interactive", hoa_code = None, trace = None):
+        self.texts.append(text)
+        return self.vectors[len(self.texts) - 1]
+
+
+class FakeDatabase:
+    def __init__(self):
+        self.searches = 0
+
+    async def get_relevant_chunks_with_context(self, query_embedding, hoa_code):
+        self.searches += 1
+        return [
+            {"document_type": "bylaws", "page_number": self.searches, "chunk_index": 0, "content": f"rule {self.searches}"}
+        ]
+
+
+@pytest.fixture
+def rag(monkeypatch):
+    monkeypatch.setenv("OPENAI_API_KEY", "test")
+    # Turn 2 stays on the subject of turn 1, turn 3 changes it
+    return RAG(FakeDatabase(), FakeEmbedder([[1.0, 0.0], [0.99, 0.05], [0.0, 1.0]]))
+
+
+def test_follow_ups_reuse_or_extend_the_session_context(rag):
+    prompts = []
+    histories = []
+
+    async def generate_answer(prompt, priority = "interactive", hoa_code = None, history = None, trace = None):
+        prompts.append(prompt)
+        histories.append(history)
+        return f"answer {len(prompts)}"
+
+    rag.generate_answer = generate_answer
+    session = Session("s1", "HOA-1", "resident@example.com")
+
+    async def run():
+        for question in ["Can I build a fence?", "What about corner lots?", "When is the pool open?"]:
+            await rag.answer_turn(session, question)
+
+    asyncio.run(run())
+
+    # The follow-up is embedded with the previous question and answered without a new search
+    assert rag.embedder.texts[1] == "Can I build a fence?\nWhat about corner lots?"
+    assert rag.db.searches == 2
+
+    # A new subject adds fresh chunks in front of the ones already retrieved
+    assert prompts[2].index("rule 2") < prompts[2].index("rule 1")
+
+    assert histories[0] == []
+    assert histories[2] == [
+        {"question": "Can I build a fence?", "answer": "answer 1"},
+        {"question": "What about corner lots?", "answer": "answer 2"},
+    ]
+
+
+def test_history_is_trimmed_to_the_token_budget():
+    session = Session("s1", "HOA-1", "resident@example.com")
+
+    for i in range(5):
+        session.add_turn(f"question {i}", "x" * 400, [], [1.0])
+
+    assert [turn["question"] for turn in session.history(budget = 250)] == ["question 3", "question 4"]
+
+
+def test_store_evicts_least_recently_used_sessions():
+    store = SessionStore(max_sessions = 2)
+
+    async def run():
+        first = await store.create("HOA-1", "a@example.com")
+        second = await store.create("HOA-1", "b@example.com")
+        await store.get(first.id)
+        await store.create("HOA-1", "c@example.com")
+        return first, second
+
+    first, second = asyncio.run(run())
+
+    assert len(store) == 2
+    assert asyncio.run(store.get(first.id)) is first
+    assert asyncio.run(store.get(second.id)) is None
+
+
+class FakeSessionDatabase:
+    def __init__(self):
+        self.rows = {}
+
+    async def get_conversation_session(self, session_id, ttl, version = None):
+        row = self.rows.get(session_id)
+        if row is None:
+            return None
+        return {**row, "turns": None if row["version"] == version else [dict(turn) for turn in row["turns"]]}
+
+    async def save_conversation_session(self, session_id, hoa_code, owner, turns, version):
+        row = self.rows.get(session_id)
+        if row is not None and row["version"] != version:
+            return None
+        new_version = version if row is None else version + 1
+        self.rows[session_id] = {"hoa_code": hoa_code, "owner": owner, "version": new_version, "turns": list(turns)}
+        return new_version
+
+    async def delete_conversation_session(self, session_id):
+        self.rows.pop(session_id, None)
+
+
+def test_workers_see_and_keep_each_others_turns():
+    db = FakeSessionDatabase()
+    first_worker, second_worker = SessionStore(db), SessionStore(db)
+
+    async def turn(store, session_id, question):
+        session = await store.get(session_id)
+        session.add_turn(question, "answer", [], [1.0])
+        await store.save(session)
+        return session
+
+    async def run():
+        session = await first_worker.create("HOA-1", "a@example.com")
+        await turn(first_worker, session.id, "question 1")
+        await turn(second_worker, session.id, "question 2")
+
+        # The first worker's copy is outdated, so it reads the second worker's turn before answering
+        assert [t["question"] for t in (await turn(first_worker, session.id, "question 3")).turns] == [
+            "question 1", "question 2", "question 3"
+        ]
+
+        # Two workers answering from the same version: the later write is merged, not lost
+        first, second = await first_worker.get(session.id), await second_worker.get(session.id)
+        first.add_turn("question 4", "answer", [], [1.0])
+        second.add_turn("question 5", "answer", [], [1.0])
+        await first_worker.save(first)
+        await second_worker.save(second)
+
+        return session.id
+
+    session_id = asyncio.run(run())
+
+    assert [t["question"] for t in db.rows[session_id]["turns"]] == [f"question {i}" for i in range(1, 6)]
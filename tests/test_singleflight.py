@@ -0,0 +1,84 @@
+import asyncio
+
+import pytest
+
+from backend.app.utils.metrics import Metrics
+from backend.app.utils.singleflight import SingleFlight
+
+
+def test_concurrent_calls_share_one_computation():
+    metrics = Metrics()
+    flight = SingleFlight("answer_query", metrics)
+    calls = 0
+
+    async def compute():
+        nonlocal calls
+        calls += 1
+        await asyncio.sleep(0.01)
+        return "answer"
+
+    async def run():
+        return await asyncio.gather(*(flight.do("key", compute) for _ in range(5)))
+
+    assert asyncio.run(run()) == ["answer"] * 5
+    assert calls == 1
+    assert flight.in_flight() == 0
+
+    counts = {s["labels"]["role"]: s["value"] for s in metrics.snapshot()["counters"]["singleflight_calls_total"]}
+    assert counts == {"leader": 1, "coalesced": 4}
+
+
+def test_error_reaches_every_waiter():
+    flight = SingleFlight("answer_query")
+
+    async def compute():
+        await asyncio.sleep(0.01)
+        raise RuntimeError("LLM generation failed")
+
+    async def run():
+        return await asyncio.gather(*(flight.do("key", compute) for _ in range(3)), return_exceptions = True)
+
+    results = asyncio.run(run())
+    assert all(isinstance(result, RuntimeError) for result in results)
+
+
+def test_cancelled_leader_does_not_cancel_followers():
+    flight = SingleFlight("answer_query")
+
+    async def compute():
+        await asyncio.sleep(0.05)
+        return "answer"
+
+    async def run():
+        leader = asyncio.create_task(flight.do("key", compute))
+        await asyncio.sleep(0)
+        follower = asyncio.create_task(flight.do("key", compute))
+        await asyncio.sleep(0)
+
+        leader.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await leader
+
+        return await follower
+
+    assert asyncio.run(run()) == "answer"
+
+
+def test_computation_is_cancelled_when_every_caller_is_gone():
+    flight = SingleFlight("answer_query")
+    finished = False
+
+    async def compute():
+        nonlocal finished
+        await asyncio.sleep(0.05)
+        finished = True
+
+    async def run():
+        caller = asyncio.create_task(flight.do("key", compute))
+        await asyncio.sleep(0)
+        caller.cancel()
+        await asyncio.sleep(0.1)
+
+    asyncio.run(run())
+    assert not finished
+    assert flight.in_flight() == 0
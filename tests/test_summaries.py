@@ -0,0 +1,77 @@
+import asyncio
+
+from backend.app.services.summaries import SummaryService, group_sections, parse_faqs
+
+
+class FakeLLM:
+    model = "fake-model"
+
+    def __init__(self):
+        self.prompts = []
+
+    async def generate_answer(self, prompt, priority = "interactive", hoa_code = None):
+        self.prompts.append(prompt)
+        if "JSON array" in prompt:
+            return 'Here you go:\n```json\n[{"question": "When are dues due?", "answer": "Monthly."}]\n```'
+        return f"summary {len(self.prompts)}"
+
+
+class FakeDatabase:
+    def __init__(self, chunks):
+        self.chunks = chunks
+        self.stored = None
+
+    async def has_document_summary(self, content_hash):
+        return self.stored is not None
+
+    async def get_document_chunks(self, content_hash):
+        return self.chunks
+
+    async def store_document_summary(self, content_hash, summary, model, sections, faqs):
+        self.stored = (content_hash, summary, model, sections, faqs)
+        return True
+
+
+def chunk(page, section, content):
+    return {"page_number": page, "section": section, "content": content}
+
+
+def test_group_sections_splits_at_headings_and_size():
+    chunks = [
+        chunk(1, None, "a" * 10),
+        chunk(1, "Article I", "b" * 10),
+        chunk(2, "Article I", "c" * 10),
+        chunk(3, "Article I", "d" * 10),
+    ]
+
+    groups = group_sections(chunks, max_chars = 25)
+
+    assert [(g["section"], g["first_page"], g["last_page"]) for g in groups] == [
+        (None, 1, 1),
+        ("Article I", 1, 2),
+        ("Article I", 3, 3),
+    ]
+
+
+def test_summarize_document_maps_reduces_and_stores_once():
+    chunks = [chunk(page, f"Article {page}", "text " * 20) for page in range(1, 7)]
+    db = FakeDatabase(chunks)
+    llm = FakeLLM()
+    service = SummaryService(db, llm, section_chars = 60)
+
+    assert asyncio.run(service.summarize_document("abc")) is True
+
+    content_hash, summary, model, sections, faqs = db.stored
+    assert (content_hash, model) == ("abc", "fake-model")
+    assert [section["section"] for section in sections] == [f"Article {page}" for page in range(1, 7)]
+    assert summary.startswith("summary")
+    assert faqs == [{"question": "When are dues due?", "answer": "Monthly."}]
+
+    # Already summarized: no more LLM calls
+    calls = len(llm.prompts)
+    assert asyncio.run(service.summarize_document("abc")) is False
+    assert len(llm.prompts) == calls
+
+
+def test_parse_faqs_ignores_unparseable_output():
+    assert parse_faqs("I could not come up with questions.") == []
@@ -0,0 +1,118 @@
+import asyncio
+import hashlib
+import tempfile
+import time
+
+import boto3
+import pytest
+from starlette.datastructures import Headers, UploadFile
+
+from backend.app.services.upload_service import UploadService, UploadTooLargeError
+
+
+BUCKET = "neighbr-test-bucket"
+
+
+# Helper: Wrap raw bytes in an UploadFile backed by a spooled temp file, like FastAPI does
+def make_upload_file(data: bytes) -> UploadFile:
+    spooled = tempfile.SpooledTemporaryFile(max_size = 1024 * 1024)
+    spooled.write(data)
+    spooled.seek(0)
+    return UploadFile(
+            file = spooled,
+            filename = "bylaws.pdf",
+            headers = Headers({"content-type": "application/pdf"}),
+            )
+
+
+@pytest.fixture
+def s3_upload_service(monkeypatch, tmp_path):
+    moto = pytest.importorskip("moto")
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setenv("S3_BUCKET_NAME", BUCKET)
+    monkeypatch.setenv("AWS_ACCESS_KEY_ID", "testing")
+    monkeypatch.setenv("AWS_SECRET_ACCESS_KEY", "testing")
+    monkeypatch.setenv("AWS_DEFAULT_REGION", "us-east-1")
+    monkeypatch.setenv("UPLOAD_STAGING_DIR", str(tmp_path))
+
+    with moto.mock_aws():
+        boto3.client("s3").create_bucket(Bucket = BUCKET)
+        yield UploadService(use_s3 = True)
+
+
+def test_s3_upload_is_multipart_and_complete(s3_upload_service):
+    # Larger than one part, so the transfer manager has to use a multipart upload
+    data = b"%PDF-1.4\n" + bytes(range(256)) * (12 * 1024 * 1024 // 256)
+    upload = make_upload_file(data)
+
+    url = asyncio.run(s3_upload_service.save_file(upload, hoa_code = "HOA-123-456-789", document_type = "By Laws"))
+
+    key = f"HOA-123-456-789/docs/{hashlib.sha256(data).hexdigest()}.pdf"
+    assert url == f"https://{BUCKET}.s3.amazonaws.com/{key}"
+
+    stored = boto3.client("s3").get_object(Bucket = BUCKET, Key = key)
+    assert stored["Body"].read() == data
+    assert stored["ContentType"] == "application/pdf"
+    assert "-" in stored["ETag"]  # Multipart uploads get a "<md5>-<parts>" ETag
+
+
+def test_s3_upload_does_not_block_event_loop(s3_upload_service):
+    upload = make_upload_file(b"%PDF-1.4\n" + b"x" * (12 * 1024 * 1024))
+
+    async def run():
+        max_gap = 0.0
+        done = asyncio.Event()
+
+        # Measure how long the loop goes without running this ticker
+        async def ticker():
+            nonlocal max_gap
+            last = time.perf_counter()
+            while not done.is_set():
+                await asyncio.sleep(0.001)
+                now = time.perf_counter()
+                max_gap = max(max_gap, now - last)
+                last = now
+
+        ticker_task = asyncio.create_task(ticker())
+        await s3_upload_service.save_file(upload, hoa_code = "HOA-123-456-789", document_type = "rules")
+        done.set()
+        await ticker_task
+        return max_gap
+
+    assert asyncio.run(run()) < 0.1
+
+
+def test_s3_upload_removes_staging_file(s3_upload_service, tmp_path):
+    asyncio.run(s3_upload_service.save_file(make_upload_file(b"%PDF-1.4\n"), hoa_code = "HOA-1", document_type = "rules"))
+
+    assert not list(tmp_path.glob("*.part"))
+
+
+@pytest.fixture
+def local_upload_service(monkeypatch, tmp_path):
+    monkeypatch.setenv("S3_BUCKET_NAME", str(tmp_path / "uploads"))
+    return UploadService(use_s3 = False, max_upload_bytes = 4 * 1024 * 1024)
+
+
+def test_receive_file_hashes_and_stores_in_one_pass(local_upload_service, tmp_path):
+    data = b"%PDF-1.4\n" + b"y" * (3 * 1024 * 1024)
+
+    stored = asyncio.run(
+            local_upload_service.receive_file(make_upload_file(data), hoa_code = "HOA-1", document_type = "CC&Rs")
+            )
+
+    assert stored["sha256"] == hashlib.sha256(data).hexdigest()
+    assert stored["size"] == len(data)
+    assert stored["key"] == f"HOA-1/docs/{stored['sha256']}.pdf"
+    assert stored["local_path"] == str(tmp_path / "uploads" / stored["key"])
+    assert open(stored["local_path"], "rb").read() == data
+
+
+def test_receive_file_rejects_oversized_upload(local_upload_service, tmp_path):
+    upload = make_upload_file(b"z" * (5 * 1024 * 1024))
+
+    with pytest.raises(UploadTooLargeError):
+        asyncio.run(local_upload_service.receive_file(upload, hoa_code = "HOA-1", document_type = "rules"))
+
+    # Nothing, not even a partial file, is left behind
+    assert not any(p.is_file() for p in (tmp_path / "uploads").rglob("*"))